@@ -0,0 +1,46 @@
+from typing import Optional
+
+from fastapi import Depends
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.api.error_handlers import ApiError
+from app.core.auth import AUTH_ADMIN_SCOPE, InvalidToken, KeysUnavailable, Principal, token_verifier
+
+# auto_error=False: отсутствие заголовка - наш 401 в формате RFC 7807, а не 403 FastAPI
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def get_current_principal(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Principal:
+    """Authorization: Bearer <JWT> -> проверенный Principal"""
+    if credentials is None:
+        raise ApiError(code="unauthorized", status=401, headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return await token_verifier.authenticate(credentials.credentials)
+    except InvalidToken:
+        raise ApiError(
+            code="unauthorized",
+            status=401,
+            headers={"WWW-Authenticate": 'Bearer error="invalid_token"'},
+        )
+    except KeysUnavailable:
+        raise ApiError(code="service_unavailable", status=503, headers={"Retry-After": "1"})
+
+
+async def get_current_user_id(principal: Principal = Depends(get_current_principal)) -> int:
+    """user_id для всех вызовов media_crud"""
+    return principal.user_id
+
+
+async def require_admin(principal: Principal = Depends(get_current_principal)) -> Principal:
+    """Только токены со scope AUTH_ADMIN_SCOPE (служебные эндпоинты)"""
+    if AUTH_ADMIN_SCOPE not in principal.scopes:
+        raise ApiError(
+            code="forbidden",
+            status=403,
+            headers={
+                "WWW-Authenticate": f'Bearer error="insufficient_scope", scope="{AUTH_ADMIN_SCOPE}"'
+            },
+        )
+    return principal
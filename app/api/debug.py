@@ -0,0 +1,54 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+from app.api.auth import require_admin
+from app.api.error_handlers import ApiError
+from app.core import profiler
+from app.core.profiler import PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS, Profile, ProfilerBusy
+from app.crud.media import media_crud
+
+# Служебные эндпоинты: только токены со scope администратора
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/profile")
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    output: Literal["collapsed", "speedscope"] = Query("collapsed", alias="format"),
+    source: Literal["live", "continuous"] = "live",
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1, le=1000),
+    idle: bool = False,
+):
+    """Stack samples of all threads for N seconds (flamegraph)
+
+    source=live - снимать seconds секунд сейчас; source=continuous - отдать
+    последние seconds секунд из скользящего окна (PROFILER_CONTINUOUS=true).
+    """
+    if source == "continuous":
+        if profiler.continuous_profiler is None:
+            raise ApiError(code="not_found", status=404)
+        profile = profiler.continuous_profiler.snapshot(seconds)
+    else:
+        try:
+            profile = await profiler.on_demand_profiler.record(
+                seconds, interval_ms / 1000, include_idle=idle
+            )
+        except ProfilerBusy:
+            raise ApiError(code="profiler_busy", status=409)
+    return _render(profile, output)
+
+
+@router.get("/stats")
+async def get_stats() -> dict:
+    """Users, media rows and tombstones per shard and in total"""
+    return await media_crud.get_stats()
+
+
+def _render(profile: Profile, output: str) -> Response:
+    headers = {"Cache-Control": "no-store", "X-Profile-Samples": str(profile.samples)}
+    if output == "speedscope":
+        headers["Content-Disposition"] = 'attachment; filename="profile.speedscope.json"'
+        return JSONResponse(profile.speedscope(), headers=headers)
+    return PlainTextResponse(profile.collapsed(), headers=headers)
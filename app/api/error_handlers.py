@@ -2,15 +2,23 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.sharding import ShardMoving
 
 from .problem import SAFE_ERROR_DETAILS, problem
 
+# SQLSTATE query_canceled: сработал statement_timeout
+QUERY_CANCELED_SQLSTATE = "57014"
+
 
 class ApiError(Exception):
-    def __init__(self, code: str, message: str = None, status: int = 400):
+    def __init__(self, code: str, message: str = None, status: int = 400, headers: dict = None):
         self.code = code
         self.message = message or SAFE_ERROR_DETAILS.get(code, "An error occurred")
         self.status = status
+        self.headers = headers
 
 
 def setup_exception_handlers(app: FastAPI):
@@ -24,7 +32,33 @@ def setup_exception_handlers(app: FastAPI):
             # title автоматически: 404 -> "Not Found", 409 -> "Conflict"
             detail=SAFE_ERROR_DETAILS.get(exc.code, "An error occurred"),  # ТОЛЬКО DETAIL
         )
-        return JSONResponse(status_code=exc.status, content=response_data)
+        return JSONResponse(status_code=exc.status, content=response_data, headers=exc.headers)
+
+    @app.exception_handler(PoolTimeoutError)
+    async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+        """No free DB connection within pool_timeout - fail fast with 503"""
+        response_data = problem(
+            status=503,
+            detail=SAFE_ERROR_DETAILS["service_unavailable"],
+        )
+        return JSONResponse(status_code=503, content=response_data, headers={"Retry-After": "1"})
+
+    @app.exception_handler(ShardMoving)
+    async def shard_moving_handler(request: Request, exc: ShardMoving):
+        """Пользователь переносится между шардами (секунды) - повторить позже"""
+        response_data = problem(status=503, detail=SAFE_ERROR_DETAILS["user_moving"])
+        return JSONResponse(status_code=503, content=response_data, headers={"Retry-After": "2"})
+
+    @app.exception_handler(DBAPIError)
+    async def database_error_handler(request: Request, exc: DBAPIError):
+        """statement_timeout -> 503; прочие ошибки БД - generic 500 без деталей"""
+        if getattr(exc.orig, "sqlstate", None) == QUERY_CANCELED_SQLSTATE:
+            response_data = problem(status=503, detail=SAFE_ERROR_DETAILS["request_timeout"])
+            return JSONResponse(
+                status_code=503, content=response_data, headers={"Retry-After": "1"}
+            )
+        response_data = problem(status=500, detail=SAFE_ERROR_DETAILS["internal_error"])
+        return JSONResponse(status_code=500, content=response_data)
 
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException):
@@ -1,32 +1,79 @@
+import asyncio
+import base64
+import binascii
+import json
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.auth import get_current_user_id
 from app.api.error_handlers import ApiError
-from app.core.database import get_db  # НОВЫЙ IMPORT
+from app.core.changefeed import (
+    KEEPALIVE_SSE,
+    OVERFLOW_SSE,
+    RESET_SSE,
+    FeedLimitExceeded,
+    change_feed,
+)
+from app.core.database import get_db, shard_of  # НОВЫЙ IMPORT
 from app.crud.media import media_crud  # Singleton instance
+from app.crud.storage import SyncCursor
 from app.schemas.media import (
+    DuplicateCandidate,
     MediaCreate,
+    MediaCreateResponse,
     MediaKind,
     MediaResponse,
+    MediaSortField,
     MediaStatusUpdate,
+    MediaSyncResponse,
+    MediaTags,
     MediaUpdate,
+    SortOrder,
+    TagCount,
+    TagMatch,
     WatchStatus,
 )
 
 router = APIRouter()
-CURRENT_USER_ID = 1  # Заглушка для аутентификации
+SSE_KEEPALIVE_SECONDS = 15
 
 
 @router.get("", response_model=List[MediaResponse])
 async def get_media(  # ASYNC
     kind: Optional[MediaKind] = Query(None),
     status: Optional[WatchStatus] = Query(None),
+    sort: MediaSortField = Query(MediaSortField.CREATED_AT),
+    order: SortOrder = Query(SortOrder.DESC),
+    year_min: Optional[int] = Query(None, ge=1800, le=2030),
+    year_max: Optional[int] = Query(None, ge=1800, le=2030),
+    rating_min: Optional[int] = Query(None, ge=1, le=10),
+    tags: Optional[str] = Query(None, max_length=1100, description="Теги через запятую"),
+    tags_match: TagMatch = Query(TagMatch.ALL),
+    user_id: int = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db),  # DATABASE DEPENDENCY
 ) -> List[MediaResponse]:
-    """Get media list with filtering"""
-    media_list = await media_crud.get_media_list(db, CURRENT_USER_ID, kind, status)
+    """Get media list with filtering, range filters and sorting"""
+    if year_min is not None and year_max is not None and year_min > year_max:
+        raise ApiError(code="validation_error", status=422)
+
+    media_list = await media_crud.get_media_list(
+        db,
+        user_id,
+        kind,
+        status,
+        sort,
+        order,
+        year_min,
+        year_max,
+        rating_min,
+        _parse_tags(tags) if tags else None,
+        tags_match,
+    )
 
     return [
         MediaResponse(
@@ -38,18 +85,187 @@ async def get_media(  # ASYNC
             user_id=media.user_id,
             status=media.status,
             rating=media.rating,
+            tags=media.tags or [],
             created_at=media.created_at.isoformat(),
         )
         for media in media_list
     ]
 
 
+def _parse_tags(raw: str) -> List[str]:
+    """?tags=a,b -> нормализованные теги (те же правила, что при записи)"""
+    try:
+        return MediaTags(tags=raw.split(",")).tags
+    except ValidationError:
+        raise ApiError(code="validation_error", status=422)
+
+
+def _encode_sync_token(cursor: SyncCursor, shard: Optional[str] = None) -> str:
+    payload = {
+        "p": cursor.position,
+        # Незавершённые xid - смещениями вниз от position: короче токен
+        "x": [cursor.position - xid for xid in cursor.pending],
+        "t": cursor.issued_at.isoformat(),
+        "s": shard,
+    }
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _decode_sync_token(token: str, shard: Optional[str] = None) -> Optional[SyncCursor]:
+    """None - токен не годится для delta sync этого шарда: нужна полная ресинхронизация
+
+    Позиция курсора имеет смысл только в БД, которая его выдала: после переноса
+    пользователя на другой шард - full resync. Токен старого формата (updated_at)
+    тоже ведёт к full resync.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ApiError(code="validation_error", status=422)
+    try:
+        payload = json.loads(raw)
+        position = int(payload["p"])
+        cursor = SyncCursor(
+            position,
+            datetime.fromisoformat(payload["t"]),
+            tuple(position - int(offset) for offset in payload["x"]),
+        )
+        issued_shard = payload["s"]
+    except (ValueError, KeyError, TypeError):
+        try:
+            legacy = datetime.fromisoformat(raw)
+        except ValueError:
+            raise ApiError(code="validation_error", status=422)
+        if legacy.tzinfo is None:
+            raise ApiError(code="validation_error", status=422)
+        return None
+    if cursor.issued_at.tzinfo is None:
+        raise ApiError(code="validation_error", status=422)
+    return cursor if issued_shard == shard else None
+
+
+@router.get("/sync", response_model=MediaSyncResponse)
+async def sync_media(
+    since: Optional[str] = Query(None, max_length=1000),
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+) -> MediaSyncResponse:
+    """Delta sync: only items changed or deleted since the token"""
+    shard = await shard_of(user_id)
+    cursor = _decode_sync_token(since, shard) if since else None
+    changes = await media_crud.get_changes_since(db, user_id, cursor)
+
+    return MediaSyncResponse(
+        upserts=[
+            MediaResponse(
+                id=media.id,
+                title=media.title,
+                kind=media.kind,
+                year=media.year,
+                description=media.description,
+                user_id=media.user_id,
+                status=media.status,
+                rating=media.rating,
+                tags=media.tags or [],
+                created_at=media.created_at.isoformat(),
+            )
+            for media in changes.upserts
+        ],
+        deleted=changes.deleted,
+        next_token=_encode_sync_token(changes.cursor, shard),
+        full_resync=changes.full_resync,
+    )
+
+
+@router.get("/changes")
+async def media_changes(
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    user_id: int = Depends(get_current_user_id),
+) -> StreamingResponse:
+    """Server-Sent Events feed of media changes (вместо polling GET /media)"""
+    try:
+        resume_from = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise ApiError(code="validation_error", status=422)
+
+    await change_feed.ensure_started()
+    shard = await shard_of(user_id)
+    try:
+        sub = change_feed.subscribe(user_id, resume_from, shard)
+    except FeedLimitExceeded:
+        raise ApiError(code="rate_limit_exceeded", status=429)
+
+    async def event_stream():
+        try:
+            if sub.reset:
+                yield RESET_SSE
+            for event in sub.replay:
+                yield event.to_sse()
+            while True:
+                try:
+                    message = await asyncio.wait_for(sub.queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield KEEPALIVE_SSE
+                    continue
+                if message is None:
+                    # Клиент не успевал читать: закрываем поток
+                    yield OVERFLOW_SSE
+                    break
+                yield message
+        finally:
+            change_feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _duplicate_candidates(similar) -> List[DuplicateCandidate]:
+    return [
+        DuplicateCandidate(
+            id=media.id,
+            title=media.title,
+            kind=media.kind,
+            year=media.year,
+            similarity=round(score, 3),
+        )
+        for media, score in similar
+    ]
+
+
+@router.get("/duplicates", response_model=List[DuplicateCandidate])
+async def find_duplicates(
+    title: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[MediaKind] = Query(None),
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+) -> List[DuplicateCandidate]:
+    """Near-duplicate check: media with similar titles, best match first"""
+    similar = await media_crud.find_near_duplicates(db, title, kind, user_id)
+    return _duplicate_candidates(similar)
+
+
+@router.get("/tags", response_model=List[TagCount])
+async def get_tag_counts(
+    user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)
+) -> List[TagCount]:
+    """Tags of the current user with the number of media for each"""
+    counts = await media_crud.get_tag_counts(db, user_id)
+    return [TagCount(tag=tag, count=count) for tag, count in counts]
+
+
 @router.get("/{media_id}", response_model=MediaResponse)
 async def get_media_by_id(  # ASYNC
-    media_id: int, db: AsyncSession = Depends(get_db)
+    media_id: int, user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)
 ) -> MediaResponse:
     """Get media by ID"""
-    media = await media_crud.get_media_by_id(db, media_id, CURRENT_USER_ID)
+    media = await media_crud.get_media_by_id(db, media_id, user_id)
     if not media:
         raise ApiError(code="not_found", status=404)
 
@@ -62,24 +278,29 @@ async def get_media_by_id(  # ASYNC
         user_id=media.user_id,
         status=media.status,
         rating=media.rating,
+        tags=media.tags or [],
         created_at=media.created_at.isoformat(),
     )
 
 
-@router.post("", response_model=MediaResponse, status_code=201)
+@router.post("", response_model=MediaCreateResponse, status_code=201)
 async def create_media(  # ASYNC
-    media_data: MediaCreate, db: AsyncSession = Depends(get_db)
-) -> MediaResponse:
-    """Create new media"""
+    media_data: MediaCreate,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+) -> MediaCreateResponse:
+    """Create new media; similar existing titles come back as a warning"""
     # Check duplicates
     if await media_crud.check_media_exists(
-        db, media_data.title, media_data.year, media_data.kind, CURRENT_USER_ID
+        db, media_data.title, media_data.year, media_data.kind, user_id
     ):
         raise ApiError(code="already_exists", status=409)
 
-    new_media = await media_crud.create_media(db, media_data, CURRENT_USER_ID)
+    # Похожие названия не блокируют создание, только возвращаются клиенту
+    similar = await media_crud.find_near_duplicates(db, media_data.title, media_data.kind, user_id)
+    new_media = await media_crud.create_media(db, media_data, user_id)
 
-    return MediaResponse(
+    return MediaCreateResponse(
         id=new_media.id,
         title=new_media.title,
         kind=new_media.kind,
@@ -88,16 +309,21 @@ async def create_media(  # ASYNC
         user_id=new_media.user_id,
         status=new_media.status,
         rating=new_media.rating,
+        tags=new_media.tags or [],
         created_at=new_media.created_at.isoformat(),
+        possible_duplicates=_duplicate_candidates(similar),
     )
 
 
 @router.put("/{media_id}", response_model=MediaResponse)
 async def update_media(  # ASYNC
-    media_id: int, media_data: MediaUpdate, db: AsyncSession = Depends(get_db)
+    media_id: int,
+    media_data: MediaUpdate,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
 ) -> MediaResponse:
     """Update media"""
-    updated_media = await media_crud.update_media(db, media_id, media_data, CURRENT_USER_ID)
+    updated_media = await media_crud.update_media(db, media_id, media_data, user_id)
     if not updated_media:
         raise ApiError(code="not_found", status=404)
 
@@ -110,16 +336,72 @@ async def update_media(  # ASYNC
         user_id=updated_media.user_id,
         status=updated_media.status,
         rating=updated_media.rating,
+        tags=updated_media.tags or [],
         created_at=updated_media.created_at.isoformat(),
     )
 
 
 @router.patch("/{media_id}/status", response_model=MediaResponse)
 async def update_media_status(  # ASYNC
-    media_id: int, status_data: MediaStatusUpdate, db: AsyncSession = Depends(get_db)
+    media_id: int,
+    status_data: MediaStatusUpdate,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
 ) -> MediaResponse:
     """Update media status"""
-    updated_media = await media_crud.update_media_status(db, media_id, status_data, CURRENT_USER_ID)
+    updated_media = await media_crud.update_media_status(db, media_id, status_data, user_id)
+    if not updated_media:
+        raise ApiError(code="not_found", status=404)
+
+    return MediaResponse(
+        id=updated_media.id,
+        title=updated_media.title,
+        kind=updated_media.kind,
+        year=updated_media.year,
+        description=updated_media.description,
+        user_id=updated_media.user_id,
+        status=updated_media.status,
+        rating=updated_media.rating,
+        tags=updated_media.tags or [],
+        created_at=updated_media.created_at.isoformat(),
+    )
+
+
+@router.put("/{media_id}/tags", response_model=MediaResponse)
+async def set_media_tags(
+    media_id: int,
+    tags_data: MediaTags,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+) -> MediaResponse:
+    """Replace media tags"""
+    updated_media = await media_crud.set_media_tags(db, media_id, tags_data.tags, user_id)
+    if not updated_media:
+        raise ApiError(code="not_found", status=404)
+
+    return MediaResponse(
+        id=updated_media.id,
+        title=updated_media.title,
+        kind=updated_media.kind,
+        year=updated_media.year,
+        description=updated_media.description,
+        user_id=updated_media.user_id,
+        status=updated_media.status,
+        rating=updated_media.rating,
+        tags=updated_media.tags or [],
+        created_at=updated_media.created_at.isoformat(),
+    )
+
+
+@router.delete("/{media_id}/tags/{tag}", response_model=MediaResponse)
+async def remove_media_tag(
+    media_id: int,
+    tag: str,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+) -> MediaResponse:
+    """Remove one tag from media"""
+    updated_media = await media_crud.remove_media_tag(db, media_id, tag.strip().lower(), user_id)
     if not updated_media:
         raise ApiError(code="not_found", status=404)
 
@@ -132,12 +414,15 @@ async def update_media_status(  # ASYNC
         user_id=updated_media.user_id,
         status=updated_media.status,
         rating=updated_media.rating,
+        tags=updated_media.tags or [],
         created_at=updated_media.created_at.isoformat(),
     )
 
 
 @router.delete("/{media_id}", status_code=204)
-async def delete_media(media_id: int, db: AsyncSession = Depends(get_db)):  # ASYNC
+async def delete_media(  # ASYNC
+    media_id: int, user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)
+):
     """Delete media"""
-    if not await media_crud.delete_media(db, media_id, CURRENT_USER_ID):
+    if not await media_crud.delete_media(db, media_id, user_id):
         raise ApiError(code="not_found", status=404)
@@ -1,6 +1,8 @@
 import uuid
 from typing import Any, Dict, Optional
 
+from app.core.context import correlation_id
+
 # HTTP статус → краткий title (стандартные фразы)
 HTTP_STATUS_TITLES = {
     400: "Bad Request",
@@ -13,6 +15,8 @@ HTTP_STATUS_TITLES = {
     422: "Unprocessable Entity",
     429: "Too Many Requests",
     500: "Internal Server Error",
+    503: "Service Unavailable",
+    507: "Insufficient Storage",
 }
 
 # Только детальные сообщения (безопасные)
@@ -25,6 +29,15 @@ SAFE_ERROR_DETAILS = {
     "payload_too_large": "Request payload exceeds maximum allowed size",
     "unsupported_media_type": "Content-Type header specifies unsupported media type",
     "rate_limit_exceeded": "Too many requests - rate limit exceeded",
+    "service_unavailable": "The service is temporarily overloaded, please retry later",
+    "request_timeout": "The request took too long to process, please retry later",
+    "internal_error": "An internal error occurred",
+    "storage_full": "The storage limit for this resource has been reached",
+    "profiler_busy": "A profiling session is already running",
+    "user_moving": "Your data is being moved to another server, please retry shortly",
+    "idempotency_key_invalid": "Idempotency-Key must be 1-255 visible ASCII characters",
+    "idempotency_key_reused": "This Idempotency-Key was already used for a different request",
+    "idempotency_key_in_use": "A request with this Idempotency-Key is still being processed",
 }
 
 
@@ -46,7 +59,8 @@ def problem(
         "title": title,  # КРАТКИЙ ИЗ HTTP СТАТУСА
         "status": status,
         "detail": detail or "An error occurred",  # ПОДРОБНЫЙ ИЗ ПАРАМЕТРА
-        "correlation_id": str(uuid.uuid4()),
+        # Тот же id, что в X-Correlation-ID и в логах запроса
+        "correlation_id": correlation_id.get() or str(uuid.uuid4()),
     }
 
     problem_response.update(kwargs)
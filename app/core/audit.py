@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from sqlalchemy.exc import DBAPIError
+
+from app.core.context import correlation_id
+from app.core.metrics import metrics
+from app.models.audit import AUDIT_COPY_COLUMNS, audit_partition_ddl, month_start
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true").lower() == "true"
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "1000"))
+AUDIT_SHUTDOWN_TIMEOUT = float(os.getenv("AUDIT_SHUTDOWN_TIMEOUT_SECONDS", "5"))
+# MEDIA_STORAGE=memory: сколько последних событий держать в памяти
+AUDIT_MEMORY_RETENTION = int(os.getenv("AUDIT_MEMORY_RETENTION", "10000"))
+STORAGE_BACKEND = os.getenv("MEDIA_STORAGE", "sql").lower()
+
+
+class AuditEvent:
+    """One audited write: who, what, which media, field diff and request id"""
+
+    __slots__ = ("occurred_at", "user_id", "op", "media_id", "changes", "correlation_id")
+
+    def __init__(
+        self,
+        user_id: int,
+        op: str,
+        media_id: Optional[int],
+        changes: Dict[str, list],
+        correlation_id: Optional[str] = None,
+        occurred_at: Optional[datetime] = None,
+    ):
+        self.occurred_at = occurred_at or datetime.now(timezone.utc)
+        self.user_id = user_id
+        self.op = op
+        self.media_id = media_id
+        self.changes = changes
+        self.correlation_id = correlation_id
+
+    def as_record(self) -> tuple:
+        """Строка для COPY в порядке AUDIT_COPY_COLUMNS (jsonb - текстом)"""
+        return (
+            self.occurred_at,
+            self.user_id,
+            self.op,
+            self.media_id,
+            json.dumps(self.changes, ensure_ascii=False),
+            self.correlation_id,
+        )
+
+
+def diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, list]:
+    """{поле: [до, после]} для изменившихся полей; create/delete - одна сторона None"""
+    before, after = before or {}, after or {}
+    return {
+        field: [before.get(field), after.get(field)]
+        for field in sorted(before.keys() | after.keys())
+        if before.get(field) != after.get(field)
+    }
+
+
+class SqlAuditSink:
+    """COPY батча в audit_log одним round trip (asyncpg copy_records_to_table)
+
+    Партиция месяца создаётся при первой записи в него; COPY идёт в
+    autocommit и атомарен сам по себе. Свой engine без пула: flush раз в
+    интервал не занимает соединения, которые нужны запросам (max_overflow=0).
+    """
+
+    def __init__(self, engine=None):
+        self._engine = engine
+        self._partitions: Set[date] = set()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            from sqlalchemy.pool import NullPool
+
+            from app.core.database import connect_args, create_database_url
+
+            self._engine = create_async_engine(
+                create_database_url("asyncpg"),
+                poolclass=NullPool,
+                connect_args=connect_args("asyncpg"),
+            )
+        return self._engine
+
+    async def write(self, events: List[AuditEvent]) -> None:
+        # Месяц - в UTC, как границы партиций
+        months = {
+            month_start(event.occurred_at.astimezone(timezone.utc).date()) for event in events
+        }
+        async with self.engine.connect() as conn:
+            for month in sorted(months - self._partitions):
+                try:
+                    await conn.exec_driver_sql(audit_partition_ddl(month))
+                    await conn.commit()
+                except DBAPIError:
+                    # Параллельно создал другой воркер; если партиции нет - упадёт COPY
+                    await conn.rollback()
+
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                "audit_log",
+                records=[event.as_record() for event in events],
+                columns=AUDIT_COPY_COLUMNS,
+            )
+        self._partitions |= months
+
+
+class MemoryAuditSink:
+    """Последние события в памяти (MEDIA_STORAGE=memory: без PostgreSQL)"""
+
+    def __init__(self, retention: int = AUDIT_MEMORY_RETENTION):
+        self.events: Deque[AuditEvent] = deque(maxlen=retention)
+
+    async def write(self, events: List[AuditEvent]) -> None:
+        self.events.extend(events)
+
+
+class AuditLog:
+    """Bounded in-process queue of audit events flushed in batches
+
+    record() только кладёт событие в очередь: запись в БД не добавляется к
+    латентности запроса. Фоновая задача пишет батчи по batch_size событий
+    раз в flush_interval (или сразу, когда набрался батч). Полная очередь -
+    событие отбрасывается и считается в audit_events_dropped_total, запрос
+    не ждёт. Ошибка записи - батч возвращается в начало очереди.
+    """
+
+    def __init__(
+        self,
+        sink,
+        max_queue: int = AUDIT_QUEUE_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval_ms: float = AUDIT_FLUSH_INTERVAL_MS,
+    ):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: Deque[AuditEvent] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+        metrics.gauge(
+            "audit_queue_depth",
+            lambda: len(self._queue),
+            help_text="Audit events waiting for flush",
+        )
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def record(
+        self,
+        user_id: int,
+        op: str,
+        media_id: Optional[int],
+        before: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Enqueue an event; never blocks and never raises"""
+        if len(self._queue) >= self.max_queue:
+            self._drop(1, "overflow")
+            return
+        self._queue.append(
+            AuditEvent(user_id, op, media_id, diff(before, after), correlation_id.get())
+        )
+        if len(self._queue) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _drop(self, count: int, reason: str) -> None:
+        self.dropped += count
+        metrics.inc(
+            "audit_events_dropped_total",
+            count,
+            labels={"reason": reason},
+            help_text="Audit events lost (queue overflow, write errors, shutdown)",
+        )
+
+    def start(self) -> None:
+        """Start the background flusher on the running loop (lifespan)"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(self.flush_interval)  # БД недоступна - не крутимся
+
+    async def flush(self) -> bool:
+        """Write everything queued so far; False if the sink failed"""
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await self.sink.write(batch)
+            except asyncio.CancelledError:
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                self._requeue(batch)
+                metrics.inc(
+                    "audit_flush_errors_total", help_text="Failed audit batch writes (retried)"
+                )
+                logger.warning("Audit flush of %d events failed: %s", len(batch), e)
+                return False
+            self.written += len(batch)
+            metrics.inc(
+                "audit_events_written_total",
+                len(batch),
+                help_text="Audit events persisted",
+            )
+        return True
+
+    def _requeue(self, batch: List[AuditEvent]) -> None:
+        # Старые события вперёд; что не помещается - теряется (и считается)
+        room = max(self.max_queue - len(self._queue), 0)
+        keep = batch[:room]
+        self._queue.extendleft(reversed(keep))
+        if len(batch) > len(keep):
+            self._drop(len(batch) - len(keep), "write_error")
+
+    async def stop(self) -> None:
+        """Stop the flusher and persist the remaining queue (flush-on-shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wakeup = None
+        try:
+            await asyncio.wait_for(self.flush(), AUDIT_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        if self._queue:
+            logger.warning("Audit shutdown: %d events not persisted", len(self._queue))
+            self._drop(len(self._queue), "shutdown")
+            self._queue.clear()
+
+
+def create_audit_sink(backend: str = STORAGE_BACKEND):
+    """Sink by storage backend: COPY в PostgreSQL или память"""
+    return MemoryAuditSink() if backend == "memory" else SqlAuditSink()
+
+
+# Singleton (на процесс); None - аудит выключен (AUDIT_ENABLED=false)
+audit_log = AuditLog(create_audit_sink()) if AUDIT_ENABLED else None
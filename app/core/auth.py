@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+from app.core.metrics import metrics
+from app.core.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Источник ключей: JWKS (путь к файлу или http(s) URL) и/или один PEM ключ без kid
+AUTH_JWKS = os.getenv("AUTH_JWKS")
+AUTH_PUBLIC_KEY_FILE = os.getenv("AUTH_PUBLIC_KEY_FILE")
+AUTH_ISSUER = os.getenv("AUTH_ISSUER") or None
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE") or None
+# Только асимметричные алгоритмы: секрет HS256 не должен жить в каждом сервисе
+AUTH_ALGORITHMS = [a.strip() for a in os.getenv("AUTH_ALGORITHMS", "RS256,ES256").split(",")]
+AUTH_LEEWAY_SECONDS = int(os.getenv("AUTH_LEEWAY_SECONDS", "30"))
+AUTH_KEYS_REFRESH_SECONDS = float(os.getenv("AUTH_KEYS_REFRESH_SECONDS", "300"))
+# Незнакомый kid перечитывает ключи не чаще, чем раз в N секунд (мусорные kid не DoS-ят JWKS)
+AUTH_KEYS_MIN_REFRESH_SECONDS = float(os.getenv("AUTH_KEYS_MIN_REFRESH_SECONDS", "10"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Кэш не держит токен дольше TTL, даже если exp дальше
+AUTH_TOKEN_CACHE_TTL_SECONDS = float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "300"))
+# Scope для служебных эндпоинтов (/debug/*)
+AUTH_ADMIN_SCOPE = os.getenv("AUTH_ADMIN_SCOPE", "admin")
+
+_USER_ID = re.compile(r"[1-9][0-9]{0,8}")
+
+
+class Principal(NamedTuple):
+    """Verified caller: user_id из sub и scopes из scope/scp"""
+
+    user_id: int
+    scopes: FrozenSet[str] = frozenset()
+
+
+class InvalidToken(Exception):
+    """Token is malformed, expired, signed by an unknown key or has bad claims"""
+
+
+class KeysUnavailable(Exception):
+    """No verification keys could be loaded"""
+
+
+class AuthNotConfigured(RuntimeError):
+    """Neither AUTH_JWKS nor AUTH_PUBLIC_KEY_FILE is set"""
+
+    def __init__(self):
+        super().__init__(
+            "no token verification keys: set AUTH_JWKS (JWKS file or URL) "
+            "or AUTH_PUBLIC_KEY_FILE (PEM public key)"
+        )
+
+
+class KeySet:
+    """Parsed public keys by kid
+
+    Ключи разбираются один раз при загрузке (PyJWK -> объект cryptography), а
+    не на каждый запрос. Перечитываются раз в refresh_seconds и при незнакомом
+    kid - так подхватывается ротация. Одновременные перечитывания сливаются в
+    одно (SingleFlight). revision растёт, когда ключ исчезает из набора.
+    """
+
+    def __init__(
+        self,
+        jwks: Optional[str] = None,
+        public_key_file: Optional[str] = None,
+        refresh_seconds: float = AUTH_KEYS_REFRESH_SECONDS,
+        min_refresh_seconds: float = AUTH_KEYS_MIN_REFRESH_SECONDS,
+    ):
+        self.jwks = jwks
+        self.public_key_file = public_key_file
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.revision = 0
+        self._keys: Dict[Optional[str], Any] = {}
+        self._loaded_at: Optional[float] = None
+        self._attempted_at: Optional[float] = None
+        self._flight = SingleFlight()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.jwks or self.public_key_file)
+
+    async def ensure_fresh(self) -> None:
+        """Перечитать набор, если он старше refresh_seconds (дешёво, когда свежий)"""
+        if not self.configured:
+            return
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            await self.refresh()
+
+    async def get(self, kid: Optional[str]) -> Optional[Any]:
+        if not self.configured:
+            return None
+
+        now = time.monotonic()
+        await self.ensure_fresh()
+        key = self._lookup(kid)
+        if key is None and now - (self._attempted_at or 0) >= self.min_refresh_seconds:
+            await self.refresh()  # Возможно, ключ только что выпущен
+            key = self._lookup(kid)
+        return key
+
+    def _lookup(self, kid: Optional[str]) -> Optional[Any]:
+        if kid is None and len(self._keys) == 1:
+            return next(iter(self._keys.values()))
+        return self._keys.get(kid)
+
+    async def refresh(self) -> None:
+        await self._flight.do("keys", "refresh", self._refresh)
+
+    async def _refresh(self) -> None:
+        self._attempted_at = time.monotonic()
+        try:
+            keys = await asyncio.to_thread(self._load)
+        except Exception as e:
+            metrics.inc(
+                "auth_keys_refresh_total",
+                labels={"result": "error"},
+                help_text="Verification key reloads",
+            )
+            if not self._keys:
+                raise KeysUnavailable() from e
+            # Источник недоступен - продолжаем со старыми ключами
+            logger.warning(
+                "Auth key refresh failed, keeping %d cached keys: %s", len(self._keys), e
+            )
+            self._loaded_at = time.monotonic()
+            return
+
+        if set(self._keys) - set(keys):
+            self.revision += 1
+        self._keys = keys
+        self._loaded_at = time.monotonic()
+        metrics.inc("auth_keys_refresh_total", labels={"result": "ok"})
+
+    def _load(self) -> Dict[Optional[str], Any]:
+        keys: Dict[Optional[str], Any] = {}
+        if self.public_key_file:
+            with open(self.public_key_file, "rb") as f:
+                keys[None] = load_pem_public_key(f.read())
+        if self.jwks:
+            for jwk in jwt.PyJWKSet.from_dict(self._read_jwks()).keys:
+                keys[jwk.key_id] = jwk.key
+        return keys
+
+    def _read_jwks(self) -> Dict[str, Any]:
+        if self.jwks.startswith(("https://", "http://")):
+            with urllib.request.urlopen(self.jwks, timeout=5) as response:  # nosec B310
+                return json.load(response)
+        with open(self.jwks, encoding="utf-8") as f:
+            return json.load(f)
+
+
+class TokenCache:
+    """Bounded LRU of already verified tokens
+
+    Ключ - sha256 токена (сами токены в памяти не храним), значение - Principal
+    и момент, после которого запись недействительна: min(exp, now + ttl).
+    """
+
+    def __init__(
+        self, maxsize: int = AUTH_TOKEN_CACHE_SIZE, ttl: float = AUTH_TOKEN_CACHE_TTL_SECONDS
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[Any, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        principal, valid_until = entry
+        if time.time() >= valid_until:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return principal
+
+    def put(self, token: str, principal: Any, expires_at: float) -> None:
+        if self.maxsize <= 0:
+            return
+        key = self._key(token)
+        self._entries[key] = (principal, min(expires_at, time.time() + self.ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class TokenVerifier:
+    """Bearer JWT -> Principal (claims sub и scope)
+
+    Проверка подписи - только при промахе кэша; повторные запросы с тем же
+    токеном стоят один sha256 и поиск в словаре.
+    """
+
+    def __init__(
+        self,
+        keys: KeySet,
+        cache: Optional[TokenCache] = None,
+        issuer: Optional[str] = AUTH_ISSUER,
+        audience: Optional[str] = AUTH_AUDIENCE,
+        algorithms: Optional[List[str]] = None,
+        leeway: int = AUTH_LEEWAY_SECONDS,
+    ):
+        self.keys = keys
+        self.cache = cache if cache is not None else TokenCache()
+        self.issuer = issuer
+        self.audience = audience
+        self.algorithms = algorithms or AUTH_ALGORITHMS
+        self.leeway = leeway
+        self._revision = keys.revision
+
+    async def verify(self, token: str) -> int:
+        return (await self.authenticate(token)).user_id
+
+    async def authenticate(self, token: str) -> Principal:
+        await self.keys.ensure_fresh()
+        if self._revision != self.keys.revision:
+            # Ключ отозван - токены, проверенные им, больше не доверенные
+            self.cache.clear()
+            self._revision = self.keys.revision
+
+        principal = self.cache.get(token)
+        if principal is not None:
+            metrics.inc(
+                "auth_token_cache_total",
+                labels={"result": "hit"},
+                help_text="Bearer token verifications served from cache",
+            )
+            return principal
+        metrics.inc("auth_token_cache_total", labels={"result": "miss"})
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError:
+            raise InvalidToken()
+        key = await self.keys.get(header.get("kid"))
+        if key is None:
+            raise InvalidToken()
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=self.algorithms,
+                issuer=self.issuer,
+                audience=self.audience,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.PyJWTError:
+            raise InvalidToken()
+
+        principal = Principal(_user_id(claims["sub"]), _scopes(claims))
+        self.cache.put(token, principal, claims["exp"])
+        return principal
+
+
+def _user_id(sub: Any) -> int:
+    """sub - положительный целый id пользователя (media.user_id, INTEGER)"""
+    if not isinstance(sub, str) or not _USER_ID.fullmatch(sub):
+        raise InvalidToken()
+    return int(sub)
+
+
+def _scopes(claims: Dict[str, Any]) -> FrozenSet[str]:
+    """scope - строка через пробел (RFC 8693), scp - список (Azure AD и др.)"""
+    scope, scp = claims.get("scope"), claims.get("scp")
+    values = scope.split() if isinstance(scope, str) else []
+    if isinstance(scp, list):
+        values += [s for s in scp if isinstance(s, str)]
+    return frozenset(values)
+
+
+def require_key_source(keys: Optional[KeySet] = None) -> None:
+    """При старте: без источника ключей каждый запрос с токеном получил бы 401"""
+    if not (keys or token_verifier.keys).configured:
+        raise AuthNotConfigured()
+
+
+# Singleton (на процесс)
+token_verifier = TokenVerifier(KeySet(AUTH_JWKS, AUTH_PUBLIC_KEY_FILE))
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Text, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.media import media_change_seq
+
+logger = logging.getLogger(__name__)
+
+# Отдельный канал на воркер pytest-xdist, чтобы события тестов не смешивались
+CHANNEL = os.getenv("CHANGE_FEED_CHANNEL", "media_changes")
+
+# Лимиты (на воркер)
+QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "100"))
+HISTORY_SIZE = int(os.getenv("CHANGE_FEED_HISTORY_SIZE", "500"))
+# Пользователей с историей (LRU): история нужна и без подписчиков - для Last-Event-ID
+HISTORY_USERS = int(os.getenv("CHANGE_FEED_HISTORY_USERS", "10000"))
+MAX_SUBSCRIBERS_PER_USER = int(os.getenv("CHANGE_FEED_MAX_PER_USER", "5"))
+MAX_SUBSCRIBERS_TOTAL = int(os.getenv("CHANGE_FEED_MAX_TOTAL", "1000"))
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """Compact change notification"""
+
+    version: int
+    user_id: int
+    media_id: int
+    op: str
+
+    def to_sse(self) -> str:
+        data = json.dumps(
+            {"id": self.media_id, "op": self.op, "version": self.version}, separators=(",", ":")
+        )
+        return f"id: {self.version}\nevent: change\ndata: {data}\n\n"
+
+
+# Служебные сообщения потока
+RESET_SSE = "event: reset\ndata: {}\n\n"
+OVERFLOW_SSE = "event: overflow\ndata: {}\n\n"
+KEEPALIVE_SSE = ": keepalive\n\n"
+
+
+async def publish_change(db: AsyncSession, user_id: int, media_id: int, op: str) -> None:
+    """Publish a change with NOTIFY inside the current transaction.
+
+    Postgres доставляет NOTIFY только после COMMIT, откат транзакции событие отменяет.
+    """
+    await publish_changes(db, [(user_id, media_id, op)])
+
+
+async def publish_changes(db: AsyncSession, changes: List[Tuple[int, int, str]]) -> None:
+    """Publish several (user_id, media_id, op) changes in one round trip
+
+    version берётся из media_change_seq до COMMIT, поэтому порядок версий может
+    расходиться с порядком коммитов. NOTIFY приходят в порядке коммитов - в нём
+    же история ChangeFeed, и повтор после Last-Event-ID идёт по позиции в ней.
+    """
+    notifications = [
+        func.pg_notify(
+            CHANNEL,
+            cast(
+                func.json_build_object(
+                    "id",
+                    media_id,
+                    "op",
+                    op,
+                    "user_id",
+                    user_id,
+                    "version",
+                    media_change_seq.next_value(),
+                ),
+                Text,
+            ),
+        )
+        for user_id, media_id, op in changes
+    ]
+    if notifications:
+        await db.execute(select(*notifications))
+
+
+class FeedLimitExceeded(Exception):
+    """Too many open subscriptions"""
+
+
+class Subscription:
+    """One SSE client: bounded queue of events"""
+
+    def __init__(
+        self, user_id: int, replay: List[ChangeEvent], reset: bool, shard: Optional[str] = None
+    ):
+        self.user_id = user_id
+        self.shard = shard
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.replay = replay
+        self.reset = reset
+        self.overflowed = False
+
+    def offer(self, message: Optional[str]) -> bool:
+        """Non-blocking put; returns False if the consumer is too slow"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+
+class ChangeFeed:
+    """Shared LISTEN connection per worker (one per shard) with fan-out to per-user queues
+
+    Шард None - основная БД (без DB_SHARDS). У каждого шарда своя media_change_seq,
+    поэтому сброс истории - на шард. История - в порядке прихода NOTIFY (порядок
+    коммитов), на HISTORY_USERS последних активных пользователей.
+    """
+
+    def __init__(
+        self,
+        history_size: int = HISTORY_SIZE,
+        listen: bool = True,
+        history_users: int = HISTORY_USERS,
+    ):
+        self.history_size = history_size
+        self.history_users = history_users
+        # False: события приходят через dispatch() в процессе (in-memory storage)
+        self.listen = listen
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._history: "OrderedDict[int, Deque[ChangeEvent]]" = OrderedDict()
+        # Шард, из которого пришла история пользователя
+        self._user_shard: Dict[int, Optional[str]] = {}
+        self._conns: Dict[Optional[str], Any] = {}
+        self._tasks: Dict[Optional[str], asyncio.Task] = {}
+        self._ready: Dict[Optional[str], asyncio.Event] = {}
+        self.dropped_subscribers = 0
+
+    # Подписки
+
+    def subscribe(
+        self, user_id: int, last_event_id: Optional[int] = None, shard: Optional[str] = None
+    ) -> Subscription:
+        total = sum(len(subs) for subs in self._subscribers.values())
+        # Без setdefault до проверки: отказ не оставляет пустой записи пользователя
+        if total >= MAX_SUBSCRIBERS_TOTAL or (
+            len(self._subscribers.get(user_id, ())) >= MAX_SUBSCRIBERS_PER_USER
+        ):
+            raise FeedLimitExceeded()
+
+        if self._user_shard.get(user_id, shard) != shard:
+            # Пользователя перенесли на другой шард: история старого шарда не годится
+            self._forget_user(user_id)
+        replay: List[ChangeEvent] = []
+        reset = False
+        if last_event_id is not None:
+            history = list(self._history.get(user_id, ()))
+            position = next((i for i, e in enumerate(history) if e.version == last_event_id), None)
+            if position is None:
+                # Событие вытеснено из истории (или пришло до старта LISTEN): разрыв не
+                # покрыт, клиент должен перечитать список
+                reset = True
+            else:
+                # По позиции, а не version > last_event_id: событие с меньшей версией,
+                # закоммиченное позже, стоит в истории после last_event_id
+                replay = history[position + 1 :]
+
+        sub = Subscription(user_id, replay, reset, shard)
+        self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subscribers.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.user_id]
+
+    def dispatch(self, event: ChangeEvent, shard: Optional[str] = None) -> None:
+        if self._user_shard.get(event.user_id, shard) != shard:
+            self._forget_user(event.user_id)
+        self._user_shard[event.user_id] = shard
+        history = self._history.get(event.user_id)
+        if history is None:
+            history = self._history[event.user_id] = deque(maxlen=self.history_size)
+            while len(self._history) > self.history_users:
+                self._forget_user(next(iter(self._history)))
+        else:
+            self._history.move_to_end(event.user_id)
+        history.append(event)
+
+        message = event.to_sse()
+        for sub in list(self._subscribers.get(event.user_id, ())):
+            if not sub.offer(message):
+                # Медленный клиент: отключаем, он переподключится с Last-Event-ID
+                self._drop(sub)
+
+    def _drop(self, sub: Subscription) -> None:
+        sub.overflowed = True
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+        self.unsubscribe(sub)
+        self.dropped_subscribers += 1
+
+    def _forget_user(self, user_id: int) -> None:
+        self._history.pop(user_id, None)
+        self._user_shard.pop(user_id, None)
+
+    def _reset_all(self, shard: Optional[str] = None) -> None:
+        """После (пере)подключения LISTEN шарда история могла потерять события"""
+        for user_id, user_shard in list(self._user_shard.items()):
+            if user_shard == shard:
+                self._forget_user(user_id)
+        for subs in list(self._subscribers.values()):
+            for sub in list(subs):
+                if sub.shard == shard and not sub.offer(RESET_SSE):
+                    self._drop(sub)
+
+    # LISTEN соединение
+
+    async def ensure_started(self) -> None:
+        if not self.listen:
+            return
+        from app.core.database import SHARDS
+
+        for shard in [spec.name for spec in SHARDS] or [None]:
+            task = self._tasks.get(shard)
+            if task is None or task.done():
+                self._ready[shard] = asyncio.Event()
+                self._tasks[shard] = asyncio.create_task(self._listen_forever(shard))
+        await asyncio.gather(*(ready.wait() for ready in self._ready.values()))
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+        for shard in list(self._conns):
+            await self._close_conn(shard)
+
+    async def _close_conn(self, shard: Optional[str] = None) -> None:
+        conn = self._conns.pop(shard, None)
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    async def _connect(self, shard: Optional[str] = None):
+        import asyncpg
+
+        from app.core.database import SHARDS, connect_args, connect_params
+
+        spec = next((spec for spec in SHARDS if spec.name == shard), None)
+        # Первый вызов может сходить в Vault (синхронный hvac) - не в потоке цикла
+        params = await asyncio.to_thread(connect_params, spec)
+        return await asyncpg.connect(**params, **connect_args("asyncpg"))
+
+    async def _listen_forever(self, shard: Optional[str] = None) -> None:
+        backoff = 0.5
+        while True:
+            try:
+                conn = self._conns[shard] = await self._connect(shard)
+                await conn.add_listener(CHANNEL, partial(self._on_notify, shard))
+                self._reset_all(shard)
+                self._ready[shard].set()
+                backoff = 0.5
+                while not conn.is_closed():
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Change feed listener failed (shard %s): %s", shard, e)
+            finally:
+                await self._close_conn(shard)
+            # Не блокируем подписчиков навсегда, если БД недоступна
+            self._ready[shard].set()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _on_notify(self, shard: Optional[str], conn, pid, channel, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            event = ChangeEvent(
+                version=int(data["version"]),
+                user_id=int(data["user_id"]),
+                media_id=int(data["id"]),
+                op=str(data["op"]),
+            )
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Malformed change notification ignored")
+            return
+        self.dispatch(event, shard)
+
+
+# Singleton (один LISTEN на воркер)
+change_feed = ChangeFeed(listen=os.getenv("MEDIA_STORAGE", "sql").lower() == "sql")
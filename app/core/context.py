@@ -0,0 +1,5 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# Id текущего запроса (CorrelationIdMiddleware): аудит, ответы с ошибками
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
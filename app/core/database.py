@@ -1,11 +1,17 @@
+import asyncio
 import logging
 import os
-from typing import AsyncGenerator, Dict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
 import hvac
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.sharding import DB_SHARDS, ShardRouter, ShardSession, ShardSpec, parse_shards
+from app.core.tracing import instrument_engine, tracer
 
 logger = logging.getLogger(__name__)
 
@@ -53,39 +59,190 @@ def get_db_secrets() -> dict:
     return secrets
 
 
-# ОДИН URL с параметром драйвера
-def create_database_url(driver: str) -> str:
+def connect_params(shard: Optional[ShardSpec] = None) -> dict:
+    """user/password/host/port/database основной БД или шарда (учётные данные общие)"""
     secrets = get_db_secrets()
+    params = {
+        "user": secrets["DB_USER"],
+        "password": secrets["DB_PASSWORD"],
+        "host": secrets["DB_HOST"],
+        "port": int(secrets["DB_PORT"]),
+        "database": secrets["DB_NAME"],
+    }
+    if shard is not None:
+        params["database"] = shard.database
+        params["host"] = shard.host or params["host"]
+        params["port"] = int(shard.port or params["port"])
+    return params
+
+
+# ОДИН URL с параметром драйвера
+def create_database_url(driver: str, shard: Optional[ShardSpec] = None) -> str:
+    params = connect_params(shard)
     return (
-        f"postgresql+{driver}://{secrets['DB_USER']}:{secrets['DB_PASSWORD']}"
-        f"@{secrets['DB_HOST']}:{secrets['DB_PORT']}/{secrets['DB_NAME']}"
+        f"postgresql+{driver}://{params['user']}:{params['password']}"
+        f"@{params['host']}:{params['port']}/{params['database']}"
     )
 
 
+# Схема PostgreSQL (search_path); в тестах - своя на каждый воркер pytest-xdist
+DB_SCHEMA = os.getenv("DB_SCHEMA")
+
+
+def connect_args(driver: str) -> dict:
+    """search_path for DB_SCHEMA: asyncpg и psycopg2 задают его по-разному"""
+    if not DB_SCHEMA:
+        return {}
+    # Только своя схема: иначе таблицы, которых в ней нет, молча берутся из public.
+    # Расширения (pg_trgm) - в public, обращения к ним - с явной схемой
+    search_path = DB_SCHEMA
+    if driver == "asyncpg":
+        return {"server_settings": {"search_path": search_path}}
+    return {"options": f"-csearch_path={search_path}"}
+
+
+# Backend хранения media: sql | memory (без PostgreSQL и Vault - тесты, локальная разработка)
+STORAGE_BACKEND = os.getenv("MEDIA_STORAGE", "sql").lower()
+
+# ПУЛ СОЕДИНЕНИЙ: бюджет на весь инстанс (все воркеры app.server), а не на процесс
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+# 0 - без бюджета: у каждого процесса DB_POOL_SIZE соединений
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Соединения воркера вне пула: LISTEN change feed и COPY аудита
+DB_RESERVED_CONNECTIONS = 2
+# Сколько соединений пула открыть при старте воркера (первые запросы без connect)
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "0"))
+
+
+def pool_size_for(
+    budget: int = DB_CONNECTION_BUDGET,
+    workers: int = WEB_WORKERS,
+    cap: int = DB_POOL_SIZE,
+    reserved: int = DB_RESERVED_CONNECTIONS,
+) -> int:
+    """Pool size of one worker: доля бюджета за вычетом служебных соединений
+
+    cap - потолок на процесс: одному event loop больше соединений не помогает,
+    CPU кончается раньше.
+    """
+    if budget <= 0:
+        return cap
+    share = budget // max(workers, 1) - reserved
+    if share < 1:
+        raise ValueError(
+            f"DB_CONNECTION_BUDGET={budget} is too small for {workers} workers "
+            f"({reserved} reserved connections each)"
+        )
+    return min(share, cap)
+
+
+POOL_SIZE = pool_size_for()
+
+
+def _create_async_engine(url: str):
+    engine = create_async_engine(
+        url,
+        echo=os.getenv("SQL_ECHO", "false").lower() == "true",
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=POOL_SIZE,
+        max_overflow=0,
+        # Короткое ожидание соединения: при исчерпании пула - быстрый 503, а не 30 с
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "2")),
+        connect_args=connect_args("asyncpg"),
+    )
+    # SQL span-ы (только при включённой трассировке: события стоят и без выборки)
+    if tracer.enabled:
+        instrument_engine(engine.sync_engine)
+    return engine
+
+
+# Шарды по user_id (DB_SHARDS); основная БД хранит shard_directory
+SHARDS: List[ShardSpec] = parse_shards(DB_SHARDS)
+
 # ENGINES
-async_engine = create_async_engine(
-    create_database_url("asyncpg"),
-    echo=os.getenv("SQL_ECHO", "false").lower() == "true",
-    pool_pre_ping=True,
-    pool_recycle=300,
-    pool_size=20,
-    max_overflow=0,
-)
-
-sync_engine = create_engine(
-    create_database_url("psycopg2"),
-    echo=os.getenv("SQL_ECHO", "false").lower() == "true",
-    pool_pre_ping=True,
-    future=True,
-)
-
-# SESSION
-AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
-
-
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    """FastAPI dependency для database session"""
+if STORAGE_BACKEND == "memory":
+    async_engine = None
+    sync_engine = None
+    AsyncSessionLocal = None
+    shard_router = None
+else:
+    async_engine = _create_async_engine(create_database_url("asyncpg"))
+
+    sync_engine = create_engine(
+        create_database_url("psycopg2"),
+        echo=os.getenv("SQL_ECHO", "false").lower() == "true",
+        pool_pre_ping=True,
+        future=True,
+        connect_args=connect_args("psycopg2"),
+    )
+
+    if SHARDS:
+        # Пул на каждый шард; DB_CONNECTION_BUDGET - на каждую БД
+        shard_router = ShardRouter(
+            {
+                shard.name: _create_async_engine(create_database_url("asyncpg", shard))
+                for shard in SHARDS
+            },
+            catalog=async_engine,
+        )
+        # SESSION: соединение берётся из движка шарда, который выбрал select_shard
+        AsyncSessionLocal = sessionmaker(
+            class_=AsyncSession, sync_session_class=ShardSession, expire_on_commit=False
+        )
+    else:
+        shard_router = None
+        # SESSION
+        AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# БЮДЖЕТЫ ВРЕМЕНИ НА SQL (statement_timeout, мс) по имени endpoint-функции
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+ROUTE_STATEMENT_TIMEOUTS_MS: Dict[str, int] = {
+    "get_media": 2000,
+    "get_media_by_id": 1000,
+    "sync_media": 3000,
+}
+
+
+def _parse_route_timeouts(raw: str) -> Dict[str, int]:
+    """Parse DB_STATEMENT_TIMEOUTS, e.g. get_media=1500,sync_media=4000"""
+    result = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            result[name.strip()] = int(value)
+    return result
+
+
+ROUTE_STATEMENT_TIMEOUTS_MS.update(_parse_route_timeouts(os.getenv("DB_STATEMENT_TIMEOUTS", "")))
+
+
+def statement_timeout_for(request: Request) -> int:
+    endpoint = request.scope.get("endpoint")
+    name = getattr(endpoint, "__name__", None)
+    return ROUTE_STATEMENT_TIMEOUTS_MS.get(name, DEFAULT_STATEMENT_TIMEOUT_MS)
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    """SET LOCAL в начале каждой транзакции сессии.
+
+    Ставится лениво (соединение берётся только при первом запросе) и живёт
+    до конца транзакции, поэтому не "протекает" в пул.
+    """
+    timeout_ms = session.info.get("statement_timeout_ms")
+    if timeout_ms:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """FastAPI dependency для database session (None для in-memory storage)"""
+    if AsyncSessionLocal is None:
+        yield None
+        return
     async with AsyncSessionLocal() as session:
+        session.info["statement_timeout_ms"] = statement_timeout_for(request)
         try:
             yield session
         except Exception:
@@ -95,19 +252,105 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[Optional[AsyncSession]]:
+    """Session outside of a request (lifespan, scripts)"""
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+def named_engines() -> Dict[str, AsyncEngine]:
+    """catalog (основная БД) и движки шардов по имени (каждый со своим пулом)"""
+    if async_engine is None:
+        return {}
+    return {"catalog": async_engine, **(shard_router.engines if shard_router else {})}
+
+
+def all_engines() -> list:
+    return list(named_engines().values())
+
+
+async def select_shard(
+    db: Optional[AsyncSession], user_id: int, router: Optional[ShardRouter] = None
+) -> None:
+    """Route the session to the user's shard (no-op without sharding)
+
+    Соединение берётся лениво, поэтому шард можно выбрать после создания сессии
+    в get_db. Одна транзакция - один шард: смена шарда посреди неё - ошибка.
+    """
+    router = router or shard_router
+    if router is None or db is None:
+        return
+    name = await router.shard_for(user_id)
+    current = db.info.get("shard")
+    if current == name:
+        return
+    if current is not None and db.in_transaction():
+        raise RuntimeError(f"session is already in a transaction on shard {current}")
+    db.info["shard"] = name
+    db.info["shard_engine"] = router.engines[name]
+
+
+async def shard_of(user_id: int) -> Optional[str]:
+    """Имя шарда пользователя; None без шардирования"""
+    if shard_router is None:
+        return None
+    return await shard_router.shard_for(user_id)
+
+
+async def scatter(
+    fn: Callable[[Optional[AsyncSession]], Awaitable[Any]], router: Optional[ShardRouter] = None
+) -> Dict[str, Any]:
+    """fn(session) на каждом шарде параллельно; без шардов - одна БД ("default")"""
+    router = router or shard_router
+    if router is None:
+        async with session_scope() as db:
+            return {"default": await fn(db)}
+
+    async def on_shard(name, engine):
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            return await fn(db)
+
+    return await router.scatter(on_shard)
+
+
+async def warm_pool(connections: int = DB_POOL_WARMUP) -> None:
+    """Open up to `connections` pool connections at once and return them to the pool"""
+    if connections <= 0:
+        return
+    async with AsyncExitStack() as stack:
+        await asyncio.gather(
+            *(
+                stack.enter_async_context(engine.connect())
+                for engine in all_engines()
+                for _ in range(min(connections, POOL_SIZE))
+            )
+        )
+
+
+async def dispose_engines() -> None:
+    for engine in all_engines():
+        await engine.dispose()
+
+
 async def create_tables():
     from app.models.base import Base
 
-    async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    for engine in all_engines():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
 
 
 async def drop_tables():
     from app.models.base import Base
 
-    async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
+    for engine in all_engines():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
 
 
 # ДЛЯ ALEMBIC
-DATABASE_URL = create_database_url("psycopg2")
+DATABASE_URL = create_database_url("psycopg2") if STORAGE_BACKEND != "memory" else None
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.core.context import correlation_id
+from app.core.metrics import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").upper()
+# json - для сборщика логов, text - для чтения глазами при разработке
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Логгеры uvicorn тоже идут через очередь и JSON (их handler-ы снимаются)
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Стандартные атрибуты LogRecord; всё остальное из extra= попадает в JSON
+_RECORD_ATTRS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys()
+    | {"message", "asctime", "correlation_id"}
+)
+
+
+class CorrelationIdFilter(logging.Filter):
+    """Attach the request correlation id to the record
+
+    Стоит на QueueHandler: contextvar читается в потоке, который пишет лог, а
+    не в потоке QueueListener, где контекста запроса уже нет.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = correlation_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; переводы строк из данных экранируются (log injection)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,  # Воркер app.server
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full
+
+    Поток, который логирует (event loop), только кладёт запись в очередь; I/O
+    делает поток QueueListener. Переполненная очередь не блокирует цикл.
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc(
+                "log_records_dropped_total",
+                help_text="Log records dropped because the log queue was full",
+            )
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение и traceback - здесь (args могут измениться позже), но без
+        # склейки в msg, как делает стандартный prepare()
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[QueueListener] = None
+_listening = False
+
+
+def configure_logging(stream=None) -> None:
+    """Root logger -> bounded queue -> QueueListener thread -> stdout
+
+    Повторный вызов только перезапускает listener после stop_logging().
+    """
+    global _listener, _listening
+    if _listener is None:
+        output = logging.StreamHandler(stream or sys.stdout)
+        if LOG_FORMAT == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(
+                logging.Formatter(
+                    "%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s"
+                )
+            )
+
+        handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(CorrelationIdFilter())
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        for name in UVICORN_LOGGERS:
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+
+        _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+
+    if not _listening:
+        _listener.start()
+        _listening = True
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the listener thread (shutdown)"""
+    global _listening
+    if _listener is not None and _listening:
+        _listener.stop()
+        _listening = False
@@ -0,0 +1,107 @@
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+_Key = Tuple[str, FrozenSet[Tuple[str, str]]]
+
+
+def _format_labels(labels: FrozenSet[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels))
+    return "{" + inner + "}"
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics with Prometheus text exposition"""
+
+    def __init__(self):
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, Callable[[], float]] = {}
+        # Гистограмма: границы, счётчики по корзинам (не кумулятивные), сумма
+        self._histograms: Dict[_Key, Tuple[Sequence[float], List[int], List[float]]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def _describe(self, name: str, kind: str, help_text: Optional[str]) -> None:
+        if name not in self._help:
+            self._help[name] = (kind, help_text or name)
+
+    def inc(
+        self,
+        name: str,
+        value: float = 1,
+        labels: Optional[Dict[str, str]] = None,
+        help_text: Optional[str] = None,
+    ) -> None:
+        self._describe(name, "counter", help_text)
+        key = (name, frozenset((labels or {}).items()))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(
+        self,
+        name: str,
+        fn: Callable[[], float],
+        labels: Optional[Dict[str, str]] = None,
+        help_text: Optional[str] = None,
+    ) -> None:
+        """Register a gauge read lazily at scrape time"""
+        self._describe(name, "gauge", help_text)
+        self._gauges[(name, frozenset((labels or {}).items()))] = fn
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float],
+        labels: Optional[Dict[str, str]] = None,
+        help_text: Optional[str] = None,
+    ) -> None:
+        """Histogram observation; buckets фиксируются первым вызовом"""
+        self._describe(name, "histogram", help_text)
+        key = (name, frozenset((labels or {}).items()))
+        entry = self._histograms.get(key)
+        if entry is None:
+            entry = self._histograms[key] = (tuple(buckets), [0] * (len(buckets) + 1), [0.0])
+        bounds, counts, total = entry
+        index = next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))
+        counts[index] += 1
+        total[0] += value
+
+    def value(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        """Counter/gauge value; для гистограммы - число наблюдений"""
+        key = (name, frozenset((labels or {}).items()))
+        if key in self._gauges:
+            return self._gauges[key]()
+        if key in self._histograms:
+            return sum(self._histograms[key][1])
+        return self._counters.get(key, 0)
+
+    def render(self) -> str:
+        series: Dict[str, list] = {}
+        for (name, labels), value in self._counters.items():
+            series.setdefault(name, []).append((labels, value))
+        for (name, labels), fn in self._gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            series.setdefault(name, []).append((labels, value))
+        for (name, labels), (bounds, counts, total) in list(self._histograms.items()):
+            cumulative = 0
+            for bound, count in zip((*bounds, "+Inf"), counts):
+                cumulative += count
+                le = labels | {("le", str(bound))}
+                series.setdefault(name, []).append((le, cumulative, "_bucket"))
+            series[name].append((labels, total[0], "_sum"))
+            series[name].append((labels, cumulative, "_count"))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text = self._help[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value, *suffix in series[name]:
+                lines.append(f"{name}{''.join(suffix)}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Singleton (на процесс)
+metrics = MetricsRegistry()
@@ -0,0 +1,190 @@
+"""Schema version (Alembic) and online DDL helpers for migrations
+
+Схема меняется только миграциями (alembic upgrade head, до выката приложения);
+при старте приложение лишь сверяет версию каждой БД с head и DDL не выполняет.
+
+Индексы на живых таблицах - build_index_concurrently: CREATE INDEX CONCURRENTLY
+не блокирует запись. Для партиционированной таблицы (media) CONCURRENTLY на
+родителе PostgreSQL не поддерживает, поэтому: индекс ON ONLY родителя (пустой,
+invalid), CONCURRENTLY на каждой партиции и ATTACH PARTITION - после
+подключения последней партиции индекс родителя становится valid.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import column, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+ALEMBIC_INI = os.getenv("ALEMBIC_CONFIG", str(Path(__file__).resolve().parents[2] / "alembic.ini"))
+# DDL миграций не ждёт блокировку дольше (не выстраивает очередь запросов за собой)
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+
+
+class SchemaOutOfDate(RuntimeError):
+    """Database schema version differs from the migrations head"""
+
+    def __init__(self, versions: Dict[str, Optional[str]], head: str):
+        stale = ", ".join(f"{name}={version or 'none'}" for name, version in versions.items())
+        super().__init__(f"schema is not at {head} ({stale}): run `alembic upgrade head`")
+        self.versions = versions
+        self.head = head
+
+
+class SchemaMismatch(RuntimeError):
+    """An existing table cannot be brought to a migration's shape in place"""
+
+
+def alembic_config(connection: Optional[Connection] = None):
+    """Config из alembic.ini; connection - выполнить миграции на нём (тесты, скрипты)"""
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", str(Path(ALEMBIC_INI).parent / "migrations"))
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def head_revision() -> str:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+async def current_revision(engine: AsyncEngine) -> Optional[str]:
+    """Версия схемы БД; None - миграции не применялись
+
+    alembic_version - с явной схемой (current_schema(), как в migrations/env.py):
+    без неё to_regclass ищет по search_path и может найти версию чужой схемы.
+    Имя схемы - идентификатор, его квотирует SQLAlchemy (sqlalchemy.table), не f-строка.
+    """
+    async with engine.connect() as conn:
+        schema, exists = (
+            await conn.execute(
+                text(
+                    "SELECT current_schema(), "
+                    "to_regclass(quote_ident(current_schema()) || '.alembic_version') IS NOT NULL"
+                )
+            )
+        ).one()
+        if not exists:
+            return None
+        version = table("alembic_version", column("version_num"), schema=schema)
+        return (await conn.execute(select(version.c.version_num))).scalar()
+
+
+async def check_schema(engines: Dict[str, AsyncEngine], head: Optional[str] = None) -> None:
+    """Raise SchemaOutOfDate unless every database is at the migrations head"""
+    if not engines:
+        return  # MEDIA_STORAGE=memory
+    head = head or head_revision()
+    versions = {name: await current_revision(engine) for name, engine in engines.items()}
+    if any(version != head for version in versions.values()):
+        raise SchemaOutOfDate(versions, head)
+
+
+def include_object(obj, name, type_, reflected, compare_to) -> bool:
+    """Autogenerate: таблицы без модели (партиции, media_old) не удалять"""
+    return not (type_ == "table" and reflected and compare_to is None)
+
+
+def partitioned(conn: Connection, table: str) -> bool:
+    """table - партиционированная таблица (relkind 'p')"""
+    return bool(
+        conn.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}
+        ).scalar()
+    )
+
+
+def _partitions(conn: Connection, table: str) -> List[str]:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:t) ORDER BY 1"
+        ),
+        {"t": table},
+    )
+    return [row[0] for row in rows]
+
+
+def _indexed_partitions(conn: Connection, name: str) -> List[str]:
+    """Партиции, индекс которых уже подключён к индексу родителя name"""
+    rows = conn.execute(
+        text(
+            "SELECT t.relname FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid "
+            "JOIN pg_class t ON t.oid = x.indrelid WHERE i.inhparent = to_regclass(:name)"
+        ),
+        {"name": name},
+    )
+    return [row[0] for row in rows]
+
+
+def _drop_invalid(conn: Connection, name: str) -> None:
+    """Прерванный CREATE INDEX CONCURRENTLY оставляет invalid индекс - построить заново"""
+    invalid = conn.execute(
+        text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+        {"name": name},
+    ).scalar()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+
+
+def build_index_concurrently(
+    conn: Connection,
+    name: str,
+    table: str,
+    columns: str,
+    using: str = "btree",
+    partitions: Optional[Iterable[str]] = None,
+) -> None:
+    """CREATE INDEX CONCURRENTLY name ON table USING using columns (повторный вызов безопасен)
+
+    conn - в режиме autocommit (CONCURRENTLY нельзя внутри транзакции). columns -
+    SQL в скобках, например "(user_id, lower(title))". У партиционированной таблицы
+    без партиций индекс родителя пуст и создаётся сразу.
+    """
+    is_partitioned = partitioned(conn, table)
+    partitions = list(partitions) if partitions is not None else _partitions(conn, table)
+    # Ожидание старых транзакций - часть CONCURRENTLY, не ограничиваем его lock_timeout
+    conn.execute(text("SET lock_timeout = 0"))
+    try:
+        if not is_partitioned:
+            _drop_invalid(conn, name)
+            conn.execute(
+                text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING {using} {columns}"
+                )
+            )
+            return
+        conn.execute(
+            text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} USING {using} {columns}")
+        )
+        indexed = set(_indexed_partitions(conn, name))
+        for partition in partitions:
+            if partition in indexed:
+                continue
+            # media_p03 -> ix_media_..._p03
+            suffix = partition[len(table) + 1 :] if partition.startswith(f"{table}_") else partition
+            child = f"{name}_{suffix}"
+            _drop_invalid(conn, child)
+            conn.execute(
+                text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} "
+                    f"ON {partition} USING {using} {columns}"
+                )
+            )
+            conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+    finally:
+        conn.execute(text("RESET lock_timeout"))
+
+
+def create_index_concurrently(name: str, table: str, columns: str, using: str = "btree") -> None:
+    """build_index_concurrently из миграции Alembic (вне транзакции миграции)"""
+    from alembic import op
+
+    with op.get_context().autocommit_block():
+        build_index_concurrently(op.get_bind(), name, table, columns, using)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 10 мс: ~100 снимков/с - достаточно для flamegraph и дёшево для процесса
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+# Глубже - обрезаются кадры со стороны корня (лист важнее)
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", "128"))
+# Непрерывный режим: скользящее окно профилей в памяти (реже снимки - меньше накладные)
+PROFILER_CONTINUOUS = os.getenv("PROFILER_CONTINUOUS", "false").lower() == "true"
+PROFILER_CONTINUOUS_INTERVAL_MS = float(os.getenv("PROFILER_CONTINUOUS_INTERVAL_MS", "50"))
+PROFILER_WINDOW_SECONDS = float(os.getenv("PROFILER_WINDOW_SECONDS", "60"))
+PROFILER_WINDOWS = int(os.getenv("PROFILER_WINDOWS", "10"))
+
+EVENT_LOOP_THREAD = "event-loop"
+SAMPLER_THREAD = "stack-sampler"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# Листовые кадры потока, который ничего не делает (ждёт работу или I/O)
+_IDLE_LEAVES = frozenset(
+    {
+        ("threading.py", "wait"),
+        ("threading.py", "_wait_for_tstate_lock"),
+        ("queue.py", "get"),
+        ("selectors.py", "select"),
+        ("thread.py", "_worker"),
+    }
+)
+
+Stack = Tuple[str, ...]
+
+
+class ProfilerBusy(Exception):
+    """Another on-demand profiling session is already running"""
+
+
+class Profile:
+    """Aggregated stack samples: (поток, кадр от корня, ..., лист) -> число снимков"""
+
+    def __init__(self, interval: float, started_at: Optional[float] = None):
+        self.interval = interval
+        self.started_at = time.time() if started_at is None else started_at
+        self.ended_at = self.started_at
+        self.samples = 0
+        self.stacks: "Counter[Stack]" = Counter()
+
+    @property
+    def duration(self) -> float:
+        return self.ended_at - self.started_at
+
+    def add(self, stacks: List[Stack]) -> None:
+        self.samples += 1
+        self.ended_at = time.time()
+        self.stacks.update(stacks)
+
+    def merge(self, other: "Profile") -> None:
+        self.started_at = min(self.started_at, other.started_at)
+        self.ended_at = max(self.ended_at, other.ended_at)
+        self.samples += other.samples
+        self.stacks.update(other.stacks)
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed stacks: "поток;f1;f2;лист N" (flamegraph.pl, speedscope)"""
+        lines = sorted(f"{';'.join(stack)} {count}" for stack, count in self.stacks.items())
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def speedscope(self, name: str = "media-catalog") -> dict:
+        """speedscope file format: один sampled-профиль на поток, общий список кадров
+
+        Снимки агрегированы (порядок во времени не хранится) - смотреть в
+        режимах Left Heavy и Sandwich.
+        """
+        frames: List[dict] = []
+        frame_index: Dict[str, int] = {}
+        by_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+        weight = self.interval * 1000
+        for stack, count in sorted(self.stacks.items()):
+            thread, *labels = stack
+            indices = []
+            for label in labels:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append(_speedscope_frame(label))
+                indices.append(frame_index[label])
+            samples, weights = by_thread.setdefault(thread, ([], []))
+            samples.append(indices)
+            weights.append(count * weight)
+
+        profiles = [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+            for thread, (samples, weights) in sorted(
+                by_thread.items(), key=lambda item: item[0] != EVENT_LOOP_THREAD
+            )
+        ]
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "media-catalog profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _speedscope_frame(label: str) -> dict:
+    """ "func (path:line)" -> {"name", "file", "line"}"""
+    name, _, location = label.partition(" (")
+    path, _, line = location.rstrip(")").rpartition(":")
+    if not path or not line.isdigit():
+        return {"name": label}
+    return {"name": name, "file": path, "line": int(line)}
+
+
+def _short_path(filename: str) -> str:
+    """Путь без site-packages/stdlib префикса: короче и без деталей окружения"""
+    prefixes = [p for p in sys.path if p and filename.startswith(p.rstrip(os.sep) + os.sep)]
+    if not prefixes:
+        return filename
+    return filename[len(max(prefixes, key=len)) :].lstrip(os.sep)
+
+
+class StackSampler:
+    """Background thread: sys._current_frames() every interval
+
+    Снимает стеки всех потоков процесса (event loop, пул to_thread/anyio,
+    служебные потоки), кроме себя. Каждый тик отдаёт список стеков в collect.
+    Кадры подписываются по code object, подписи кэшируются: снимок - это
+    проход по f_back и поиск в словаре. Простаивающие потоки (ждут работу
+    или I/O) по умолчанию пропускаются.
+    """
+
+    def __init__(
+        self,
+        collect: Callable[[List[Stack]], None],
+        interval: float = PROFILER_INTERVAL_MS / 1000,
+        include_idle: bool = False,
+        max_depth: int = PROFILER_MAX_DEPTH,
+        loop_thread_id: Optional[int] = None,
+    ):
+        self.collect = collect
+        self.interval = interval
+        self.include_idle = include_idle
+        self.max_depth = max_depth
+        self.loop_thread_id = loop_thread_id
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if self.loop_thread_id is None:
+            # Запуск из корутины: текущий поток и есть поток event loop
+            self.loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=SAMPLER_THREAD, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    def _run(self) -> None:
+        next_at = time.monotonic()
+        while not self._stop.wait(max(0.0, next_at - time.monotonic())):
+            started = time.perf_counter()
+            try:
+                self.collect(self.sample())
+            except Exception:
+                logger.exception("Stack sampling failed")
+            metrics.inc(
+                "profiler_sampling_seconds_total",
+                time.perf_counter() - started,
+                help_text="Time spent taking stack samples (profiler overhead)",
+            )
+            # Отстали (GIL занят) - не догоняем пачкой снимков
+            next_at = max(next_at + self.interval, time.monotonic())
+
+    def sample(self) -> List[Stack]:
+        """One snapshot of every thread except samplers (свой и непрерывного режима)"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if names.get(ident) == SAMPLER_THREAD:
+                continue
+            code = frame.f_code
+            if (
+                not self.include_idle
+                and (
+                    os.path.basename(code.co_filename),
+                    code.co_name,
+                )
+                in _IDLE_LEAVES
+            ):
+                continue
+            if ident == self.loop_thread_id:
+                thread = EVENT_LOOP_THREAD
+            else:
+                thread = names.get(ident, f"thread-{ident}")
+            stacks.append((thread, *self._walk(frame)))
+        return stacks
+
+    def _walk(self, frame) -> List[str]:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+                self._labels[code] = label
+            labels.append(label)
+            frame = frame.f_back
+        if frame is not None:
+            labels.append("[truncated]")
+        labels.reverse()
+        return labels
+
+
+class OnDemandProfiler:
+    """/debug/profile?seconds=N: один сеанс за раз, ожидание не блокирует event loop"""
+
+    def __init__(self):
+        self.running = False
+
+    async def record(
+        self,
+        seconds: float,
+        interval: float = PROFILER_INTERVAL_MS / 1000,
+        include_idle: bool = False,
+    ) -> Profile:
+        if self.running:
+            raise ProfilerBusy()
+        self.running = True
+        profile = Profile(interval)
+        sampler = StackSampler(profile.add, interval, include_idle)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()  # И при отмене (клиент отключился)
+            self.running = False
+        metrics.inc("profiler_sessions_total", help_text="On-demand profiling sessions")
+        return profile
+
+
+class ContinuousProfiler:
+    """Rolling window of profiles kept in memory
+
+    Снимки копятся в текущем окне длиной window_seconds; закрытые окна лежат в
+    deque(maxlen=windows), старые вытесняются. snapshot(seconds) сливает окна,
+    пересекающиеся с последними seconds секундами, - без ожидания.
+    """
+
+    def __init__(
+        self,
+        interval: float = PROFILER_CONTINUOUS_INTERVAL_MS / 1000,
+        window_seconds: float = PROFILER_WINDOW_SECONDS,
+        windows: int = PROFILER_WINDOWS,
+        include_idle: bool = False,
+    ):
+        self.interval = interval
+        self.window_seconds = window_seconds
+        self.windows: Deque[Profile] = deque(maxlen=windows)
+        self.current = Profile(interval)
+        # Сэмплер пишет из своего потока, snapshot читает из event loop
+        self._lock = threading.Lock()
+        self._sampler = StackSampler(self._collect, interval, include_idle)
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._sampler.stop()
+
+    def _collect(self, stacks: List[Stack]) -> None:
+        with self._lock:
+            if time.time() - self.current.started_at >= self.window_seconds:
+                self.windows.append(self.current)
+                self.current = Profile(self.interval)
+            self.current.add(stacks)
+
+    def snapshot(self, seconds: Optional[float] = None) -> Profile:
+        since = time.time() - seconds if seconds is not None else 0.0
+        with self._lock:
+            recent = [p for p in (*self.windows, self.current) if p.ended_at >= since]
+            merged = Profile(self.interval, started_at=self.current.started_at)
+            for profile in recent:
+                merged.merge(profile)
+        return merged
+
+
+# Singletons (на процесс); continuous_profiler = None - непрерывный режим выключен
+on_demand_profiler = OnDemandProfiler()
+continuous_profiler = ContinuousProfiler() if PROFILER_CONTINUOUS else None
@@ -0,0 +1,192 @@
+"""User-sharded routing: user_id -> one of N PostgreSQL databases
+
+Каждый шард - отдельная БД со своей схемой и своим пулом. Шард пользователя:
+запись в shard_directory (catalog БД), иначе - consistent hash ring по user_id.
+Directory нужен для переноса пользователей (scripts.rebalance_shards): после
+добавления шарда ring отдаёт часть пользователей новому шарду, и до переноса
+данных их держат записи directory.
+
+DB_SHARDS="s0=media_s0,s1=db2.internal:5432/media_s1" - имя=БД или имя=host:port/БД
+(учётные данные - общие, из get_db_secrets). Пусто - шардирования нет.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from bisect import bisect
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+from app.models.shard_directory import ShardDirectoryModel
+
+DB_SHARDS = os.getenv("DB_SHARDS", "")
+# hash - ring + переопределения directory; directory - каждый пользователь закреплён записью
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "hash").lower()
+# Точек на шард в ring: больше - ровнее распределение
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+# Кэш directory на воркер; перенос пользователя ждёт TTL, чтобы все воркеры увидели freeze
+SHARD_DIRECTORY_TTL_SECONDS = float(os.getenv("SHARD_DIRECTORY_TTL_SECONDS", "5"))
+SHARD_DIRECTORY_CACHE_SIZE = int(os.getenv("SHARD_DIRECTORY_CACHE_SIZE", "100000"))
+
+STATE_ACTIVE = "active"
+STATE_FROZEN = "frozen"
+
+
+class ShardSpec(NamedTuple):
+    name: str
+    database: str
+    host: Optional[str] = None
+    port: Optional[str] = None
+
+
+class ShardMoving(Exception):
+    """User data is being moved between shards right now (retry shortly)"""
+
+    def __init__(self, user_id: int):
+        super().__init__(f"user {user_id} is being moved between shards")
+        self.user_id = user_id
+
+
+def parse_shards(raw: str) -> List[ShardSpec]:
+    shards = []
+    for part in raw.split(","):
+        name, _, target = part.strip().partition("=")
+        if not name:
+            continue
+        if not target:
+            raise ValueError(f"DB_SHARDS entry without a database: {part!r}")
+        address, slash, database = target.rpartition("/")
+        host, _, port = address.partition(":") if slash else ("", "", "")
+        shards.append(ShardSpec(name, database, host or None, port or None))
+    if len({shard.name for shard in shards}) != len(shards):
+        raise ValueError("DB_SHARDS names must be unique")
+    return shards
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash: новый шард забирает ~1/N пользователей, остальные на месте"""
+
+    def __init__(self, shards: List[str], vnodes: int = SHARD_VNODES):
+        if not shards:
+            raise ValueError("hash ring needs at least one shard")
+        points = sorted((_point(f"{name}#{i}"), name) for name in shards for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def owner(self, user_id: int) -> str:
+        position = bisect(self._points, _point(str(user_id))) % len(self._points)
+        return self._owners[position]
+
+
+class ShardSession(Session):
+    """Session без фиксированного bind: движок шарда выбирает select_shard()"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        engine = self.info.get("shard_engine")
+        if engine is None:
+            raise RuntimeError("no shard selected for this session (MediaCRUD routes by user_id)")
+        return engine.sync_engine
+
+
+class ShardRouter:
+    """Shard engines, ring and the cached directory"""
+
+    def __init__(
+        self,
+        engines: Dict[str, AsyncEngine],
+        catalog: AsyncEngine,
+        routing: str = SHARD_ROUTING,
+        ttl: float = SHARD_DIRECTORY_TTL_SECONDS,
+        cache_size: int = SHARD_DIRECTORY_CACHE_SIZE,
+    ):
+        if routing not in ("hash", "directory"):
+            raise ValueError(f"Unknown SHARD_ROUTING: {routing}")
+        self.engines = engines
+        self.catalog = catalog
+        self.routing = routing
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.ring = HashRing(list(engines))
+        # user_id -> (шард из directory или None, state, valid until)
+        self._cache: "OrderedDict[int, Tuple[Optional[str], str, float]]" = OrderedDict()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.engines)
+
+    async def lookup(self, user_id: int) -> Tuple[Optional[str], str]:
+        """Запись directory (кэш на ttl секунд, в том числе отсутствие записи)"""
+        entry = self._cache.get(user_id)
+        if entry is not None and time.monotonic() < entry[2]:
+            self._cache.move_to_end(user_id)
+            return entry[0], entry[1]
+        async with self.catalog.connect() as conn:
+            row = (
+                await conn.execute(
+                    select(ShardDirectoryModel.shard, ShardDirectoryModel.state).where(
+                        ShardDirectoryModel.user_id == user_id
+                    )
+                )
+            ).first()
+        shard, state = (row.shard, row.state) if row else (None, STATE_ACTIVE)
+        self._remember(user_id, shard, state)
+        return shard, state
+
+    def _remember(self, user_id: int, shard: Optional[str], state: str) -> None:
+        self._cache[user_id] = (shard, state, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def forget(self, user_id: int) -> None:
+        self._cache.pop(user_id, None)
+
+    async def shard_for(self, user_id: int) -> str:
+        shard, state = await self.lookup(user_id)
+        if state == STATE_FROZEN:
+            raise ShardMoving(user_id)
+        if shard is not None:
+            return shard
+        owner = self.ring.owner(user_id)
+        if self.routing == "directory":
+            owner = await self._assign(user_id, owner)
+        return owner
+
+    async def _assign(self, user_id: int, shard: str) -> str:
+        """Первое обращение пользователя: закрепить за шардом (гонка воркеров - победит один)"""
+        async with self.catalog.begin() as conn:
+            await conn.execute(
+                insert(ShardDirectoryModel)
+                .values(user_id=user_id, shard=shard, state=STATE_ACTIVE)
+                .on_conflict_do_nothing()
+            )
+            row = (
+                await conn.execute(
+                    select(ShardDirectoryModel.shard, ShardDirectoryModel.state).where(
+                        ShardDirectoryModel.user_id == user_id
+                    )
+                )
+            ).one()
+        self._remember(user_id, row.shard, row.state)
+        if row.state == STATE_FROZEN:
+            raise ShardMoving(user_id)
+        return row.shard
+
+    async def scatter(self, fn: Callable[[str, AsyncEngine], Awaitable[Any]]) -> Dict[str, Any]:
+        """fn(name, engine) на всех шардах параллельно (admin-запросы)"""
+        results = await asyncio.gather(*(fn(name, engine) for name, engine in self.engines.items()))
+        return dict(zip(self.engines, results))
+
+    async def dispose(self) -> None:
+        for engine in self.engines.values():
+            await engine.dispose()
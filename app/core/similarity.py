@@ -0,0 +1,34 @@
+import re
+from typing import FrozenSet
+
+# Артикли не отличают названия: "The Matrix" == "Matrix"
+_STOPWORDS = frozenset({"the", "a", "an"})
+_WORD = re.compile(r"\w+")
+
+
+def normalize_title(title: str) -> str:
+    """Signature of a title for near-duplicate search
+
+    Нижний регистр, без пунктуации и артиклей: "The Lord of the Rings - The Return
+    of the King" и "Lord of the Rings: Return of the King" дают одну строку.
+    """
+    words = _WORD.findall(title.lower())
+    meaningful = [word for word in words if word not in _STOPWORDS]
+    return " ".join(meaningful or words)
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Trigrams exactly as pg_trgm builds them (слово дополняется "  " слева и " " справа)"""
+    result = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """pg_trgm similarity(): общие триграммы / все различные триграммы"""
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+# Лидер был отменён (клиент отключился): ожидающие повторяют вызов сами
+_RETRY = object()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical async calls
+
+    Вызовы группируются по group (user_id) и key (параметры запроса). Пока
+    вызов "в полёте", повторные вызовы с тем же ключом ждут его результат и не
+    занимают соединение из пула. forget(group) отрезает уже идущие вызовы
+    группы: новые запросы после записи выполнят свой запрос к БД.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Dict[Hashable, asyncio.Future]] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, group: Hashable, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            calls = self._calls.setdefault(group, {})
+            future = calls.get(key)
+            if future is None:
+                return await self._lead(group, calls, key, fn)
+
+            self.followers += 1
+            result = await asyncio.shield(future)
+            if result is not _RETRY:
+                return result
+
+    async def _lead(self, group, calls, key, fn):
+        future = asyncio.get_running_loop().create_future()
+        calls[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_result(_RETRY)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие; у лидера пробрасываем как обычно
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._discard(group, calls, key, future)
+
+    def _discard(self, group, calls, key, future) -> None:
+        if calls.get(key) is future:
+            del calls[key]
+        if not calls and self._calls.get(group) is calls:
+            del self._calls[group]
+
+    def forget(self, group: Hashable) -> None:
+        """Stop sharing in-flight calls of the group (called after a write)"""
+        self._calls.pop(group, None)
+
+    def in_flight(self, group: Any = None) -> int:
+        if group is not None:
+            return len(self._calls.get(group, {}))
+        return sum(len(calls) for calls in self._calls.values())
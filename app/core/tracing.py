@@ -0,0 +1,403 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import secrets
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# none (выключено) | file (OTLP JSON построчно в файл) | otlp (OTLP/HTTP JSON в коллектор)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "media-catalog")
+# Доля трейсов, решение принимается в корне (входящий traceparent с флагом - всегда)
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.1"))
+# > 0: запросы медленнее порога экспортируются даже вне выборки (хвост p99, NFR-01)
+TRACING_SLOW_MS = float(os.getenv("TRACING_SLOW_MS", "0"))
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "4096"))
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", "512"))
+TRACING_EXPORT_INTERVAL_MS = float(os.getenv("TRACING_EXPORT_INTERVAL_MS", "2000"))
+# Текст SQL в span обрезается (параметры не пишутся вовсе)
+TRACING_MAX_STATEMENT = 2000
+
+# OTLP SpanKind
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """W3C traceparent -> (trace_id, parent span_id, sampled); None если невалиден"""
+    if not value:
+        return None
+    match = _TRACEPARENT.fullmatch(value.strip().lower())
+    if not match:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+class _Trace:
+    """Finished spans of one request (всё, что экспортируется одним решением)"""
+
+    __slots__ = ("sampled", "spans")
+
+    def __init__(self, sampled: bool):
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+
+
+class Span:
+    """One timed operation; trace is None for a non-recording span"""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "_started",
+        "attributes",
+        "error",
+        "trace",
+    )
+
+    def __init__(
+        self,
+        trace_id: str,
+        parent_id: Optional[str],
+        name: str,
+        kind: int = SPAN_KIND_INTERNAL,
+        trace: Optional[_Trace] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.trace = trace
+
+    @property
+    def sampled(self) -> bool:
+        return self.trace is not None and self.trace.sampled
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else self.start_ns
+        return (end - self.start_ns) / 1e6
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self) -> None:
+        # Длительность по монотонным часам, начало - по настенным (для OTLP)
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._started)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            # STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_payload(spans: List[Span], service_name: str = TRACING_SERVICE_NAME) -> Dict[str, Any]:
+    """ExportTraceServiceRequest в JSON-кодировке OTLP"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+                "scopeSpans": [
+                    {"scope": {"name": "app.core.tracing"}, "spans": [s.to_otlp() for s in spans]}
+                ],
+            }
+        ]
+    }
+
+
+class FileSpanWriter:
+    """Один OTLP JSON объект на строку (для локального просмотра и тестов)"""
+
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+
+    def write(self, payload: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload) + "\n")
+
+
+class OtlpHttpWriter:
+    """POST OTLP/HTTP JSON в коллектор (или его локальную заглушку)"""
+
+    def __init__(self, endpoint: str = TRACING_OTLP_ENDPOINT, timeout: float = 5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def write(self, payload: Dict[str, Any]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):  # nosec B310
+            pass
+
+
+class BatchSpanExporter:
+    """Bounded span queue written in batches by a background task
+
+    Запрос только добавляет готовые span-ы в очередь; запись (файл, HTTP)
+    идёт в потоке через asyncio.to_thread. Переполнение - span отбрасывается
+    и считается в tracing_spans_dropped_total.
+    """
+
+    def __init__(
+        self,
+        writer,
+        max_queue: int = TRACING_QUEUE_SIZE,
+        batch_size: int = TRACING_BATCH_SIZE,
+        interval_ms: float = TRACING_EXPORT_INTERVAL_MS,
+    ):
+        self.writer = writer
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._queue: Deque[Span] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.exported = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def export(self, spans: List[Span]) -> None:
+        room = self.max_queue - len(self._queue)
+        if len(spans) > room:
+            metrics.inc(
+                "tracing_spans_dropped_total",
+                len(spans) - max(room, 0),
+                help_text="Spans dropped because the export queue was full",
+            )
+            spans = spans[: max(room, 0)]
+        self._queue.extend(spans)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await asyncio.to_thread(self.writer.write, otlp_payload(batch))
+            except Exception as e:
+                # Трейсы - не аудит: батч не переигрывается
+                metrics.inc("tracing_spans_dropped_total", len(batch))
+                logger.warning("Span export of %d spans failed: %s", len(batch), e)
+                return
+            self.exported += len(batch)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Spans for one process: корень на запрос, дочерние - CRUD и SQL
+
+    Решение о выборке принимается в корне (входящий traceparent или
+    sample_ratio по trace_id). При slow_ms > 0 span-ы пишутся в память для
+    всех запросов, а экспортируются выбранные и медленные.
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[BatchSpanExporter] = None,
+        sample_ratio: float = TRACING_SAMPLE_RATIO,
+        slow_ms: float = TRACING_SLOW_MS,
+    ):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.slow_ms = slow_ms
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def _should_sample(self, trace_id: str) -> bool:
+        # Детерминированно по младшим 8 байтам trace_id (как TraceIdRatioBased)
+        return int(trace_id[16:], 16) < self.sample_ratio * 2**64
+
+    def start_root(self, name: str, traceparent: Optional[str] = None) -> Span:
+        parsed = parse_traceparent(traceparent)
+        if parsed:
+            trace_id, parent_id, sampled = parsed
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+            sampled = self._should_sample(trace_id)
+        recording = sampled or self.slow_ms > 0
+        trace = _Trace(sampled) if recording else None
+        return Span(trace_id, parent_id, name, SPAN_KIND_SERVER, trace)
+
+    def end_root(self, root: Span) -> None:
+        root.finish()
+        trace = root.trace
+        if trace is None or self.exporter is None:
+            return
+        if trace.sampled or (self.slow_ms > 0 and root.duration_ms >= self.slow_ms):
+            self.exporter.export(trace.spans)
+
+    @contextmanager
+    def activate(self, span: Span) -> Iterator[Span]:
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    def start_child(
+        self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None
+    ) -> Optional[Span]:
+        """Child of the current span; None when nothing is being recorded"""
+        parent = _current_span.get()
+        if parent is None or parent.trace is None:
+            return None
+        return Span(parent.trace_id, parent.span_id, name, kind, parent.trace, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        span = self.start_child(name, attributes=attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+
+
+def traced(name: str):
+    """Child span around an async function (MediaCRUD methods)"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_engine(sync_engine) -> None:
+    """SQL span per cursor execute (события Engine; для AsyncEngine - его sync_engine)"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_sql_span(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+        context._trace_span = tracer.start_child(
+            f"SQL {operation}",
+            SPAN_KIND_CLIENT,
+            {
+                "db.system": "postgresql",
+                "db.operation": operation,
+                "db.statement": statement[:TRACING_MAX_STATEMENT],
+            },
+        )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _finish_sql_span(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.attributes["db.rows"] = cursor.rowcount if cursor is not None else -1
+            span.finish()
+            context._trace_span = None
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _fail_sql_span(exception_context):
+        span = getattr(exception_context.execution_context, "_trace_span", None)
+        if span is not None:
+            span.error = type(exception_context.original_exception).__name__
+            span.finish()
+            exception_context.execution_context._trace_span = None
+
+
+def create_exporter(kind: str = TRACING_EXPORTER) -> Optional[BatchSpanExporter]:
+    """Exporter by TRACING_EXPORTER; None - трассировка выключена"""
+    if kind == "file":
+        return BatchSpanExporter(FileSpanWriter())
+    if kind == "otlp":
+        return BatchSpanExporter(OtlpHttpWriter())
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown TRACING_EXPORTER: {kind}")
+
+
+# Singleton (на процесс)
+tracer = Tracer(create_exporter())
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from anyio import to_thread
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100"))
+# Задержка heartbeat больше порога = цикл заблокирован: снимаем стек потока event loop
+LOOP_BLOCKED_THRESHOLD_MS = float(os.getenv("LOOP_BLOCKED_THRESHOLD_MS", "200"))
+# Не чаще одного стека в лог за N секунд (блокировка на каждом запросе не топит логи)
+LOOP_STACK_LOG_COOLDOWN_SECONDS = float(os.getenv("LOOP_STACK_LOG_COOLDOWN_SECONDS", "10"))
+LOOP_STACK_MAX_FRAMES = 40
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# anyio - run_in_threadpool Starlette (sync def handlers), asyncio - asyncio.to_thread
+THREADPOOLS = ("anyio", "asyncio")
+
+
+class PoolStats:
+    __slots__ = ("in_use", "limit", "waiting", "saturated_since")
+
+    def __init__(self):
+        self.in_use = 0
+        self.limit = 0
+        self.waiting = 0
+        self.saturated_since: Optional[float] = None
+
+
+class LoopWatchdog:
+    """Event-loop lag and threadpool saturation monitor
+
+    Heartbeat-задача в цикле спит interval и меряет, насколько позже
+    проснулась (лаг, гистограмма event_loop_lag_seconds). Поток-монитор
+    проверяет время последнего heartbeat: если цикл молчит дольше порога,
+    он снимает стек потока event loop (sys._current_frames) - то есть код,
+    который блокирует цикл прямо сейчас, - и пишет его в лог. Это работает
+    и при вечной блокировке, когда сам цикл уже ничего не залогирует.
+    Заодно heartbeat снимает загрузку пулов потоков.
+    """
+
+    def __init__(
+        self,
+        interval: float = LOOP_WATCHDOG_INTERVAL_MS / 1000,
+        threshold: float = LOOP_BLOCKED_THRESHOLD_MS / 1000,
+        stack_cooldown: float = LOOP_STACK_LOG_COOLDOWN_SECONDS,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_cooldown = stack_cooldown
+        self.lag = 0.0
+        self.pools: Dict[str, PoolStats] = {name: PoolStats() for name in THREADPOOLS}
+        self.last_blocked_stack: Optional[str] = None
+        self.loop_thread_id: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._beat = 0.0
+        self._reported_beat: Optional[float] = None
+        self._last_stack_log = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Из корутины: текущий поток - поток event loop"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self._register_gauges()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def _register_gauges(self) -> None:
+        # При start(): метрики отдаёт запущенный экземпляр
+        metrics.gauge(
+            "event_loop_lag_last_seconds", lambda: self.lag, help_text="Last event-loop lag"
+        )
+        for name, stats in self.pools.items():
+            labels = {"pool": name}
+            metrics.gauge(
+                "threadpool_in_use", lambda s=stats: s.in_use, labels, "Busy threadpool workers"
+            )
+            metrics.gauge("threadpool_limit", lambda s=stats: s.limit, labels, "Threadpool size")
+            metrics.gauge(
+                "threadpool_waiting",
+                lambda s=stats: s.waiting,
+                labels,
+                "Calls waiting for a free threadpool worker",
+            )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.beat(time.monotonic() - expected)
+
+    def beat(self, lag: float) -> None:
+        """One heartbeat: лаг в метрики, затем загрузка пулов"""
+        self._beat = time.monotonic()
+        self.lag = lag = max(0.0, lag)
+        metrics.observe(
+            "event_loop_lag_seconds",
+            lag,
+            LAG_BUCKETS,
+            help_text="How late the event-loop heartbeat woke up",
+        )
+        if lag >= self.threshold:
+            metrics.inc(
+                "event_loop_blocked_seconds_total",
+                lag,
+                help_text="Time the event loop was blocked beyond the threshold",
+            )
+        self.sample_threadpools()
+
+    def _monitor(self) -> None:
+        # Проверка чаще порога: стек снимается, пока блокировка ещё идёт
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            self.check()
+
+    def check(self) -> bool:
+        """Monitor thread: True, если цикл сейчас заблокирован (о блокировке - один раз)"""
+        beat = self._beat
+        stalled = time.monotonic() - beat - self.interval
+        if stalled < self.threshold:
+            return False
+        if self._reported_beat == beat:
+            return True
+        self._reported_beat = beat
+        metrics.inc(
+            "event_loop_blocked_total",
+            help_text="Event-loop stalls longer than the threshold",
+        )
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return True
+        stack = "".join(traceback.format_stack(frame, limit=LOOP_STACK_MAX_FRAMES))
+        self.last_blocked_stack = stack
+        now = time.monotonic()
+        if now - self._last_stack_log >= self.stack_cooldown:
+            self._last_stack_log = now
+            logger.warning(
+                "Event loop blocked for %.0f ms",
+                stalled * 1000,
+                extra={"blocked_ms": round(stalled * 1000), "stack": stack},
+            )
+        return True
+
+    def sample_threadpools(self) -> None:
+        """В потоке event loop: лимитер anyio привязан к циклу"""
+        limiter = to_thread.current_default_thread_limiter()
+        self._update(
+            "anyio",
+            int(limiter.borrowed_tokens),
+            int(limiter.total_tokens),
+            limiter.statistics().tasks_waiting,
+        )
+        executor = getattr(self._loop or asyncio.get_running_loop(), "_default_executor", None)
+        if executor is not None:
+            # ThreadPoolExecutor не отдаёт число занятых потоков: очередь задач - признак
+            # того, что свободных нет
+            self._update(
+                "asyncio",
+                len(executor._threads),
+                executor._max_workers,
+                executor._work_queue.qsize(),
+            )
+
+    def _update(self, pool: str, in_use: int, limit: int, waiting: int) -> None:
+        stats = self.pools[pool]
+        stats.in_use, stats.limit, stats.waiting = in_use, limit, waiting
+        if waiting and stats.saturated_since is None:
+            stats.saturated_since = time.monotonic()
+            metrics.inc(
+                "threadpool_saturated_total",
+                labels={"pool": pool},
+                help_text="Times a threadpool ran out of free workers",
+            )
+            logger.warning(
+                "Threadpool %s saturated: %d/%d workers busy, %d calls waiting",
+                pool,
+                in_use,
+                limit,
+                waiting,
+                extra={"pool": pool, "in_use": in_use, "limit": limit, "waiting": waiting},
+            )
+        elif not waiting and stats.saturated_since is not None:
+            logger.info(
+                "Threadpool %s recovered after %.1f s",
+                pool,
+                time.monotonic() - stats.saturated_since,
+                extra={"pool": pool},
+            )
+            stats.saturated_since = None
+
+
+# Singleton (на процесс); None - watchdog выключен (LOOP_WATCHDOG_ENABLED=false)
+loop_watchdog = LoopWatchdog() if LOOP_WATCHDOG_ENABLED else None
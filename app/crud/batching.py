@@ -0,0 +1,227 @@
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, tuple_
+
+from app.core.changefeed import publish_changes
+from app.models.media import MediaModel
+from app.schemas.media import MediaCreate, MediaStatusUpdate, WatchStatus
+
+# Group commit (по умолчанию выключен)
+WRITE_BATCHING = os.getenv("MEDIA_WRITE_BATCHING", "false").lower() == "true"
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("MEDIA_WRITE_BATCH_MAX_DELAY_MS", "5"))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("MEDIA_WRITE_BATCH_MAX_SIZE", "64"))
+
+
+class _PendingWrite:
+    """Queued write with the caller's future"""
+
+    __slots__ = ("op", "user_id", "payload", "media_id", "snapshot", "before", "future")
+
+    def __init__(
+        self,
+        op: str,
+        user_id: int,
+        payload,
+        media_id: Optional[int] = None,
+        snapshot: Optional[Callable[[Optional[MediaModel]], Any]] = None,
+    ):
+        self.op = op
+        self.user_id = user_id
+        self.payload = payload
+        self.media_id = media_id
+        # Снимок строки до изменения (аудит) - в flush, под FOR UPDATE
+        self.snapshot = snapshot
+        self.before: Any = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class WriteBatcher:
+    """Group commit for create_media / update_media_status
+
+    Записи копятся до max_delay_ms или max_batch_size и применяются одной
+    транзакцией: новые строки - одним многострочным INSERT ... RETURNING,
+    статусы - одним SELECT ... FOR UPDATE и пакетным UPDATE при flush.
+    Если общий COMMIT падает, элементы переигрываются по одному, чтобы каждый
+    вызывающий получил свою строку или свою ошибку. С шардированием батч
+    делится по шардам пользователей: транзакция на шард.
+
+    Состояние "до" для аудита статуса тоже читается в flush (snapshot) из
+    заблокированной строки: сессия запроса соединения не берёт.
+    """
+
+    def __init__(
+        self,
+        session_factory=None,
+        max_delay_ms: float = WRITE_BATCH_MAX_DELAY_MS,
+        max_batch_size: int = WRITE_BATCH_MAX_SIZE,
+        router=None,
+    ):
+        self._session_factory = session_factory
+        self._router = router
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: List[_PendingWrite] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def session_factory(self):
+        if self._session_factory is None:
+            from app.core.database import AsyncSessionLocal
+
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    @property
+    def router(self):
+        if self._router is None:
+            from app.core.database import shard_router
+
+            self._router = shard_router
+        return self._router
+
+    async def create(self, media_data: MediaCreate, user_id: int) -> MediaModel:
+        return await self._submit(_PendingWrite("create", user_id, media_data))
+
+    async def update_status(
+        self,
+        media_id: int,
+        status_data: MediaStatusUpdate,
+        user_id: int,
+        snapshot: Optional[Callable[[Optional[MediaModel]], Any]] = None,
+    ) -> Tuple[Optional[MediaModel], Any]:
+        """(строка после изменения, snapshot(строка до него) или None)"""
+        item = _PendingWrite("status", user_id, status_data, media_id, snapshot)
+        row = await self._submit(item)
+        return row, item.before
+
+    async def _submit(self, item: _PendingWrite):
+        self._pending.append(item)
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._start_flush)
+        return await item.future
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def drain(self) -> None:
+        """Flush queued writes and wait for in-progress batches (shutdown)"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush(self, batch: List[_PendingWrite]) -> None:
+        router = self.router
+        if router is None:
+            await self._flush_shard(batch)
+            return
+        groups: Dict[str, List[_PendingWrite]] = {}
+        for item in batch:
+            try:
+                groups.setdefault(await router.shard_for(item.user_id), []).append(item)
+            except Exception as e:  # ShardMoving, недоступен directory
+                if not item.future.done():
+                    item.future.set_exception(e)
+        await asyncio.gather(*(self._flush_shard(items) for items in groups.values()))
+
+    async def _flush_shard(self, batch: List[_PendingWrite]) -> None:
+        """Один шард (или БД без шардирования) - одна транзакция"""
+        try:
+            async with self.session_factory() as session:
+                try:
+                    if self.router is not None:
+                        from app.core.database import select_shard
+
+                        await select_shard(session, batch[0].user_id, self.router)
+                    results = await self._apply(session, batch)
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    error = e
+                else:
+                    error = None
+        except Exception as e:  # Не удалось даже открыть сессию
+            error, results = e, None
+
+        if error is None:
+            self.batches += 1
+            self.items += len(batch)
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+            return
+
+        if len(batch) == 1:
+            if not batch[0].future.done():
+                batch[0].future.set_exception(error)
+            return
+
+        # Изолируем виновника: каждая запись в своей транзакции
+        for item in batch:
+            await self._flush([item])
+
+    async def _apply(self, session, batch: List[_PendingWrite]) -> list:
+        results: list = [None] * len(batch)
+
+        creates = [(i, item) for i, item in enumerate(batch) if item.op == "create"]
+        if creates:
+            new_rows = [
+                MediaModel(
+                    title=item.payload.title,
+                    kind=item.payload.kind,
+                    year=item.payload.year,
+                    description=item.payload.description,
+                    user_id=item.user_id,  # 🔒 User isolation (NFR-06)
+                    status=WatchStatus.TO_WATCH,
+                    rating=None,
+                    tags=list(item.payload.tags),
+                )
+                for _, item in creates
+            ]
+            session.add_all(new_rows)
+            await session.flush()  # insertmanyvalues: один INSERT ... RETURNING
+            for (i, _), row in zip(creates, new_rows):
+                results[i] = row
+
+        updates = [(i, item) for i, item in enumerate(batch) if item.op == "status"]
+        if updates:
+            keys = {(item.media_id, item.user_id) for _, item in updates}
+            rows = await session.execute(
+                select(MediaModel)
+                .where(tuple_(MediaModel.id, MediaModel.user_id).in_(keys))
+                .with_for_update()
+            )
+            by_key = {(row.id, row.user_id): row for row in rows.scalars().all()}
+            for i, item in updates:
+                row = by_key.get((item.media_id, item.user_id))
+                if item.snapshot is not None:
+                    item.before = item.snapshot(row)
+                if row is not None:
+                    row.status = item.payload.status
+                    row.rating = item.payload.rating
+                results[i] = row
+            await session.flush()
+
+        await publish_changes(
+            session,
+            [
+                (item.user_id, row.id, item.op)
+                for item, row in zip(batch, results)
+                if row is not None
+            ],
+        )
+        return results
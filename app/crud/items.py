@@ -0,0 +1,198 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# false - /items не обслуживается (состояние стора есть только в одном процессе,
+# с ним app.server не запускает несколько воркеров)
+ITEMS_ENABLED = os.getenv("ITEMS_ENABLED", "true").lower() == "true"
+# Лимит записей: память стора ограничена (id + name до 100 символов на запись)
+ITEMS_MAX = int(os.getenv("ITEMS_MAX", "100000"))
+# Каталог для snapshot + WAL; пусто - только память (тесты, dev)
+ITEMS_DATA_DIR = os.getenv("ITEMS_DATA_DIR", "")
+# fsync после каждой записи WAL: надёжнее, но медленнее
+ITEMS_WAL_FSYNC = os.getenv("ITEMS_WAL_FSYNC", "false").lower() == "true"
+# Период фонового snapshot (секунды)
+ITEMS_SNAPSHOT_INTERVAL = float(os.getenv("ITEMS_SNAPSHOT_INTERVAL", "60"))
+
+SNAPSHOT_FILE = "items.snapshot"
+WAL_FILE = "items.wal"
+ROTATED_WAL_FILE = "items.wal.old"
+
+
+class ItemStoreFull(Exception):
+    """ITEMS_MAX reached"""
+
+
+class ItemStoreCorrupt(Exception):
+    """Snapshot or WAL has a damaged record that is not a torn WAL tail"""
+
+
+class Item:
+    """Compact item record"""
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name}
+
+
+def _encode(item: Item) -> bytes:
+    return (json.dumps(item.to_dict(), separators=(",", ":")) + "\n").encode()
+
+
+class ItemStore:
+    """Items by id (dict, O(1)) with optional snapshot + append-only WAL on disk
+
+    Каждая запись сначала дописывается в WAL, затем видна в памяти.
+    snapshot() переключает WAL на новый файл под блокировкой, а сам snapshot
+    пишет вне её (tmp + os.replace); при загрузке: snapshot, затем старый и
+    текущий WAL. Повтор записи идемпотентен (ключ - id). Оборванная последняя
+    строка текущего WAL после сбоя отбрасывается; испорченные snapshot и старый
+    WAL (их пишут атомарно) - ItemStoreCorrupt.
+    """
+
+    def __init__(
+        self,
+        data_dir: Optional[str] = ITEMS_DATA_DIR,
+        max_items: int = ITEMS_MAX,
+        fsync: bool = ITEMS_WAL_FSYNC,
+    ):
+        self.data_dir = data_dir or None
+        self.max_items = max_items
+        self.fsync = fsync
+        self._items: Dict[int, Item] = {}
+        self._ids = itertools.count(1)
+        # sync endpoints /items выполняются в threadpool
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._wal = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    # Работа с данными
+
+    def create(self, name: str) -> Item:
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                raise ItemStoreFull()
+            item = Item(next(self._ids), name)
+            if self._wal is not None:
+                self._wal.write(_encode(item))
+                self._wal.flush()
+                if self.fsync:
+                    os.fsync(self._wal.fileno())
+            self._items[item.id] = item
+            return item
+
+    def get(self, item_id: int) -> Optional[Item]:
+        return self._items.get(item_id)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    # Персистентность
+
+    def open(self) -> int:
+        """Load snapshot + WAL and start appending; returns the number of items"""
+        if self.data_dir is None:
+            return 0
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._lock:
+            self._items.clear()
+            self._replay(self._path(SNAPSHOT_FILE))
+            self._replay(self._path(ROTATED_WAL_FILE))
+            self._replay(self._path(WAL_FILE), torn_tail=True)
+            self._ids = itertools.count(max(self._items, default=0) + 1)
+            self._wal = open(self._path(WAL_FILE), "ab")
+            return len(self._items)
+
+    def _replay(self, path: str, torn_tail: bool = False) -> None:
+        """torn_tail - файл дописывается (текущий WAL): последняя строка может быть оборвана"""
+        if not os.path.exists(path):
+            return
+        offset = 0
+        with open(path, "rb") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                    item = Item(int(record["id"]), str(record["name"]))
+                except (ValueError, KeyError, TypeError):
+                    record = None
+                if record is None or not line.endswith(b"\n"):
+                    if not torn_tail or f.read(1):
+                        # Не хвост дописываемого файла: молча терять остаток нельзя
+                        raise ItemStoreCorrupt(f"{path}: damaged record at line {number}")
+                    # Недописанная строка (сбой посреди записи): обрезаем, иначе новые
+                    # записи WAL склеятся с ней
+                    logger.warning("Truncated record in %s discarded", path)
+                    break
+                self._items[item.id] = item
+                offset += len(line)
+        if torn_tail:
+            os.truncate(path, offset)
+
+    def snapshot(self) -> int:
+        """Compact WAL into a snapshot; returns the number of items written"""
+        if self.data_dir is None:
+            return 0
+        with self._snapshot_lock:
+            with self._lock:
+                if self._wal is None:
+                    return 0
+                items: List[Item] = list(self._items.values())
+                # Всё, что есть в items, уже в WAL: начинаем новый файл
+                self._wal.close()
+                self._rotate_wal()
+                self._wal = open(self._path(WAL_FILE), "ab")
+
+            tmp_path = self._path(SNAPSHOT_FILE + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(_encode(item) for item in items))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(SNAPSHOT_FILE))
+            os.remove(self._path(ROTATED_WAL_FILE))
+            return len(items)
+
+    def _rotate_wal(self) -> None:
+        """WAL -> старый WAL, не затирая старый WAL неудавшегося прошлого snapshot
+
+        Его записей нет ни в одном snapshot: к ним дописывается текущий WAL (через
+        tmp + os.replace), и только потом текущий WAL удаляется.
+        """
+        wal, rotated = self._path(WAL_FILE), self._path(ROTATED_WAL_FILE)
+        if not os.path.exists(rotated):
+            os.replace(wal, rotated)
+            return
+        tmp_path = rotated + ".tmp"
+        with open(tmp_path, "wb") as dst:
+            for path in (rotated, wal):
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, rotated)
+        os.remove(wal)
+
+    def close(self) -> None:
+        if self._wal is None:
+            return
+        self.snapshot()
+        with self._lock:
+            self._wal.close()
+            self._wal = None
+
+
+# Singleton (на процесс)
+item_store = ItemStore()
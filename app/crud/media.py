@@ -1,109 +1,245 @@
-from typing import List, Optional
+import os
+from typing import List, Optional, Tuple
 
-from sqlalchemy import and_, delete, func, select
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.audit import AuditLog, audit_log
+from app.core.database import scatter, select_shard
+from app.core.sharding import ShardRouter
+from app.core.similarity import normalize_title
+from app.core.singleflight import SingleFlight
+from app.core.tracing import traced
+from app.crud.batching import WRITE_BATCHING, WriteBatcher
+from app.crud.memory_storage import InMemoryMediaStorage
+from app.crud.sql_storage import SqlAlchemyMediaStorage
+from app.crud.storage import MediaStorage, SyncChanges, SyncCursor
 from app.models.media import MediaModel
-from app.schemas.media import MediaCreate, MediaKind, MediaStatusUpdate, MediaUpdate, WatchStatus
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    TagMatch,
+    WatchStatus,
+)
+
+# Объединение одинаковых параллельных чтений (single-flight)
+READ_COALESCING = os.getenv("MEDIA_READ_COALESCING", "true").lower() == "true"
+# Поиск похожих дублей: минимальное сходство названий и число кандидатов
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", "0.5"))
+DUPLICATE_CANDIDATES_LIMIT = int(os.getenv("DUPLICATE_CANDIDATES_LIMIT", "5"))
+# Backend хранения: sql (PostgreSQL) | memory (без внешних сервисов)
+STORAGE_BACKEND = os.getenv("MEDIA_STORAGE", "sql").lower()
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> MediaStorage:
+    """Storage backend by name (MEDIA_STORAGE)"""
+    if backend == "sql":
+        return SqlAlchemyMediaStorage()
+    if backend == "memory":
+        return InMemoryMediaStorage()
+    raise ValueError(f"Unknown MEDIA_STORAGE: {backend}")
+
+
+# Счётчики MediaStorage.stats (admin)
+STATS_FIELDS = ("users", "media", "tombstones")
+
+# Поля media, изменения которых попадают в аудит
+AUDITED_FIELDS = ("title", "kind", "year", "description", "status", "rating", "tags")
+
+
+def _audit_fields(media: Optional[MediaModel]) -> Optional[dict]:
+    """Снимок полей для diff (enum - значением, чтобы ложился в JSON)"""
+    if media is None:
+        return None
+    snapshot = {}
+    for field in AUDITED_FIELDS:
+        value = getattr(media, field)
+        snapshot[field] = list(value) if field == "tags" else getattr(value, "value", value)
+    return snapshot
 
 
 class MediaCRUD:
-    """Async CRUD operations for Media with user isolation"""
+    """Async CRUD operations for Media with user isolation
+
+    Хранение делегируется MediaStorage (PostgreSQL или in-memory); здесь -
+    выбор шарда пользователя, single-flight чтений, group commit и аудит
+    записей (NFR-09), общие для всех backend-ов.
+    """
+
+    def __init__(
+        self,
+        storage: Optional[MediaStorage] = None,
+        coalesce_reads: bool = READ_COALESCING,
+        write_batcher: Optional[WriteBatcher] = None,
+        audit: Optional[AuditLog] = None,
+        router: Optional[ShardRouter] = None,
+    ):
+        self.storage = storage if storage is not None else SqlAlchemyMediaStorage()
+        # None - shard_router из app.core.database (или без шардирования)
+        self.router = router
+        self.coalesce_reads = coalesce_reads
+        self._reads = SingleFlight()
+        self.write_batcher = write_batcher
+        self.audit = audit
+
+    async def _coalesce(self, user_id: int, key: tuple, fn):
+        """Run a read through single-flight: identical concurrent calls share one query
 
+        Сессии ожидающих запросов не берут соединение из пула, т.к. AsyncSession
+        подключается лениво. Мутирующие методы обращаются к storage напрямую.
+        """
+        if not self.coalesce_reads:
+            return await fn()
+        return await self._reads.do(user_id, key, fn)
+
+    async def _route(self, db: AsyncSession, user_id: int) -> None:
+        """Сессия запроса - на шард пользователя (до первого SQL)"""
+        await select_shard(db, user_id, self.router)
+
+    def _writes_committed(self, user_id: int) -> None:
+        """После записи новые чтения пользователя не присоединяются к старым запросам"""
+        self._reads.forget(user_id)
+
+    async def _audit_before(self, db: AsyncSession, media_id: int, user_id: int):
+        """Состояние до записи - снимок сразу (объект сессии изменится на месте)"""
+        if self.audit is None:
+            return None
+        return _audit_fields(await self.storage.get_by_id(db, media_id, user_id))
+
+    def _audit(self, user_id: int, op: str, media_id: int, before=None, after=None) -> None:
+        if self.audit is not None:
+            self.audit.record(user_id, op, media_id, before, _audit_fields(after))
+
+    @traced("MediaCRUD.get_media_list")
     async def get_media_list(
         self,
         db: AsyncSession,
         user_id: int,
         kind: Optional[MediaKind] = None,
         status: Optional[WatchStatus] = None,
+        sort: MediaSortField = MediaSortField.CREATED_AT,
+        order: SortOrder = SortOrder.DESC,
+        year_min: Optional[int] = None,
+        year_max: Optional[int] = None,
+        rating_min: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        tags_match: TagMatch = TagMatch.ALL,
     ) -> List[MediaModel]:
         """Get media list with filtering and user isolation (NFR-06)"""
-        query = select(MediaModel).where(MediaModel.user_id == user_id)
-
-        if kind:
-            query = query.where(MediaModel.kind == kind)
-        if status:
-            query = query.where(MediaModel.status == status)
-
-        # Сортировка по дате создания (новые сначала)
-        query = query.order_by(MediaModel.created_at.desc())
-
-        result = await db.execute(query)
-        return result.scalars().all()
+        await self._route(db, user_id)
+        tag_key = tuple(sorted(tags)) if tags else None
+        media_list = await self._coalesce(
+            user_id,
+            (
+                "list",
+                kind,
+                status,
+                sort,
+                order,
+                year_min,
+                year_max,
+                rating_min,
+                tag_key,
+                tags_match,
+            ),
+            lambda: self.storage.list_media(
+                db,
+                user_id,
+                kind,
+                status,
+                sort,
+                order,
+                year_min,
+                year_max,
+                rating_min,
+                tags,
+                tags_match,
+            ),
+        )
+        return list(media_list)
 
+    @traced("MediaCRUD.get_media_by_id")
     async def get_media_by_id(
         self, db: AsyncSession, media_id: int, user_id: int
     ) -> Optional[MediaModel]:
         """Get media by ID with user isolation (NFR-06)"""
-        query = select(MediaModel).where(
-            and_(MediaModel.id == media_id, MediaModel.user_id == user_id)
+        await self._route(db, user_id)
+        return await self._coalesce(
+            user_id, ("id", media_id), lambda: self.storage.get_by_id(db, media_id, user_id)
+        )
+
+    @traced("MediaCRUD.get_changes_since")
+    async def get_changes_since(
+        self, db: AsyncSession, user_id: int, since: Optional[SyncCursor]
+    ) -> SyncChanges:
+        """Delta sync: items changed and deleted after the cursor (NFR-06)
+
+        Один запрос и для delta, и для full resync: курсор (xmin снимка), tombstones
+        и строки media по индексам (user_id, change_xid).
+        """
+        await self._route(db, user_id)
+        return await self._coalesce(
+            user_id, ("sync", since), lambda: self.storage.changes_since(db, user_id, since)
         )
-        result = await db.execute(query)
-        return result.scalar_one_or_none()
 
+    @traced("MediaCRUD.check_media_exists")
     async def check_media_exists(
         self, db: AsyncSession, title: str, year: int, kind: MediaKind, user_id: int
     ) -> bool:
         """Check if media already exists for user (duplicate prevention)"""
-        query = select(MediaModel).where(
-            and_(
-                MediaModel.user_id == user_id,
-                func.lower(MediaModel.title) == func.lower(title),  # Case-insensitive
-                MediaModel.year == year,
-                MediaModel.kind == kind,
-            )
+        await self._route(db, user_id)
+        return await self.storage.exists(db, title, year, kind, user_id)
+
+    @traced("MediaCRUD.find_near_duplicates")
+    async def find_near_duplicates(
+        self,
+        db: AsyncSession,
+        title: str,
+        kind: Optional[MediaKind],
+        user_id: int,
+        threshold: float = DUPLICATE_SIMILARITY_THRESHOLD,
+        limit: int = DUPLICATE_CANDIDATES_LIMIT,
+    ) -> List[Tuple[MediaModel, float]]:
+        """Media with similar titles (trigram similarity), best match first"""
+        await self._route(db, user_id)
+        return await self._coalesce(
+            user_id,
+            ("similar", normalize_title(title), kind, threshold, limit),
+            lambda: self.storage.find_similar(db, user_id, title, kind, threshold, limit),
         )
-        result = await db.execute(query)
-        return result.scalar_one_or_none() is not None
 
+    @traced("MediaCRUD.create_media")
     async def create_media(
         self, db: AsyncSession, media_data: MediaCreate, user_id: int
     ) -> MediaModel:
         """Create new media with user isolation"""
-        new_media = MediaModel(
-            title=media_data.title,
-            kind=media_data.kind,
-            year=media_data.year,
-            description=media_data.description,
-            user_id=user_id,  # 🔒 User isolation (NFR-06)
-            status=WatchStatus.TO_WATCH,
-            rating=None,
-        )
-
-        db.add(new_media)
-        try:
-            await db.commit()
-            await db.refresh(new_media)
-            return new_media
-        except IntegrityError:
-            await db.rollback()
-            # Log the actual error for debugging but don't expose it
-            # logger.error(f"Database integrity error: {e}")
-            raise  # Re-raise for duplicate handling
+        await self._route(db, user_id)
+        if self.write_batcher is not None:
+            # Group commit: своя сессия батчера, db не используется
+            new_media = await self.write_batcher.create(media_data, user_id)
+        else:
+            new_media = await self.storage.create(db, media_data, user_id)
+        self._writes_committed(user_id)
+        self._audit(user_id, "create", new_media.id, after=new_media)
+        return new_media
 
+    @traced("MediaCRUD.update_media")
     async def update_media(
         self, db: AsyncSession, media_id: int, media_data: MediaUpdate, user_id: int
     ) -> Optional[MediaModel]:
         """Update media with user isolation"""
-        media = await self.get_media_by_id(db, media_id, user_id)
-        if not media:
-            return None
-
-        # Update fields
-        media.title = media_data.title
-        media.kind = media_data.kind
-        media.year = media_data.year
-        media.description = media_data.description
-
-        try:
-            await db.commit()
-            await db.refresh(media)
-            return media
-        except IntegrityError:
-            await db.rollback()
-            raise
+        await self._route(db, user_id)
+        before = await self._audit_before(db, media_id, user_id)
+        media = await self.storage.update(db, media_id, media_data, user_id)
+        if media is not None:
+            self._writes_committed(user_id)
+            self._audit(user_id, "update", media_id, before, media)
+        return media
 
+    @traced("MediaCRUD.update_media_status")
     async def update_media_status(
         self,
         db: AsyncSession,
@@ -112,31 +248,79 @@ class MediaCRUD:
         user_id: int,
     ) -> Optional[MediaModel]:
         """Update media status with user isolation"""
-        media = await self.get_media_by_id(db, media_id, user_id)
-        if not media:
-            return None
+        await self._route(db, user_id)
+        if self.write_batcher is not None:
+            # Снимок "до" - в flush батчера: db не используется, запрос не держит
+            # второе соединение пула, пока ждёт батч
+            snapshot = _audit_fields if self.audit is not None else None
+            media, before = await self.write_batcher.update_status(
+                media_id, status_data, user_id, snapshot
+            )
+        else:
+            before = await self._audit_before(db, media_id, user_id)
+            media = await self.storage.update_status(db, media_id, status_data, user_id)
+        if media is not None:
+            self._writes_committed(user_id)
+            self._audit(user_id, "status", media_id, before, media)
+        return media
 
-        media.status = status_data.status
-        media.rating = status_data.rating
+    @traced("MediaCRUD.set_media_tags")
+    async def set_media_tags(
+        self, db: AsyncSession, media_id: int, tags: List[str], user_id: int
+    ) -> Optional[MediaModel]:
+        """Replace media tags with user isolation"""
+        await self._route(db, user_id)
+        before = await self._audit_before(db, media_id, user_id)
+        media = await self.storage.set_tags(db, media_id, tags, user_id)
+        if media is not None:
+            self._writes_committed(user_id)
+            self._audit(user_id, "tags", media_id, before, media)
+        return media
 
-        try:
-            await db.commit()
-            await db.refresh(media)
-            return media
-        except IntegrityError:
-            await db.rollback()
-            raise
+    @traced("MediaCRUD.remove_media_tag")
+    async def remove_media_tag(
+        self, db: AsyncSession, media_id: int, tag: str, user_id: int
+    ) -> Optional[MediaModel]:
+        """Remove one tag from media with user isolation (atomic in storage)"""
+        await self._route(db, user_id)
+        before = await self._audit_before(db, media_id, user_id)
+        media = await self.storage.remove_tag(db, media_id, tag, user_id)
+        if media is not None:
+            self._writes_committed(user_id)
+            self._audit(user_id, "tags", media_id, before, media)
+        return media
 
+    @traced("MediaCRUD.get_tag_counts")
+    async def get_tag_counts(self, db: AsyncSession, user_id: int) -> List[Tuple[str, int]]:
+        """Tag -> number of user's media (NFR-06)"""
+        await self._route(db, user_id)
+        return await self._coalesce(
+            user_id, ("tag_counts",), lambda: self.storage.tag_counts(db, user_id)
+        )
+
+    @traced("MediaCRUD.delete_media")
     async def delete_media(self, db: AsyncSession, media_id: int, user_id: int) -> bool:
         """Delete media with user isolation"""
-        media = await self.get_media_by_id(db, media_id, user_id)
-        if not media:
+        await self._route(db, user_id)
+        before = await self._audit_before(db, media_id, user_id)
+        if not await self.storage.delete(db, media_id, user_id):
             return False
-
-        await db.delete(media)
-        await db.commit()
+        self._writes_committed(user_id)
+        self._audit(user_id, "delete", media_id, before)
         return True
 
+    @traced("MediaCRUD.purge_tombstones")
+    async def purge_tombstones(self, db: AsyncSession) -> int:
+        """Remove tombstones older than the retention period"""
+        return await self.storage.purge_tombstones(db)
+
+    @traced("MediaCRUD.get_stats")
+    async def get_stats(self) -> dict:
+        """Admin stats: scatter-gather по всем шардам и сумма"""
+        shards = await scatter(self.storage.stats, self.router)
+        total = {key: sum(stats[key] for stats in shards.values()) for key in STATS_FIELDS}
+        return {"shards": shards, "total": total}
+
     async def create_demo_data(self, db: AsyncSession, user_id: int) -> None:
         """Create demo data for development"""
         demo_media = [
@@ -170,9 +354,14 @@ class MediaCRUD:
 
     async def clear_all(self, db: AsyncSession) -> None:
         """Clear all data (for tests only)"""
-        await db.execute(delete(MediaModel))
-        await db.commit()
+        await self.storage.clear(db)
+        self._reads = SingleFlight()
 
 
 # Singleton instance
-media_crud = MediaCRUD()
+media_crud = MediaCRUD(
+    storage=create_storage(),
+    # Group commit - только для PostgreSQL: in-memory запись и так без round trip
+    write_batcher=WriteBatcher() if WRITE_BATCHING and STORAGE_BACKEND == "sql" else None,
+    audit=audit_log,
+)
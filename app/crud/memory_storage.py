@@ -0,0 +1,423 @@
+import itertools
+import math
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.core.changefeed import ChangeEvent, change_feed
+from app.core.similarity import normalize_title, trigrams
+from app.crud.storage import TOMBSTONE_RETENTION, SyncChanges, SyncCursor
+from app.models.media import MediaModel
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    TagMatch,
+    WatchStatus,
+)
+
+# title_norm вычисляется из title (MediaModel._sync_title_norm); change_xid - только в SQL
+_COLUMNS = [
+    column.key
+    for column in MediaModel.__table__.columns
+    if column.key not in ("title_norm", "change_xid")
+]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Фильтр по kind/status/тегам выгоднее полного прохода, если он отсекает большую часть строк
+_BUCKET_SELECTIVITY = 4
+
+
+def _sort_key(field: MediaSortField, media: MediaModel) -> tuple:
+    """Key of the (user_id, field) index; id breaks ties like a physical row order
+
+    created_at и id растут вместе, поэтому индекс по дате - это индекс по id.
+    NULL rating идёт последним при ASC и первым при DESC, как в PostgreSQL.
+    """
+    if field == MediaSortField.CREATED_AT:
+        return (media.id,)
+    if field == MediaSortField.RATING:
+        return (media.rating is None, media.rating or 0, media.id)
+    return (getattr(media, field.value), media.id)
+
+
+def _dup_key(title: str, year: int, kind: MediaKind) -> Tuple[str, int, MediaKind]:
+    return (title.lower(), year, kind)
+
+
+class _UserPartition:
+    """All rows and secondary indexes of one user"""
+
+    __slots__ = (
+        "rows",
+        "sorted",
+        "by_kind",
+        "by_status",
+        "by_tag",
+        "by_trigram",
+        "trigrams",
+        "duplicates",
+        "by_updated",
+        "tombstones",
+    )
+
+    def __init__(self):
+        self.rows: Dict[int, MediaModel] = {}
+        self.sorted: Dict[MediaSortField, List[tuple]] = {field: [] for field in MediaSortField}
+        self.by_kind: Dict[MediaKind, Set[int]] = {}
+        self.by_status: Dict[WatchStatus, Set[int]] = {}
+        # Инвертированный индекс тег -> id (аналог GIN)
+        self.by_tag: Dict[str, Set[int]] = {}
+        # Инвертированный индекс триграмм title_norm (аналог pg_trgm GIN)
+        self.by_trigram: Dict[str, Set[int]] = {}
+        self.trigrams: Dict[int, FrozenSet[str]] = {}
+        self.duplicates: Dict[Tuple[str, int, MediaKind], Set[int]] = {}
+        self.by_updated: List[Tuple[datetime, int]] = []
+        self.tombstones: List[Tuple[datetime, int]] = []
+
+    def add(self, media: MediaModel) -> None:
+        self.rows[media.id] = media
+        for field, index in self.sorted.items():
+            insort(index, _sort_key(field, media))
+        self.by_kind.setdefault(media.kind, set()).add(media.id)
+        self.by_status.setdefault(media.status, set()).add(media.id)
+        for tag in media.tags:
+            self.by_tag.setdefault(tag, set()).add(media.id)
+        self.trigrams[media.id] = trigrams(media.title_norm)
+        for trigram in self.trigrams[media.id]:
+            self.by_trigram.setdefault(trigram, set()).add(media.id)
+        self.duplicates.setdefault(_dup_key(media.title, media.year, media.kind), set()).add(
+            media.id
+        )
+        # updated_at монотонен, поэтому запись всегда в конец
+        self.by_updated.append((media.updated_at, media.id))
+
+    def remove(self, media: MediaModel) -> None:
+        del self.rows[media.id]
+        for field, index in self.sorted.items():
+            _remove_sorted(index, _sort_key(field, media))
+        _discard(self.by_kind, media.kind, media.id)
+        _discard(self.by_status, media.status, media.id)
+        for tag in media.tags:
+            _discard(self.by_tag, tag, media.id)
+        for trigram in self.trigrams.pop(media.id):
+            _discard(self.by_trigram, trigram, media.id)
+        _discard(self.duplicates, _dup_key(media.title, media.year, media.kind), media.id)
+        _remove_sorted(self.by_updated, (media.updated_at, media.id))
+
+
+def _remove_sorted(index: list, key: tuple) -> None:
+    position = bisect_left(index, key)
+    if position < len(index) and index[position] == key:
+        del index[position]
+
+
+def _discard(buckets: dict, key, media_id: int) -> None:
+    bucket = buckets.get(key)
+    if bucket is not None:
+        bucket.discard(media_id)
+        if not bucket:
+            del buckets[key]
+
+
+class InMemoryMediaStorage:
+    """Indexed in-process storage with the same semantics as the SQL backend
+
+    Для тестов и локальной разработки без PostgreSQL/Vault. Строки неизменяемы
+    (copy-on-write): запись заменяет объект целиком, поэтому уже отданные
+    читателям объекты остаются согласованным снимком, как после SELECT.
+    Данные живут в памяти одного процесса (один воркер).
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserPartition] = {}
+        self._ids = itertools.count(1)
+        self._versions = itertools.count(1)
+        self._last_stamp = datetime.min.replace(tzinfo=timezone.utc)
+
+    def _now(self) -> datetime:
+        """Strictly increasing timestamps: курсор sync не пропускает записи"""
+        stamp = datetime.now(timezone.utc)
+        if stamp <= self._last_stamp:
+            stamp = self._last_stamp + timedelta(microseconds=1)
+        self._last_stamp = stamp
+        return stamp
+
+    def _partition(self, user_id: int) -> _UserPartition:
+        partition = self._users.get(user_id)
+        if partition is None:
+            partition = self._users[user_id] = _UserPartition()
+        return partition
+
+    def _publish(self, user_id: int, media_id: int, op: str) -> None:
+        # Без LISTEN/NOTIFY: событие сразу уходит подписчикам этого процесса
+        change_feed.dispatch(ChangeEvent(next(self._versions), user_id, media_id, op))
+
+    def _replace(self, partition: _UserPartition, media: MediaModel, **changes) -> MediaModel:
+        values = {column: getattr(media, column) for column in _COLUMNS}
+        values.update(changes, updated_at=self._now())
+        updated = MediaModel(**values)
+        partition.remove(media)
+        partition.add(updated)
+        return updated
+
+    async def list_media(
+        self,
+        db,
+        user_id: int,
+        kind: Optional[MediaKind] = None,
+        status: Optional[WatchStatus] = None,
+        sort: MediaSortField = MediaSortField.CREATED_AT,
+        order: SortOrder = SortOrder.DESC,
+        year_min: Optional[int] = None,
+        year_max: Optional[int] = None,
+        rating_min: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        tags_match: TagMatch = TagMatch.ALL,
+    ) -> List[MediaModel]:
+        partition = self._users.get(user_id)
+        if partition is None:
+            return []
+        wanted = set(tags or ())
+
+        def matches(media: MediaModel) -> bool:
+            return (
+                (kind is None or media.kind == kind)
+                and (status is None or media.status == status)
+                and (year_min is None or media.year >= year_min)
+                and (year_max is None or media.year <= year_max)
+                and (
+                    rating_min is None or (media.rating is not None and media.rating >= rating_min)
+                )
+                and (
+                    not wanted
+                    or (
+                        not wanted.isdisjoint(media.tags)
+                        if tags_match == TagMatch.ANY
+                        else wanted.issubset(media.tags)
+                    )
+                )
+            )
+
+        candidates = self._bucket_candidates(partition, kind, status, wanted, tags_match)
+        if candidates is not None and len(candidates) * _BUCKET_SELECTIVITY < len(partition.rows):
+            # Селективный фильтр: сортируем только подходящие строки
+            rows = [partition.rows[media_id] for media_id in candidates]
+            rows = [media for media in rows if matches(media)]
+            rows.sort(key=lambda media: _sort_key(sort, media), reverse=order == SortOrder.DESC)
+            return rows
+
+        # Проход по индексу сортировки: порядок готов, диапазон по полю сортировки - bisect
+        index = partition.sorted[sort]
+        start, stop = 0, len(index)
+        if sort == MediaSortField.YEAR:
+            if year_min is not None:
+                start = bisect_left(index, (year_min,))
+            if year_max is not None:
+                stop = bisect_left(index, (year_max + 1,))
+        elif sort == MediaSortField.RATING and rating_min is not None:
+            start = bisect_left(index, (False, rating_min))
+            stop = bisect_left(index, (True,))
+
+        keys = index[start:stop]
+        if order == SortOrder.DESC:
+            keys.reverse()
+        rows = (partition.rows[key[-1]] for key in keys)
+        return [media for media in rows if matches(media)]
+
+    @staticmethod
+    def _bucket_candidates(
+        partition: _UserPartition,
+        kind: Optional[MediaKind],
+        status: Optional[WatchStatus],
+        tags: Set[str],
+        tags_match: TagMatch,
+    ) -> Optional[Set[int]]:
+        buckets = []
+        if kind is not None:
+            buckets.append(partition.by_kind.get(kind, set()))
+        if status is not None:
+            buckets.append(partition.by_status.get(status, set()))
+        if tags and tags_match == TagMatch.ANY:
+            buckets.append(set().union(*(partition.by_tag.get(tag, ()) for tag in tags)))
+        elif tags:
+            buckets.extend(partition.by_tag.get(tag, set()) for tag in tags)
+        if not buckets:
+            return None
+        buckets.sort(key=len)
+        return buckets[0].intersection(*buckets[1:])
+
+    async def get_by_id(self, db, media_id: int, user_id: int) -> Optional[MediaModel]:
+        partition = self._users.get(user_id)
+        return partition.rows.get(media_id) if partition is not None else None
+
+    async def changes_since(self, db, user_id: int, since: Optional[SyncCursor]) -> SyncChanges:
+        """Метки времени выдаются синхронно и монотонно: курсор - сама метка (в мкс)"""
+        now = self._now()
+        full_resync = since is None or since.issued_at < now - TOMBSTONE_RETENTION
+        partition = self._users.get(user_id) or _UserPartition()
+
+        upserts: List[MediaModel] = []
+        deleted: List[int] = []
+        if full_resync:
+            upserts = [partition.rows[media_id] for _, media_id in partition.by_updated]
+        else:
+            after = (_EPOCH + timedelta(microseconds=since.position), float("inf"))
+            start = bisect_left(partition.by_updated, after)
+            upserts = [partition.rows[media_id] for _, media_id in partition.by_updated[start:]]
+            start = bisect_left(partition.tombstones, after)
+            deleted = [media_id for _, media_id in partition.tombstones[start:]]
+
+        position = (now - _EPOCH) // timedelta(microseconds=1)
+        return SyncChanges(upserts, deleted, SyncCursor(position, now), full_resync)
+
+    async def exists(self, db, title: str, year: int, kind: MediaKind, user_id: int) -> bool:
+        partition = self._users.get(user_id)
+        return partition is not None and _dup_key(title, year, kind) in partition.duplicates
+
+    async def create(self, db, media_data: MediaCreate, user_id: int) -> MediaModel:
+        stamp = self._now()
+        new_media = MediaModel(
+            id=next(self._ids),
+            title=media_data.title,
+            kind=media_data.kind,
+            year=media_data.year,
+            description=media_data.description,
+            user_id=user_id,  # 🔒 User isolation (NFR-06)
+            status=WatchStatus.TO_WATCH,
+            rating=None,
+            tags=list(media_data.tags),
+            created_at=stamp,
+            updated_at=stamp,
+        )
+        self._partition(user_id).add(new_media)
+        self._publish(user_id, new_media.id, "create")
+        return new_media
+
+    async def update(
+        self, db, media_id: int, media_data: MediaUpdate, user_id: int
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        updated = self._replace(
+            self._users[user_id],
+            media,
+            title=media_data.title,
+            kind=media_data.kind,
+            year=media_data.year,
+            description=media_data.description,
+        )
+        self._publish(user_id, media_id, "update")
+        return updated
+
+    async def update_status(
+        self, db, media_id: int, status_data: MediaStatusUpdate, user_id: int
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        updated = self._replace(
+            self._users[user_id], media, status=status_data.status, rating=status_data.rating
+        )
+        self._publish(user_id, media_id, "status")
+        return updated
+
+    async def set_tags(
+        self, db, media_id: int, tags: List[str], user_id: int
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        updated = self._replace(self._users[user_id], media, tags=list(tags))
+        self._publish(user_id, media_id, "tags")
+        return updated
+
+    async def remove_tag(self, db, media_id: int, tag: str, user_id: int) -> Optional[MediaModel]:
+        # Без await между чтением и заменой: атомарно в цикле событий
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        tags = [t for t in media.tags if t != tag]
+        updated = self._replace(self._users[user_id], media, tags=tags)
+        self._publish(user_id, media_id, "tags")
+        return updated
+
+    async def tag_counts(self, db, user_id: int) -> List[Tuple[str, int]]:
+        partition = self._users.get(user_id)
+        if partition is None:
+            return []
+        counts = [(tag, len(ids)) for tag, ids in partition.by_tag.items()]
+        return sorted(counts, key=lambda item: (-item[1], item[0]))
+
+    async def find_similar(
+        self,
+        db,
+        user_id: int,
+        title: str,
+        kind: Optional[MediaKind],
+        threshold: float,
+        limit: int,
+    ) -> List[Tuple[MediaModel, float]]:
+        partition = self._users.get(user_id)
+        query = trigrams(normalize_title(title))
+        if partition is None or not query:
+            return []
+
+        # Prefix filtering: similarity <= общие / |query|, поэтому у подходящей строки
+        # не меньше ceil(threshold * |query|) общих триграмм и хотя бы одна из них -
+        # среди |query| - min_shared + 1 самых редких. Частые триграммы не сканируются.
+        min_shared = max(1, math.ceil(threshold * len(query) - 1e-9))
+        postings = sorted((partition.by_trigram.get(trigram, ()) for trigram in query), key=len)
+        candidates = set().union(*postings[: len(query) - min_shared + 1])
+
+        matches = []
+        for media_id in candidates:
+            row_trigrams = partition.trigrams[media_id]
+            common = len(query & row_trigrams)
+            score = common / (len(query) + len(row_trigrams) - common)
+            media = partition.rows[media_id]
+            if score >= threshold and (kind is None or media.kind == kind):
+                matches.append((media, score))
+        matches.sort(key=lambda match: (-match[1], match[0].id))
+        return matches[:limit]
+
+    async def delete(self, db, media_id: int, user_id: int) -> bool:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return False
+
+        partition = self._users[user_id]
+        partition.remove(media)
+        partition.tombstones.append((self._now(), media_id))
+        self._publish(user_id, media_id, "delete")
+        return True
+
+    async def stats(self, db) -> dict:
+        return {
+            "users": sum(1 for partition in self._users.values() if partition.rows),
+            "media": sum(len(partition.rows) for partition in self._users.values()),
+            "tombstones": sum(len(partition.tombstones) for partition in self._users.values()),
+        }
+
+    async def purge_tombstones(self, db) -> int:
+        horizon = (self._now() - TOMBSTONE_RETENTION,)
+        purged = 0
+        for partition in self._users.values():
+            position = bisect_left(partition.tombstones, horizon)
+            purged += position
+            del partition.tombstones[:position]
+        return purged
+
+    async def clear(self, db) -> None:
+        # Как TRUNCATE ... RESTART IDENTITY
+        self._users.clear()
+        self._ids = itertools.count(1)
@@ -0,0 +1,352 @@
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Text, and_, cast, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.changefeed import publish_change
+from app.core.similarity import normalize_title
+from app.crud.storage import TOMBSTONE_RETENTION, SyncChanges, SyncCursor
+from app.models.media import TRGM_SCHEMA, MediaModel, MediaTombstoneModel
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    TagMatch,
+    WatchStatus,
+)
+
+# Незавершённых транзакций в курсоре delta sync не больше (иначе курсор - xmin)
+SYNC_MAX_PENDING_XIDS = int(os.getenv("SYNC_MAX_PENDING_XIDS", "32"))
+
+
+def _snapshot_cursor(snapshot: str, issued_at: datetime) -> SyncCursor:
+    """Курсор из pg_current_snapshot()::text ("xmin:xmax:xip,xip,...")"""
+    xmin, xmax, xip = snapshot.split(":")
+    pending = tuple(int(xid) for xid in xip.split(",") if xid)
+    if len(pending) > SYNC_MAX_PENDING_XIDS:
+        return SyncCursor(int(xmin), issued_at)
+    return SyncCursor(int(xmax), issued_at, pending)
+
+
+def _changed_since(change_xid, since: SyncCursor):
+    if not since.pending:
+        return change_xid >= since.position
+    return or_(change_xid >= since.position, change_xid.in_(since.pending))
+
+
+def build_media_list_query(
+    user_id: int,
+    kind: Optional[MediaKind] = None,
+    status: Optional[WatchStatus] = None,
+    sort: MediaSortField = MediaSortField.CREATED_AT,
+    order: SortOrder = SortOrder.DESC,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    rating_min: Optional[int] = None,
+    tags: Optional[List[str]] = None,
+    tags_match: TagMatch = TagMatch.ALL,
+):
+    """SELECT for GET /media
+
+    Фильтры идут по индексам (user_id[, kind|status], year|rating) из
+    MediaModel.__table_args__: запрос читает одну партицию и только строки
+    пользователя. Порядок индексом не обеспечивается: без пагинации планировщик
+    выбирает bitmap-скан и сортирует в памяти несколько сотен строк пользователя -
+    дешевле прохода по индексу в порядке сортировки (даже с LIMIT он так делает при
+    фильтре по другой колонке), см. docs/adr/ADR-006. Теги - через GIN индекс
+    ix_media_tags.
+    """
+    query = select(MediaModel).where(MediaModel.user_id == user_id)
+
+    if kind:
+        query = query.where(MediaModel.kind == kind)
+    if status:
+        query = query.where(MediaModel.status == status)
+    if year_min is not None:
+        query = query.where(MediaModel.year >= year_min)
+    if year_max is not None:
+        query = query.where(MediaModel.year <= year_max)
+    if rating_min is not None:
+        query = query.where(MediaModel.rating >= rating_min)
+    if tags:
+        if tags_match == TagMatch.ANY:
+            query = query.where(MediaModel.tags.overlap(tags))
+        else:
+            query = query.where(MediaModel.tags.contains(tags))
+
+    column = getattr(MediaModel, sort.value)
+    return query.order_by(column.desc() if order == SortOrder.DESC else column.asc())
+
+
+class SqlAlchemyMediaStorage:
+    """PostgreSQL storage through the request's AsyncSession"""
+
+    async def list_media(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        kind: Optional[MediaKind] = None,
+        status: Optional[WatchStatus] = None,
+        sort: MediaSortField = MediaSortField.CREATED_AT,
+        order: SortOrder = SortOrder.DESC,
+        year_min: Optional[int] = None,
+        year_max: Optional[int] = None,
+        rating_min: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        tags_match: TagMatch = TagMatch.ALL,
+    ) -> List[MediaModel]:
+        query = build_media_list_query(
+            user_id, kind, status, sort, order, year_min, year_max, rating_min, tags, tags_match
+        )
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def get_by_id(
+        self, db: AsyncSession, media_id: int, user_id: int
+    ) -> Optional[MediaModel]:
+        query = select(MediaModel).where(
+            and_(MediaModel.id == media_id, MediaModel.user_id == user_id)
+        )
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+
+    async def changes_since(
+        self, db: AsyncSession, user_id: int, since: Optional[SyncCursor]
+    ) -> SyncChanges:
+        """Один запрос: снимок, tombstones и media по индексам (user_id, change_xid)
+
+        Снимок этого запроса видит ровно строки транзакций с xid < xmax, кроме
+        незавершённых (xip). Следующий sync берёт xid >= xmax и xip: запоздавший
+        COMMIT не теряется, а уже выданное не приходит повторно. Если xip длиннее
+        SYNC_MAX_PENDING_XIDS, курсор - xmin (строки от xmin могут прийти повторно,
+        upsert идемпотентен).
+        """
+        horizon = datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+        full_resync = since is None or since.issued_at < horizon
+        head = [
+            cast(func.pg_current_snapshot(), Text).label("snapshot"),
+            func.now().label("issued_at"),
+        ]
+        on_media = MediaModel.user_id == user_id
+        if not full_resync:
+            head.append(
+                select(func.array_agg(MediaTombstoneModel.media_id))
+                .where(
+                    and_(
+                        MediaTombstoneModel.user_id == user_id,
+                        _changed_since(MediaTombstoneModel.change_xid, since),
+                    )
+                )
+                .scalar_subquery()
+                .label("deleted")
+            )
+            on_media = and_(on_media, _changed_since(MediaModel.change_xid, since))
+        # Строка курсора есть и без изменений: media присоединяется к ней (LEFT JOIN)
+        cursor = select(*head).subquery("sync_cursor")
+        result = await db.execute(
+            select(cursor, MediaModel)
+            .select_from(cursor)
+            .outerjoin(MediaModel, on_media)
+            .order_by(MediaModel.change_xid, MediaModel.id)
+        )
+        rows = result.all()
+        upserts = [row.MediaModel for row in rows if row.MediaModel is not None]
+        deleted = (rows[0].deleted or []) if not full_resync else []
+        cursor = _snapshot_cursor(rows[0].snapshot, rows[0].issued_at)
+        return SyncChanges(upserts, deleted, cursor, full_resync)
+
+    async def exists(
+        self, db: AsyncSession, title: str, year: int, kind: MediaKind, user_id: int
+    ) -> bool:
+        query = select(MediaModel).where(
+            and_(
+                MediaModel.user_id == user_id,
+                func.lower(MediaModel.title) == func.lower(title),  # Case-insensitive
+                MediaModel.year == year,
+                MediaModel.kind == kind,
+            )
+        )
+        result = await db.execute(query)
+        return result.scalar_one_or_none() is not None
+
+    async def create(self, db: AsyncSession, media_data: MediaCreate, user_id: int) -> MediaModel:
+        new_media = MediaModel(
+            title=media_data.title,
+            kind=media_data.kind,
+            year=media_data.year,
+            description=media_data.description,
+            user_id=user_id,  # 🔒 User isolation (NFR-06)
+            status=WatchStatus.TO_WATCH,
+            rating=None,
+            tags=list(media_data.tags),
+        )
+
+        db.add(new_media)
+        try:
+            await db.flush()  # Нужен id для события
+            await publish_change(db, user_id, new_media.id, "create")
+            await db.commit()
+            await db.refresh(new_media)
+            return new_media
+        except IntegrityError:
+            await db.rollback()
+            # Log the actual error for debugging but don't expose it
+            # logger.error(f"Database integrity error: {e}")
+            raise  # Re-raise for duplicate handling
+
+    async def update(
+        self, db: AsyncSession, media_id: int, media_data: MediaUpdate, user_id: int
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        # Update fields
+        media.title = media_data.title
+        media.kind = media_data.kind
+        media.year = media_data.year
+        media.description = media_data.description
+
+        try:
+            await publish_change(db, user_id, media.id, "update")
+            await db.commit()
+            await db.refresh(media)
+            return media
+        except IntegrityError:
+            await db.rollback()
+            raise
+
+    async def update_status(
+        self,
+        db: AsyncSession,
+        media_id: int,
+        status_data: MediaStatusUpdate,
+        user_id: int,
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        media.status = status_data.status
+        media.rating = status_data.rating
+
+        try:
+            await publish_change(db, user_id, media.id, "status")
+            await db.commit()
+            await db.refresh(media)
+            return media
+        except IntegrityError:
+            await db.rollback()
+            raise
+
+    async def set_tags(
+        self, db: AsyncSession, media_id: int, tags: List[str], user_id: int
+    ) -> Optional[MediaModel]:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return None
+
+        media.tags = list(tags)
+        await publish_change(db, user_id, media.id, "tags")
+        await db.commit()
+        await db.refresh(media)
+        return media
+
+    async def remove_tag(
+        self, db: AsyncSession, media_id: int, tag: str, user_id: int
+    ) -> Optional[MediaModel]:
+        """Один UPDATE ... array_remove ... RETURNING: без чтения списка в Python"""
+        media = await db.scalar(
+            update(MediaModel)
+            .where(MediaModel.id == media_id, MediaModel.user_id == user_id)
+            .values(tags=func.array_remove(MediaModel.tags, tag, type_=MediaModel.tags.type))
+            .returning(MediaModel)
+            .execution_options(populate_existing=True)
+        )
+        if media is None:
+            await db.rollback()
+            return None
+
+        await publish_change(db, user_id, media.id, "tags")
+        await db.commit()
+        return media
+
+    async def tag_counts(self, db: AsyncSession, user_id: int) -> List[Tuple[str, int]]:
+        """Один агрегирующий запрос: unnest(tags) + GROUP BY"""
+        user_tags = (
+            select(func.unnest(MediaModel.tags).label("tag"))
+            .where(MediaModel.user_id == user_id)
+            .subquery()
+        )
+        count = func.count().label("count")
+        result = await db.execute(
+            select(user_tags.c.tag, count)
+            .group_by(user_tags.c.tag)
+            .order_by(count.desc(), user_tags.c.tag)
+        )
+        return [(tag, n) for tag, n in result.all()]
+
+    async def find_similar(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        title: str,
+        kind: Optional[MediaKind],
+        threshold: float,
+        limit: int,
+    ) -> List[Tuple[MediaModel, float]]:
+        """title_norm % :q идёт по триграммному GIN индексу ix_media_title_norm_trgm"""
+        normalized = normalize_title(title)
+        # Порог оператора % - на время транзакции
+        await db.execute(
+            select(func.set_config("pg_trgm.similarity_threshold", str(threshold), True))
+        )
+        # Функция и оператор pg_trgm - по схеме расширения (search_path её может не содержать)
+        trgm = getattr(func, TRGM_SCHEMA)
+        score = trgm.similarity(MediaModel.title_norm, normalized).label("score")
+        similar = MediaModel.title_norm.op(f"OPERATOR({TRGM_SCHEMA}.%)")(normalized)
+        query = select(MediaModel, score).where(and_(MediaModel.user_id == user_id, similar))
+        if kind:
+            query = query.where(MediaModel.kind == kind)
+        result = await db.execute(query.order_by(score.desc(), MediaModel.id).limit(limit))
+        return [(media, float(value)) for media, value in result.all()]
+
+    async def delete(self, db: AsyncSession, media_id: int, user_id: int) -> bool:
+        media = await self.get_by_id(db, media_id, user_id)
+        if not media:
+            return False
+
+        await publish_change(db, user_id, media.id, "delete")
+        db.add(MediaTombstoneModel(media_id=media.id, user_id=user_id))
+        await db.delete(media)
+        await db.commit()
+        return True
+
+    async def stats(self, db: AsyncSession) -> dict:
+        users, media = (
+            await db.execute(select(func.count(MediaModel.user_id.distinct()), func.count()))
+        ).one()
+        tombstones = (
+            await db.execute(select(func.count()).select_from(MediaTombstoneModel))
+        ).scalar_one()
+        return {"users": users, "media": media, "tombstones": tombstones}
+
+    async def purge_tombstones(self, db: AsyncSession) -> int:
+        result = await db.execute(
+            delete(MediaTombstoneModel).where(
+                MediaTombstoneModel.deleted_at < func.now() - TOMBSTONE_RETENTION
+            )
+        )
+        await db.commit()
+        return result.rowcount
+
+    async def clear(self, db: AsyncSession) -> None:
+        await db.execute(delete(MediaModel))
+        await db.execute(delete(MediaTombstoneModel))
+        await db.commit()
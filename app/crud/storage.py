@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Protocol, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.media import MediaModel
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    TagMatch,
+    WatchStatus,
+)
+
+# Сколько хранить tombstones; более старый курсор -> полная ресинхронизация
+TOMBSTONE_RETENTION = timedelta(days=int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30")))
+
+
+class SyncCursor(NamedTuple):
+    """Position in a user's change stream (delta sync token)
+
+    Следующий sync отдаёт изменения с позицией >= position и с позициями из
+    pending (SQL: xid транзакций, незавершённых на момент снимка; в памяти -
+    метка времени в микросекундах, pending пуст). issued_at - для TOMBSTONE_RETENTION.
+    """
+
+    position: int
+    issued_at: datetime
+    pending: Tuple[int, ...] = ()
+
+
+class SyncChanges(NamedTuple):
+    """Result of a delta sync query"""
+
+    upserts: List[MediaModel]
+    deleted: List[int]
+    cursor: SyncCursor
+    full_resync: bool
+
+
+class MediaStorage(Protocol):
+    """Storage backend behind MediaCRUD
+
+    Все методы изолированы по user_id (NFR-06). Мутирующие методы сами
+    фиксируют изменения (COMMIT) и публикуют событие в change feed.
+    db - сессия запроса; backend без БД её игнорирует (может быть None).
+    """
+
+    async def list_media(
+        self,
+        db: Optional[AsyncSession],
+        user_id: int,
+        kind: Optional[MediaKind] = None,
+        status: Optional[WatchStatus] = None,
+        sort: MediaSortField = MediaSortField.CREATED_AT,
+        order: SortOrder = SortOrder.DESC,
+        year_min: Optional[int] = None,
+        year_max: Optional[int] = None,
+        rating_min: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        tags_match: TagMatch = TagMatch.ALL,
+    ) -> List[MediaModel]: ...
+
+    async def get_by_id(
+        self, db: Optional[AsyncSession], media_id: int, user_id: int
+    ) -> Optional[MediaModel]: ...
+
+    async def changes_since(
+        self, db: Optional[AsyncSession], user_id: int, since: Optional[SyncCursor]
+    ) -> SyncChanges: ...
+
+    async def exists(
+        self, db: Optional[AsyncSession], title: str, year: int, kind: MediaKind, user_id: int
+    ) -> bool: ...
+
+    async def create(
+        self, db: Optional[AsyncSession], media_data: MediaCreate, user_id: int
+    ) -> MediaModel: ...
+
+    async def update(
+        self, db: Optional[AsyncSession], media_id: int, media_data: MediaUpdate, user_id: int
+    ) -> Optional[MediaModel]: ...
+
+    async def update_status(
+        self,
+        db: Optional[AsyncSession],
+        media_id: int,
+        status_data: MediaStatusUpdate,
+        user_id: int,
+    ) -> Optional[MediaModel]: ...
+
+    async def set_tags(
+        self, db: Optional[AsyncSession], media_id: int, tags: List[str], user_id: int
+    ) -> Optional[MediaModel]: ...
+
+    async def remove_tag(
+        self, db: Optional[AsyncSession], media_id: int, tag: str, user_id: int
+    ) -> Optional[MediaModel]:
+        """Убрать один тег атомарно: параллельные изменения тегов не теряются"""
+        ...
+
+    async def tag_counts(
+        self, db: Optional[AsyncSession], user_id: int
+    ) -> List[Tuple[str, int]]: ...
+
+    async def find_similar(
+        self,
+        db: Optional[AsyncSession],
+        user_id: int,
+        title: str,
+        kind: Optional[MediaKind],
+        threshold: float,
+        limit: int,
+    ) -> List[Tuple[MediaModel, float]]: ...
+
+    async def delete(self, db: Optional[AsyncSession], media_id: int, user_id: int) -> bool: ...
+
+    async def purge_tombstones(self, db: Optional[AsyncSession]) -> int: ...
+
+    async def stats(self, db: Optional[AsyncSession]) -> dict:
+        """{"users", "media", "tombstones"} всего хранилища (admin, не по user_id)"""
+        ...
+
+    async def clear(self, db: Optional[AsyncSession]) -> None: ...
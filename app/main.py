@@ -1,37 +1,126 @@
+import asyncio
+import logging
 import os
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
+from app.api.debug import router as debug_router
 from app.api.error_handlers import ApiError, setup_exception_handlers
 from app.api.media import router as media_router
-from app.core.database import AsyncSessionLocal, create_tables
+from app.core.audit import audit_log
+from app.core.auth import require_key_source
+from app.core.changefeed import change_feed
+from app.core.database import named_engines, scatter, session_scope, warm_pool
+from app.core.logs import configure_logging, stop_logging
+from app.core.metrics import metrics
+from app.core.migrations import SchemaOutOfDate, check_schema
+from app.core.profiler import continuous_profiler
+from app.core.tracing import tracer
+from app.core.watchdog import loop_watchdog
 from app.crud import media_crud
+from app.crud.items import ITEMS_ENABLED, ITEMS_SNAPSHOT_INTERVAL, ItemStoreFull, item_store
+from app.middleware.access_log import AccessLogMiddleware
+from app.middleware.admission import AdmissionControlMiddleware
+from app.middleware.compression import CompressionMiddleware
 from app.middleware.content_type import StrictContentTypeMiddleware
+from app.middleware.correlation import CorrelationIdMiddleware
+from app.middleware.disconnect import CancelOnDisconnectMiddleware
+from app.middleware.idempotency import (
+    IDEMPOTENCY_PURGE_INTERVAL,
+    IdempotencyMiddleware,
+    idempotency_store,
+)
+from app.middleware.tracing import TracingMiddleware
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+async def _snapshot_items_periodically():
+    while True:
+        await asyncio.sleep(ITEMS_SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(item_store.snapshot)
+        except OSError as e:
+            logger.warning("Items snapshot failed: %s", e)
+
+
+async def _purge_idempotency_keys_periodically():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        try:
+            await idempotency_store.purge()
+        except Exception as e:
+            logger.warning("Idempotency keys purge failed: %s", e)
+
+
+async def prepare_database(env: str) -> None:
+    """Версия схемы (DDL - только alembic upgrade); вне test/ci - demo data и очистка tombstones"""
+    await check_schema(named_engines())
+    if env in ("test", "ci"):
+        return
+    try:
+        async with session_scope() as db:
+            await media_crud.create_demo_data(db, user_id=1)
+        await scatter(media_crud.purge_tombstones)  # На каждом шарде
+    except Exception as e:
+        logger.warning("Demo data creation failed: %s", e)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan события приложения"""
     env = os.getenv("ENV", "local").lower()
+    configure_logging()  # Повторный запуск приложения в том же процессе (тесты)
+    require_key_source()  # До старта фоновых задач: без ключей не обслуживаем запросы
+    if ITEMS_ENABLED:
+        await asyncio.to_thread(item_store.open)
+    snapshot_task = asyncio.create_task(_snapshot_items_periodically()) if ITEMS_ENABLED else None
+    purge_task = (
+        asyncio.create_task(_purge_idempotency_keys_periodically())
+        if idempotency_store is not None
+        else None
+    )
+    if audit_log is not None:
+        audit_log.start()
+    if tracer.exporter is not None:
+        tracer.exporter.start()
+    if continuous_profiler is not None:
+        continuous_profiler.start()
+    if loop_watchdog is not None:
+        loop_watchdog.start()
     try:
-        if env == "test":
-            await create_tables()
-            yield
-        elif env == "ci":
-            await create_tables()
-            yield
-        else:
-            await create_tables()
-            try:
-                async with AsyncSessionLocal() as db:
-                    await media_crud.create_demo_data(db, user_id=1)
-            except Exception as e:
-                print(f"[lifespan] Demo data creation failed: {e}")
-            yield
+        # app.server готовит схему один раз в мастер-процессе, до fork воркеров
+        if os.getenv("SERVER_DATABASE_PREPARED") != "1":
+            await prepare_database(env)
+        await warm_pool()
+        yield
+    except SchemaOutOfDate:
+        raise  # Не обслуживать запросы на схеме, которую код не ожидает
     except Exception as e:
-        print(f"[lifespan] Unexpected error: {e}")
+        logger.exception("Unexpected lifespan error: %s", e)
         yield
+    finally:
+        if snapshot_task is not None:
+            snapshot_task.cancel()
+        if purge_task is not None:
+            purge_task.cancel()
+        if loop_watchdog is not None:
+            await loop_watchdog.stop()
+        if continuous_profiler is not None:
+            continuous_profiler.stop()
+        if ITEMS_ENABLED:
+            await asyncio.to_thread(item_store.close)
+        if media_crud.write_batcher is not None:
+            await media_crud.write_batcher.drain()
+        if audit_log is not None:
+            await audit_log.stop()  # После drain: события батчера тоже в очереди
+        await change_feed.stop()
+        if tracer.exporter is not None:
+            await tracer.exporter.stop()
+        stop_logging()  # Последним: дописать очередь логов
 
 
 app = FastAPI(
@@ -47,19 +136,48 @@ setup_exception_handlers(app)
 # Регистрируем middleware для строгой проверки Content-Type
 app.add_middleware(StrictContentTypeMiddleware, allowed_types=["application/json"])
 
+# Отмена обработчика (и SQL-запроса) при отключении клиента
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# Admission control: лимиты по классам маршрутов и быстрый 503
+app.add_middleware(AdmissionControlMiddleware)
+
+# Idempotency-Key: повтор получает сохранённый ответ; снаружи admission control -
+# повторы и ожидающие дубликаты не занимают слоты и соединения из пула
+app.add_middleware(IdempotencyMiddleware)
+
+# Сжатие ответов (внешний слой: добавляется последним)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "500")),
+    gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+)
+
+# Корневой span запроса (traceparent) - снаружи сжатия и admission control
+app.add_middleware(TracingMiddleware)
+
+# Access log (с семплированием успешных запросов) - внутри correlation id
+app.add_middleware(AccessLogMiddleware)
+
+# Correlation id запроса (аудит, логи, X-Correlation-ID) - самый внешний слой
+app.add_middleware(CorrelationIdMiddleware)
+
 # Регистрируем роутеры
 app.include_router(media_router, prefix="/media", tags=["media"])
+app.include_router(debug_router, prefix="/debug", tags=["debug"])
 
 
+# async: без I/O, и не ждёт свободного потока, когда пул занят /items
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 
-_DB = {"items": []}
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
-@app.post("/items")
 def create_item(name: str):
 
     if not name or len(name) > 100:
@@ -67,16 +185,21 @@ def create_item(name: str):
             code="validation_error",  # Безопасное сообщение из SAFE_ERROR_DETAILS
             status=422,
         )
-    item = {"id": len(_DB["items"]) + 1, "name": name}
-    _DB["items"].append(item)
-    return item
+    try:
+        item = item_store.create(name)
+    except ItemStoreFull:
+        raise ApiError(code="storage_full", status=507)
+    return item.to_dict()
 
 
-@app.get("/items/{item_id}")
 def get_item(item_id: int):
-    from app.api.error_handlers import ApiError
+    item = item_store.get(item_id)
+    if item is None:
+        raise ApiError(code="not_found", status=404)  # Без message
+    return item.to_dict()
+
 
-    for it in _DB["items"]:
-        if it["id"] == item_id:
-            return it
-    raise ApiError(code="not_found", status=404)  # Без message
+# ITEMS_ENABLED=false: без /items сервер может работать несколькими воркерами
+if ITEMS_ENABLED:
+    app.add_api_route("/items", create_item, methods=["POST"])
+    app.add_api_route("/items/{item_id}", get_item, methods=["GET"])
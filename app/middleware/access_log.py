@@ -0,0 +1,73 @@
+import logging
+import os
+import random
+import time
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger("app.access")
+
+# Доля успешных быстрых запросов, попадающих в лог (ошибки и медленные - всегда)
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "500"))
+
+
+class AccessLogMiddleware:
+    """One structured log line per request, with sampling of successful ones
+
+    Строка содержит метод, путь (без query string - там могут быть токены),
+    статус и длительность; correlation_id добавляет фильтр логирования.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = ACCESS_LOG_SAMPLE_RATE,
+        slow_ms: float = ACCESS_LOG_SLOW_MS,
+        rng=random.random,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.rng = rng
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500}  # Исключение до ответа - 500
+
+        async def capture_status(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture_status)
+        finally:
+            self._log(scope, state["status"], (time.perf_counter() - started) * 1000)
+
+    def _log(self, scope, status: int, duration_ms: float) -> None:
+        always = status >= 400 or duration_ms >= self.slow_ms
+        if not always and self.rng() >= self.sample_rate:
+            metrics.inc(
+                "access_log_sampled_out_total",
+                help_text="Successful requests not written to the access log (sampling)",
+            )
+            return
+        logger.log(
+            logging.WARNING if status >= 500 else logging.INFO,
+            "%s %s %d",
+            scope["method"],
+            scope["path"],
+            status,
+            extra={
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(duration_ms, 2),
+                "sampled": not always,
+            },
+        )
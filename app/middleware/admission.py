@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+from typing import Dict, Optional
+
+from app.api.problem import SAFE_ERROR_DETAILS, problem
+from app.core.database import POOL_SIZE
+from app.core.metrics import metrics
+
+# Маршруты с приоритетом: никогда не ждут и не отбрасываются
+PRIORITY_PATHS = ("/health", "/metrics")
+# Диагностика нужна как раз под перегрузкой; /debug/profile держит запрос секундами
+PRIORITY_PREFIXES = ("/debug/",)
+
+
+class Lane:
+    """Bounded concurrency + bounded wait queue for one route class"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+        labels = {"lane": name}
+        metrics.gauge(
+            "admission_in_flight", lambda: self.in_flight, labels, "Requests being processed"
+        )
+        metrics.gauge("admission_waiting", lambda: self.waiting, labels, "Requests queued")
+
+    async def acquire(self) -> bool:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        else:
+            # Очередь уже полна: отвечаем сразу, а не копим задержку и память
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            # Своя задача вместо wait_for: после таймаута или отмены видно, получен ли
+            # permit (wait_for < 3.12 мог потерять его или проглотить отмену)
+            acquire = asyncio.ensure_future(self._semaphore.acquire())
+            try:
+                await asyncio.wait({acquire}, timeout=self.queue_timeout)
+            except BaseException:
+                self._abandon(acquire)
+                raise
+            finally:
+                self.waiting -= 1
+            if not acquire.done():
+                self._abandon(acquire)
+                return False
+        self.in_flight += 1
+        return True
+
+    def _abandon(self, acquire: "asyncio.Future[bool]") -> None:
+        """Перестать ждать; permit, полученный в тот же шаг, вернуть в семафор"""
+        acquire.cancel()
+        acquire.add_done_callback(self._release_unused)
+
+    def _release_unused(self, acquire: "asyncio.Future[bool]") -> None:
+        if not acquire.cancelled() and acquire.exception() is None:
+            self._semaphore.release()
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def default_lanes(pool_size: int = POOL_SIZE) -> Dict[str, Lane]:
+    """Лимиты по умолчанию: read + write = pool_size воркера (70/30; при 20 - 14 и 6)"""
+    timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+    read_limit = max(1, round(pool_size * 0.7))
+    return {
+        "read": Lane(
+            "read",
+            _env_int("ADMISSION_READ_LIMIT", read_limit),
+            _env_int("ADMISSION_READ_QUEUE", 50),
+            timeout,
+        ),
+        "write": Lane(
+            "write",
+            _env_int("ADMISSION_WRITE_LIMIT", max(1, pool_size - read_limit)),
+            _env_int("ADMISSION_WRITE_QUEUE", 20),
+            timeout,
+        ),
+        # SSE держит слот всё время жизни потока, соединение из пула - нет
+        "stream": Lane("stream", _env_int("ADMISSION_STREAM_LIMIT", 200), 0, 0),
+    }
+
+
+def classify(scope) -> Optional[str]:
+    """Route class of the request; None = priority lane"""
+    path = scope["path"]
+    if path in PRIORITY_PATHS or path.startswith(PRIORITY_PREFIXES):
+        return None
+    if path == "/media/changes":
+        return "stream"
+    if scope["method"] in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+class AdmissionControlMiddleware:
+    """Load shedding: быстрый 503 + Retry-After вместо ожидания пула"""
+
+    def __init__(
+        self, app, lanes: Optional[Dict[str, Lane]] = None, retry_after: Optional[int] = None
+    ):
+        self.app = app
+        self.lanes = lanes if lanes is not None else default_lanes()
+        self.retry_after = retry_after or _env_int("ADMISSION_RETRY_AFTER", 1)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        lane_name = classify(scope)
+        lane = self.lanes.get(lane_name) if lane_name else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await lane.acquire():
+            metrics.inc(
+                "admission_shed_total",
+                labels={"lane": lane.name},
+                help_text="Requests rejected with 503 by load shedding",
+            )
+            await self._reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+
+    async def _reject(self, send) -> None:
+        body = json.dumps(
+            problem(status=503, detail=SAFE_ERROR_DETAILS["service_unavailable"])
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,329 @@
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:  # Опциональные кодеки: используются, только если установлены
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Порядок предпочтения сервера при равных q-values
+SERVER_PREFERENCE = [
+    name
+    for name, available in (
+        ("br", brotli is not None),
+        ("zstd", zstandard is not None),
+        ("gzip", True),
+    )
+    if available
+]
+
+DEFAULT_COMPRESSIBLE_TYPES = ("application/json", "application/problem+json", "text/")
+
+# SSE нельзя буферизовать/сжимать: клиент должен получать события сразу
+EXCLUDED_TYPES = ("text/event-stream",)
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Parse Accept-Encoding into {coding: q}"""
+    codings: Dict[str, float] = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[token] = q
+    return codings
+
+
+def choose_encoding(header: str, preference: Iterable[str] = None) -> Optional[str]:
+    """Pick the best supported content coding for the given Accept-Encoding"""
+    if not header:
+        return None
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+
+    best, best_q = None, 0.0
+    for name in preference or SERVER_PREFERENCE:
+        q = codings.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class _StreamCompressor:
+    """Incremental compressor with per-chunk flush (for chunked responses)"""
+
+    def __init__(self, encoding: str, gzip_level: int):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=4)
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.flush()
+        return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_FINISH)
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def compress_bytes(data: bytes, encoding: str, gzip_level: int = 6) -> bytes:
+    """One-shot compression of a complete body"""
+    if encoding == "gzip":
+        obj = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        return obj.compress(data) + obj.flush()
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+class CompressedBodyCache:
+    """Bounded LRU of compressed bodies keyed by (encoding, content version)"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def version_of(body: bytes) -> bytes:
+        """Content version = digest of the uncompressed body.
+
+        Digest (а не счётчик в памяти процесса) остаётся корректным при нескольких
+        воркерах: изменение списка у пользователя сразу даёт другой ключ.
+        """
+        return hashlib.blake2b(body, digest_size=16).digest()
+
+    def get(self, encoding: str, version: bytes) -> Optional[bytes]:
+        key = (encoding, version)
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, encoding: str, version: bytes, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        key = (encoding, version)
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._data[key] = value
+        self._size += len(value)
+        while len(self._data) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self._size -= len(evicted)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware: gzip/br/zstd по Accept-Encoding
+
+    - ответы меньше minimum_size отдаются как есть;
+    - chunked ответы (more_body=True) сжимаются потоково с flush на каждый чанк;
+    - целые ответы на GET кэшируются в сжатом виде, повтор того же контента
+      не тратит CPU на сжатие.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 500,
+        gzip_level: int = 6,
+        cache: Optional[CompressedBodyCache] = None,
+        compressible_types: Iterable[str] = DEFAULT_COMPRESSIBLE_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.cache = cache if cache is not None else CompressedBodyCache()
+        self.compressible_types = tuple(compressible_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, cacheable=scope["method"] == "GET")
+        await self.app(scope, receive, responder.wrap(send))
+
+    def is_compressible(self, headers: List[Tuple[bytes, bytes]]) -> bool:
+        content_type = ""
+        for key, value in headers:
+            key = key.lower()
+            if key == b"content-encoding":
+                return False  # Уже сжато
+            if key == b"content-type":
+                content_type = value.decode("latin-1").split(";")[0].strip().lower()
+        if not content_type or content_type.startswith(EXCLUDED_TYPES):
+            return False
+        return content_type.startswith(self.compressible_types)
+
+
+class _CompressionResponder:
+    """Per-request state for CompressionMiddleware"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, cacheable: bool):
+        self.mw = middleware
+        self.encoding = encoding
+        self.cacheable = cacheable
+        self.start_message = None
+        self.passthrough = False
+        self.stream: Optional[_StreamCompressor] = None
+
+    def wrap(self, send):
+        async def wrapped_send(message):
+            await self.send(message, send)
+
+        return wrapped_send
+
+    async def send(self, message, send):
+        msg_type = message["type"]
+
+        if msg_type == "http.response.start":
+            # Откладываем заголовки до первого чанка тела
+            self.start_message = message
+            headers = list(message.get("headers", []))
+            if message["status"] in (204, 304) or not self.mw.is_compressible(headers):
+                self.passthrough = True
+                await send(message)
+            return
+
+        if msg_type != "http.response.body" or self.passthrough:
+            await send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is not None:
+            chunk = self.stream.compress(body) if body else b""
+            if not more_body:
+                chunk += self.stream.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        headers = list(self.start_message.get("headers", []))
+
+        if not more_body:
+            # Целый ответ
+            if len(body) < self.mw.minimum_size:
+                await send(self.start_message)
+                await send(message)
+                return
+            compressed = self._compress_whole(body)
+            self._set_headers(headers, content_length=len(compressed))
+            await send(self.start_message)
+            await send({"type": "http.response.body", "body": compressed})
+            return
+
+        # Chunked ответ: content-length неизвестна, используем заявленную если есть
+        declared = _header(headers, b"content-length")
+        if declared is not None and int(declared) < self.mw.minimum_size:
+            self.passthrough = True
+            await send(self.start_message)
+            await send(message)
+            return
+
+        self.stream = _StreamCompressor(self.encoding, self.mw.gzip_level)
+        self._set_headers(headers, content_length=None)
+        await send(self.start_message)
+        await send(
+            {"type": "http.response.body", "body": self.stream.compress(body), "more_body": True}
+        )
+
+    def _compress_whole(self, body: bytes) -> bytes:
+        if not self.cacheable:
+            return compress_bytes(body, self.encoding, self.mw.gzip_level)
+        cache = self.mw.cache
+        version = cache.version_of(body)
+        compressed = cache.get(self.encoding, version)
+        if compressed is None:
+            compressed = compress_bytes(body, self.encoding, self.mw.gzip_level)
+            cache.put(self.encoding, version, compressed)
+        return compressed
+
+    def _set_headers(self, headers: List[Tuple[bytes, bytes]], content_length: Optional[int]):
+        result = []
+        vary_values = []
+        for key, value in headers:
+            lower = key.lower()
+            if lower == b"content-length":
+                continue
+            if lower == b"vary":
+                vary_values.append(value)
+                continue
+            if lower == b"etag" and not value.startswith(b"W/"):
+                # Сжатое представление отличается побайтно -> только weak ETag
+                value = b"W/" + value
+            result.append((key, value))
+
+        vary = b", ".join(vary_values)
+        if b"accept-encoding" not in vary.lower():
+            vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+        result.append((b"vary", vary))
+        result.append((b"content-encoding", self.encoding.encode("latin-1")))
+        if content_length is not None:
+            result.append((b"content-length", str(content_length).encode("latin-1")))
+
+        self.start_message = dict(self.start_message)
+        self.start_message["headers"] = result
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
@@ -0,0 +1,39 @@
+import re
+import uuid
+
+from app.core.context import correlation_id
+
+HEADER = b"x-correlation-id"
+# Чужой id принимаем, только если он безопасен для логов и заголовков
+_VALID_ID = re.compile(rb"[A-Za-z0-9._-]{1,64}")
+
+
+class CorrelationIdMiddleware:
+    """Request-scoped correlation id in a contextvar, echoed as X-Correlation-ID
+
+    Берётся из входящего X-Correlation-ID (если валиден) или генерируется.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(HEADER)
+        value = incoming.decode() if incoming and _VALID_ID.fullmatch(incoming) else None
+        value = value or str(uuid.uuid4())
+        token = correlation_id.set(value)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != HEADER]
+                message["headers"] = headers + [(HEADER, value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            correlation_id.reset(token)
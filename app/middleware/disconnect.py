@@ -0,0 +1,62 @@
+import asyncio
+
+from app.core.metrics import metrics
+
+
+class CancelOnDisconnectMiddleware:
+    """Cancel the request handler when the client disconnects
+
+    Отмена задачи доходит до asyncpg: выполняющийся запрос отменяется на сервере
+    (cancel request), и соединение возвращается в пул, а не работает впустую.
+    Очередь между watcher и приложением - на одно сообщение: следующий кусок тела
+    читается, только когда приложение забрало предыдущий (backpressure сохраняется,
+    тело не копится в памяти). Disconnect обрабатывается до постановки в очередь.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=1)
+        state = {"response_complete": False, "disconnected": False}
+
+        async def queued_receive():
+            return await queue.get()
+
+        async def tracked_send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["response_complete"] = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, queued_receive, tracked_send))
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    # Отмена - не дожидаясь, пока приложение дочитает очередь
+                    if not state["response_complete"] and not app_task.done():
+                        state["disconnected"] = True
+                        app_task.cancel()
+                    await queue.put(message)
+                    return
+                await queue.put(message)
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                raise  # Отменили нас самих (shutdown), а не клиент
+            metrics.inc(
+                "requests_cancelled_total",
+                help_text="Requests cancelled because the client disconnected",
+            )
+        finally:
+            if not app_task.done():
+                app_task.cancel()
+            watcher.cancel()
@@ -0,0 +1,481 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.api.problem import SAFE_ERROR_DETAILS, problem
+from app.core.auth import InvalidToken, KeysUnavailable, token_verifier
+from app.core.database import async_engine
+from app.core.metrics import metrics
+from app.models.idempotency import IdempotencyKeyModel
+
+logger = logging.getLogger(__name__)
+
+# memory - только LRU процесса; sql - ещё и таблица idempotency_keys (общая для воркеров)
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory").lower()
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_BYTES = int(os.getenv("IDEMPOTENCY_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Сколько помнить ответ: окно, в котором клиент повторяет запрос
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Повтор ждёт первый запрос не дольше, дальше - 409 + Retry-After
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# Аренда ключа в таблице: воркер упал посреди запроса - ключ свободен через N секунд
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+# Запросы и ответы больше - без идемпотентности (тело держится в памяти целиком)
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(1024 * 1024)))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "600"))
+
+IDEMPOTENT_METHODS = ("POST", "PUT", "PATCH")
+# Видимые ASCII символы, как в draft-ietf-httpapi-idempotency-key-header
+KEY_PATTERN = re.compile(r"[\x21-\x7e]{1,255}")
+# Временные ошибки не сохраняются: повтор должен выполниться заново (5xx - тоже)
+TRANSIENT_STATUSES = (408, 425, 429)
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+
+Ident = Tuple[int, str]
+
+
+class StoredResponse(NamedTuple):
+    """Первый ответ на ключ и fingerprint запроса, на который он был дан"""
+
+    fingerprint: bytes
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(key) + len(value) for key, value in self.headers)
+
+
+class KeyInFlight(Exception):
+    """The first request with this key is still running in another worker"""
+
+
+def fingerprint_of(scope, body: bytes) -> bytes:
+    """blake2b метода, пути, query и тела запроса"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b"")):
+        digest.update(part)
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.digest()
+
+
+def storable(status: int) -> bool:
+    return status < 500 and status not in TRANSIENT_STATUSES
+
+
+class IdempotencyCache:
+    """Bounded LRU of stored responses keyed by (user_id, Idempotency-Key), with TTL"""
+
+    def __init__(
+        self,
+        max_entries: int = IDEMPOTENCY_CACHE_SIZE,
+        max_bytes: int = IDEMPOTENCY_CACHE_BYTES,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[Ident, Tuple[float, StoredResponse]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, ident: Ident) -> Optional[StoredResponse]:
+        entry = self._data.get(ident)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= time.monotonic():
+            self._pop(ident)
+            return None
+        self._data.move_to_end(ident)
+        return response
+
+    def put(self, ident: Ident, response: StoredResponse) -> None:
+        if response.size > self.max_bytes:
+            return
+        self._pop(ident)
+        self._data[ident] = (time.monotonic() + self.ttl, response)
+        self._size += response.size
+        while len(self._data) > self.max_entries or self._size > self.max_bytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self._size -= evicted.size
+
+    def _pop(self, ident: Ident) -> None:
+        entry = self._data.pop(ident, None)
+        if entry is not None:
+            self._size -= entry[1].size
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqlIdempotencyStore:
+    """idempotency_keys: ответы, общие для воркеров и перезапусков
+
+    Первый запрос арендует ключ (строка со status=0) одним INSERT ... ON
+    CONFLICT: из одновременных запросов в разных воркерах ключ получает ровно
+    один, остальные видят status=0 и ждут. Просроченная строка (ответ старше TTL
+    или брошенная аренда) занимается заново тем же INSERT.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        lease: float = IDEMPOTENCY_LEASE_SECONDS,
+    ):
+        self.engine = engine
+        self.ttl = timedelta(seconds=ttl)
+        self.lease = timedelta(seconds=lease)
+        self.table = IdempotencyKeyModel.__table__
+
+    def _where(self, user_id: int, key: str):
+        return (self.table.c.user_id == user_id) & (self.table.c.key == key)
+
+    async def reserve(self, user_id: int, key: str, fingerprint: bytes) -> Optional[StoredResponse]:
+        """None - ключ арендован (выполнить запрос); иначе сохранённый ответ
+
+        KeyInFlight - первый запрос ещё выполняется.
+        """
+        stmt = insert(self.table).values(
+            user_id=user_id,
+            key=key,
+            fingerprint=fingerprint,
+            status=0,
+            expires_at=func.now() + self.lease,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.user_id, self.table.c.key],
+            set_={
+                "fingerprint": stmt.excluded.fingerprint,
+                "status": 0,
+                "headers": None,
+                "body": None,
+                "created_at": func.now(),
+                "expires_at": stmt.excluded.expires_at,
+            },
+            where=self.table.c.expires_at < func.now(),
+        ).returning(self.table.c.user_id)
+        async with self.engine.begin() as conn:
+            if (await conn.execute(stmt)).first() is not None:
+                return None
+            row = (
+                await conn.execute(
+                    select(
+                        self.table.c.fingerprint,
+                        self.table.c.status,
+                        self.table.c.headers,
+                        self.table.c.body,
+                    ).where(self._where(user_id, key))
+                )
+            ).first()
+        if row is None or row.status == 0:
+            raise KeyInFlight()  # row is None - строку только что удалил purge
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in row.headers]
+        return StoredResponse(row.fingerprint, row.status, headers, row.body)
+
+    async def complete(self, user_id: int, key: str, response: StoredResponse) -> None:
+        headers = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in response.headers]
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(self.table)
+                .where(self._where(user_id, key))
+                .values(
+                    status=response.status,
+                    headers=headers,
+                    body=response.body,
+                    expires_at=func.now() + self.ttl,
+                )
+            )
+
+    async def release(self, user_id: int, key: str) -> None:
+        """Ответ не сохраняется (5xx, отмена): следующий повтор выполнит запрос"""
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                delete(self.table).where(self._where(user_id, key) & (self.table.c.status == 0))
+            )
+
+    async def purge(self) -> int:
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                delete(self.table).where(self.table.c.expires_at < func.now())
+            )
+        return result.rowcount
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def bearer_user(scope) -> Optional[int]:
+    """user_id из Authorization: Bearer (кэш токенов общий с get_current_principal)"""
+    scheme, _, token = (_header(scope, b"authorization") or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    try:
+        return (await token_verifier.authenticate(token.strip())).user_id
+    except (InvalidToken, KeysUnavailable):
+        return None
+
+
+async def _read_body(receive, limit: int) -> Tuple[List[dict], Optional[bytes]]:
+    """Сообщения тела запроса и тело целиком; None - больше limit или клиент ушёл"""
+    messages: List[dict] = []
+    size = 0
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            return messages, None
+        size += len(message.get("body", b""))
+        if size > limit:
+            return messages, None
+        if not message.get("more_body", False):
+            return messages, b"".join(m.get("body", b"") for m in messages)
+
+
+def _replay_receive(messages: List[dict], receive):
+    """receive, отдающий сначала уже прочитанное тело (дальше - disconnect и пр.)"""
+    pending = list(messages)
+
+    async def replayed():
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replayed
+
+
+class _Recorder:
+    """send, который запоминает ответ обработчика (и отправляет его клиенту)"""
+
+    def __init__(self, send, limit: int):
+        self._send = send
+        self.limit = limit
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.complete = False
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            self.size += len(body)
+            if self.size <= self.limit:
+                self.chunks.append(body)
+            self.complete = not message.get("more_body", False)
+        await self._send(message)
+
+    def response(self, fingerprint: bytes) -> Optional[StoredResponse]:
+        if self.status is None or not self.complete or self.size > self.limit:
+            return None
+        return StoredResponse(fingerprint, self.status, self.headers, b"".join(self.chunks))
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI: Idempotency-Key для POST/PUT/PATCH
+
+    Первый ответ на (user_id, ключ) сохраняется - в LRU процесса и, при
+    IDEMPOTENCY_STORE=sql, в idempotency_keys - и на повтор отдаётся побайтно
+    с Idempotent-Replayed: true, без вызова обработчика (и MediaCRUD). Повтор,
+    пока первый запрос выполняется, ждёт его ответ. Тот же ключ с другим
+    запросом - 422. Запросы без ключа и без валидного токена проходят как есть.
+    """
+
+    def __init__(
+        self,
+        app,
+        cache: Optional[IdempotencyCache] = None,
+        store: Optional[SqlIdempotencyStore] = None,
+        user_of: Callable[[dict], Awaitable[Optional[int]]] = bearer_user,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+        max_body_bytes: int = IDEMPOTENCY_MAX_BODY_BYTES,
+    ):
+        self.app = app
+        self.cache = cache if cache is not None else IdempotencyCache()
+        self.store = store if store is not None else idempotency_store
+        self.user_of = user_of
+        self.wait_seconds = wait_seconds
+        self.max_body_bytes = max_body_bytes
+        # Ключи, первый запрос которых выполняется в этом процессе
+        self._in_flight: Dict[Ident, asyncio.Future] = {}
+        metrics.gauge(
+            "idempotency_cache_entries",
+            lambda: len(self.cache),
+            help_text="Responses held in the in-process idempotency cache",
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        key = _header(scope, b"idempotency-key")
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not KEY_PATTERN.fullmatch(key):
+            await _problem(send, 400, "idempotency_key_invalid")
+            return
+
+        user_id = await self.user_of(scope)
+        if user_id is None:
+            await self.app(scope, receive, send)  # 401 ответит сам обработчик
+            return
+
+        messages, body = await _read_body(receive, self.max_body_bytes)
+        receive = _replay_receive(messages, receive)
+        if body is None:
+            _count("bypass")
+            await self.app(scope, receive, send)
+            return
+
+        await self._handle(scope, receive, send, (user_id, key), fingerprint_of(scope, body))
+
+    async def _handle(self, scope, receive, send, ident: Ident, fingerprint: bytes) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_seconds
+        while True:
+            stored = self.cache.get(ident)
+            if stored is not None:
+                await self._replay(send, stored, fingerprint)
+                return
+            leader = self._in_flight.get(ident)
+            if leader is None:
+                break
+            # Ждём первый запрос; после него - ответ из кэша или (5xx, отмена) ключ свободен
+            try:
+                await asyncio.wait_for(asyncio.shield(leader), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                await self._in_use(send)
+                return
+
+        future = loop.create_future()
+        self._in_flight[ident] = future
+        try:
+            await self._lead(scope, receive, send, ident, fingerprint, deadline)
+        finally:
+            del self._in_flight[ident]
+            future.set_result(None)
+
+    async def _lead(self, scope, receive, send, ident: Ident, fingerprint: bytes, deadline):
+        store = self.store
+        if store is not None:
+            try:
+                stored = await self._reserve(store, ident, fingerprint, deadline)
+            except KeyInFlight:
+                await self._in_use(send)
+                return
+            except Exception as e:  # БД недоступна: остаётся защита в пределах процесса
+                logger.warning("Idempotency store unavailable: %s", e)
+                store = None
+            else:
+                if stored is not None:
+                    self.cache.put(ident, stored)
+                    await self._replay(send, stored, fingerprint)
+                    return
+
+        recorder = _Recorder(send, self.max_body_bytes)
+        saved = False
+        try:
+            await self.app(scope, receive, recorder.send)
+            response = recorder.response(fingerprint)
+            if response is not None and storable(response.status):
+                self.cache.put(ident, response)
+                if store is not None:
+                    await store.complete(*ident, response)
+                saved = True
+            _count("stored" if saved else "not_stored")
+        finally:
+            if store is not None and not saved:
+                try:
+                    await store.release(*ident)
+                except Exception as e:
+                    logger.warning("Idempotency key release failed: %s", e)
+
+    async def _reserve(self, store, ident: Ident, fingerprint: bytes, deadline):
+        """store.reserve с ожиданием, пока ключ занят другим воркером"""
+        loop = asyncio.get_running_loop()
+        delay = 0.05
+        while True:
+            try:
+                return await store.reserve(*ident, fingerprint)
+            except KeyInFlight:
+                if loop.time() + delay > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+    async def _replay(self, send, stored: StoredResponse, fingerprint: bytes) -> None:
+        if stored.fingerprint != fingerprint:
+            _count("mismatch")
+            await _problem(send, 422, "idempotency_key_reused")
+            return
+        _count("replayed")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": stored.status,
+                "headers": [*stored.headers, REPLAYED_HEADER],
+            }
+        )
+        await send({"type": "http.response.body", "body": stored.body})
+
+    async def _in_use(self, send) -> None:
+        _count("in_use")
+        await _problem(send, 409, "idempotency_key_in_use", [(b"retry-after", b"1")])
+
+
+def _count(result: str) -> None:
+    metrics.inc(
+        "idempotency_requests_total",
+        labels={"result": result},
+        help_text="Requests with an Idempotency-Key by outcome",
+    )
+
+
+async def _problem(send, status: int, code: str, headers=()) -> None:
+    body = json.dumps(problem(status=status, detail=SAFE_ERROR_DETAILS[code])).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+# Singleton (None - только LRU процесса)
+idempotency_store = (
+    SqlIdempotencyStore(async_engine)
+    if IDEMPOTENCY_STORE == "sql" and async_engine is not None
+    else None
+)
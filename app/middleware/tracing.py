@@ -0,0 +1,56 @@
+from app.core import tracing
+from app.core.context import correlation_id
+
+
+class TracingMiddleware:
+    """Root SERVER span per request with W3C traceparent propagation
+
+    Входящий traceparent продолжает трейс клиента (и его решение о выборке);
+    traceresponse в ответе даёт клиенту id трейса для поиска в коллекторе.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        tracer = tracing.tracer
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"traceparent")
+        root = tracer.start_root(scope["method"], incoming.decode("latin-1") if incoming else None)
+        state = {"status": 500}
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"traceresponse", root.traceparent().encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            with tracer.activate(root):
+                await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None)
+            root.name = f"{scope['method']} {route_path or scope['path']}"
+            root.attributes.update(
+                {
+                    "http.request.method": scope["method"],
+                    "url.path": scope["path"],
+                    "http.response.status_code": state["status"],
+                }
+            )
+            if route_path:
+                root.attributes["http.route"] = route_path
+            if correlation_id.get():
+                root.attributes["correlation_id"] = correlation_id.get()
+            if state["status"] >= 500 and root.error is None:
+                root.error = f"HTTP {state['status']}"
+            tracer.end_root(root)
@@ -1,4 +1,15 @@
+from .audit import AuditLogModel
 from .base import Base
-from .media import MediaModel
+from .idempotency import IdempotencyKeyModel
+from .media import MediaModel, MediaTombstoneModel, media_change_seq
+from .shard_directory import ShardDirectoryModel
 
-__all__ = ["Base", "MediaModel"]
+__all__ = [
+    "AuditLogModel",
+    "Base",
+    "IdempotencyKeyModel",
+    "MediaModel",
+    "MediaTombstoneModel",
+    "ShardDirectoryModel",
+    "media_change_seq",
+]
@@ -0,0 +1,73 @@
+from datetime import date
+
+from sqlalchemy import DDL, BigInteger, Column, DateTime, Identity, Index, Integer, String, event
+from sqlalchemy.dialects.postgresql import JSONB
+
+from .base import Base
+
+
+class AuditLogModel(Base):
+    """Append-only журнал изменений media (NFR-09), партиции по месяцам occurred_at"""
+
+    __tablename__ = "audit_log"
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    # Ключ партиционирования обязан входить в первичный ключ
+    occurred_at = Column(DateTime(timezone=True), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    op = Column(String(16), nullable=False)
+    media_id = Column(Integer, nullable=True)
+    # {поле: [до, после]} - только изменившиеся поля
+    changes = Column(JSONB, nullable=False, server_default="{}")
+    correlation_id = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("ix_audit_log_user_occurred", "user_id", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)", "extend_existing": True},
+    )
+
+
+# Колонки, которые пишет COPY (id и остальное - по умолчанию)
+AUDIT_COPY_COLUMNS = ("occurred_at", "user_id", "op", "media_id", "changes", "correlation_id")
+
+# UPDATE/DELETE запрещены триггером; старые данные удаляются только DROP партиции
+# (по одной команде на DDL: asyncpg не выполняет несколько команд в prepared statement)
+event.listen(
+    AuditLogModel.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION audit_log_append_only() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'audit_log is append-only';
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    ),
+)
+event.listen(
+    AuditLogModel.__table__,
+    "after_create",
+    DDL(
+        "CREATE TRIGGER audit_log_append_only BEFORE UPDATE OR DELETE ON audit_log "
+        "FOR EACH ROW EXECUTE FUNCTION audit_log_append_only()"
+    ),
+)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def audit_partition_ddl(month: date) -> str:
+    """CREATE партиции audit_log за месяц (UTC), начинающийся с month
+
+    Границы - явно в UTC: голую дату timestamptz читает в TimeZone сессии, и
+    на сервере не в UTC события у границы месяца не попадали бы в партицию.
+    """
+    following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS audit_log_y{month:%Y}m{month:%m} "
+        f"PARTITION OF audit_log FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+        f"TO ('{following.isoformat()} 00:00:00+00')"
+    )
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, DateTime, Index, Integer, LargeBinary, SmallInteger, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from .base import Base
+
+
+class IdempotencyKeyModel(Base):
+    """Сохранённые ответы на запросы с Idempotency-Key (IDEMPOTENCY_STORE=sql)
+
+    Общая для воркеров часть кэша идемпотентности: повтор, попавший в другой
+    процесс, получает тот же ответ. status=0 - первый запрос ещё выполняется
+    (expires_at - срок аренды ключа), иначе - сохранённый ответ до expires_at.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    key = Column(String(255), primary_key=True)
+    # blake2b метода, пути, query и тела: тот же ключ с другим запросом - 422
+    fingerprint = Column(LargeBinary, nullable=False)
+    status = Column(SmallInteger, nullable=False, server_default="0")
+    headers = Column(JSONB, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+        {"extend_existing": True},
+    )
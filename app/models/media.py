@@ -1,35 +1,141 @@
-from sqlalchemy import Column, DateTime
+import os
+
+from sqlalchemy import DDL, BigInteger, Column, DateTime
 from sqlalchemy import Enum as SQLEnum
-from sqlalchemy import Index, Integer, String
+from sqlalchemy import Index, Integer, Sequence, String, Text, cast, event, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 
+from app.core.similarity import normalize_title
 from app.schemas.media import MediaKind, WatchStatus
 
 from .base import Base
 
+# Диапазонные фильтры GET /media (year_min/year_max, rating_min): индексы (user_id[, kind|status], поле).
+# Сортировку индексы не обслуживают: без пагинации планировщик читает строки пользователя
+# bitmap-сканом и сортирует их в памяти, поэтому индексов "под сортировку" нет
+RANGE_COLUMNS = ("year", "rating")
+
+# media - HASH-партиции по user_id: каждый запрос MediaCRUD фильтрует по user_id и
+# читает одну партицию; индексы и VACUUM - на партицию, а не на всю таблицу.
+# Число партиций меняется только миграцией (scripts.partition_media)
+MEDIA_PARTITIONS = int(os.getenv("MEDIA_PARTITIONS", "16"))
+
+# Глобально монотонная версия изменений (id события в change feed)
+media_change_seq = Sequence("media_change_seq", metadata=Base.metadata)
+
+# Транзакция, записавшая строку (xid8 в bigint): курсор delta sync - снимок запроса
+# (xmax и незавершённые xid), запоздавший COMMIT не проскочит мимо него, в отличие
+# от now() начала транзакции
+CURRENT_XID = "(pg_current_xact_id()::text::bigint)"
+
+
+# Триграммный индекс по title_norm; pg_trgm - trusted extension (PG 13+), владельцу БД хватает прав.
+# Схема расширения - явно в opclass, операторе % и similarity(): её нет в search_path при DB_SCHEMA
+TRGM_SCHEMA = "public"
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL(f"CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA {TRGM_SCHEMA}"),
+)
+
 
 class MediaModel(Base):
     """SQLAlchemy модель для медиа"""
 
     __tablename__ = "media"
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String(200), nullable=False, index=True)
-    kind = Column(SQLEnum(MediaKind), nullable=False, index=True)
+    # PK партиционированной таблицы обязан включать ключ партиционирования;
+    # id по-прежнему из одной последовательности media_id_seq (уникален в пределах БД шарда).
+    # Отдельных индексов на id, title, kind, user_id нет: их покрывают PK (id, user_id) и
+    # составные (user_id, ...) ниже, а лишние индексы - лишняя запись на каждый INSERT
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    title = Column(String(200), nullable=False)
+    # Нормализованное название (normalize_title) для поиска похожих дублей
+    title_norm = Column(String(200), nullable=False, server_default="")
+    kind = Column(SQLEnum(MediaKind), nullable=False)
     year = Column(Integer, nullable=False)
     description = Column(String(1000), nullable=True)
-    user_id = Column(Integer, nullable=False, index=True)  # 🔒 Security: user isolation
+    # 🔒 Security: user isolation; ключ партиционирования
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
     status = Column(SQLEnum(WatchStatus), nullable=False, default=WatchStatus.TO_WATCH)
     rating = Column(Integer, nullable=True)
+    tags = Column(ARRAY(String(50)), nullable=False, default=list, server_default="{}")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Обновляется при каждой записи (delta sync)
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now()
+    )
+    change_xid = Column(
+        BigInteger,
+        nullable=False,
+        server_default=text(CURRENT_XID),
+        onupdate=cast(cast(func.pg_current_xact_id(), Text), BigInteger),
+    )
 
     __table_args__ = (
-        Index("ix_media_user_title_year", "user_id", "title", "year"),  # Duplicate check
-        Index("ix_media_user_kind", "user_id", "kind"),  # Filtering by kind
-        Index("ix_media_user_status", "user_id", "status"),  # Filtering by status
-        Index("ix_media_user_created", "user_id", "created_at"),  # Ordering by date
-        {"extend_existing": True},
+        # Duplicate check: check_media_exists сравнивает lower(title)
+        Index("ix_media_user_lower_title_year", "user_id", func.lower(title), "year"),
+        Index("ix_media_user_rating", "user_id", "rating"),  # rating_min
+        Index("ix_media_user_year", "user_id", "year"),  # year_min/year_max
+        # Фильтр по kind/status (с диапазоном или без)
+        *[
+            Index(f"ix_media_user_{column}_{field}", "user_id", column, field)
+            for column in ("kind", "status")
+            for field in RANGE_COLUMNS
+        ],
+        Index("ix_media_user_change_xid", "user_id", "change_xid"),  # Delta sync
+        # ?tags=: @> (all) / && (any); с условием по user_id - BitmapAnd с индексом (user_id, ...)
+        Index("ix_media_tags", "tags", postgresql_using="gin"),
+        # Near-duplicates: title_norm % :q и similarity() без полного прохода
+        Index(
+            "ix_media_title_norm_trgm",
+            "title_norm",
+            postgresql_using="gin",
+            postgresql_ops={"title_norm": f"{TRGM_SCHEMA}.gin_trgm_ops"},
+        ),
+        # Индексы выше создаются на родителе: PostgreSQL строит их в каждой партиции
+        {"postgresql_partition_by": "HASH (user_id)", "extend_existing": True},
     )
 
+    @validates("title")
+    def _sync_title_norm(self, key, title):
+        self.title_norm = normalize_title(title)
+        return title
+
     def __repr__(self):
         return f"<MediaModel(id={self.id}, title='{self.title}', user_id={self.user_id})>"
+
+
+def media_partition_ddl(
+    index: int, partitions: int = MEDIA_PARTITIONS, table: str = "media"
+) -> str:
+    """CREATE партиции index из partitions (media_p00, media_p01, ...)"""
+    return (
+        f"CREATE TABLE {table}_p{index:02d} PARTITION OF {table} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {index})"
+    )
+
+
+# По одной команде на DDL (asyncpg не выполняет несколько команд в prepared statement)
+for _index in range(MEDIA_PARTITIONS):
+    event.listen(MediaModel.__table__, "after_create", DDL(media_partition_ddl(_index)))
+
+
+class MediaTombstoneModel(Base):
+    """Следы удалённых медиа для delta sync"""
+
+    __tablename__ = "media_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    media_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)  # 🔒 Security: user isolation
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    change_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+
+    __table_args__ = (
+        Index("ix_media_tombstones_user_change_xid", "user_id", "change_xid"),  # Delta sync
+        Index("ix_media_tombstones_deleted", "deleted_at"),  # purge_tombstones
+        {"extend_existing": True},
+    )
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.sql import func
+
+from .base import Base
+
+
+class ShardDirectoryModel(Base):
+    """user_id -> шард: переопределения consistent hash (перенесённые пользователи)
+
+    Живёт в основной (catalog) БД. При SHARD_ROUTING=directory - запись на каждого
+    пользователя. state=frozen - пользователь переносится, запросы получают 503.
+    """
+
+    __tablename__ = "shard_directory"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(String(64), nullable=False)
+    state = Column(String(16), nullable=False, server_default="active")
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now()
+    )
+
+    __table_args__ = ({"extend_existing": True},)
@@ -1,8 +1,21 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Annotated, List, Optional
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, field_validator
+
+# Тег: слова из букв/цифр/_/- через одиночный пробел, хранится в нижнем регистре
+Tag = Annotated[
+    str,
+    StringConstraints(
+        strip_whitespace=True,
+        to_lower=True,
+        min_length=1,
+        max_length=50,
+        pattern=r"^[\w-]+( [\w-]+)*$",
+    ),
+]
+MAX_TAGS_PER_MEDIA = 20
 
 
 # Enums
@@ -24,6 +37,29 @@ class WatchStatus(str, Enum):
     WATCHED = "watched"
 
 
+class MediaSortField(str, Enum):
+    """Поле сортировки списка медиа"""
+
+    CREATED_AT = "created_at"
+    RATING = "rating"
+    YEAR = "year"
+    TITLE = "title"
+
+
+class SortOrder(str, Enum):
+    """Направление сортировки"""
+
+    ASC = "asc"
+    DESC = "desc"
+
+
+class TagMatch(str, Enum):
+    """Семантика фильтра по тегам"""
+
+    ALL = "all"  # Все теги (tags @> ...)
+    ANY = "any"  # Хотя бы один (tags && ...)
+
+
 class Media(BaseModel):
     """Доменная модель медиа контента"""
 
@@ -47,7 +83,18 @@ class MediaBase(BaseModel):
     description: Optional[str] = Field(None, max_length=1000, description="Описание")
 
 
-class MediaCreate(MediaBase):
+class MediaTags(BaseModel):
+    """Список тегов без повторов"""
+
+    tags: List[Tag] = Field(default_factory=list, max_length=MAX_TAGS_PER_MEDIA, description="Теги")
+
+    @field_validator("tags")
+    @classmethod
+    def unique_tags(cls, tags: List[str]) -> List[str]:
+        return list(dict.fromkeys(tags))
+
+
+class MediaCreate(MediaBase, MediaTags):
     """Схема создания медиа"""
 
     pass
@@ -73,6 +120,43 @@ class MediaResponse(MediaBase):
     user_id: int
     status: WatchStatus
     rating: Optional[int]
+    tags: List[str] = []
     created_at: str
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class DuplicateCandidate(BaseModel):
+    """Похожее медиа (возможный дубль)"""
+
+    id: int
+    title: str
+    kind: MediaKind
+    year: int
+    similarity: float = Field(..., ge=0, le=1, description="Триграммное сходство названий")
+
+
+class MediaCreateResponse(MediaResponse):
+    """Ответ на создание: медиа + предупреждение о похожих"""
+
+    possible_duplicates: List[DuplicateCandidate] = Field(
+        default_factory=list, description="Похожие медиа, созданные ранее"
+    )
+
+
+class TagCount(BaseModel):
+    """Число медиа с тегом"""
+
+    tag: str
+    count: int
+
+
+class MediaSyncResponse(BaseModel):
+    """Схема ответа delta sync"""
+
+    upserts: List[MediaResponse] = Field(..., description="Созданные/изменённые медиа")
+    deleted: List[int] = Field(..., description="ID удалённых медиа")
+    next_token: str = Field(..., description="Курсор для следующей синхронизации")
+    full_resync: bool = Field(
+        False, description="True: курсор устарел, upserts содержит весь каталог"
+    )
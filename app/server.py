@@ -0,0 +1,320 @@
+"""Multi-process server: pre-fork uvicorn workers on one listening socket
+
+Запуск (вместо `uvicorn --workers N`):
+    python -m app.server --workers 4 --port 8000
+
+Мастер-процесс один раз импортирует приложение (воркеры получают его через
+fork, copy-on-write), готовит схему БД и открывает сокет. Воркеры стартуют
+со сдвигом (warmup stagger), размер пула каждого - доля DB_CONNECTION_BUDGET.
+Воркеров по умолчанию - по числу CPU с учётом квоты cgroup, но не больше, чем
+бюджет соединений позволяет дать каждому хотя бы одно соединение пула.
+Состояние только в памяти процесса (/items, MEDIA_STORAGE=memory) воркеры не
+разделяют: тогда по умолчанию один воркер, а --workers > 1 - ошибка (кроме
+SERVER_ALLOW_PROCESS_LOCAL_STATE=true - бенчмарки и тесты самого сервера).
+SIGTERM/SIGINT: воркеры перестают принимать соединения, дорабатывают
+запросы (до drain timeout) и проходят shutdown lifespan; упавший воркер
+перезапускается.
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("app.server")
+
+# Только loopback по умолчанию; в контейнере SERVER_HOST=0.0.0.0 задают Dockerfile и compose.yaml
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# 0 - по числу доступных процессу CPU (и не больше, чем позволяет DB_CONNECTION_BUDGET)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))
+# Как в app.core.database: его нельзя импортировать до WEB_WORKERS (пул считается при импорте)
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+DB_RESERVED_CONNECTIONS = 2
+# Как в app.crud.items / app.crud.media (импорт app.crud тянет app.core.database)
+ITEMS_ENABLED = os.getenv("ITEMS_ENABLED", "true").lower() == "true"
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "sql").lower()
+# Только для нагрузки без записей: у каждого воркера своё состояние /items и memory storage
+SERVER_ALLOW_PROCESS_LOCAL_STATE = (
+    os.getenv("SERVER_ALLOW_PROCESS_LOCAL_STATE", "false").lower() == "true"
+)
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Воркер i начинает старт через i * stagger секунд: пул, JWKS и кэши греются не все разом
+SERVER_WARMUP_STAGGER_SECONDS = float(os.getenv("SERVER_WARMUP_STAGGER_SECONDS", "0.5"))
+# Сколько воркер дорабатывает начатые запросы после SIGTERM
+SERVER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("SERVER_DRAIN_TIMEOUT_SECONDS", "30"))
+# Сверх drain: shutdown lifespan (drain батчера, flush аудита и трейсов)
+SERVER_SHUTDOWN_GRACE_SECONDS = 10
+SERVER_BACKLOG = 2048
+# Воркер, упавший быстрее, перезапускается с паузой (не крутимся в цикле падений)
+MIN_WORKER_UPTIME_SECONDS = 5
+RESTART_DELAY_SECONDS = 1
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT) -> Optional[int]:
+    """CPU quota контейнера (cgroup v2 cpu.max или v1 cfs_quota_us), округлённая вверх"""
+    try:
+        quota, period = _read(os.path.join(root, "cpu.max")).split()[:2]
+    except (OSError, ValueError):
+        try:
+            quota = _read(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+            period = _read(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+
+def available_cpus() -> int:
+    """CPU, доступные процессу: affinity не видит квоту cgroup (docker --cpus)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+
+def default_workers(
+    cpus: Optional[int] = None,
+    budget: int = DB_CONNECTION_BUDGET,
+    reserved: int = DB_RESERVED_CONNECTIONS,
+) -> int:
+    """Workers when WEB_WORKERS/--workers is not set
+
+    По CPU, но не больше budget // (reserved + 1): каждому воркеру - служебные
+    соединения и хотя бы одно соединение пула. Явно заданное число воркеров не
+    урезается - слишком маленький бюджет для него - ошибка старта.
+    """
+    workers = cpus or available_cpus()
+    if budget > 0:
+        workers = min(workers, budget // (reserved + 1))
+    return max(workers, 1)
+
+
+def process_local_state(
+    items_enabled: bool = ITEMS_ENABLED, media_storage: str = MEDIA_STORAGE
+) -> List[str]:
+    """Хранилища, живущие только в процессе: после fork у каждого воркера своё"""
+    state: List[str] = []
+    if SERVER_ALLOW_PROCESS_LOCAL_STATE:
+        return state
+    if items_enabled:
+        # Без ITEMS_DATA_DIR - память, с ним - WAL с одним писателем
+        state.append("/items store (set ITEMS_ENABLED=false)")
+    if media_storage == "memory":
+        state.append("MEDIA_STORAGE=memory")
+    return state
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(SERVER_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Master process: fork, restart and drain of uvicorn workers"""
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        warmup_stagger: float = SERVER_WARMUP_STAGGER_SECONDS,
+        drain_timeout: float = SERVER_DRAIN_TIMEOUT_SECONDS,
+    ):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.warmup_stagger = warmup_stagger
+        self.drain_timeout = drain_timeout
+        # pid -> (номер воркера, время запуска)
+        self.children: Dict[int, tuple] = {}
+        self.stopping = False
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for index in range(self.workers):
+            self._spawn(index, delay=index * self.warmup_stagger)
+        logger.info("Started %d workers (pid %d)", self.workers, os.getpid())
+
+        while not self.stopping:
+            self._reap()
+            time.sleep(0.2)
+        return self._drain()
+
+    def _request_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def _spawn(self, index: int, delay: float) -> None:
+        from app.core.logs import configure_logging, stop_logging
+
+        # Поток QueueListener не переживает fork: останавливаем на время fork
+        stop_logging()
+        pid = os.fork()
+        if pid == 0:
+            self._worker(index, delay)  # Не возвращается
+        configure_logging()
+        self.children[pid] = (index, time.monotonic() + delay)
+
+    def _worker(self, index: int, delay: float) -> None:
+        import uvicorn
+
+        from app.core.logs import configure_logging, stop_logging
+
+        code = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.environ["WEB_WORKER_INDEX"] = str(index)
+            time.sleep(delay)
+            config = uvicorn.Config(
+                self.app,
+                lifespan="on",
+                log_config=None,  # Логи - через app.core.logs (JSON, очередь)
+                access_log=False,  # Access log пишет AccessLogMiddleware
+                timeout_graceful_shutdown=int(self.drain_timeout),
+            )
+            server = uvicorn.Server(config)
+            # uvicorn после остановки повторяет пойманный SIGTERM прежнему обработчику:
+            # SIG_DFL убил бы процесс до записи хвоста логов
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *_: setattr(server, "should_exit", True))
+            server.run(sockets=[self.sock])
+            code = 0 if server.started else 3  # 3 - как у uvicorn: сбой старта
+        except BaseException:
+            logger.exception("Worker %d failed", index)
+        finally:
+            # lifespan уже остановил listener: запустить, чтобы дописать хвост очереди
+            configure_logging()
+            stop_logging()
+            os._exit(code)
+
+    def _reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            uptime = time.monotonic() - started
+            logger.warning(
+                "Worker %d (pid %d) exited with status %d, restarting",
+                index,
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            delay = RESTART_DELAY_SECONDS if uptime < MIN_WORKER_UPTIME_SECONDS else 0
+            self._spawn(index, delay)
+
+    def _drain(self) -> int:
+        logger.info("Draining %d workers", len(self.children))
+        for pid in list(self.children):
+            _signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout + SERVER_SHUTDOWN_GRACE_SECONDS
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            logger.warning("Worker pid %d did not stop in time, killing", pid)
+            _signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.clear()
+        return 0
+
+
+def _signal(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+async def _prepare_database() -> None:
+    """Проверка схемы и demo data - один раз, в мастере; соединения не должны пережить fork"""
+    from app.core.database import dispose_engines
+    from app.main import prepare_database
+
+    try:
+        await prepare_database(os.getenv("ENV", "local").lower())
+    finally:
+        await dispose_engines()  # И пулы шардов
+
+
+def parse_args(argv: Optional[list] = None, local_state: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Pre-fork multi-process server")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS or None)
+    parser.add_argument("--warmup-stagger", type=float, default=SERVER_WARMUP_STAGGER_SECONDS)
+    parser.add_argument("--drain-timeout", type=float, default=SERVER_DRAIN_TIMEOUT_SECONDS)
+    args = parser.parse_args(argv)
+    if local_state is None:
+        local_state = process_local_state()
+    if local_state:
+        # Воркеры выдали бы одни и те же id, а GET на другом воркере - 404
+        if args.workers is not None and args.workers > 1:
+            parser.error(
+                f"{', '.join(local_state)}: state lives in one process, run with --workers 1"
+            )
+        args.workers = 1
+    elif args.workers is None:
+        args.workers = default_workers()
+    return args
+
+
+def main(argv: Optional[list] = None) -> int:
+    args = parse_args(argv)
+
+    # До импорта приложения: размер пула считается при импорте app.core.database
+    os.environ["WEB_WORKERS"] = str(args.workers)
+    from app.core.auth import require_key_source
+    from app.core.database import POOL_SIZE
+    from app.main import app
+
+    require_key_source()  # В мастере: иначе воркеры падали бы на старте по кругу
+
+    asyncio.run(_prepare_database())
+    os.environ["SERVER_DATABASE_PREPARED"] = "1"
+
+    sock = bind_socket(args.host, args.port)
+    logger.info(
+        "Serving on %s:%d with %d workers, pool_size=%d per worker",
+        args.host,
+        args.port,
+        args.workers,
+        POOL_SIZE,
+    )
+    try:
+        return Supervisor(app, sock, args.workers, args.warmup_stagger, args.drain_timeout).run()
+    finally:
+        sock.close()
+        from app.core.logs import stop_logging
+
+        stop_logging()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
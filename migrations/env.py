@@ -0,0 +1,97 @@
+"""Alembic environment: основная (catalog) БД и каждый шард из DB_SHARDS
+
+Все базы получают одну схему: миграции применяются к каждой по очереди.
+-x database=<catalog|имя шарда> - только одна база. Соединение из
+config.attributes["connection"] (тесты, скрипты) - только оно.
+"""
+
+import logging
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.core.migrations import MIGRATION_LOCK_TIMEOUT, include_object
+from app.models import Base
+
+CATALOG = "catalog"
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+config = context.config
+target_metadata = Base.metadata
+
+if config.cmd_opts is not None:
+    # Командная строка alembic: логи миграций; при вызове из кода - логирование приложения
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+
+def _configure(**kwargs) -> None:
+    context.configure(
+        target_metadata=target_metadata,
+        include_object=include_object,
+        compare_type=True,
+        # autocommit_block() (CREATE INDEX CONCURRENTLY) - вне транзакции миграции
+        transaction_per_migration=True,
+        **kwargs,
+    )
+
+
+def _run(connection) -> None:
+    # DDL не ждёт блокировку бесконечно: иначе за ним встают все запросы к таблице
+    connection.execute(text(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'"))
+    # alembic_version - в схеме соединения (DB_SCHEMA), с явным именем: без схемы
+    # Alembic найдёт по search_path версию другой схемы (public) и не создаст таблиц
+    schema = connection.execute(text("SELECT current_schema()")).scalar()
+    if schema is None:
+        raise SystemExit("no schema in search_path: create DB_SCHEMA first")
+    connection.commit()
+    _configure(connection=connection, version_table_schema=schema)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _databases() -> dict:
+    from app.core.database import SHARDS, connect_args, create_database_url
+
+    databases = {CATALOG: create_database_url("psycopg2")}
+    databases.update({spec.name: create_database_url("psycopg2", spec) for spec in SHARDS})
+    selected = context.get_x_argument(as_dictionary=True).get("database")
+    if selected is not None:
+        if selected not in databases:
+            raise SystemExit(f"unknown database {selected!r}: {', '.join(databases)}")
+        databases = {selected: databases[selected]}
+    return {name: (url, connect_args("psycopg2")) for name, url in databases.items()}
+
+
+def run_migrations_offline() -> None:
+    """SQL-скрипт (alembic upgrade head --sql) для основной БД"""
+    from app.core.database import DB_SCHEMA, create_database_url
+
+    _configure(
+        url=create_database_url("psycopg2"), literal_binds=True, version_table_schema=DB_SCHEMA
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    for name, (url, args) in _databases().items():
+        engine = create_engine(url, poolclass=NullPool, connect_args=args)
+        try:
+            with engine.connect() as connection:
+                logger.info("Migrating database %s", name)
+                _run(connection)
+        finally:
+            engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,318 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 23:57:07.919024
+
+Схема на момент перехода на миграции (раньше - create_all при старте). Базы,
+созданные create_all, принимаются, только если таблицы приводятся к этой схеме:
+недостающие колонки (title_norm, tags, updated_at, change_xid - create_all их к
+старой таблице не добавлял) добавляются на месте, title_norm заполняется батчами.
+Непартиционированную media миграция не переносит (долгое копирование) - ошибка
+SchemaMismatch с просьбой запустить scripts.partition_media и повторить upgrade.
+
+Индексы строятся CONCURRENTLY: на принятой живой таблице запись не блокируется.
+Индексы create_all, которых в схеме нет (одноколоночные и под сортировку GET
+/media, по updated_at/deleted_at вместо change_xid), с принятых таблиц удаляются.
+"""
+
+import os
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+from app.core.migrations import SchemaMismatch, create_index_concurrently, partitioned
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Число HASH-партиций media при создании таблицы (дальше - scripts.partition_media)
+MEDIA_PARTITIONS = int(os.getenv("MEDIA_PARTITIONS", "16"))
+TITLE_NORM_BATCH = 10_000
+# xid записавшей транзакции (курсор delta sync)
+CURRENT_XID = "(pg_current_xact_id()::text::bigint)"
+
+
+def _create_audit_log() -> None:
+    op.create_table(
+        "audit_log",
+        sa.Column("id", sa.BigInteger(), sa.Identity(always=False), nullable=False),
+        sa.Column("occurred_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("op", sa.String(length=16), nullable=False),
+        sa.Column("media_id", sa.Integer(), nullable=True),
+        sa.Column(
+            "changes", postgresql.JSONB(astext_type=sa.Text()), server_default="{}", nullable=False
+        ),
+        sa.Column("correlation_id", sa.String(length=64), nullable=True),
+        sa.PrimaryKeyConstraint("id", "occurred_at"),
+        postgresql_partition_by="RANGE (occurred_at)",
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION audit_log_append_only() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'audit_log is append-only';
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        "CREATE TRIGGER audit_log_append_only BEFORE UPDATE OR DELETE ON audit_log "
+        "FOR EACH ROW EXECUTE FUNCTION audit_log_append_only()"
+    )
+
+
+def _create_media() -> None:
+    op.create_table(
+        "media",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("title", sa.String(length=200), nullable=False),
+        sa.Column("title_norm", sa.String(length=200), server_default="", nullable=False),
+        sa.Column(
+            "kind",
+            sa.Enum("MOVIE", "SERIES", "COURSE", "BOOK", "PODCAST", name="mediakind"),
+            nullable=False,
+        ),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("description", sa.String(length=1000), nullable=True),
+        sa.Column("user_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column(
+            "status", sa.Enum("TO_WATCH", "WATCHING", "WATCHED", name="watchstatus"), nullable=False
+        ),
+        sa.Column("rating", sa.Integer(), nullable=True),
+        sa.Column(
+            "tags", postgresql.ARRAY(sa.String(length=50)), server_default="{}", nullable=False
+        ),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=True
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "change_xid", sa.BigInteger(), server_default=sa.text(CURRENT_XID), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("id", "user_id"),
+        postgresql_partition_by="HASH (user_id)",
+    )
+    for index in range(MEDIA_PARTITIONS):
+        op.execute(
+            f"CREATE TABLE media_p{index:02d} PARTITION OF media "
+            f"FOR VALUES WITH (MODULUS {MEDIA_PARTITIONS}, REMAINDER {index})"
+        )
+
+
+def _create_media_tombstones() -> None:
+    op.create_table(
+        "media_tombstones",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("media_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "deleted_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "change_xid", sa.BigInteger(), server_default=sa.text(CURRENT_XID), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def _create_shard_directory() -> None:
+    op.create_table(
+        "shard_directory",
+        sa.Column("user_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("shard", sa.String(length=64), nullable=False),
+        sa.Column("state", sa.String(length=16), server_default="active", nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+
+# media - последней: если она остановит миграцию, остальные таблицы уже созданы
+# (scripts.partition_media нужна media_tombstones)
+TABLES = {
+    "audit_log": _create_audit_log,
+    "media_tombstones": _create_media_tombstones,
+    "shard_directory": _create_shard_directory,
+    "media": _create_media,
+}
+
+# Колонки таблиц ревизии; партиционированные - audit_log и media
+COLUMNS = {
+    "audit_log": {"id", "occurred_at", "user_id", "op", "media_id", "changes", "correlation_id"},
+    "media": {
+        "id",
+        "title",
+        "title_norm",
+        "kind",
+        "year",
+        "description",
+        "user_id",
+        "status",
+        "rating",
+        "tags",
+        "created_at",
+        "updated_at",
+        "change_xid",
+    },
+    "media_tombstones": {"id", "media_id", "user_id", "deleted_at", "change_xid"},
+    "shard_directory": {"user_id", "shard", "state", "updated_at"},
+}
+PARTITIONED = ("audit_log", "media")
+
+# Колонки, появившиеся после первых create_all: ADD COLUMN с постоянным (не volatile)
+# значением по умолчанию не переписывает таблицу. change_xid старых строк - 0 (они
+# закоммичены до любого курсора), затем DEFAULT - xid транзакции
+ADDED_COLUMNS = {
+    "media": {
+        "title_norm": "VARCHAR(200) NOT NULL DEFAULT ''",
+        "tags": "VARCHAR(50)[] NOT NULL DEFAULT '{}'",
+        "updated_at": "TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+        "change_xid": "BIGINT NOT NULL DEFAULT 0",
+    },
+    "media_tombstones": {"change_xid": "BIGINT NOT NULL DEFAULT 0"},
+}
+
+# (имя, таблица, колонки, метод)
+INDEXES = [
+    ("ix_audit_log_user_occurred", "audit_log", "(user_id, occurred_at)", "btree"),
+    ("ix_media_tags", "media", "(tags)", "gin"),
+    ("ix_media_title_norm_trgm", "media", "(title_norm public.gin_trgm_ops)", "gin"),
+    ("ix_media_user_lower_title_year", "media", "(user_id, lower(title), year)", "btree"),
+    ("ix_media_user_rating", "media", "(user_id, rating)", "btree"),
+    ("ix_media_user_year", "media", "(user_id, year)", "btree"),
+    *[
+        (f"ix_media_user_{column}_{field}", "media", f"(user_id, {column}, {field})", "btree")
+        for column in ("kind", "status")
+        for field in ("year", "rating")
+    ],
+    ("ix_media_user_change_xid", "media", "(user_id, change_xid)", "btree"),
+    (
+        "ix_media_tombstones_user_change_xid",
+        "media_tombstones",
+        "(user_id, change_xid)",
+        "btree",
+    ),
+    ("ix_media_tombstones_deleted", "media_tombstones", "(deleted_at)", "btree"),
+]
+
+# Индексы create_all прежних моделей: их покрывают PK и составные индексы выше, а
+# сортировку GET /media планировщик делает в памяти (docs/adr/ADR-006)
+LEGACY_INDEXES = (
+    "ix_media_id",
+    "ix_media_kind",
+    "ix_media_title",
+    "ix_media_user_id",
+    "ix_media_user_title_year",
+    "ix_media_user_created",
+    *[
+        f"ix_media_user_{column}_{field}"
+        for column in ("kind", "status")
+        for field in ("created_at", "title")
+    ],
+    "ix_media_user_updated",
+    "ix_media_tombstones_user_deleted",
+)
+
+
+def _columns(name: str) -> set:
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(name)}
+
+
+def _backfill_title_norm() -> None:
+    """title_norm строк, созданных до колонки: батчами по id, каждый - своя транзакция
+
+    Повторный запуск (после прерванного) продолжает с незаполненных строк.
+    """
+    from app.core.similarity import normalize_title
+
+    conn = op.get_bind()
+    after = 0
+    with op.get_context().autocommit_block():
+        while True:
+            rows = conn.execute(
+                sa.text(
+                    "SELECT id, title FROM media WHERE id > :after AND title_norm = '' "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {"after": after, "limit": TITLE_NORM_BATCH},
+            ).all()
+            if not rows:
+                return
+            conn.execute(
+                sa.text("UPDATE media SET title_norm = :norm WHERE id = :id"),
+                [{"id": id_, "norm": normalize_title(title)} for id_, title in rows],
+            )
+            after = rows[-1][0]
+
+
+def _adopt(name: str) -> None:
+    """Таблица из create_all: привести к схеме ревизии или остановиться с объяснением
+
+    Всё сделанное до этого момента, добавленные колонки и title_norm фиксируются
+    сразу (autocommit): они нужны scripts.partition_media, если дальше миграция
+    остановится на партиционировании media.
+    """
+    missing = COLUMNS[name] - _columns(name)
+    added = ADDED_COLUMNS.get(name, {})
+    if missing & added.keys():
+        with op.get_context().autocommit_block():
+            for column in sorted(missing & added.keys()):
+                op.execute(f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS {column} {added[column]}")
+            if "change_xid" in missing:
+                op.execute(f"ALTER TABLE {name} ALTER COLUMN change_xid SET DEFAULT {CURRENT_XID}")
+    if name == "media":
+        _backfill_title_norm()
+    missing -= added.keys()
+    if missing:
+        raise SchemaMismatch(
+            f"table {name} has no columns {', '.join(sorted(missing))}: "
+            "it was not created by this application, migrate it by hand"
+        )
+    if name in PARTITIONED and not partitioned(op.get_bind(), name):
+        hint = "run `python -m scripts.partition_media`" if name == "media" else "recreate it"
+        raise SchemaMismatch(f"table {name} is not partitioned: {hint}, then upgrade again")
+
+
+def upgrade() -> None:
+    # pg_trgm - trusted extension (PG 13+), владельцу БД хватает прав
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public")
+    op.execute("CREATE SEQUENCE IF NOT EXISTS media_change_seq")
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    for name, create in TABLES.items():
+        if name in existing:
+            _adopt(name)
+        else:
+            create()
+    # Без блокировки записи в принятые таблицы; у новых пустых партиций - мгновенно
+    for name, table, columns, using in INDEXES:
+        create_index_concurrently(name, table, columns, using)
+    # Только у принятых таблиц; DROP INDEX на партиционированном родителе - без
+    # CONCURRENTLY (PostgreSQL не поддерживает), под lock_timeout миграций
+    for name in LEGACY_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def downgrade() -> None:
+    for name in reversed(list(TABLES)):
+        op.drop_table(name)
+    op.execute("DROP FUNCTION IF EXISTS audit_log_append_only()")
+    op.execute("DROP SEQUENCE IF EXISTS media_change_seq")
+    op.execute("DROP TYPE IF EXISTS watchstatus")
+    op.execute("DROP TYPE IF EXISTS mediakind")
@@ -0,0 +1,192 @@
+"""Benchmark: adding an index to a seeded media table, blocking vs CONCURRENTLY
+
+Отдельная БД (--database, создаётся и мигрируется alembic), в media - --rows
+строк (по умолчанию 10M; уже засеянная БД переиспользуется с --keep). Во время
+сборки индекса --writers соединений пишут в media, как приложение (INSERT +
+UPDATE); отчёт - время сборки, пропускная способность записи и задержки
+записей, пересёкшихся со сборкой.
+
+CREATE INDEX на партиционированном родителе держит SHARE lock на всех
+партициях: записи ждут всю сборку. build_index_concurrently (миграции) -
+дольше по времени, но записи не останавливаются.
+
+    ENV=ci DB_USER=... python -m scripts.bench_migrations --rows 10000000 --keep
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List, Tuple
+
+from alembic import command
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.migrations import alembic_config, build_index_concurrently
+
+INDEX = "ix_media_bench_year_rating"
+COLUMNS = "(year, rating)"
+SEED_CHUNK = 1_000_000
+
+SEED = text(
+    "INSERT INTO media (title, title_norm, kind, year, user_id, status, rating) "
+    "SELECT 'Title ' || i, 'title ' || i, "
+    "(ARRAY['MOVIE','SERIES','COURSE','BOOK','PODCAST'])[1 + i % 5]::mediakind, "
+    "1950 + i % 75, 1 + i % :users, "
+    "(ARRAY['TO_WATCH','WATCHING','WATCHED'])[1 + i % 3]::watchstatus, "
+    "CASE WHEN i % 4 = 0 THEN NULL ELSE i % 11 END "
+    "FROM generate_series(:start, :stop) i"
+)
+WRITE = text(
+    "INSERT INTO media (title, kind, year, user_id, status) "
+    "VALUES ('Bench', 'MOVIE', 2000, :user, 'TO_WATCH') RETURNING id"
+)
+UPDATE = text("UPDATE media SET rating = 5, updated_at = now() WHERE user_id = :user AND id = :id")
+
+
+def _urls(database: str) -> Tuple[str, str, str]:
+    from app.core.database import create_database_url
+    from app.core.sharding import ShardSpec
+
+    spec = ShardSpec("bench", database)
+    return (
+        create_database_url("psycopg2"),
+        create_database_url("psycopg2", spec),
+        create_database_url("asyncpg", spec),
+    )
+
+
+def prepare(database: str, rows: int, users: int, fresh: bool) -> float:
+    """БД, миграции, сид; возвращает время сида (0 - уже засеяна)"""
+    admin_url, url, _ = _urls(database)
+    admin = create_engine(admin_url, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_database WHERE datname = :d"), {"d": database}
+        ).scalar()
+        if exists and fresh:
+            conn.execute(text(f'DROP DATABASE "{database}" WITH (FORCE)'))
+        if not exists or fresh:
+            conn.execute(text(f'CREATE DATABASE "{database}"'))
+    admin.dispose()
+
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            started = time.monotonic()
+            command.upgrade(alembic_config(conn), "head")
+            print(f"alembic upgrade head: {time.monotonic() - started:.2f} s")
+        with engine.connect() as conn:
+            present = conn.execute(text("SELECT count(*) FROM media")).scalar_one()
+        if present >= rows:
+            print(f"reusing {present} rows")
+            return 0.0
+        started = time.monotonic()
+        for start in range(present + 1, rows + 1, SEED_CHUNK):
+            stop = min(start + SEED_CHUNK - 1, rows)
+            with engine.begin() as conn:
+                conn.execute(SEED, {"start": start, "stop": stop, "users": users})
+            print(f"seeded {stop} / {rows}", flush=True)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM ANALYZE media"))
+        return time.monotonic() - started
+    finally:
+        engine.dispose()
+
+
+async def _writer(engine: AsyncEngine, users: int, stop: asyncio.Event, samples: List) -> None:
+    while not stop.is_set():
+        user = random.randint(1, users)
+        started = time.monotonic()
+        async with engine.begin() as conn:
+            media_id = (await conn.execute(WRITE, {"user": user})).scalar_one()
+            await conn.execute(UPDATE, {"user": user, "id": media_id})
+        samples.append((started, time.monotonic() - started))
+
+
+def _build(url: str, mode: str) -> Tuple[float, float]:
+    engine = create_engine(url, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {INDEX}"))
+            started = time.monotonic()
+            if mode == "blocking":
+                conn.execute(text(f"CREATE INDEX {INDEX} ON media {COLUMNS}"))
+            else:
+                build_index_concurrently(conn, INDEX, "media", COLUMNS)
+            finished = time.monotonic()
+            conn.execute(text(f"DROP INDEX {INDEX}"))
+        return started, finished
+    finally:
+        engine.dispose()
+
+
+async def measure(database: str, mode: str, writers: int, users: int) -> dict:
+    _, url, async_url = _urls(database)
+    engine = create_async_engine(async_url, pool_size=writers, max_overflow=0)
+    stop = asyncio.Event()
+    samples: List[Tuple[float, float]] = []
+    tasks = [asyncio.create_task(_writer(engine, users, stop, samples)) for _ in range(writers)]
+    try:
+        await asyncio.sleep(1)  # Записи до сборки: базовая задержка
+        started, finished = await asyncio.to_thread(_build, url, mode)
+        await asyncio.sleep(1)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks)
+        await engine.dispose()
+
+    # Записи, пересёкшиеся со сборкой (blocking: начатые до неё тоже ждут её конца)
+    during = sorted(
+        latency * 1000
+        for begun, latency in samples
+        if begun <= finished and begun + latency >= started
+    )
+    completed = sum(1 for begun, latency in samples if started <= begun + latency <= finished)
+    return {
+        "mode": mode,
+        "build_s": finished - started,
+        "writes_per_s": completed / (finished - started),
+        "p50_ms": statistics.median(during),
+        "p99_ms": during[int(len(during) * 0.99)],
+        "max_ms": during[-1],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default="bench_migrations")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--fresh", action="store_true", help="recreate and reseed the database")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    args = parser.parse_args()
+
+    seeded = prepare(args.database, args.rows, args.users, args.fresh)
+    if seeded:
+        print(f"seed: {seeded:.1f} s")
+    try:
+        print(
+            f"{'mode':<11} {'build s':>8} {'writes/s':>9} {'p50 ms':>8} {'p99 ms':>9} {'max ms':>9}"
+        )
+        for mode in ("blocking", "concurrent"):
+            result = asyncio.run(measure(args.database, mode, args.writers, args.users))
+            print(
+                f"{result['mode']:<11} {result['build_s']:8.1f} {result['writes_per_s']:9.1f} "
+                f"{result['p50_ms']:8.1f} {result['p99_ms']:9.1f} {result['max_ms']:9.1f}"
+            )
+    finally:
+        if not args.keep:
+            admin_url, _, _ = _urls(args.database)
+            admin = create_engine(admin_url, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+            with admin.connect() as conn:
+                conn.execute(text(f'DROP DATABASE IF EXISTS "{args.database}" WITH (FORCE)'))
+            admin.dispose()
+
+
+if __name__ == "__main__":
+    main()
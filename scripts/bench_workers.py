@@ -0,0 +1,146 @@
+"""Benchmark: throughput of app.server with 1..N worker processes
+
+Сервер запускается в режиме MEDIA_STORAGE=memory (БД не нужна) со своим
+JWKS; нагрузка - только чтения, поэтому отдельное хранилище у каждого воркера
+допустимо (SERVER_ALLOW_PROCESS_LOCAL_STATE); нагрузку дают --clients процессов по --concurrency запросов каждый.
+Клиенты делят CPU с сервером: для честной картины clients + workers не
+должно превышать число ядер (или запускайте нагрузку с другой машины).
+
+    python -m scripts.bench_workers --workers 1 2 4 --clients 4 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ISSUER = "media-catalog-bench"
+AUDIENCE = "media-catalog"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _auth(tmpdir: str):
+    """JWKS для сервера и токен для клиентов"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key(), as_dict=True)
+    path = os.path.join(tmpdir, "jwks.json")
+    with open(path, "w") as f:
+        json.dump({"keys": [{**jwk, "kid": "bench", "alg": "RS256"}]}, f)
+    token = jwt.encode(
+        {"sub": "1", "iss": ISSUER, "aud": AUDIENCE, "exp": int(time.time()) + 3600},
+        key,
+        algorithm="RS256",
+        headers={"kid": "bench"},
+    )
+    return path, token
+
+
+async def _load(url: str, token: str, concurrency: int, duration: float) -> int:
+    done = 0
+    deadline = time.monotonic() + duration
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=10) as client:
+
+        async def one():
+            nonlocal done
+            while time.monotonic() < deadline:
+                response = await client.get(url)
+                if response.status_code == 200:
+                    done += 1
+
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+    return done
+
+
+def _client(url: str, token: str, concurrency: int, duration: float, results) -> None:
+    results.put(asyncio.run(_load(url, token, concurrency, duration)))
+
+
+def run_workers(workers: int, args, jwks: str, token: str) -> float:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "ENV": "test",
+        "MEDIA_STORAGE": "memory",
+        "SERVER_ALLOW_PROCESS_LOCAL_STATE": "true",
+        "AUTH_JWKS": jwks,
+        "AUTH_ISSUER": ISSUER,
+        "AUTH_AUDIENCE": AUDIENCE,
+        "LOG_LEVEL": "warning",
+        "LOOP_WATCHDOG_ENABLED": "false",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port)]
+        + ["--workers", str(workers), "--warmup-stagger", "0"],
+        env=env,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.2)
+        time.sleep(1)  # Все воркеры прошли startup
+
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=_client,
+                args=(f"{base_url}{args.path}", token, args.concurrency, args.duration, results),
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        total = sum(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+        return total / args.duration
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--path", default="/media?limit=20")
+    args = parser.parse_args()
+
+    print(f"CPUs available: {len(os.sched_getaffinity(0))}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jwks, token = _auth(tmpdir)
+        baseline = None
+        for workers in args.workers:
+            rate = run_workers(workers, args, jwks, token)
+            baseline = baseline or rate
+            print(f"{workers:>2} workers {rate:10.1f} req/s  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark: per-request commit vs group commit for create_media
+
+Запуск (нужна БД, как для тестов):
+    ENV=ci DB_USER=... python -m scripts.bench_write_batching --items 2000 --concurrency 100
+
+Схема - миграциями (alembic upgrade head), как в продакшене: индексы и партиции
+те же, что платит каждый INSERT.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from alembic import command
+from sqlalchemy import delete
+
+from app.core.database import POOL_SIZE, AsyncSessionLocal
+from app.core.migrations import alembic_config
+from app.crud.batching import WriteBatcher
+from app.crud.media import MediaCRUD
+from app.models.media import MediaModel
+from app.schemas.media import MediaCreate, MediaKind
+
+
+async def run_mode(crud: MediaCRUD, items: int, concurrency: int, user_id: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    # Как admission control приложения: без батчера соединение пула держит каждый
+    # запрос, лишние ждут в очереди, а не pool_timeout
+    connections = asyncio.Semaphore(POOL_SIZE if crud.write_batcher is None else concurrency)
+
+    async def one(i: int):
+        async with semaphore, connections:
+            async with AsyncSessionLocal() as db:
+                await crud.create_media(
+                    db,
+                    MediaCreate(title=f"Bench {i}", kind=MediaKind.MOVIE, year=2000),
+                    user_id,
+                )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(items)))
+    return items / (time.perf_counter() - started)
+
+
+async def main(items: int, concurrency: int, delay_ms: float, batch_size: int) -> None:
+    command.upgrade(alembic_config(), "head")
+    user_id = random.randint(10_000_000, 20_000_000)  # Изолированный пользователь бенчмарка
+
+    try:
+        modes = [
+            ("per-request commit", MediaCRUD(coalesce_reads=False)),
+            (
+                f"group commit ({delay_ms} ms / {batch_size})",
+                MediaCRUD(
+                    coalesce_reads=False,
+                    write_batcher=WriteBatcher(max_delay_ms=delay_ms, max_batch_size=batch_size),
+                ),
+            ),
+        ]
+        baseline = None
+        for name, crud in modes:
+            rate = await run_mode(crud, items, concurrency, user_id)
+            baseline = baseline or rate
+            print(f"{name:<32} {rate:10.1f} items/s  x{rate / baseline:.2f}")
+            if crud.write_batcher is not None:
+                batcher = crud.write_batcher
+                print(f"{'':<32} avg batch size {batcher.items / max(batcher.batches, 1):.1f}")
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(MediaModel).where(MediaModel.user_id == user_id))
+            await db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.concurrency, args.delay_ms, args.batch_size))
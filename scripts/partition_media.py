@@ -0,0 +1,327 @@
+"""Online migration of media to the HASH-partitioned layout (MediaModel)
+
+Переносит существующую таблицу media (обычную или с другим числом партиций)
+в media, партиционированную HASH (user_id), пока приложение работает:
+
+1. media_new: LIKE media (типы, NOT NULL, DEFAULT nextval(media_id_seq)) +
+   PARTITION BY HASH (user_id) и партиции media_new_pNN.
+2. Копирование батчами по id - короткие транзакции, блокировок на media нет.
+3. Индексы MediaModel.__table__ на родителе (PostgreSQL строит их в каждой
+   партиции) - после копирования, bulk load без поддержки индексов.
+4. Догон: строки с updated_at после начала копирования - upsert, tombstones -
+   delete; повторяется, пока дельта не станет меньше батча.
+5. Под ACCESS EXCLUSIVE (с lock_timeout и повторами): последний догон,
+   media -> media_old, media_new -> media, имена индексов и партиций,
+   последовательность id переходит к новой таблице.
+
+    ENV=ci DB_USER=... python -m scripts.partition_media [--partitions N] [--drop-old]
+
+media_old остаётся для отката (--drop-old удаляет её после переключения).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import Callable, Collection, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex
+
+from app.models.media import MEDIA_PARTITIONS, MediaModel, media_partition_ddl
+
+TABLE = "media"
+STAGING = "media_new"
+OLD = "media_old"
+DEFAULT_BATCH_SIZE = 10_000
+MAX_CATCH_UP_ROUNDS = 10
+SWAP_LOCK_TIMEOUT = "5s"
+SWAP_ATTEMPTS = 5
+# Догон идёт по updated_at (= now() начала транзакции): запас на транзакции,
+# которые закоммитились позже, чем получили updated_at
+CATCH_UP_WINDOW = timedelta(seconds=float(os.getenv("PARTITION_CATCH_UP_WINDOW_SECONDS", "2")))
+
+_KEY = ("id", "user_id")
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+async def layout(conn: AsyncConnection, table: str = TABLE) -> Tuple[Optional[str], int]:
+    """(relkind, число партиций): ('r', 0) - обычная таблица, ('p', N) - партиции"""
+    row = (
+        await conn.execute(
+            text(
+                "SELECT c.relkind::text, (SELECT count(*) FROM pg_inherits WHERE inhparent = c.oid) "
+                "FROM pg_class c WHERE c.oid = to_regclass(:table)"
+            ),
+            {"table": table},
+        )
+    ).first()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+async def table_columns(conn: AsyncConnection, table: str = TABLE) -> List[str]:
+    rows = await conn.execute(
+        text(
+            "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:table) "
+            "AND attnum > 0 AND NOT attisdropped ORDER BY attnum"
+        ),
+        {"table": table},
+    )
+    return [row[0] for row in rows]
+
+
+def staging_indexes(columns: Optional[Collection[str]] = None) -> List[Tuple[str, str]]:
+    """(итоговое имя, CREATE INDEX на media_new под временным именем) из MediaModel
+
+    columns - колонки переносимой таблицы: индексы колонок, которых в ней ещё нет
+    (таблица до поздних миграций), пропускаются - их построит миграция колонки.
+    """
+    indexes = []
+    for index in sorted(MediaModel.__table__.indexes, key=lambda i: i.name):
+        if columns is not None and any(c.name not in columns for c in index.columns):
+            continue
+        ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+        # Имена index=True колонок выводятся из имени таблицы: DDL модели, а не копия таблицы
+        head = f"CREATE INDEX {index.name} ON {TABLE} "
+        if not ddl.startswith(head):
+            raise MigrationError(f"unexpected DDL for {index.name}: {ddl}")
+        staged = f"CREATE INDEX {index.name}_new ON {STAGING} {ddl[len(head):]}"
+        indexes.append((index.name, staged))
+    return indexes
+
+
+async def create_staging(conn: AsyncConnection, partitions: int) -> None:
+    await conn.execute(
+        text(
+            f"CREATE TABLE {STAGING} (LIKE {TABLE} INCLUDING DEFAULTS) "
+            "PARTITION BY HASH (user_id)"
+        )
+    )
+    await conn.execute(
+        text(f"ALTER TABLE {STAGING} ADD CONSTRAINT {STAGING}_pkey PRIMARY KEY (id, user_id)")
+    )
+    for index in range(partitions):
+        await conn.execute(text(media_partition_ddl(index, partitions, STAGING)))
+
+
+async def copy_rows(
+    engine: AsyncEngine, batch_size: int, log: Callable[[str], None] = print
+) -> int:
+    """Батчи по id, каждый в своей транзакции; возвращает число скопированных строк"""
+    after, total = 0, 0
+    while True:
+        async with engine.begin() as conn:
+            last, count = (
+                await conn.execute(
+                    text(
+                        f"""
+                        WITH batch AS (
+                            SELECT * FROM {TABLE} WHERE id > :after ORDER BY id LIMIT :limit
+                        ), copied AS (
+                            INSERT INTO {STAGING} SELECT * FROM batch ON CONFLICT DO NOTHING
+                        )
+                        SELECT max(id), count(*) FROM batch
+                        """
+                    ),
+                    {"after": after, "limit": batch_size},
+                )
+            ).one()
+        if not count:
+            return total
+        after, total = last, total + count
+        log(f"copied {total} rows (id <= {after})")
+
+
+async def catch_up(conn: AsyncConnection, since, columns: Collection[str]) -> int:
+    """Изменения media после since: upsert изменённых строк, delete удалённых"""
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in _KEY)
+    upserted = await conn.execute(
+        text(
+            f"INSERT INTO {STAGING} SELECT * FROM {TABLE} WHERE updated_at >= :since "
+            f"ON CONFLICT (id, user_id) DO UPDATE SET {updates}"
+        ),
+        {"since": since},
+    )
+    deleted = await conn.execute(
+        text(
+            f"DELETE FROM {STAGING} AS s USING media_tombstones AS t "
+            "WHERE t.deleted_at >= :since AND s.id = t.media_id AND s.user_id = t.user_id"
+        ),
+        {"since": since},
+    )
+    return upserted.rowcount + deleted.rowcount
+
+
+async def _now(conn: AsyncConnection):
+    return (await conn.execute(text("SELECT now()"))).scalar_one()
+
+
+async def _index_names(conn: AsyncConnection, table: str) -> List[str]:
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = to_regclass(:t)"
+        ),
+        {"t": table},
+    )
+    return [row[0] for row in rows]
+
+
+async def _partition_names(conn: AsyncConnection, table: str) -> List[str]:
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:t) ORDER BY 1"
+        ),
+        {"t": table},
+    )
+    return [row[0] for row in rows]
+
+
+async def _rename_partition(conn: AsyncConnection, name: str, prefix: str, new_prefix: str):
+    """media_new_p03 -> media_p03 вместе с индексами (media_new_p03_*_idx -> media_p03_*)"""
+    for index in await _index_names(conn, name):
+        if index.startswith(prefix):
+            renamed = f"{new_prefix}{index[len(prefix):]}"
+            await conn.execute(text(f"ALTER INDEX {index} RENAME TO {renamed}"))
+    await conn.execute(text(f"ALTER TABLE {name} RENAME TO {new_prefix}{name[len(prefix):]}"))
+
+
+async def swap(
+    conn: AsyncConnection, since, indexes: List[Tuple[str, str]], columns: Collection[str]
+) -> int:
+    """Одна транзакция под ACCESS EXCLUSIVE: записи в media ждут только её"""
+    await conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+    # Сначала tombstones: DELETE в приложении пишет tombstone раньше, чем удаляет строку
+    await conn.execute(text("LOCK TABLE media_tombstones IN EXCLUSIVE MODE"))
+    await conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+    changed = await catch_up(conn, since, columns)
+
+    sequence = (
+        await conn.execute(text(f"SELECT pg_get_serial_sequence('{TABLE}', 'id')"))
+    ).scalar_one()
+    old_partitions = await _partition_names(conn, TABLE)
+    old_indexes = await _index_names(conn, TABLE)
+
+    await conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {OLD}"))
+    for name in old_indexes:
+        await conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_old"))
+    for name in old_partitions:
+        await _rename_partition(conn, name, TABLE, OLD)
+
+    await conn.execute(text(f"ALTER TABLE {STAGING} RENAME TO {TABLE}"))
+    await conn.execute(text(f"ALTER INDEX {STAGING}_pkey RENAME TO {TABLE}_pkey"))
+    for name, _ in indexes:
+        await conn.execute(text(f"ALTER INDEX {name}_new RENAME TO {name}"))
+    for name in await _partition_names(conn, TABLE):
+        await _rename_partition(conn, name, STAGING, TABLE)
+    if sequence:
+        # Иначе DROP TABLE media_old удалит последовательность вместе со старой колонкой
+        await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+    return changed
+
+
+async def migrate(
+    engine: AsyncEngine,
+    partitions: int = MEDIA_PARTITIONS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    drop_old: bool = False,
+    log: Callable[[str], None] = print,
+) -> bool:
+    """False - media уже в нужной раскладке, переносить нечего"""
+    if partitions < 1:
+        raise MigrationError("partitions must be >= 1")
+    async with engine.begin() as conn:
+        kind, current = await layout(conn)
+        if kind is None:
+            raise MigrationError(f"table {TABLE} does not exist")
+        if kind == "p" and current == partitions:
+            log(f"{TABLE} already has {partitions} hash partitions")
+            return False
+        for leftover in (STAGING, OLD):
+            if (await layout(conn, leftover))[0] is not None:
+                raise MigrationError(f"{leftover} exists (previous run?): drop it and restart")
+        # Всё, что изменится после этой отметки, заберёт догон
+        since = await _now(conn) - CATCH_UP_WINDOW
+        columns = await table_columns(conn)
+        await create_staging(conn, partitions)
+    log(f"created {STAGING} with {partitions} partitions")
+
+    await copy_rows(engine, batch_size, log)
+
+    indexes = staging_indexes(columns)
+    async with engine.begin() as conn:
+        for name, ddl in indexes:
+            await conn.execute(text(ddl))
+        log(f"built {len(indexes)} indexes on every partition")
+        await conn.execute(text(f"ANALYZE {STAGING}"))
+
+    for _ in range(MAX_CATCH_UP_ROUNDS):
+        async with engine.begin() as conn:
+            mark = await _now(conn) - CATCH_UP_WINDOW
+            changed = await catch_up(conn, since, columns)
+        since = mark
+        log(f"caught up {changed} changed rows")
+        if changed < batch_size:
+            break
+
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            async with engine.begin() as conn:
+                changed = await swap(conn, since, indexes, columns)
+            break
+        except DBAPIError as e:
+            retryable = "lock timeout" in str(e) or "deadlock detected" in str(e)
+            if not retryable or attempt == SWAP_ATTEMPTS:
+                raise
+            log(f"swap attempt {attempt} could not take the lock, retrying")
+            await asyncio.sleep(attempt)
+    log(f"swapped {STAGING} -> {TABLE} ({changed} rows caught up under lock)")
+
+    if drop_old:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE {OLD}"))
+        log(f"dropped {OLD}")
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from app.core.database import connect_args, create_database_url
+
+    parser = argparse.ArgumentParser(description="Migrate media to hash partitions on user_id")
+    parser.add_argument("--partitions", type=int, default=MEDIA_PARTITIONS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--drop-old", action="store_true", help="DROP media_old after the swap")
+    args = parser.parse_args(argv)
+
+    engine = create_async_engine(
+        create_database_url("asyncpg"), poolclass=NullPool, connect_args=connect_args("asyncpg")
+    )
+
+    async def run():
+        try:
+            return await migrate(engine, args.partitions, args.batch_size, args.drop_old)
+        finally:
+            await engine.dispose()
+
+    started = time.monotonic()
+    try:
+        asyncio.run(run())
+    except MigrationError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(f"done in {time.monotonic() - started:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,491 @@
+"""Query-plan audit: every query MediaCRUD emits must be index-backed
+
+Скрипт засевает реалистичный объём данных, прогоняет все методы MediaCRUD,
+перехватывает реальные SQL-запросы (before_cursor_execute) и для каждого делает
+EXPLAIN (FORMAT JSON) с настройками планировщика по умолчанию. В отчёте: Seq Scan,
+Sort, оценка стоимости, используемые и неиспользуемые индексы, число прочитанных
+партиций media (запрос с user_id обязан читать одну - partition pruning). Партиции
+и их индексы в отчёте - под именами родителя. Код возврата 1, если запрос деградировал
+или индекс ни разу не использован (каждый индекс - лишняя запись на INSERT). Админские
+запросы по всему шарду (FULL_SCAN_PATTERNS) читают все партиции - это не регрессия.
+Перед прогоном - VACUUM ANALYZE: планы как у живой базы после autovacuum.
+
+Sort - регрессия, только если сортируется больше --max-sort-rows строк (оценка
+планировщика). GET /media без пагинации возвращает все записи пользователя: bitmap
+по (user_id, ...) и сортировка нескольких сотен строк в памяти дешевле, чем проход
+по индексу в порядке сортировки со случайным чтением heap - так и выбирает
+планировщик. Большой Sort - признак запроса, который читает не одного пользователя.
+Схема - только миграциями (alembic upgrade head); аудит её не создаёт.
+
+CLI (нужна одноразовая БД, как для тестов):
+    ENV=ci DB_USER=... python -m scripts.query_audit [--baseline FILE] [--write-baseline]
+
+Pytest plugin:
+    python -m pytest -p scripts.query_audit --query-audit
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import re
+import sys
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.migrations import check_schema
+from app.crud.media import MediaCRUD
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    TagMatch,
+    WatchStatus,
+)
+
+AUDITED_TABLES = ("media", "media_tombstones")
+AUDIT_USER_BASE = 900_000_000  # Пользователи аудита не пересекаются с реальными
+DEFAULT_USERS = 200
+DEFAULT_ITEMS_PER_USER = 500
+_TABLE_REF = re.compile(r"\b(?:FROM|UPDATE|JOIN)\s+(?:media|media_tombstones)\b", re.IGNORECASE)
+COST_TOLERANCE = 1.5  # Рост оценки стоимости > 50% относительно baseline = регрессия
+# Sort до стольких строк (оценка планировщика) - в памяти и дёшев, не регрессия
+MAX_SORT_ROWS = 10_000
+# Запросы, которым нужен проход по всей таблице (Seq Scan и все партиции - ожидаемо):
+# точные счётчики админской статистики шарда
+FULL_SCAN_PATTERNS = {"get_stats"}
+# Названия засеянных записей: два слова из списка (пара уникальна для i < 900) и номер -
+# разнообразные, как настоящие, чтобы триграммный поиск был избирательным
+SEED_WORDS = (
+    "night river empire signal garden winter harbor echo crown shadow ember orbit canyon "
+    "meadow falcon summit lantern harvest tide comet forest mirror thunder velvet anchor "
+    "prism marble willow cipher atlas"
+).split()
+
+_pattern: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "query_audit_pattern", default=None
+)
+
+
+def seeded_title(i: int) -> str:
+    """Название i-й засеянной записи (как в seed)"""
+    words = len(SEED_WORDS)
+    return f"{SEED_WORDS[i % words].title()} {SEED_WORDS[i // words % words].title()} {i}"
+
+
+def workload(user_id: int, media_id: int):
+    """(pattern name, coroutine factory) for every MediaCRUD query shape"""
+
+    async def delta_sync(c, db):
+        # Курсор - от предыдущего sync: delta читает только свежие изменения
+        full = await c.get_changes_since(db, user_id, None)
+        return await c.get_changes_since(db, user_id, full.cursor)
+
+    calls = [
+        ("get_media_by_id", lambda c, db: c.get_media_by_id(db, media_id, user_id)),
+        (
+            "check_media_exists",
+            lambda c, db: c.check_media_exists(
+                db, seeded_title(7), 1957, MediaKind.COURSE, user_id
+            ),
+        ),
+        ("get_changes_since(full)", lambda c, db: c.get_changes_since(db, user_id, None)),
+        ("get_changes_since(delta)", delta_sync),
+    ]
+    calls += [
+        ("get_tag_counts", lambda c, db: c.get_tag_counts(db, user_id)),
+        (
+            "find_near_duplicates",
+            lambda c, db: c.find_near_duplicates(
+                db, seeded_title(7).rsplit(" ", 1)[0], MediaKind.COURSE, user_id
+            ),
+        ),
+        # Админские запросы - по всему шарду, не по пользователю
+        ("get_stats", lambda c, db: c.storage.stats(db)),
+        ("purge_tombstones", lambda c, db: c.purge_tombstones(db)),
+    ]
+    for sort in MediaSortField:
+        for order in SortOrder:
+            for label, filters in (
+                ("", {}),
+                (",kind", {"kind": MediaKind.MOVIE}),
+                (",status", {"status": WatchStatus.WATCHED}),
+                (",years", {"year_min": 1990, "year_max": 2000}),
+                (",rating", {"rating_min": 7}),
+                (",kind,years", {"kind": MediaKind.MOVIE, "year_min": 1990, "year_max": 2000}),
+                (",kind,rating", {"kind": MediaKind.MOVIE, "rating_min": 7}),
+                (
+                    ",status,years",
+                    {"status": WatchStatus.WATCHED, "year_min": 1990, "year_max": 2000},
+                ),
+                (",status,rating", {"status": WatchStatus.WATCHED, "rating_min": 7}),
+                (",tags all", {"tags": ["tag3", "genre3"], "tags_match": TagMatch.ALL}),
+                (",tags any", {"tags": ["tag3", "tag5"], "tags_match": TagMatch.ANY}),
+            ):
+                calls.append(
+                    (
+                        f"get_media_list({sort.value} {order.value}{label})",
+                        lambda c, db, s=sort, o=order, f=filters: c.get_media_list(
+                            db, user_id, sort=s, order=o, **f
+                        ),
+                    )
+                )
+    calls += [
+        (
+            "update_media",
+            lambda c, db: c.update_media(
+                db,
+                media_id,
+                MediaUpdate(title="Audited", kind=MediaKind.MOVIE, year=2000),
+                user_id,
+            ),
+        ),
+        (
+            "update_media_status",
+            lambda c, db: c.update_media_status(
+                db, media_id, MediaStatusUpdate(status=WatchStatus.WATCHED, rating=8), user_id
+            ),
+        ),
+        (
+            "create_media",
+            lambda c, db: c.create_media(
+                db, MediaCreate(title="Audit new", kind=MediaKind.BOOK, year=2020), user_id
+            ),
+        ),
+        ("set_media_tags", lambda c, db: c.set_media_tags(db, media_id, ["audit"], user_id)),
+        ("remove_media_tag", lambda c, db: c.remove_media_tag(db, media_id, "audit", user_id)),
+        ("delete_media", lambda c, db: c.delete_media(db, media_id, user_id)),
+    ]
+    return calls
+
+
+async def seed(conn, users: int, items_per_user: int) -> None:
+    """Bulk seed with generate_series (быстро даже для миллионов строк)"""
+    await conn.execute(
+        text(
+            """
+            INSERT INTO media (title, title_norm, kind, year, description, user_id, status,
+                               rating, tags, created_at, updated_at)
+            SELECT initcap(w.title), w.title,
+                   (ARRAY['MOVIE','SERIES','COURSE','BOOK','PODCAST'])[1 + i % 5]::mediakind,
+                   1950 + i % 75,
+                   'Seeded by query audit',
+                   :base + u,
+                   (ARRAY['TO_WATCH','WATCHING','WATCHED'])[1 + (i / 7) % 3]::watchstatus,
+                   CASE WHEN i % 3 = 0 THEN NULL ELSE 1 + i % 10 END,
+                   ARRAY['tag' || i % 40, 'genre' || i % 7],
+                   now() - (i || ' minutes')::interval,
+                   now() - (i || ' minutes')::interval
+            FROM generate_series(1, :users) AS u, generate_series(1, :items) AS i,
+                 (SELECT CAST(:words AS text[]) AS words, CAST(:n AS integer) AS n) AS seed,
+                 LATERAL (
+                     SELECT words[1 + i % n] || ' ' || words[1 + i / n % n] || ' ' || i AS title
+                 ) AS w
+            """
+        ),
+        {
+            "base": AUDIT_USER_BASE,
+            "users": users,
+            "items": items_per_user,
+            "words": list(SEED_WORDS),
+            "n": len(SEED_WORDS),
+        },
+    )
+    await conn.execute(
+        text(
+            """
+            INSERT INTO media_tombstones (media_id, user_id, deleted_at)
+            SELECT i, :base + u, now() - (i || ' minutes')::interval
+            FROM generate_series(1, :users) AS u, generate_series(1, 20) AS i
+            """
+        ),
+        {"base": AUDIT_USER_BASE, "users": users},
+    )
+
+
+async def vacuum(engine) -> None:
+    """VACUUM ANALYZE засеянных таблиц, как после autovacuum на живой базе
+
+    Статистика, карта видимости и пустой pending list GIN индексов: сразу после
+    массовой вставки скан GIN дороже, и планировщик его не выбирает.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table in AUDITED_TABLES:
+            await conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+async def cleanup(conn) -> None:
+    for table in AUDITED_TABLES:
+        await conn.execute(
+            text(f"DELETE FROM {table} WHERE user_id >= :base"), {"base": AUDIT_USER_BASE}
+        )
+
+
+def _walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def _large_sort(node: dict, max_sort_rows: int) -> bool:
+    if node["Node Type"] not in ("Sort", "Incremental Sort"):
+        return False
+    return node.get("Plan Rows", float("inf")) > max_sort_rows
+
+
+def summarize_plan(
+    plan: dict, parents: Optional[Dict[str, str]] = None, max_sort_rows: int = MAX_SORT_ROWS
+) -> dict:
+    """parents: партиция/индекс партиции -> таблица/индекс родителя (partition_parents)
+
+    sorts - число Sort узлов больше max_sort_rows строк (без оценки - всегда).
+    """
+    parents = parents or {}
+    nodes = list(_walk(plan))
+    relations = {n["Relation Name"] for n in nodes if "Relation Name" in n}
+    return {
+        "cost": plan["Total Cost"],
+        "seq_scans": sorted(
+            {
+                parents.get(n["Relation Name"], n["Relation Name"])
+                for n in nodes
+                if n["Node Type"] == "Seq Scan"
+            }
+        ),
+        "sorts": sum(1 for n in nodes if _large_sort(n, max_sort_rows)),
+        "indexes": sorted(
+            {parents.get(n["Index Name"], n["Index Name"]) for n in nodes if "Index Name" in n}
+        ),
+        "partitions": len(relations & parents.keys()),
+    }
+
+
+async def partition_parents(conn) -> Dict[str, str]:
+    """Partition (and partition index) name -> top-level parent name, по pg_inherits"""
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname, p.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE pg_table_is_visible(p.oid)"
+        )
+    )
+    direct = dict(rows.all())
+    parents = {}
+    for name, parent in direct.items():
+        while parent in direct:  # Партиция партиции
+            parent = direct[parent]
+        parents[name] = parent
+    return parents
+
+
+async def run_audit(
+    database_url: str,
+    users: int = DEFAULT_USERS,
+    items_per_user: int = DEFAULT_ITEMS_PER_USER,
+    max_sort_rows: int = MAX_SORT_ROWS,
+) -> dict:
+    from app.core.database import connect_args
+
+    engine = create_async_engine(
+        database_url, poolclass=NullPool, connect_args=connect_args("asyncpg")
+    )
+    captured: Dict[str, List[tuple]] = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        name = _pattern.get()
+        sql = statement.lstrip().upper()
+        if name is None or executemany or not sql.startswith(("SELECT", "UPDATE", "DELETE")):
+            return
+        if not _TABLE_REF.search(statement):
+            return  # SELECT now(), pg_notify(...)
+        captured.setdefault(name, []).append((statement, parameters))
+
+    try:
+        await check_schema({"audit": engine})
+        async with engine.begin() as conn:
+            await cleanup(conn)
+            await seed(conn, users, items_per_user)
+            user_id = AUDIT_USER_BASE + 1
+            media_id = (
+                await conn.execute(
+                    text("SELECT min(id) FROM media WHERE user_id = :u"), {"u": user_id}
+                )
+            ).scalar_one()
+        await vacuum(engine)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        crud = MediaCRUD(coalesce_reads=False)
+        for name, call in workload(user_id, media_id):
+            token = _pattern.set(name)
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as db:
+                    await call(crud, db)
+            finally:
+                _pattern.reset(token)
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+        report: Dict[str, list] = {}
+        async with engine.connect() as conn:
+            parents = await partition_parents(conn)
+            for name, statements in captured.items():
+                for statement, parameters in statements:
+                    raw = await conn.exec_driver_sql(
+                        f"EXPLAIN (FORMAT JSON) {statement}", parameters
+                    )
+                    plan = raw.scalar()
+                    plan = (plan if isinstance(plan, list) else json.loads(plan))[0]["Plan"]
+                    summary = summarize_plan(plan, parents, max_sort_rows)
+                    summary["sql"] = " ".join(statement.split())
+                    report.setdefault(name, []).append(summary)
+
+            rows = await conn.execute(
+                text(
+                    "SELECT indexname FROM pg_indexes "
+                    "WHERE schemaname = current_schema() AND tablename = ANY(:tables)"
+                ),
+                {"tables": list(AUDITED_TABLES)},
+            )
+            all_indexes = {row[0] for row in rows}
+
+        async with engine.begin() as conn:
+            await cleanup(conn)
+    finally:
+        await engine.dispose()
+
+    used = {index for entries in report.values() for e in entries for index in e["indexes"]}
+    return {
+        "patterns": report,
+        "unused_indexes": sorted(all_indexes - used - {"media_pkey", "media_tombstones_pkey"}),
+    }
+
+
+def find_regressions(result: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Проблемы отчёта; неиспользуемый индекс - тоже проблема (лишняя запись на INSERT)"""
+    problems = []
+    for name, entries in result["patterns"].items():
+        full_scan = name in FULL_SCAN_PATTERNS
+        for i, entry in enumerate(entries):
+            if entry["seq_scans"] and not full_scan:
+                problems.append(f"{name}: Seq Scan on {', '.join(entry['seq_scans'])}")
+            if entry["sorts"]:
+                problems.append(f"{name}: in-memory Sort")  # Больше MAX_SORT_ROWS строк
+            if entry.get("partitions", 0) > 1 and not full_scan:
+                problems.append(
+                    f"{name}: no partition pruning ({entry['partitions']} partitions scanned)"
+                )
+            if baseline:
+                previous = baseline.get(name, [])
+                if i < len(previous) and entry["cost"] > previous[i] * COST_TOLERANCE:
+                    problems.append(
+                        f"{name}: estimated cost {entry['cost']:.1f} (baseline {previous[i]:.1f})"
+                    )
+    problems.extend(f"unused index {index}" for index in result.get("unused_indexes", ()))
+    return problems
+
+
+def format_report(result: dict, problems: List[str]) -> str:
+    lines = ["Query plan audit", "=" * 16]
+    for name, entries in sorted(result["patterns"].items()):
+        full_scan = name in FULL_SCAN_PATTERNS
+        for entry in entries:
+            flags = []
+            if entry["seq_scans"] and not full_scan:
+                flags.append("SEQ SCAN")
+            if entry["sorts"]:
+                flags.append("SORT")
+            if entry.get("partitions", 0) > 1 and not full_scan:
+                flags.append("NO PRUNING")
+            status = "FAIL" if flags else "full" if full_scan else "ok  "
+            lines.append(
+                f"{status} {name:<44} cost={entry['cost']:>9.1f} "
+                f"idx={','.join(entry['indexes']) or '-'} {' '.join(flags)}"
+            )
+    lines.append("")
+    lines.append("Unused indexes: " + (", ".join(result["unused_indexes"]) or "none"))
+    if problems:
+        lines.append("")
+        lines.append("Regressions:")
+        lines.extend(f"  - {problem}" for problem in problems)
+    return "\n".join(lines)
+
+
+def baseline_costs(result: dict) -> dict:
+    return {
+        name: [entry["cost"] for entry in entries] for name, entries in result["patterns"].items()
+    }
+
+
+def _database_url() -> str:
+    from app.core.database import create_database_url
+
+    return create_database_url("asyncpg")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Audit MediaCRUD query plans")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--items-per-user", type=int, default=DEFAULT_ITEMS_PER_USER)
+    parser.add_argument("--max-sort-rows", type=int, default=MAX_SORT_ROWS)
+    parser.add_argument("--baseline", help="JSON file with baseline costs")
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON report")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(
+        run_audit(_database_url(), args.users, args.items_per_user, args.max_sort_rows)
+    )
+
+    baseline = None
+    if args.baseline and not args.write_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = find_regressions(result, baseline)
+
+    if args.baseline and args.write_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(baseline_costs(result), f, indent=2, sort_keys=True)
+
+    print(json.dumps(result, indent=2) if args.json else format_report(result, problems))
+    return 1 if problems else 0
+
+
+# Pytest plugin
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("query-audit")
+    group.addoption(
+        "--query-audit", action="store_true", help="Fail the run if a CRUD query plan regresses"
+    )
+    group.addoption("--query-audit-baseline", default=None, help="Baseline costs JSON")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    if not config.getoption("--query-audit"):
+        return
+
+    result = asyncio.run(run_audit(_database_url()))
+    baseline = None
+    path = config.getoption("--query-audit-baseline")
+    if path:
+        with open(path) as f:
+            baseline = json.load(f)
+    problems = find_regressions(result, baseline)
+
+    reporter = config.pluginmanager.get_plugin("terminalreporter")
+    if reporter is not None:
+        reporter.write_line(format_report(result, problems))
+    if problems:
+        session.exitstatus = 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Move users between shard databases (DB_SHARDS) without downtime
+
+Перенос одного пользователя (move):
+
+1. shard_directory: (user, исходный шард, frozen) - запросы пользователя
+   получают 503 user_moving с Retry-After.
+2. Пауза SHARD_DIRECTORY_TTL_SECONDS + grace: кэш directory всех воркеров
+   увидел freeze, начатые до него запросы завершились. TTL - приложения
+   (--directory-ttl), не router скрипта: тот читает directory без кэша.
+3. Одна транзакция на целевом шарде: строки media (с теми же id) и
+   tombstones пользователя; media_id_seq и media_change_seq целевого шарда
+   подтягиваются не ниже исходных - новые id не совпадут с перенесёнными,
+   версии change feed не пойдут назад. Если id уже заняты на целевом шарде
+   записями других пользователей (последовательности шардов независимы),
+   перенос останавливается с ошибкой до копирования. Токен delta sync привязан
+   к шарду: после переноса клиент получит full resync.
+4. directory: (user, целевой шард, active); в режиме hash запись удаляется,
+   если целевой шард - владелец пользователя в ring.
+5. Строки пользователя удаляются на исходном шарде.
+
+Прерванный перенос безопасно повторить: пользователь остаётся frozen на
+исходном шарде, а шаг 3 сначала удаляет его строки на целевом.
+
+Добавление шарда (SHARD_ROUTING=hash):
+
+    # DB_SHARDS уже с новым шардом, приложение - ещё со старым списком
+    DB_SHARDS=... python -m scripts.rebalance_shards pin
+    # выкатить приложение с новым DB_SHARDS: закреплённые пользователи на месте
+    DB_SHARDS=... python -m scripts.rebalance_shards rebalance
+    DB_SHARDS=... python -m scripts.rebalance_shards move --user 42 --to s1
+
+media_id_seq нового шарда до выкатки сдвигается за id остальных шардов
+(setval с запасом): иначе id новых записей совпадут с id переносимых
+пользователей, и move остановится с ошибкой.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.sharding import (
+    SHARD_DIRECTORY_TTL_SECONDS,
+    SHARD_ROUTING,
+    STATE_ACTIVE,
+    STATE_FROZEN,
+    ShardRouter,
+    ShardSpec,
+)
+from app.models.media import MediaModel, MediaTombstoneModel
+from app.models.shard_directory import ShardDirectoryModel
+
+# Запас на запросы, которые выбрали шард до freeze и ещё пишут в него
+DEFAULT_GRACE_SECONDS = 2.0
+
+MEDIA = MediaModel.__table__
+TOMBSTONES = MediaTombstoneModel.__table__
+DIRECTORY = ShardDirectoryModel.__table__
+
+
+class RebalanceError(Exception):
+    pass
+
+
+def build_router(specs: List[ShardSpec], routing: str = SHARD_ROUTING) -> ShardRouter:
+    """Router на движках без пула (скрипт): catalog - основная БД"""
+    from app.core.database import connect_args, create_database_url
+
+    def engine(spec: Optional[ShardSpec] = None) -> AsyncEngine:
+        return create_async_engine(
+            create_database_url("asyncpg", spec),
+            poolclass=NullPool,
+            connect_args=connect_args("asyncpg"),
+        )
+
+    if not specs:
+        raise RebalanceError("DB_SHARDS is empty: nothing to rebalance")
+    return ShardRouter({spec.name: engine(spec) for spec in specs}, engine(), routing, ttl=0)
+
+
+async def _set_directory(router: ShardRouter, user_id: int, shard: str, state: str) -> None:
+    async with router.catalog.begin() as conn:
+        await conn.execute(
+            insert(DIRECTORY)
+            .values(user_id=user_id, shard=shard, state=state)
+            .on_conflict_do_update(
+                index_elements=[DIRECTORY.c.user_id],
+                set_={"shard": shard, "state": state, "updated_at": func.now()},
+            )
+        )
+    router.forget(user_id)
+
+
+async def _sequence_value(conn, sequence: str) -> int:
+    return (await conn.execute(text(f"SELECT last_value FROM {sequence}"))).scalar_one()
+
+
+async def copy_user(source: AsyncEngine, target: AsyncEngine, user_id: int) -> int:
+    """Строки пользователя source -> target (одна транзакция на target)
+
+    RebalanceError, если id строк пользователя на target уже заняты.
+    """
+    async with source.connect() as conn:
+        # change_xid - xid транзакции источника; на target его заново ставит DEFAULT
+        columns = [column for column in MEDIA.c if column.name != "change_xid"]
+        media = [
+            dict(row._mapping)
+            for row in await conn.execute(select(*columns).where(MEDIA.c.user_id == user_id))
+        ]
+        tombstones = [
+            dict(row._mapping)
+            for row in await conn.execute(
+                select(TOMBSTONES.c.media_id, TOMBSTONES.c.user_id, TOMBSTONES.c.deleted_at).where(
+                    TOMBSTONES.c.user_id == user_id
+                )
+            )
+        ]
+        change_version = await _sequence_value(conn, "media_change_seq")
+
+    async with target.begin() as conn:
+        # Сначала последовательность (setval не откатывается): новые id целевого
+        # шарда уже не попадут в перенесённые, занятые - видны проверке ниже
+        max_id = max((row["id"] for row in media), default=1)
+        await conn.execute(
+            text(
+                "SELECT setval('media_id_seq', GREATEST(:id, "
+                "(SELECT last_value FROM media_id_seq)))"
+            ),
+            {"id": max_id},
+        )
+        rows = await conn.execute(
+            text(
+                "SELECT id FROM media WHERE id = ANY(:ids) AND user_id <> :user "
+                "ORDER BY id LIMIT 10"
+            ),
+            {"ids": [row["id"] for row in media], "user": user_id},
+        )
+        taken = rows.scalars().all()
+        if taken:
+            raise RebalanceError(
+                f"user {user_id}: media ids {', '.join(map(str, taken))} are already used "
+                "on the target shard by other users; user stays frozen on the source shard"
+            )
+        await conn.execute(delete(MEDIA).where(MEDIA.c.user_id == user_id))
+        await conn.execute(delete(TOMBSTONES).where(TOMBSTONES.c.user_id == user_id))
+        if media:
+            await conn.execute(insert(MEDIA), media)
+        if tombstones:
+            await conn.execute(insert(TOMBSTONES), tombstones)
+        await conn.execute(
+            text(
+                "SELECT setval('media_change_seq', GREATEST(:version, "
+                "(SELECT last_value FROM media_change_seq)))"
+            ),
+            {"version": change_version},
+        )
+    return len(media)
+
+
+async def move_user(
+    router: ShardRouter,
+    user_id: int,
+    target: str,
+    grace: float = DEFAULT_GRACE_SECONDS,
+    log: Callable[[str], None] = print,
+    directory_ttl: float = SHARD_DIRECTORY_TTL_SECONDS,
+) -> bool:
+    """Перенести пользователя на target; False - он уже там
+
+    directory_ttl - TTL кэша directory в воркерах приложения: до его истечения
+    воркер может писать на source по старой записи.
+    """
+    if target not in router.engines:
+        raise RebalanceError(f"unknown shard: {target}")
+    router.forget(user_id)
+    pinned, state = await router.lookup(user_id)
+    source = pinned or router.ring.owner(user_id)
+    if source == target and state != STATE_FROZEN:
+        return False
+
+    if source != target:
+        await _set_directory(router, user_id, source, STATE_FROZEN)
+        await asyncio.sleep(directory_ttl + grace)
+        rows = await copy_user(router.engines[source], router.engines[target], user_id)
+    else:
+        rows = 0  # Прерванный перенос обратно на исходный шард: только разморозить
+
+    if router.routing == "hash" and target == router.ring.owner(user_id):
+        async with router.catalog.begin() as conn:
+            await conn.execute(delete(DIRECTORY).where(DIRECTORY.c.user_id == user_id))
+        router.forget(user_id)
+    else:
+        await _set_directory(router, user_id, target, STATE_ACTIVE)
+
+    if source != target:
+        async with router.engines[source].begin() as conn:
+            await conn.execute(delete(MEDIA).where(MEDIA.c.user_id == user_id))
+            await conn.execute(delete(TOMBSTONES).where(TOMBSTONES.c.user_id == user_id))
+    log(f"user {user_id}: {source} -> {target} ({rows} rows)")
+    return True
+
+
+async def pin(router: ShardRouter, log: Callable[[str], None] = print) -> int:
+    """Закрепить на текущем шарде пользователей, которых новый ring отдаёт другому"""
+
+    async def users(name: str, engine: AsyncEngine) -> List[int]:
+        async with engine.connect() as conn:
+            rows = await conn.execute(select(MEDIA.c.user_id).union(select(TOMBSTONES.c.user_id)))
+            return [row[0] for row in rows]
+
+    placement: Dict[str, List[int]] = await router.scatter(users)
+    pinned = 0
+    async with router.catalog.begin() as conn:
+        for shard, user_ids in placement.items():
+            moved = [user_id for user_id in user_ids if router.ring.owner(user_id) != shard]
+            if moved:
+                result = await conn.execute(
+                    insert(DIRECTORY)
+                    .values([{"user_id": u, "shard": shard, "state": STATE_ACTIVE} for u in moved])
+                    .on_conflict_do_nothing()
+                )
+                pinned += result.rowcount
+    log(f"pinned {pinned} users")
+    return pinned
+
+
+async def rebalance(
+    router: ShardRouter,
+    limit: Optional[int] = None,
+    grace: float = DEFAULT_GRACE_SECONDS,
+    log: Callable[[str], None] = print,
+    directory_ttl: float = SHARD_DIRECTORY_TTL_SECONDS,
+) -> int:
+    """Перенести закреплённых пользователей к их владельцу в ring"""
+    async with router.catalog.connect() as conn:
+        rows = (await conn.execute(select(DIRECTORY.c.user_id, DIRECTORY.c.shard))).all()
+    moved = 0
+    for user_id, shard in rows:
+        if limit is not None and moved >= limit:
+            break
+        owner = router.ring.owner(user_id)
+        if shard != owner and await move_user(router, user_id, owner, grace, log, directory_ttl):
+            moved += 1
+    log(f"moved {moved} users")
+    return moved
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from app.core.database import SHARDS
+
+    parser = argparse.ArgumentParser(description="Move users between shard databases")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GRACE_SECONDS)
+    parser.add_argument(
+        "--directory-ttl",
+        type=float,
+        default=SHARD_DIRECTORY_TTL_SECONDS,
+        help="SHARD_DIRECTORY_TTL_SECONDS of the running app",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("move", help="move one user to a shard")
+    move.add_argument("--user", type=int, required=True)
+    move.add_argument("--to", required=True)
+    commands.add_parser("pin", help="pin users whose ring owner changed to their current shard")
+    balance = commands.add_parser("rebalance", help="move pinned users to their ring owner")
+    balance.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    async def run():
+        router = build_router(SHARDS)
+        try:
+            if args.command == "move":
+                await move_user(
+                    router, args.user, args.to, args.grace, directory_ttl=args.directory_ttl
+                )
+            elif args.command == "pin":
+                await pin(router)
+            else:
+                await rebalance(router, args.limit, args.grace, directory_ttl=args.directory_ttl)
+        finally:
+            await router.dispose()
+            await router.catalog.dispose()
+
+    started = time.monotonic()
+    try:
+        asyncio.run(run())
+    except RebalanceError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(f"done in {time.monotonic() - started:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
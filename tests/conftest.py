@@ -1,15 +1,89 @@
 import asyncio
+import json
+import os
+import shutil
 import sys
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Generator
+from typing import Awaitable, Callable, Generator, TypeVar
 
+import jwt
 import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Request
 from fastapi.testclient import TestClient
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+# pytest-xdist: у каждого воркера своя схема и свой канал NOTIFY (до импорта app)
+_WORKER = os.getenv("PYTEST_XDIST_WORKER")
+if _WORKER:
+    os.environ.setdefault("DB_SCHEMA", f"test_{_WORKER}")
+    os.environ.setdefault("CHANGE_FEED_CHANNEL", f"media_changes_{_WORKER}")
+
+# JWT: тестовые токены подписываются этим ключом, JWKS - локальный файл (до импорта app).
+# Воркеры xdist наследуют AUTH_JWKS мастера - и ключ должны взять его же
+if os.getenv("TEST_JWT_SIGNING_KEY_PEM"):
+    TEST_SIGNING_KEY = serialization.load_pem_private_key(
+        os.environ["TEST_JWT_SIGNING_KEY_PEM"].encode(), password=None
+    )
+else:
+    TEST_SIGNING_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    os.environ["TEST_JWT_SIGNING_KEY_PEM"] = TEST_SIGNING_KEY.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+TEST_KID = "test-key"
+TEST_ISSUER = "media-catalog-tests"
+TEST_AUDIENCE = "media-catalog"
+_AUTH_DIR = Path(tempfile.mkdtemp(prefix="media-auth-"))
+
+
+def public_jwk(private_key, kid: str) -> dict:
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    return {**jwk, "kid": kid, "use": "sig", "alg": "RS256"}
+
+
+(_AUTH_DIR / "jwks.json").write_text(json.dumps({"keys": [public_jwk(TEST_SIGNING_KEY, TEST_KID)]}))
+os.environ.setdefault("AUTH_JWKS", str(_AUTH_DIR / "jwks.json"))
+os.environ.setdefault("AUTH_ISSUER", TEST_ISSUER)
+os.environ.setdefault("AUTH_AUDIENCE", TEST_AUDIENCE)
+
+
+def _make_token(sub: str = "1", key=None, kid: str = TEST_KID, **claims) -> str:
+    now = int(time.time())
+    payload = {
+        "sub": sub,
+        "iss": TEST_ISSUER,
+        "aud": TEST_AUDIENCE,
+        "iat": now,
+        "exp": now + 3600,
+        **claims,
+    }
+    return jwt.encode(payload, key or TEST_SIGNING_KEY, algorithm="RS256", headers={"kid": kid})
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "no_transaction: test needs real COMMITs (TRUNCATE instead of rollback)"
+    )
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_AUTH_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def make_token():
+    """Factory of signed test JWTs: make_token(sub="2", exp=...)"""
+    return _make_token
+
 
 @pytest.fixture(scope="session")
 def event_loop() -> Generator[asyncio.AbstractEventLoop, None, None]:
@@ -32,56 +106,178 @@ def event_loop() -> Generator[asyncio.AbstractEventLoop, None, None]:
         loop.close()
 
 
-@pytest.fixture(autouse=True, scope="function")
-def cleanup_before_each_test():
-    """Очистка БД ПЕРЕД каждым тестом - СИНХРОННО"""
+T = TypeVar("T")
 
-    def sync_cleanup():
-        """Синхронная очистка через psycopg2 (НЕ asyncpg)"""
-        import psycopg2
 
-        from app.core.database import get_db_secrets
+@pytest.fixture
+def run() -> Generator[Callable[[Awaitable[T]], T], None, None]:
+    """run(coro) - выполнить корутину из синхронного теста
 
+    Свой event loop на тест (не session loop фикстуры client): незавершённые
+    задачи отменяются, loop закрывается после теста.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        yield loop.run_until_complete
+    finally:
         try:
-            secrets = get_db_secrets()
-            conn = psycopg2.connect(
-                host=secrets["DB_HOST"],
-                port=secrets["DB_PORT"],
-                database=secrets["DB_NAME"],
-                user=secrets["DB_USER"],
-                password=secrets["DB_PASSWORD"],
-            )
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
 
-            with conn.cursor() as cur:
-                # Проверяем существование таблицы
-                cur.execute(
-                    """
-                    SELECT EXISTS (
-                        SELECT FROM information_schema.tables
-                        WHERE table_name = 'media'
-                    )
-                """
-                )
-
-                if cur.fetchone()[0]:
-                    cur.execute("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
-                    conn.commit()
-                    print("Database cleaned before test")
 
+def _memory_storage() -> bool:
+    return os.getenv("MEDIA_STORAGE", "sql").lower() == "memory"
+
+
+def _psycopg2_connect():
+    import psycopg2
+
+    from app.core.database import connect_args, get_db_secrets
+
+    secrets = get_db_secrets()
+    return psycopg2.connect(
+        host=secrets["DB_HOST"],
+        port=secrets["DB_PORT"],
+        database=secrets["DB_NAME"],
+        user=secrets["DB_USER"],
+        password=secrets["DB_PASSWORD"],
+        **connect_args("psycopg2"),
+    )
+
+
+@pytest.fixture(autouse=True, scope="session")
+def database_schema():
+    """Схема воркера и миграции - один раз на сессию; без схемы тесты не запускаются"""
+    if _memory_storage():
+        yield
+        return
+
+    from alembic import command
+    from psycopg2 import sql
+
+    from app.core.database import DB_SCHEMA
+    from app.core.migrations import alembic_config
+
+    try:
+        if DB_SCHEMA:
+            # Схема воркера xdist - заново: данные прошлых запусков не влияют на тесты
+            conn = _psycopg2_connect()
+            with conn.cursor() as cur:
+                schema = sql.Identifier(DB_SCHEMA)
+                cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(schema))
+                cur.execute(sql.SQL("CREATE SCHEMA {}").format(schema))
+            conn.commit()
             conn.close()
+        # Схема - миграциями, как в production (приложение при старте сверяет версию)
+        command.upgrade(alembic_config(), "head")
+        conn = _psycopg2_connect()
+        with conn.cursor() as cur:
+            cur.execute("SELECT current_schema(), to_regclass('media')")
+            schema, media = cur.fetchone()
+        conn.close()
+    except Exception as e:
+        pytest.exit(f"Schema setup failed: {e}", returncode=3)
+    if media is None or (DB_SCHEMA and schema != DB_SCHEMA):
+        pytest.exit(f"Schema setup failed: no media table in schema {schema}", returncode=3)
+    yield
+
+
+def _truncate():
+    """Синхронная очистка через psycopg2 (НЕ asyncpg); ошибка - ошибка теста"""
+    conn = _psycopg2_connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE media, media_tombstones RESTART IDENTITY CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(autouse=True, scope="function")
+def cleanup_before_each_test(request, event_loop):
+    """Очистка для тестов, которым нужны настоящие COMMIT
+
+    Остальные тесты изолированы транзакцией с откатом (фикстура client), TRUNCATE
+    им не нужен. no_transaction: now() внутри одной транзакции не меняется,
+    NOTIFY доставляется только после COMMIT - такие тесты чистят БД до и после.
+    """
+    if _memory_storage():
+        from app.crud import media_crud
+
+        event_loop.run_until_complete(media_crud.clear_all(None))
+        yield
+        return
 
-        except Exception as e:
-            print(f"Cleanup failed: {e}")
+    if request.node.get_closest_marker("no_transaction") is None:
+        yield
+        return
 
-    # Выполняем cleanup ПЕРЕД каждым тестом
-    sync_cleanup()
+    _truncate()
     yield
+    _truncate()
+
+
+_test_engine = None
+
+
+@contextmanager
+def _rollback_after_test(app, portal):
+    """Outer transaction per test; каждая сессия get_db работает в SAVEPOINT
+
+    COMMIT в коде приложения освобождает только savepoint, а в конце теста
+    внешняя транзакция откатывается. NullPool: соединения asyncpg привязаны к
+    event loop, а у каждого TestClient он свой.
+    """
+    global _test_engine
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from app.core.database import connect_args, create_database_url, get_db, statement_timeout_for
+
+    if _test_engine is None:
+        _test_engine = create_async_engine(
+            create_database_url("asyncpg"),
+            poolclass=NullPool,
+            connect_args=connect_args("asyncpg"),
+        )
+
+    # Соединение открывается лениво: тесты без обращений к БД его не ждут
+    state = {}
+
+    async def get_test_db(request: Request):
+        if "conn" not in state:
+            state["conn"] = await _test_engine.connect()
+            state["outer"] = await state["conn"].begin()
+        async with AsyncSession(
+            bind=state["conn"], join_transaction_mode="create_savepoint", expire_on_commit=False
+        ) as session:
+            session.info["statement_timeout_ms"] = statement_timeout_for(request)
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    try:
+        yield
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        if "conn" in state:
+            portal.call(state["outer"].rollback)
+            portal.call(state["conn"].close)
 
 
 @pytest.fixture(scope="function")
-def client() -> Generator[TestClient, None, None]:
-    """Simple TestClient БЕЗ cleanup в fixture"""
+def client(request) -> Generator[TestClient, None, None]:
+    """TestClient от имени пользователя 1; данные теста откатываются вместе с транзакцией"""
     from app.main import app
 
-    with TestClient(app) as test_client:
-        yield test_client
+    with TestClient(app, headers={"Authorization": f"Bearer {_make_token()}"}) as test_client:
+        if _memory_storage() or request.node.get_closest_marker("no_transaction"):
+            yield test_client
+            return
+        with _rollback_after_test(app, test_client.portal):
+            yield test_client
@@ -0,0 +1,136 @@
+"""Tests for admission control / load shedding"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.middleware.admission import AdmissionControlMiddleware, Lane, classify
+
+
+def make_app(read_limit: int = 1, read_queue: int = 0, queue_timeout: float = 0.05):
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.get("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    lanes = {
+        "read": Lane("read", read_limit, read_queue, queue_timeout),
+        "write": Lane("write", 1, 0, queue_timeout),
+    }
+    app.add_middleware(AdmissionControlMiddleware, lanes=lanes, retry_after=2)
+    return app, release
+
+
+def test_classify_route_classes():
+    assert classify({"path": "/health", "method": "GET"}) is None
+    assert classify({"path": "/metrics", "method": "GET"}) is None
+    assert classify({"path": "/media/changes", "method": "GET"}) == "stream"
+    assert classify({"path": "/media", "method": "GET"}) == "read"
+    assert classify({"path": "/media", "method": "POST"}) == "write"
+
+
+def test_overload_is_shed_with_fast_503(run):
+    async def scenario():
+        app, release = make_app(read_limit=1, read_queue=0)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.get("/slow"))
+            await asyncio.sleep(0.01)
+            shed = await client.get("/slow")
+            health = await client.get("/health")  # Приоритетная полоса
+            release.set()
+            return await first, shed, health
+
+    first, shed, health = run(scenario())
+
+    assert first.status_code == 200
+    assert health.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "2"
+    body = shed.json()
+    assert body["status"] == 503
+    assert body["title"] == "Service Unavailable"
+    assert "correlation_id" in body
+
+
+def test_queued_request_admitted_when_slot_frees(run):
+    async def scenario():
+        app, release = make_app(read_limit=1, read_queue=5, queue_timeout=1)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.get("/slow"))
+            await asyncio.sleep(0.01)
+            second = asyncio.ensure_future(client.get("/slow"))
+            await asyncio.sleep(0.01)
+            release.set()
+            return await first, await second
+
+    first, second = run(scenario())
+    assert first.status_code == 200
+    assert second.status_code == 200
+
+
+def test_queue_timeout_sheds(run):
+    async def scenario():
+        app, release = make_app(read_limit=1, read_queue=5, queue_timeout=0.05)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.get("/slow"))
+            await asyncio.sleep(0.01)
+            second = await client.get("/slow")
+            release.set()
+            await first
+            return second
+
+    assert run(scenario()).status_code == 503
+
+
+class LateSemaphore(asyncio.Semaphore):
+    """Permit выдаётся уже после таймаута ожидания (гонка таймаута и release)"""
+
+    async def acquire(self):
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            pass  # Отмена опоздала: permit всё равно получен
+        self._value -= 1  # locked() всегда True: без ожидания в super().acquire()
+        return True
+
+    def locked(self):
+        return True  # Lane.acquire идёт в очередь
+
+
+def test_permit_granted_after_timeout_is_returned(run):
+    async def scenario():
+        lane = Lane("read", limit=1, max_queue=5, queue_timeout=0.01)
+        lane._semaphore = LateSemaphore(1)
+        admitted = await lane.acquire()
+        await asyncio.sleep(0.1)
+        return admitted, lane._semaphore._value, lane.waiting
+
+    assert run(scenario()) == (False, 1, 0)  # Permit вернулся
+
+
+def test_cancelled_waiter_does_not_keep_permit(run):
+    async def scenario():
+        lane = Lane("read", limit=1, max_queue=5, queue_timeout=5)
+        assert await lane.acquire()
+        waiter = asyncio.ensure_future(lane.acquire())
+        await asyncio.sleep(0.01)
+        lane.release()
+        waiter.cancel()  # Клиент ушёл в тот же шаг, когда освободился слот
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return await asyncio.wait_for(lane.acquire(), 1), lane.in_flight
+
+    assert run(scenario()) == (True, 1)
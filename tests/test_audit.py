@@ -0,0 +1,230 @@
+"""Tests for the batched audit log (NFR-09)"""
+
+import asyncio
+import os
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.audit import AuditEvent, AuditLog, MemoryAuditSink, diff
+from app.models.audit import audit_partition_ddl
+
+
+class FlakySink(MemoryAuditSink):
+    """Падает первые failures раз, потом пишет"""
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+        self.batches = []
+
+    async def write(self, events):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database is down")
+        self.batches.append(len(events))
+        await super().write(events)
+
+
+def test_diff_keeps_only_changed_fields():
+    before = {"title": "Old", "year": 2000, "rating": None}
+    after = {"title": "New", "year": 2000, "rating": 8}
+
+    assert diff(before, after) == {"rating": [None, 8], "title": ["Old", "New"]}
+    assert diff(None, {"title": "X"}) == {"title": [None, "X"]}
+    assert diff({"title": "X"}, None) == {"title": ["X", None]}
+
+
+def test_flush_writes_in_batches(run):
+    sink = FlakySink()
+    audit = AuditLog(sink, batch_size=2)
+    for i in range(5):
+        audit.record(1, "create", i, after={"title": f"T{i}"})
+
+    assert run(audit.flush()) is True
+    assert sink.batches == [2, 2, 1]
+    assert [event.media_id for event in sink.events] == [0, 1, 2, 3, 4]
+
+
+def test_overflow_drops_new_events_without_blocking():
+    audit = AuditLog(FlakySink(), max_queue=3)
+    for i in range(5):
+        audit.record(1, "create", i)
+
+    assert len(audit) == 3
+    assert audit.dropped == 2
+
+
+def test_failed_batch_is_retried_in_order(run):
+    sink = FlakySink(failures=1)
+    audit = AuditLog(sink, batch_size=10)
+    audit.record(1, "create", 1)
+    audit.record(1, "delete", 1)
+
+    assert run(audit.flush()) is False
+    assert len(audit) == 2  # Вернулись в очередь
+    assert run(audit.flush()) is True
+    assert [event.op for event in sink.events] == ["create", "delete"]
+
+
+def test_background_flush_and_flush_on_shutdown(run):
+    sink = FlakySink()
+    audit = AuditLog(sink, batch_size=2, flush_interval_ms=10_000)
+
+    async def scenario():
+        audit.start()
+        audit.record(1, "create", 1)
+        audit.record(1, "create", 2)  # Набрался батч - flush не ждёт интервала
+        await asyncio.sleep(0.05)
+        flushed_early = len(sink.events)
+        audit.record(1, "create", 3)
+        await audit.stop()
+        return flushed_early
+
+    assert run(scenario()) == 2
+    assert len(sink.events) == 3
+    assert len(audit) == 0
+
+
+def test_event_record_matches_copy_columns():
+    event = AuditEvent(1, "update", 5, {"title": ["Старое", "New"]}, "abc")
+    occurred_at, user_id, op, media_id, changes, correlation_id = event.as_record()
+
+    assert occurred_at.tzinfo is not None
+    assert (user_id, op, media_id, correlation_id) == (1, "update", 5, "abc")
+    assert changes == '{"title": ["Старое", "New"]}'
+
+
+def test_partition_bounds_are_utc():
+    assert audit_partition_ddl(date(2026, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS audit_log_y2026m12 PARTITION OF audit_log "
+        "FOR VALUES FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00')"
+    )
+
+
+@pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+def test_month_boundary_event_lands_in_partition_on_non_utc_session(run):
+    """31 марта 20:00 UTC - уже 1 апреля в Asia/Tokyo; партиция - мартовская (UTC)"""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from app.core.audit import SqlAuditSink
+    from app.core.database import connect_args, create_database_url
+
+    corr = f"corr-{uuid.uuid4()}"
+    args = connect_args("asyncpg")
+    args["server_settings"] = {**args.get("server_settings", {}), "timezone": "Asia/Tokyo"}
+    occurred_at = datetime(2097, 3, 31, 20, tzinfo=timezone.utc)
+
+    async def scenario():
+        engine = create_async_engine(
+            create_database_url("asyncpg"), poolclass=NullPool, connect_args=args
+        )
+        try:
+            await SqlAuditSink(engine).write(
+                [AuditEvent(424242, "create", 1, {}, corr, occurred_at=occurred_at)]
+            )
+            async with engine.connect() as conn:
+                return await conn.scalar(
+                    text(
+                        "SELECT tableoid::regclass::text FROM audit_log WHERE correlation_id = :c"
+                    ),
+                    {"c": corr},
+                )
+        finally:
+            await engine.dispose()
+
+    assert run(scenario()).endswith("audit_log_y2097m03")
+
+
+@pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+def test_sql_sink_copies_into_partition_and_is_append_only(run):
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from app.core.audit import SqlAuditSink
+    from app.core.database import connect_args, create_database_url
+
+    # Append-only: строки прошлых прогонов не удалить - свой correlation id на прогон
+    corr = f"corr-{uuid.uuid4()}"
+
+    async def scenario():
+        engine = create_async_engine(
+            create_database_url("asyncpg"), poolclass=NullPool, connect_args=connect_args("asyncpg")
+        )
+        try:
+            await SqlAuditSink(engine).write(
+                [AuditEvent(424242, "create", 1, {"title": [None, "Copied"]}, corr)]
+            )
+            async with engine.connect() as conn:
+                row = (
+                    await conn.execute(
+                        text(
+                            "SELECT tableoid::regclass::text, changes, correlation_id "
+                            "FROM audit_log WHERE correlation_id = :corr"
+                        ),
+                        {"corr": corr},
+                    )
+                ).one()
+                with pytest.raises(DBAPIError, match="append-only"):
+                    await conn.execute(text("DELETE FROM audit_log WHERE user_id = 424242"))
+            return row
+        finally:
+            await engine.dispose()
+
+    partition, changes, stored_corr = run(scenario())
+    assert partition.startswith("audit_log_y")
+    assert changes == {"title": [None, "Copied"]}
+    assert stored_corr == corr
+
+
+class TestAuditApi:
+    """Аудит записей через API"""
+
+    @pytest.fixture
+    def audit(self, monkeypatch):
+        from app.crud import media_crud
+
+        audit = AuditLog(MemoryAuditSink())
+        monkeypatch.setattr(media_crud, "audit", audit)
+        return audit
+
+    def test_writes_are_audited_with_diff_and_correlation_id(
+        self, run, client: TestClient, audit: AuditLog
+    ):
+        created = client.post("/media", json={"title": "Audited", "kind": "movie", "year": 2001})
+        media_id = created.json()["id"]
+        updated = client.patch(
+            f"/media/{media_id}/status",
+            json={"status": "watched", "rating": 9},
+            headers={"X-Correlation-ID": "req-42"},
+        )
+        assert updated.headers["x-correlation-id"] == "req-42"
+        client.delete(f"/media/{media_id}")
+        client.get(f"/media/{media_id}")  # Чтения не аудитируются
+
+        run(audit.flush())
+        events = list(audit.sink.events)
+        assert [(e.op, e.media_id, e.user_id) for e in events] == [
+            ("create", media_id, 1),
+            ("status", media_id, 1),
+            ("delete", media_id, 1),
+        ]
+        assert events[0].changes["title"] == [None, "Audited"]
+        assert events[1].changes == {"rating": [None, 9], "status": ["to_watch", "watched"]}
+        assert events[1].correlation_id == "req-42"
+        assert events[2].changes["title"] == ["Audited", None]
+
+    def test_generated_correlation_id_is_echoed(self, client: TestClient):
+        first = client.get("/health").headers["x-correlation-id"]
+        second = client.get("/health", headers={"X-Correlation-ID": "bad id\n"})
+        assert first and second.headers["x-correlation-id"] not in ("bad id\n", first)
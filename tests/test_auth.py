@@ -0,0 +1,206 @@
+"""Tests for JWT bearer authentication"""
+
+import base64
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi.testclient import TestClient
+
+from app.core.auth import (
+    AuthNotConfigured,
+    InvalidToken,
+    KeySet,
+    KeysUnavailable,
+    TokenCache,
+    TokenVerifier,
+    require_key_source,
+    token_verifier,
+)
+
+
+def _es256_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def _coordinate(value: int) -> str:
+    # Ровно 32 байта: to_jwk в PyJWT 2.9 теряет ведущие нули, и такой JWK не читается
+    return base64.urlsafe_b64encode(value.to_bytes(32, "big")).decode().rstrip("=")
+
+
+def _write_jwks(path, *keys):
+    jwks = []
+    for kid, private_key in keys:
+        numbers = private_key.public_key().public_numbers()
+        jwks.append(
+            {
+                "kty": "EC",
+                "crv": "P-256",
+                "x": _coordinate(numbers.x),
+                "y": _coordinate(numbers.y),
+                "kid": kid,
+                "alg": "ES256",
+            }
+        )
+    path.write_text(json.dumps({"keys": jwks}))
+
+
+def _token(private_key, kid=None, sub="7", exp_in=3600, **claims):
+    headers = {"kid": kid} if kid else None
+    payload = {"sub": sub, "exp": int(time.time()) + exp_in, **claims}
+    return jwt.encode(payload, private_key, algorithm="ES256", headers=headers)
+
+
+def _verifier(jwks_path=None, public_key_file=None, **keyset_options):
+    keys = KeySet(str(jwks_path) if jwks_path else None, public_key_file, **keyset_options)
+    return TokenVerifier(keys, issuer=None, audience=None, algorithms=["ES256"], leeway=0)
+
+
+def test_verified_token_is_served_from_cache(run, tmp_path):
+    key = _es256_key()
+    _write_jwks(tmp_path / "jwks.json", ("k1", key))
+    verifier = _verifier(tmp_path / "jwks.json")
+    token = _token(key, "k1")
+
+    assert run(verifier.verify(token)) == 7
+    # Источник ключей пропал, но повторная проверка подпись не трогает
+    (tmp_path / "jwks.json").unlink()
+    assert run(verifier.verify(token)) == 7
+    assert len(verifier.cache) == 1
+
+
+def test_key_rotation(run, tmp_path):
+    old, new = _es256_key(), _es256_key()
+    path = tmp_path / "jwks.json"
+    _write_jwks(path, ("old", old))
+    verifier = _verifier(path, min_refresh_seconds=0)
+    old_token = _token(old, "old")
+    assert run(verifier.verify(old_token)) == 7
+
+    # Новый kid: набор перечитывается сам
+    _write_jwks(path, ("old", old), ("new", new))
+    assert run(verifier.verify(_token(new, "new", sub="8"))) == 8
+
+    # Старый ключ отозван: закэшированный токен больше не принимается
+    _write_jwks(path, ("new", new))
+    verifier.keys.refresh_seconds = 0
+    with pytest.raises(InvalidToken):
+        run(verifier.verify(old_token))
+
+
+def test_unknown_kid_does_not_reload_keys_on_every_request(run, tmp_path):
+    key = _es256_key()
+    _write_jwks(tmp_path / "jwks.json", ("k1", key))
+    verifier = _verifier(tmp_path / "jwks.json", min_refresh_seconds=60)
+    run(verifier.verify(_token(key, "k1")))
+
+    _write_jwks(tmp_path / "jwks.json", ("k1", key), ("k2", key))
+    with pytest.raises(InvalidToken):
+        run(verifier.verify(_token(key, "k2")))
+
+
+def test_pem_key_file_accepts_token_without_kid(run, tmp_path):
+    key = _es256_key()
+    pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    (tmp_path / "key.pem").write_bytes(pem)
+    verifier = _verifier(public_key_file=str(tmp_path / "key.pem"))
+
+    assert run(verifier.verify(_token(key))) == 7
+
+
+@pytest.mark.parametrize(
+    "token_options",
+    [
+        {"exp_in": -60},  # Истёк
+        {"sub": "alice"},  # user_id - только положительное целое
+        {"sub": "0"},
+    ],
+)
+def test_invalid_claims_rejected(run, tmp_path, token_options):
+    key = _es256_key()
+    _write_jwks(tmp_path / "jwks.json", ("k1", key))
+    verifier = _verifier(tmp_path / "jwks.json")
+
+    with pytest.raises(InvalidToken):
+        run(verifier.verify(_token(key, "k1", **token_options)))
+
+
+def test_unsigned_and_foreign_tokens_rejected(run, tmp_path):
+    key = _es256_key()
+    _write_jwks(tmp_path / "jwks.json", ("k1", key))
+    verifier = _verifier(tmp_path / "jwks.json")
+    unsigned = jwt.encode({"sub": "7", "exp": int(time.time()) + 60}, None, algorithm="none")
+
+    for token in (unsigned, _token(_es256_key(), "k1"), "not-a-jwt"):
+        with pytest.raises(InvalidToken):
+            run(verifier.verify(token))
+
+
+def test_missing_key_source_is_unavailable(run, tmp_path):
+    verifier = _verifier(tmp_path / "missing.json")
+    with pytest.raises(KeysUnavailable):
+        run(verifier.verify(_token(_es256_key(), "k1")))
+
+
+def test_startup_fails_without_key_source(tmp_path):
+    with pytest.raises(AuthNotConfigured, match="AUTH_JWKS"):
+        require_key_source(KeySet(None, None))
+    with pytest.raises(AuthNotConfigured):
+        require_key_source(KeySet("", ""))  # Пустые переменные compose
+    require_key_source(KeySet(None, str(tmp_path / "key.pem")))
+
+
+def test_token_cache_is_bounded_and_expires():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put("a", 1, time.time() + 60)
+    cache.put("b", 2, time.time() + 60)
+    cache.get("a")
+    cache.put("c", 3, time.time() + 60)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None  # Вытеснен как давно не использованный
+
+    cache.put("expired", 4, time.time() - 1)
+    assert cache.get("expired") is None
+
+
+class TestAuthApi:
+    """Тесты аутентификации через API"""
+
+    def test_missing_token(self, client: TestClient):
+        response = client.get("/media", headers={"Authorization": ""})
+        assert response.status_code == 401
+        assert response.headers["www-authenticate"] == "Bearer"
+        assert response.json()["detail"] == "Authentication required"
+
+    def test_invalid_tokens(self, client: TestClient, make_token):
+        for token in (
+            make_token(exp=int(time.time()) - 3600),
+            make_token(aud="another-service"),
+            make_token(key=rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        ):
+            response = client.get("/media", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 401
+            assert 'error="invalid_token"' in response.headers["www-authenticate"]
+
+    def test_users_are_isolated(self, client: TestClient, make_token):
+        created = client.post("/media", json={"title": "Mine", "kind": "movie", "year": 2000})
+        assert created.status_code == 201
+        assert created.json()["user_id"] == 1
+
+        other = {"Authorization": f"Bearer {make_token(sub='2')}"}
+        assert client.get("/media", headers=other).json() == []
+        assert client.get(f"/media/{created.json()['id']}", headers=other).status_code == 404
+
+
+def test_scopes_from_scope_and_scp_claims(run, make_token):
+    verifier = TokenVerifier(token_verifier.keys)
+    principal = run(verifier.authenticate(make_token(scope="media admin", scp=["debug", 1])))
+
+    assert principal.user_id == 1
+    assert principal.scopes == {"media", "admin", "debug"}
@@ -0,0 +1,113 @@
+"""Tests for the media change feed fan-out (no database needed)"""
+
+import pytest
+
+from app.core import changefeed
+from app.core.changefeed import ChangeEvent, ChangeFeed, FeedLimitExceeded
+
+
+def event(version: int, user_id: int = 1, media_id: int = 10, op: str = "update"):
+    return ChangeEvent(version=version, user_id=user_id, media_id=media_id, op=op)
+
+
+def test_sse_format_has_no_user_id():
+    message = event(7, user_id=42, media_id=3, op="create").to_sse()
+    assert message.startswith("id: 7\nevent: change\n")
+    assert '"id":3' in message
+    assert '"op":"create"' in message
+    assert "42" not in message
+    assert message.endswith("\n\n")
+
+
+def test_events_fan_out_only_to_owner():
+    feed = ChangeFeed()
+    mine = feed.subscribe(user_id=1)
+    other = feed.subscribe(user_id=2)
+
+    feed.dispatch(event(1, user_id=1))
+
+    assert mine.queue.qsize() == 1
+    assert other.queue.qsize() == 0
+
+
+def test_resume_from_last_event_id_replays_missed_events():
+    feed = ChangeFeed()
+    for version in range(1, 6):
+        feed.dispatch(event(version))
+
+    sub = feed.subscribe(user_id=1, last_event_id=3)
+
+    assert not sub.reset
+    assert [e.version for e in sub.replay] == [4, 5]
+
+
+def test_resume_beyond_history_requests_reset():
+    feed = ChangeFeed(history_size=3)
+    for version in range(1, 10):
+        feed.dispatch(event(version))
+
+    sub = feed.subscribe(user_id=1, last_event_id=2)
+
+    assert sub.reset
+    assert sub.replay == []
+
+
+def test_slow_consumer_is_dropped(monkeypatch):
+    monkeypatch.setattr(changefeed, "QUEUE_SIZE", 2)
+    feed = ChangeFeed()
+    sub = feed.subscribe(user_id=1)
+
+    for version in range(1, 5):
+        feed.dispatch(event(version))
+
+    assert sub.overflowed
+    assert sub.queue.get_nowait() is None  # Сигнал закрытия потока
+    assert feed.dropped_subscribers == 1
+    assert not feed._subscribers
+
+
+def test_subscriber_limit_per_user(monkeypatch):
+    monkeypatch.setattr(changefeed, "MAX_SUBSCRIBERS_PER_USER", 2)
+    feed = ChangeFeed()
+    feed.subscribe(user_id=1)
+    feed.subscribe(user_id=1)
+
+    with pytest.raises(FeedLimitExceeded):
+        feed.subscribe(user_id=1)
+    feed.subscribe(user_id=2)
+
+
+def test_rejected_subscribers_leave_no_entries(monkeypatch):
+    monkeypatch.setattr(changefeed, "MAX_SUBSCRIBERS_TOTAL", 1)
+    feed = ChangeFeed()
+    feed.subscribe(user_id=1)
+
+    for user_id in range(2, 100):
+        with pytest.raises(FeedLimitExceeded):
+            feed.subscribe(user_id=user_id)
+    assert list(feed._subscribers) == [1]
+
+
+def test_resume_replays_a_lower_version_committed_later():
+    """Версия берётся до COMMIT: 4 закоммитилась после 5 и пришла позже"""
+    feed = ChangeFeed()
+    for version in (1, 2, 3, 5, 4, 6):
+        feed.dispatch(event(version))
+
+    sub = feed.subscribe(user_id=1, last_event_id=5)
+
+    assert not sub.reset
+    assert [e.version for e in sub.replay] == [4, 6]
+
+
+def test_history_is_kept_for_a_bounded_number_of_users():
+    feed = ChangeFeed(history_users=2)
+    for user_id in (1, 2, 3):
+        feed.dispatch(event(user_id, user_id=user_id))
+    feed.dispatch(event(4, user_id=2))  # 2 недавно активен: следующим вытесняется 3
+    feed.dispatch(event(5, user_id=4))
+
+    assert set(feed._history) == {2, 4}
+    assert set(feed._user_shard) == {2, 4}
+    # Историю пользователя 1 вытеснили: продолжить нельзя, только перечитать список
+    assert feed.subscribe(user_id=1, last_event_id=1).reset
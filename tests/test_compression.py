@@ -0,0 +1,113 @@
+"""Tests for response compression middleware"""
+
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.middleware.compression import CompressedBodyCache, CompressionMiddleware, choose_encoding
+
+BIG_PAYLOAD = [{"id": i, "title": f"Movie {i}", "kind": "movie"} for i in range(200)]
+
+
+def make_client(cache: CompressedBodyCache = None) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/big")
+    def big():
+        return JSONResponse(BIG_PAYLOAD)
+
+    @app.get("/small")
+    def small():
+        return JSONResponse({"status": "ok"})
+
+    @app.get("/text")
+    def text():
+        return PlainTextResponse("x" * 2000)
+
+    @app.get("/stream")
+    def stream():
+        async def chunks():
+            for i in range(5):
+                yield ('{"chunk": %d, "pad": "%s"}\n' % (i, "y" * 300)).encode()
+
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    @app.get("/events")
+    def events():
+        async def chunks():
+            yield b"data: " + b"z" * 2000 + b"\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=500, cache=cache)
+    return TestClient(app)
+
+
+def test_choose_encoding_respects_q_values():
+    assert choose_encoding("gzip", ["gzip"]) == "gzip"
+    assert choose_encoding("gzip;q=0", ["gzip"]) is None
+    assert choose_encoding("identity", ["gzip"]) is None
+    assert choose_encoding("*", ["br", "gzip"]) == "br"
+    assert choose_encoding("br;q=0.5, gzip", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("", ["gzip"]) is None
+
+
+def test_large_json_is_gzipped():
+    client = make_client()
+    r = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in r.headers["vary"].lower()
+    assert r.json() == BIG_PAYLOAD
+
+
+def test_small_response_not_compressed():
+    client = make_client()
+    r = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+    assert r.json() == {"status": "ok"}
+
+
+def test_no_accept_encoding_passthrough():
+    client = make_client()
+    r = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in r.headers
+    assert r.json() == BIG_PAYLOAD
+
+
+def test_streaming_response_compressed_incrementally():
+    client = make_client()
+    r = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert "content-length" not in r.headers
+    lines = r.text.strip().split("\n")
+    assert len(lines) == 5
+
+
+def test_event_stream_never_compressed():
+    client = make_client()
+    r = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+
+def test_repeated_response_served_from_cache():
+    cache = CompressedBodyCache(max_entries=8)
+    client = make_client(cache)
+
+    first = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/big", headers={"Accept-Encoding": "gzip"})
+
+    assert first.json() == second.json() == BIG_PAYLOAD
+    assert cache.misses == 1
+    assert cache.hits == 1
+    assert len(cache) == 1
+
+
+def test_cache_is_bounded():
+    cache = CompressedBodyCache(max_entries=2)
+    for i in range(5):
+        body = f"body-{i}".encode()
+        cache.put("gzip", cache.version_of(body), gzip.compress(body))
+    assert len(cache) == 2
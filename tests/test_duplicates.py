@@ -0,0 +1,60 @@
+"""Tests for near-duplicate detection"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.similarity import normalize_title, similarity, trigrams
+
+
+def test_normalization_ignores_case_punctuation_and_articles():
+    assert normalize_title("Lord of the Rings: Return of the King") == normalize_title(
+        "The Lord of the Rings - The Return of the King"
+    )
+    assert normalize_title("The") == "the"  # Название только из артикля не пустеет
+
+
+def test_similarity_matches_pg_trgm():
+    # SELECT similarity('word', 'words') -> 0.571429 (пример из документации pg_trgm)
+    assert similarity(trigrams("word"), trigrams("words")) == pytest.approx(4 / 7)
+    assert similarity(trigrams("abc"), trigrams("xyz")) == 0
+    assert similarity(trigrams(""), trigrams("abc")) == 0
+
+
+class TestNearDuplicates:
+    """Тесты поиска похожих медиа через API"""
+
+    def test_create_warns_about_similar_title(self, client: TestClient):
+        first = client.post(
+            "/media",
+            json={"title": "Lord of the Rings: Return of the King", "kind": "movie", "year": 2003},
+        ).json()
+        assert first["possible_duplicates"] == []
+
+        response = client.post(
+            "/media",
+            json={
+                "title": "The Lord of the Rings - The Return of the King",
+                "kind": "movie",
+                "year": 2003,
+            },
+        )
+        assert response.status_code == 201  # Предупреждение, а не отказ
+        duplicates = response.json()["possible_duplicates"]
+        assert [d["id"] for d in duplicates] == [first["id"]]
+        assert duplicates[0]["similarity"] == 1.0
+
+    def test_duplicates_endpoint_ranks_and_filters(self, client: TestClient):
+        client.post("/media", json={"title": "The Matrix", "kind": "movie", "year": 1999})
+        client.post("/media", json={"title": "The Matrix Reloaded", "kind": "movie", "year": 2003})
+        client.post("/media", json={"title": "Matrix", "kind": "book", "year": 2010})
+        client.post("/media", json={"title": "Die Hard", "kind": "movie", "year": 1988})
+
+        response = client.get("/media/duplicates?title=matrix&kind=movie")
+        assert response.status_code == 200
+        titles = [d["title"] for d in response.json()]
+        assert titles[0] == "The Matrix"
+        assert "Die Hard" not in titles
+        assert "Matrix" not in titles  # Другой kind
+
+    def test_duplicates_requires_title(self, client: TestClient):
+        assert client.get("/media/duplicates").status_code == 422
@@ -0,0 +1,225 @@
+"""Tests for Idempotency-Key support (replay, mismatch, in-flight duplicates, SQL store)"""
+
+import asyncio
+import os
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.middleware.idempotency import (
+    IdempotencyCache,
+    IdempotencyMiddleware,
+    KeyInFlight,
+    SqlIdempotencyStore,
+    StoredResponse,
+)
+
+needs_postgres = pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+
+
+def make_app(**options):
+    app = FastAPI()
+    calls = []
+    release = asyncio.Event()
+    release.set()
+
+    @app.post("/orders")
+    async def create_order(payload: dict):
+        calls.append(payload)
+        await release.wait()
+        if payload.get("fail"):
+            return JSONResponse({"error": "boom"}, status_code=503)
+        return JSONResponse({"order": len(calls)}, status_code=201)
+
+    async def user_of(scope):
+        for key, value in scope["headers"]:
+            if key == b"x-user":
+                return int(value)
+        return None
+
+    app.add_middleware(IdempotencyMiddleware, user_of=user_of, **options)
+    return app, calls, release
+
+
+def post(client, key, payload=None, user="1"):
+    return client.post(
+        "/orders",
+        json=payload or {"item": "book"},
+        headers={"Idempotency-Key": key, "X-User": user},
+    )
+
+
+class TestMediaApi:
+    """Повторы POST /media через весь стек приложения"""
+
+    def test_retry_replays_first_response_instead_of_409(self, client: TestClient):
+        key = str(uuid.uuid4())
+        payload = {"title": "Idempotent Movie", "kind": "movie", "year": 2001}
+
+        first = client.post("/media", json=payload, headers={"Idempotency-Key": key})
+        retry = client.post("/media", json=payload, headers={"Idempotency-Key": key})
+        no_key = client.post("/media", json=payload)
+
+        assert first.status_code == retry.status_code == 201
+        assert retry.content == first.content  # Побайтно тот же ответ
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert "idempotent-replayed" not in first.headers
+        assert no_key.status_code == 409  # Без ключа - прежнее поведение
+        assert len(client.get("/media").json()) == 1
+
+    def test_same_key_with_another_body_is_rejected(self, client: TestClient):
+        key = str(uuid.uuid4())
+        client.post(
+            "/media",
+            json={"title": "First", "kind": "movie", "year": 2001},
+            headers={"Idempotency-Key": key},
+        )
+        response = client.post(
+            "/media",
+            json={"title": "Second", "kind": "movie", "year": 2001},
+            headers={"Idempotency-Key": key},
+        )
+
+        assert response.status_code == 422
+        assert response.json()["detail"] == (
+            "This Idempotency-Key was already used for a different request"
+        )
+        assert len(client.get("/media").json()) == 1
+
+    def test_invalid_key_is_rejected(self, client: TestClient):
+        response = client.post(
+            "/media",
+            json={"title": "Long key", "kind": "movie", "year": 2001},
+            headers={"Idempotency-Key": "k" * 256},
+        )
+        assert response.status_code == 400
+
+
+def test_concurrent_duplicates_wait_for_the_first_response(run):
+    async def scenario():
+        app, calls, release = make_app()
+        release.clear()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(post(client, "k1"))
+            await asyncio.sleep(0.05)
+            duplicates = [asyncio.ensure_future(post(client, "k1")) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await first, await asyncio.gather(*duplicates), calls
+
+    first, duplicates, calls = run(scenario())
+
+    assert len(calls) == 1  # Обработчик выполнен один раз
+    assert first.status_code == 201
+    assert all(d.status_code == 201 and d.content == first.content for d in duplicates)
+    assert all(d.headers["idempotent-replayed"] == "true" for d in duplicates)
+
+
+def test_duplicate_gets_409_when_the_first_request_outlives_the_wait(run):
+    async def scenario():
+        app, calls, release = make_app(wait_seconds=0.05)
+        release.clear()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(post(client, "k1"))
+            await asyncio.sleep(0.02)
+            duplicate = await post(client, "k1")
+            release.set()
+            return await first, duplicate
+
+    first, duplicate = run(scenario())
+
+    assert first.status_code == 201
+    assert duplicate.status_code == 409
+    assert duplicate.headers["retry-after"] == "1"
+
+
+def test_transient_errors_and_other_users_are_not_replayed(run):
+    async def scenario():
+        app, calls, _ = make_app()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            failed = await post(client, "k1", {"fail": True})
+            retried = await post(client, "k1", {"fail": True})
+            other_user = await post(client, "k1", {"fail": True}, user="2")
+            anonymous = await client.post("/orders", json={}, headers={"Idempotency-Key": "k1"})
+            return [failed, retried, other_user, anonymous], calls
+
+    responses, calls = run(scenario())
+
+    assert [r.status_code for r in responses] == [503, 503, 503, 201]
+    assert len(calls) == 4  # 5xx не сохраняется; ключ - в пределах пользователя
+
+
+def test_cache_is_bounded_and_entries_expire():
+    response = StoredResponse(b"f", 201, [(b"content-type", b"application/json")], b"x" * 10)
+    cache = IdempotencyCache(max_entries=2, max_bytes=1024, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.put((1, key), response)
+    assert len(cache) == 2 and cache.get((1, "a")) is None
+
+    expired = IdempotencyCache(ttl=0)
+    expired.put((1, "a"), response)
+    assert expired.get((1, "a")) is None and len(expired) == 0
+
+
+@needs_postgres
+def test_sql_store_shares_responses_between_workers(run):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from app.core.database import create_database_url
+
+    user = 900_000_000 + uuid.uuid4().int % 1_000_000
+
+    async def scenario():
+        engine = create_async_engine(create_database_url("asyncpg"), poolclass=NullPool)
+        store = SqlIdempotencyStore(engine, ttl=60, lease=60)
+        try:
+            # Два воркера: у каждого свой LRU, таблица общая
+            first_app, calls, _ = make_app(store=store)
+            second_app, second_calls, _ = make_app(store=store)
+            responses = []
+            for app in (first_app, second_app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    responses.append(await post(client, "k1", user=str(user)))
+
+            # Аренда: ключ занят, пока первый запрос не завершён
+            assert await store.reserve(user, "k2", b"f") is None
+            with pytest.raises(KeyInFlight):
+                await store.reserve(user, "k2", b"f")
+            await store.release(user, "k2")
+            assert await store.reserve(user, "k2", b"f") is None
+
+            async with engine.begin() as conn:
+                await conn.execute(
+                    text(
+                        "UPDATE idempotency_keys SET expires_at = now() - interval '1 second' "
+                        "WHERE user_id = :u"
+                    ),
+                    {"u": user},
+                )
+            purged = await store.purge()
+            return responses, calls, second_calls, purged
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    text("DELETE FROM idempotency_keys WHERE user_id = :u"), {"u": user}
+                )
+            await engine.dispose()
+
+    (first, replayed), calls, second_calls, purged = run(scenario())
+
+    assert len(calls) == 1 and second_calls == []
+    assert replayed.content == first.content
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert purged >= 2
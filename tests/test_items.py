@@ -0,0 +1,139 @@
+"""Tests for the /items store"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.crud.items import (
+    ROTATED_WAL_FILE,
+    SNAPSHOT_FILE,
+    WAL_FILE,
+    ItemStore,
+    ItemStoreCorrupt,
+    ItemStoreFull,
+)
+
+
+def test_create_and_get_item(client: TestClient):
+    created = client.post("/items?name=first", headers={"Content-Type": "application/json"})
+    assert created.status_code == 200
+    item_id = created.json()["id"]
+
+    r = client.get(f"/items/{item_id}")
+    assert r.status_code == 200
+    assert r.json() == {"id": item_id, "name": "first"}
+
+
+def test_concurrent_creates_get_unique_ids():
+    store = ItemStore(data_dir=None)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        items = list(pool.map(lambda i: store.create(f"item {i}"), range(500)))
+    assert sorted(item.id for item in items) == list(range(1, 501))
+    assert len(store) == 500
+
+
+def test_store_is_bounded():
+    store = ItemStore(data_dir=None, max_items=2)
+    store.create("a")
+    store.create("b")
+    with pytest.raises(ItemStoreFull):
+        store.create("c")
+
+
+def test_wal_survives_restart(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    store.create("a")
+    store.create("b")
+    # Процесс "упал": ни snapshot, ни close
+
+    restored = ItemStore(data_dir=str(tmp_path))
+    assert restored.open() == 2
+    assert restored.get(2).name == "b"
+    assert restored.create("c").id == 3  # Счётчик id продолжается
+
+
+def test_snapshot_compacts_wal(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    for i in range(10):
+        store.create(f"item {i}")
+    assert store.snapshot() == 10
+    assert os.path.getsize(tmp_path / WAL_FILE) == 0
+    store.create("after snapshot")
+    store.close()
+
+    restored = ItemStore(data_dir=str(tmp_path))
+    assert restored.open() == 11
+    assert restored.get(11).name == "after snapshot"
+    assert (tmp_path / SNAPSHOT_FILE).exists()
+
+
+def test_truncated_wal_tail_is_ignored(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    store.create("complete")
+    with open(tmp_path / WAL_FILE, "ab") as f:
+        f.write(b'{"id":2,"na')  # Сбой посреди записи
+
+    restored = ItemStore(data_dir=str(tmp_path))
+    assert restored.open() == 1
+    assert restored.get(1).name == "complete"
+    restored.create("next")
+
+    again = ItemStore(data_dir=str(tmp_path))
+    assert again.open() == 2
+    assert again.get(2).name == "next"
+
+
+def test_failed_snapshot_keeps_rotated_wal_records(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    store.create("before first snapshot")
+    # snapshot падает после ротации WAL: записи остаются только в старом WAL
+    (tmp_path / (SNAPSHOT_FILE + ".tmp")).mkdir()
+    with pytest.raises(OSError):
+        store.snapshot()
+    store.create("before second snapshot")
+    with pytest.raises(OSError):
+        store.snapshot()  # Старый WAL не затирается: текущий дописывается к нему
+    store.create("after")
+    # Процесс "упал"
+
+    restored = ItemStore(data_dir=str(tmp_path))
+    assert restored.open() == 3
+    assert [restored.get(i).name for i in (1, 2, 3)] == [
+        "before first snapshot",
+        "before second snapshot",
+        "after",
+    ]
+    (tmp_path / (SNAPSHOT_FILE + ".tmp")).rmdir()
+    assert restored.snapshot() == 3
+    assert not (tmp_path / ROTATED_WAL_FILE).exists()
+
+
+def test_damaged_snapshot_is_an_error(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    for name in ("a", "b", "c"):
+        store.create(name)
+    store.close()
+    lines = (tmp_path / SNAPSHOT_FILE).read_bytes().splitlines(keepends=True)
+    (tmp_path / SNAPSHOT_FILE).write_bytes(lines[0] + b'{"id":2,"na\n' + lines[2])
+
+    with pytest.raises(ItemStoreCorrupt, match="line 2"):
+        ItemStore(data_dir=str(tmp_path)).open()
+
+
+def test_damaged_record_inside_wal_is_an_error(tmp_path):
+    store = ItemStore(data_dir=str(tmp_path))
+    store.open()
+    store.create("a")
+    with open(tmp_path / WAL_FILE, "ab") as f:
+        f.write(b"garbage\n")
+    store.create("b")  # После испорченной строки - не оборванный хвост
+
+    with pytest.raises(ItemStoreCorrupt):
+        ItemStore(data_dir=str(tmp_path)).open()
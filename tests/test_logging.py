@@ -0,0 +1,107 @@
+"""Tests for structured logging and request correlation"""
+
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.core.context import correlation_id
+from app.core.logs import CorrelationIdFilter, JsonFormatter, NonBlockingQueueHandler
+from app.middleware.access_log import AccessLogMiddleware
+from app.middleware.correlation import CorrelationIdMiddleware
+
+
+def _pipeline():
+    """Логгер -> NonBlockingQueueHandler -> QueueListener -> JSON в StringIO"""
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(100))
+    handler.addFilter(CorrelationIdFilter())
+    logger = logging.getLogger("test.structured")
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    return logger, QueueListener(handler.queue, output), stream
+
+
+def test_json_lines_carry_correlation_id_extras_and_traceback():
+    logger, listener, stream = _pipeline()
+    listener.start()
+    token = correlation_id.set("req-1")
+    try:
+        logger.info("created %s", "evil\ninjected", extra={"media_id": 5})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+    finally:
+        correlation_id.reset(token)
+        listener.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2  # Перевод строки из данных не порождает фальшивую запись
+    first, second = (json.loads(line) for line in lines)
+    assert first["message"] == "created evil\ninjected"
+    assert first["correlation_id"] == "req-1"
+    assert first["media_id"] == 5
+    assert first["level"] == "info"
+    assert "ValueError: boom" in second["exc_info"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    record = logging.makeLogRecord({"msg": "x"})
+    handler.handle(record)
+    handler.handle(record)  # Не блокирует и не бросает
+
+    assert handler.queue.qsize() == 1
+
+
+def _app(rng, slow_ms=500.0):
+    app = FastAPI()
+
+    @app.get("/ok")
+    def ok():
+        return {"status": "ok"}
+
+    @app.get("/missing")
+    def missing():
+        return JSONResponse({"detail": "nope"}, status_code=404)
+
+    app.add_middleware(AccessLogMiddleware, sample_rate=0.1, slow_ms=slow_ms, rng=rng)
+    app.add_middleware(CorrelationIdMiddleware)
+    return TestClient(app)
+
+
+def test_access_log_samples_only_successful_requests(caplog):
+    client = _app(rng=lambda: 0.99)
+    with caplog.at_level(logging.INFO, logger="app.access"):
+        client.get("/ok")
+        client.get("/missing", headers={"X-Correlation-ID": "abc"})
+
+    records = [r for r in caplog.records if r.name == "app.access"]
+    assert [(r.path, r.status) for r in records] == [("/missing", 404)]
+    assert records[0].sampled is False
+
+
+def test_access_log_keeps_sampled_and_slow_requests(caplog):
+    with caplog.at_level(logging.INFO, logger="app.access"):
+        _app(rng=lambda: 0.01).get("/ok")
+        _app(rng=lambda: 0.99, slow_ms=0).get("/ok")
+
+    records = [r for r in caplog.records if r.name == "app.access"]
+    assert [r.sampled for r in records] == [True, False]
+
+
+def test_problem_echoes_request_correlation_id(client: TestClient):
+    response = client.get("/media/999", headers={"X-Correlation-ID": "trace-me"})
+
+    assert response.status_code == 404
+    assert response.headers["x-correlation-id"] == "trace-me"
+    assert response.json()["correlation_id"] == "trace-me"
@@ -0,0 +1,189 @@
+"""Tests for GET /media sorting/range filters and their index coverage"""
+
+import itertools
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.crud.sql_storage import build_media_list_query
+from app.schemas.media import MediaKind, MediaSortField, SortOrder, WatchStatus
+from scripts.query_audit import summarize_plan
+
+PLAN_USER_BASE = 800_000_000
+PLAN_USERS = 200
+PLAN_ITEMS_PER_USER = 500
+
+
+def plan_sorts(plan: dict):
+    if plan["Node Type"] in ("Sort", "Incremental Sort"):
+        yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_sorts(child)
+
+
+def plan_relations(plan: dict):
+    if "Relation Name" in plan:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from plan_relations(child)
+
+
+COMBINATIONS = list(
+    itertools.product(
+        list(MediaSortField),
+        list(SortOrder),
+        [None, MediaKind.MOVIE],
+        [None, WatchStatus.WATCHED],
+        [{}, {"year_min": 1990, "year_max": 2010}, {"rating_min": 7}],
+    )
+)
+
+
+@pytest.fixture(scope="module")
+def list_plans():
+    """EXPLAIN каждой комбинации с настройками планировщика по умолчанию
+
+    Данные - PLAN_USERS пользователей по PLAN_ITEMS_PER_USER записей, после ANALYZE.
+    Всё в одной транзакции с откатом; повторный ANALYZE возвращает статистику пустой
+    таблицы (reltuples ANALYZE пишет вне транзакции).
+    """
+    from app.core.database import sync_engine
+
+    if sync_engine is None:
+        pytest.skip("EXPLAIN требует PostgreSQL (MEDIA_STORAGE=memory)")
+
+    plans = {}
+    with sync_engine.connect() as conn:
+        conn.execute(
+            text(
+                """
+                INSERT INTO media (title, title_norm, kind, year, user_id, status, rating)
+                SELECT 'Title ' || i,
+                       'title ' || i,
+                       (ARRAY['MOVIE','SERIES','COURSE','BOOK','PODCAST'])[1 + i % 5]::mediakind,
+                       1950 + i % 75,
+                       :base + u,
+                       (ARRAY['TO_WATCH','WATCHING','WATCHED'])[1 + (i / 7) % 3]::watchstatus,
+                       CASE WHEN i % 3 = 0 THEN NULL ELSE 1 + i % 10 END
+                FROM generate_series(1, :users) AS u, generate_series(1, :items) AS i
+                """
+            ),
+            {"base": PLAN_USER_BASE, "users": PLAN_USERS, "items": PLAN_ITEMS_PER_USER},
+        )
+        conn.execute(text("ANALYZE media"))
+        for combination in COMBINATIONS:
+            sort, order, kind, status, ranges = combination
+            query = build_media_list_query(PLAN_USER_BASE + 1, kind, status, sort, order, **ranges)
+            sql = str(query.compile(sync_engine, compile_kwargs={"literal_binds": True}))
+            raw = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            plan = (raw if isinstance(raw, list) else json.loads(raw))[0]["Plan"]
+            plans[sort, order, kind, status, tuple(ranges.items())] = (sql, plan)
+        # Индексы партиций (ix_..._p13, media_p13_..._idx) - под именами индексов родителя
+        parents = dict(
+            conn.execute(
+                text(
+                    "SELECT c.relname, p.relname FROM pg_inherits i "
+                    "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent"
+                )
+            ).all()
+        )
+        conn.rollback()
+        conn.execute(text("ANALYZE media"))
+        conn.commit()
+    return {
+        key: (sql, plan, summarize_plan(plan, parents, max_sort_rows=PLAN_ITEMS_PER_USER))
+        for key, (sql, plan) in plans.items()
+    }
+
+
+def test_kind_and_status_filters_have_range_indexes():
+    from app.models.media import RANGE_COLUMNS, MediaModel
+
+    indexed = {tuple(c.name for c in index.columns) for index in MediaModel.__table__.indexes}
+    for field in RANGE_COLUMNS:
+        assert ("user_id", field) in indexed
+        for column in ("kind", "status"):
+            assert ("user_id", column, field) in indexed
+
+
+@pytest.mark.parametrize("sort,order,kind,status,ranges", COMBINATIONS)
+def test_list_query_reads_only_the_users_rows(list_plans, sort, order, kind, status, ranges):
+    """EXPLAIN: индекс по user_id, одна партиция, Sort - не больше строк пользователя
+
+    Критерий приёмки сужен (docs/adr/ADR-006): порядок индексом не обеспечивается,
+    в плане допустим один Sort в памяти, но только по строкам одного пользователя.
+    """
+    sql, plan, summary = list_plans[sort, order, kind, status, tuple(ranges.items())]
+
+    assert summary["seq_scans"] == [], sql
+    assert summary["indexes"], sql
+    assert len(set(plan_relations(plan))) == 1, sql  # partition pruning
+    sorts = list(plan_sorts(plan))
+    assert len(sorts) <= 1, sql
+    assert all(node["Plan Rows"] <= PLAN_ITEMS_PER_USER for node in sorts), sql
+    assert summary["sorts"] == 0, sql
+
+
+def test_every_list_filter_index_is_used(list_plans):
+    """Индексы фильтров GET /media не лишние: каждый выбирает хотя бы один план"""
+    from app.models.media import RANGE_COLUMNS
+
+    used = set()
+    for _, _, summary in list_plans.values():
+        used.update(summary["indexes"])
+    expected = {f"ix_media_user_{field}" for field in RANGE_COLUMNS} | {
+        f"ix_media_user_{column}_{field}"
+        for column in ("kind", "status")
+        for field in RANGE_COLUMNS
+    }
+    assert expected - used == set()
+
+
+class TestMediaSorting:
+    """Тесты сортировки и диапазонных фильтров"""
+
+    def _seed(self, client: TestClient):
+        items = [
+            ("Alpha", 1995, 6),
+            ("Bravo", 2005, 9),
+            ("Charlie", 2015, None),
+        ]
+        for title, year, rating in items:
+            media_id = client.post(
+                "/media", json={"title": title, "kind": "movie", "year": year}
+            ).json()["id"]
+            if rating is not None:
+                client.patch(
+                    f"/media/{media_id}/status", json={"status": "watched", "rating": rating}
+                )
+
+    def test_sort_by_year_both_directions(self, client: TestClient):
+        self._seed(client)
+
+        asc = client.get("/media?sort=year&order=asc").json()
+        desc = client.get("/media?sort=year&order=desc").json()
+
+        assert [m["year"] for m in asc] == [1995, 2005, 2015]
+        assert [m["year"] for m in desc] == [2015, 2005, 1995]
+
+    def test_sort_by_title(self, client: TestClient):
+        self._seed(client)
+        titles = [m["title"] for m in client.get("/media?sort=title&order=asc").json()]
+        assert titles == ["Alpha", "Bravo", "Charlie"]
+
+    def test_year_range_filter(self, client: TestClient):
+        self._seed(client)
+        titles = [m["title"] for m in client.get("/media?year_min=2000&year_max=2010").json()]
+        assert titles == ["Bravo"]
+
+    def test_rating_min_filter(self, client: TestClient):
+        self._seed(client)
+        titles = [m["title"] for m in client.get("/media?rating_min=7").json()]
+        assert titles == ["Bravo"]
+
+    def test_invalid_sort_and_range_rejected(self, client: TestClient):
+        assert client.get("/media?sort=description").status_code == 422
+        assert client.get("/media?year_min=2010&year_max=2000").status_code == 422
+        assert client.get("/media?rating_min=11").status_code == 422
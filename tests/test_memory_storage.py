@@ -0,0 +1,139 @@
+"""Tests for the in-memory storage backend"""
+
+import itertools
+from datetime import timedelta
+
+import pytest
+
+from app.crud.memory_storage import InMemoryMediaStorage
+from app.schemas.media import (
+    MediaCreate,
+    MediaKind,
+    MediaSortField,
+    MediaStatusUpdate,
+    MediaUpdate,
+    SortOrder,
+    WatchStatus,
+)
+
+
+def reference_sort(rows, sort, order):
+    """Порядок, который вернул бы PostgreSQL (NULLS LAST при ASC)"""
+    if sort == MediaSortField.RATING:
+        key = lambda m: (m.rating is None, m.rating or 0, m.id)  # noqa: E731
+    elif sort == MediaSortField.CREATED_AT:
+        key = lambda m: (m.created_at, m.id)  # noqa: E731
+    else:
+        key = lambda m: (getattr(m, sort.value), m.id)  # noqa: E731
+    return sorted(rows, key=key, reverse=order == SortOrder.DESC)
+
+
+@pytest.fixture
+def storage(run):
+    storage = InMemoryMediaStorage()
+    kinds = list(MediaKind)
+    statuses = list(WatchStatus)
+    for i in range(60):
+        media = run(
+            storage.create(
+                None,
+                MediaCreate(
+                    title=f"Title {i % 17}", kind=kinds[i % len(kinds)], year=1980 + i % 40
+                ),
+                user_id=1,
+            )
+        )
+        if i % 3:
+            run(
+                storage.update_status(
+                    None,
+                    media.id,
+                    MediaStatusUpdate(
+                        status=statuses[i % len(statuses)], rating=(i % 10) + 1 if i % 4 else None
+                    ),
+                    user_id=1,
+                )
+            )
+    run(storage.create(None, MediaCreate(title="Other", kind=MediaKind.MOVIE, year=2000), 2))
+    return storage
+
+
+@pytest.mark.parametrize(
+    "sort,order,kind,status,ranges",
+    list(
+        itertools.product(
+            list(MediaSortField),
+            list(SortOrder),
+            [None, MediaKind.MOVIE],
+            [None, WatchStatus.WATCHED],
+            [{}, {"year_min": 1990, "year_max": 2010}, {"rating_min": 7}],
+        )
+    ),
+)
+def test_list_matches_full_scan(run, storage, sort, order, kind, status, ranges):
+    result = run(storage.list_media(None, 1, kind, status, sort, order, **ranges))
+
+    everything = run(storage.list_media(None, 1))
+    expected = [
+        m
+        for m in everything
+        if (kind is None or m.kind == kind)
+        and (status is None or m.status == status)
+        and m.year >= ranges.get("year_min", 0)
+        and m.year <= ranges.get("year_max", 9999)
+        and ("rating_min" not in ranges or (m.rating or 0) >= ranges["rating_min"])
+    ]
+    assert [m.id for m in result] == [m.id for m in reference_sort(expected, sort, order)]
+
+
+def test_user_isolation(run, storage):
+    assert [m.title for m in run(storage.list_media(None, 2))] == ["Other"]
+    assert run(storage.get_by_id(None, 1, user_id=2)) is None
+    assert run(storage.delete(None, 1, user_id=2)) is False
+
+
+def test_duplicate_index_follows_updates(run, storage):
+    media = run(storage.get_by_id(None, 1, 1))
+    assert run(storage.exists(None, "title 0", 1980, media.kind, 1))  # Case-insensitive
+    run(storage.update(None, 1, MediaUpdate(title="Renamed", kind=media.kind, year=1999), 1))
+    assert run(storage.exists(None, "RENAMED", 1999, media.kind, 1))
+    assert not run(storage.exists(None, "title 0", 1980, media.kind, 1))
+
+
+def test_updates_are_copy_on_write(run, storage):
+    before = run(storage.get_by_id(None, 1, 1))
+    after = run(storage.update_status(None, 1, MediaStatusUpdate(status=WatchStatus.WATCHED), 1))
+    assert before is not after
+    assert before.status == WatchStatus.TO_WATCH
+    assert after.updated_at > before.updated_at
+
+
+def test_changes_since(run, storage):
+    full = run(storage.changes_since(None, 1, None))
+    assert full.full_resync and len(full.upserts) == 60
+
+    run(storage.update_status(None, 5, MediaStatusUpdate(status=WatchStatus.WATCHED), 1))
+    run(storage.delete(None, 7, 1))
+    delta = run(storage.changes_since(None, 1, full.cursor))
+    assert not delta.full_resync
+    assert [m.id for m in delta.upserts] == [5]
+    assert delta.deleted == [7]
+
+    empty = run(storage.changes_since(None, 1, delta.cursor))
+    assert empty.upserts == [] and empty.deleted == [] and empty.cursor >= delta.cursor
+
+
+def test_purge_tombstones(run, storage, monkeypatch):
+    from app.crud import memory_storage
+
+    run(storage.delete(None, 3, 1))
+    assert run(storage.purge_tombstones(None)) == 0
+    monkeypatch.setattr(memory_storage, "TOMBSTONE_RETENTION", timedelta(0))
+    assert run(storage.purge_tombstones(None)) == 1
+
+
+def test_clear_restarts_identity(run, storage):
+    run(storage.clear(None))
+    assert run(storage.list_media(None, 1)) == []
+    media = run(storage.create(None, MediaCreate(title="X", kind=MediaKind.MOVIE, year=2000), 1))
+    assert media.id == 1
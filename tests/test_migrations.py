@@ -0,0 +1,275 @@
+"""Tests for Alembic migrations, the startup schema check and concurrent index builds"""
+
+import os
+import uuid
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.migrations import (
+    SchemaMismatch,
+    SchemaOutOfDate,
+    alembic_config,
+    build_index_concurrently,
+    check_schema,
+    head_revision,
+    include_object,
+)
+from app.models import Base
+from app.models.media import MEDIA_PARTITIONS
+
+BASELINE_TABLES = ("audit_log", "media", "media_tombstones", "shard_directory")
+
+# media из create_all до миграций и партиционирования: без title_norm, tags, updated_at
+PRE_MIGRATIONS_DDL = [
+    "CREATE TYPE mediakind AS ENUM ('MOVIE', 'SERIES', 'COURSE', 'BOOK', 'PODCAST')",
+    "CREATE TYPE watchstatus AS ENUM ('TO_WATCH', 'WATCHING', 'WATCHED')",
+    """
+    CREATE TABLE media (
+        id SERIAL PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        kind mediakind NOT NULL,
+        year INTEGER NOT NULL,
+        description VARCHAR(1000),
+        user_id INTEGER NOT NULL,
+        status watchstatus NOT NULL,
+        rating INTEGER,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    )
+    """,
+    "CREATE INDEX ix_media_user_created ON media (user_id, created_at)",
+    "INSERT INTO media (title, kind, year, user_id, status) "
+    "VALUES ('The Matrix!', 'MOVIE', 1999, 1, 'TO_WATCH')",
+]
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+
+
+@pytest.fixture
+def scratch_url():
+    """Пустая временная БД: миграции с нуля, без схемы тестов"""
+    from app.core.database import create_database_url
+    from app.core.sharding import ShardSpec
+
+    name = f"migration_test_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(
+        create_database_url("psycopg2"), poolclass=NullPool, isolation_level="AUTOCOMMIT"
+    )
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    try:
+        yield lambda driver: create_database_url(driver, ShardSpec("scratch", name))
+    finally:
+        with admin.connect() as conn:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin.dispose()
+
+
+def _migrate(url: str, revision: str = "head", downgrade: bool = False, connect_args=None) -> None:
+    engine = create_engine(url, poolclass=NullPool, connect_args=connect_args or {})
+    try:
+        with engine.connect() as conn:
+            step = command.downgrade if downgrade else command.upgrade
+            step(alembic_config(conn), revision)
+    finally:
+        engine.dispose()
+
+
+async def _check(url: str, connect_args=None) -> None:
+    engine = create_async_engine(url, poolclass=NullPool, connect_args=connect_args or {})
+    try:
+        await check_schema({"scratch": engine})
+    finally:
+        await engine.dispose()
+
+
+def _diff(conn) -> list:
+    context = MigrationContext.configure(conn, opts={"include_object": include_object})
+    return compare_metadata(context, Base.metadata)
+
+
+def test_migrations_build_the_model_schema_and_roll_back(run, scratch_url):
+    url = scratch_url("psycopg2")
+    with pytest.raises(SchemaOutOfDate, match="alembic upgrade head"):
+        run(_check(scratch_url("asyncpg")))
+
+    _migrate(url)
+    run(_check(scratch_url("asyncpg")))
+
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            assert _diff(conn) == []  # Миграции совпадают с моделями
+            partitions = conn.execute(
+                text("SELECT count(*) FROM pg_inherits WHERE inhparent = 'media'::regclass")
+            ).scalar_one()
+            trigger = conn.execute(
+                text("SELECT count(*) FROM pg_trigger WHERE tgname = 'audit_log_append_only'")
+            ).scalar_one()
+        assert (partitions, trigger) == (MEDIA_PARTITIONS, 1)
+
+        _migrate(url, "base", downgrade=True)
+        with engine.connect() as conn:
+            tables = conn.execute(
+                text("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+            ).all()
+        assert tables == [("alembic_version",)]
+        _migrate(url)  # downgrade обратим
+    finally:
+        engine.dispose()
+
+
+def test_baseline_adopts_a_database_created_by_create_all(run, scratch_url):
+    url = scratch_url("psycopg2")
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        # Схема до миграций: таблицы, которые знала create_all (а не текущие модели)
+        tables = [Base.metadata.tables[name] for name in BASELINE_TABLES]
+        Base.metadata.create_all(engine, tables=tables)
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO media (title, kind, year, user_id, status) "
+                    "VALUES ('Kept', 'MOVIE', 2000, 1, 'TO_WATCH')"
+                )
+            )
+        _migrate(url)
+        with engine.connect() as conn:
+            titles = conn.execute(text("SELECT title FROM media")).scalars().all()
+    finally:
+        engine.dispose()
+
+    assert titles == ["Kept"]
+    run(_check(scratch_url("asyncpg")))
+
+
+def test_baseline_alters_a_pre_migration_table_and_requires_partitioning(run, scratch_url):
+    """Старая media не принимается как есть: колонки добавляются, партиции - partition_media"""
+    from scripts.partition_media import migrate
+
+    url = scratch_url("psycopg2")
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.begin() as conn:
+            for ddl in PRE_MIGRATIONS_DDL:
+                conn.execute(text(ddl))
+
+        with pytest.raises(SchemaMismatch, match="partition_media"):
+            _migrate(url)
+        with pytest.raises(SchemaOutOfDate):
+            run(_check(scratch_url("asyncpg")))
+        with engine.connect() as conn:
+            title_norm = conn.execute(text("SELECT title_norm FROM media")).scalar_one()
+        assert title_norm == "matrix"
+
+        async def partition():
+            async_engine = create_async_engine(scratch_url("asyncpg"), poolclass=NullPool)
+            try:
+                await migrate(async_engine, batch_size=100, log=lambda message: None)
+            finally:
+                await async_engine.dispose()
+
+        run(partition())
+        _migrate(url)
+        run(_check(scratch_url("asyncpg")))
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT title, tags FROM media")).all()
+    finally:
+        engine.dispose()
+
+    assert rows == [("The Matrix!", [])]
+
+
+def test_schema_is_migrated_apart_from_public(run, scratch_url, monkeypatch):
+    """DB_SCHEMA (воркер xdist): версия и таблицы - свои, даже если public уже мигрирована"""
+    from app.core import database
+
+    _migrate(scratch_url("psycopg2"))  # public - на head
+    monkeypatch.setattr(database, "DB_SCHEMA", "worker_schema")
+    engine = create_engine(scratch_url("psycopg2"), poolclass=NullPool)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE SCHEMA worker_schema"))
+
+        with pytest.raises(SchemaOutOfDate):
+            run(_check(scratch_url("asyncpg"), database.connect_args("asyncpg")))
+        _migrate(scratch_url("psycopg2"), connect_args=database.connect_args("psycopg2"))
+        run(_check(scratch_url("asyncpg"), database.connect_args("asyncpg")))
+
+        with engine.connect() as conn:
+            tables = set(
+                conn.execute(
+                    text("SELECT tablename FROM pg_tables WHERE schemaname = 'worker_schema'")
+                ).scalars()
+            )
+    finally:
+        engine.dispose()
+
+    assert {"alembic_version", "media", "idempotency_keys"} <= tables
+
+
+def _index_state(conn, name: str):
+    valid = conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"), {"n": name}
+    ).scalar()
+    attached = conn.execute(
+        text("SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(:n)"), {"n": name}
+    ).scalar_one()
+    return valid, attached
+
+
+def test_concurrent_index_build_on_partitioned_and_plain_tables(scratch_url):
+    url = scratch_url("psycopg2")
+    _migrate(url)
+    engine = create_engine(url, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO media (title, kind, year, user_id, status) "
+                    "SELECT 'T' || i, 'MOVIE', 1990 + i % 30, i % 50, 'TO_WATCH' "
+                    "FROM generate_series(1, 2000) i"
+                )
+            )
+            # Как после прерванной сборки: invalid индекс на одной партиции
+            conn.execute(text("CREATE INDEX ix_media_year_rating ON ONLY media (year, rating)"))
+            conn.execute(text("CREATE INDEX ix_media_year_rating_p00 ON media_p00 (year)"))
+            conn.execute(
+                text(
+                    "UPDATE pg_index SET indisvalid = false "
+                    "WHERE indexrelid = 'ix_media_year_rating_p00'::regclass"
+                )
+            )
+
+            build_index_concurrently(conn, "ix_media_year_rating", "media", "(year, rating)")
+            build_index_concurrently(conn, "ix_media_year_rating", "media", "(year, rating)")
+            partitioned = _index_state(conn, "ix_media_year_rating")
+            build_index_concurrently(conn, "ix_tombstones_media", "media_tombstones", "(media_id)")
+            plain = _index_state(conn, "ix_tombstones_media")
+            columns = conn.execute(
+                text("SELECT pg_get_indexdef('ix_media_year_rating_p00'::regclass)")
+            ).scalar_one()
+    finally:
+        engine.dispose()
+
+    assert partitioned == (True, MEDIA_PARTITIONS)
+    assert plain == (True, 0)
+    assert "(year, rating)" in columns  # Invalid индекс пересоздан
+
+
+def test_revisions_form_a_single_line():
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory.from_config(alembic_config())
+    assert script.get_heads() == [head_revision()]
+    assert [rev.revision for rev in script.walk_revisions()][::-1] == [
+        "0001",
+        "0002",
+    ]
@@ -0,0 +1,190 @@
+"""Tests for the hash-partitioned media table and its migration (PostgreSQL only)"""
+
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.models.media import MEDIA_PARTITIONS, MediaModel
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+
+# media до партиционирования: PK (id), те же колонки и часть индексов
+LEGACY_DDL = [
+    """
+    CREATE TABLE media (
+        id SERIAL PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        title_norm VARCHAR(200) NOT NULL DEFAULT '',
+        kind mediakind NOT NULL,
+        year INTEGER NOT NULL,
+        description VARCHAR(1000),
+        user_id INTEGER NOT NULL,
+        status watchstatus NOT NULL,
+        rating INTEGER,
+        tags VARCHAR(50)[] NOT NULL DEFAULT '{}',
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX ix_media_user_created ON media (user_id, created_at)",
+    """
+    CREATE TABLE media_tombstones (
+        id SERIAL PRIMARY KEY,
+        media_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+INSERT_ROWS = text(
+    "INSERT INTO media (title, kind, year, user_id, status) "
+    "SELECT 'Title ' || i, 'MOVIE', 2000, 1 + i % 7, 'TO_WATCH' FROM generate_series(1, :n) i"
+)
+
+
+def _engine(search_path=None):
+    from app.core.database import connect_args, create_database_url
+
+    args = connect_args("asyncpg")
+    if search_path:
+        args = {"server_settings": {"search_path": search_path}}
+    return create_async_engine(
+        create_database_url("asyncpg"), poolclass=NullPool, connect_args=args
+    )
+
+
+def test_media_is_hash_partitioned_with_indexes_on_every_partition(run):
+    from scripts.partition_media import _index_names, layout
+
+    async def scenario():
+        engine = _engine()
+        try:
+            async with engine.connect() as conn:
+                kind, partitions = await layout(conn)
+                rows = await conn.execute(
+                    text(
+                        "SELECT p.relname, count(i.indexrelid) FROM pg_inherits h "
+                        "JOIN pg_class p ON p.oid = h.inhrelid "
+                        "LEFT JOIN pg_index i ON i.indrelid = p.oid "
+                        "WHERE h.inhparent = to_regclass('media') GROUP BY p.relname"
+                    )
+                )
+                per_partition = dict(rows.all())
+                parent_indexes = set(await _index_names(conn, "media"))
+            return kind, partitions, per_partition, parent_indexes
+        finally:
+            await engine.dispose()
+
+    kind, partitions, per_partition, parent_indexes = run(scenario())
+    assert (kind, partitions) == ("p", MEDIA_PARTITIONS)
+    assert {index.name for index in MediaModel.__table__.indexes} < parent_indexes
+    assert set(per_partition.values()) == {len(parent_indexes)}
+
+
+def test_every_crud_query_reads_one_partition(run):
+    from app.core.database import create_database_url
+    from scripts.query_audit import FULL_SCAN_PATTERNS, find_regressions, run_audit
+
+    result = run(run_audit(create_database_url("asyncpg"), users=3, items_per_user=20))
+
+    assert not [p for p in find_regressions(result) if "partition pruning" in p]
+    # Кроме админской статистики по всему шарду
+    media_queries = [
+        entry
+        for name, entries in result["patterns"].items()
+        if name not in FULL_SCAN_PATTERNS
+        for entry in entries
+        if entry["partitions"]
+    ]
+    assert {entry["partitions"] for entry in media_queries} == {1}
+    assert result["patterns"]["get_media_by_id"][0]["partitions"] == 1
+
+
+def test_migration_moves_rows_changes_and_sequence(run):
+    from scripts import partition_media
+
+    schema = f"partition_test_{uuid.uuid4().hex[:8]}"
+    base = os.getenv("DB_SCHEMA") or "public"
+    logs = []
+
+    async def scenario():
+        admin = _engine()
+        engine = _engine(f"{schema},{base},public")
+        async with admin.begin() as conn:
+            await conn.execute(text(f"CREATE SCHEMA {schema}"))
+        try:
+            async with engine.begin() as conn:
+                for ddl in LEGACY_DDL:
+                    await conn.execute(text(ddl))
+                await conn.execute(INSERT_ROWS, {"n": 50})
+
+            # Запись во время копирования: изменение, удаление (с tombstone) и вставка
+            copy_rows = partition_media.copy_rows
+
+            async def copy_with_traffic(engine_, batch_size, log):
+                total = await copy_rows(engine_, batch_size, log)
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        text("UPDATE media SET title = 'Changed', updated_at = now() WHERE id = 3")
+                    )
+                    await conn.execute(
+                        text(
+                            "INSERT INTO media_tombstones (media_id, user_id) "
+                            "SELECT id, user_id FROM media WHERE id = 4"
+                        )
+                    )
+                    await conn.execute(text("DELETE FROM media WHERE id = 4"))
+                    await conn.execute(INSERT_ROWS, {"n": 1})
+                return total
+
+            partition_media.copy_rows = copy_with_traffic
+            try:
+                migrated = await partition_media.migrate(
+                    engine, partitions=4, batch_size=20, log=logs.append
+                )
+            finally:
+                partition_media.copy_rows = copy_rows
+
+            async with engine.begin() as conn:
+                kind, partitions = await partition_media.layout(conn)
+                ids = [row[0] for row in await conn.execute(text("SELECT id FROM media"))]
+                title = (
+                    await conn.execute(text("SELECT title FROM media WHERE id = 3"))
+                ).scalar_one()
+                new_id = (
+                    await conn.execute(
+                        text(
+                            "INSERT INTO media (title, kind, year, user_id, status) "
+                            "VALUES ('After', 'BOOK', 2001, 1, 'TO_WATCH') RETURNING id"
+                        )
+                    )
+                ).scalar_one()
+                indexes = await partition_media._index_names(conn, "media")
+                again = await partition_media.migrate(engine, partitions=4, log=logs.append)
+                old_kind, _ = await partition_media.layout(conn, "media_old")
+            return migrated, kind, partitions, ids, title, new_id, indexes, again, old_kind
+        finally:
+            await engine.dispose()
+            async with admin.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            await admin.dispose()
+
+    migrated, kind, partitions, ids, title, new_id, indexes, again, old_kind = run(scenario())
+
+    assert migrated and (kind, partitions) == ("p", 4)
+    assert sorted(ids) == [i for i in range(1, 52) if i != 4]
+    assert title == "Changed"
+    assert new_id == 52  # media_id_seq перешла к новой таблице
+    # Индекс колонки, которой у старой таблицы нет, строит миграция (0001), а не перенос
+    expected = {index.name for index in MediaModel.__table__.indexes} - {"ix_media_user_change_xid"}
+    assert expected | {"media_pkey"} == set(indexes)
+    assert again is False
+    assert old_kind == "r"  # Старая таблица - для отката
+    assert any(line.startswith("swapped") for line in logs)
@@ -0,0 +1,182 @@
+"""Tests for the sampling profiler (/debug/profile)"""
+
+import asyncio
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import profiler
+from app.core.profiler import ContinuousProfiler, OnDemandProfiler, Profile, StackSampler
+
+
+def busy_handler(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_handler, args=(stop,), name="busy-worker")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def _leaf_names(profile: Profile, thread: str):
+    return {
+        frame.split(" (")[0]
+        for stack, _ in profile.stacks.items()
+        if stack[0] == thread
+        for frame in stack[1:]
+    }
+
+
+def test_collapsed_and_speedscope_formats():
+    profile = Profile(interval=0.01)
+    profile.add([("event-loop", "main (app/main.py:1)", "handler (app/api/media.py:10)")])
+    profile.add([("event-loop", "main (app/main.py:1)", "handler (app/api/media.py:10)")])
+    profile.add([("asyncio_0", "_worker (concurrent/futures/thread.py:69)", "[truncated]")])
+
+    assert profile.collapsed().splitlines() == [
+        "asyncio_0;_worker (concurrent/futures/thread.py:69);[truncated] 1",
+        "event-loop;main (app/main.py:1);handler (app/api/media.py:10) 2",
+    ]
+    document = profile.speedscope()
+    frames = document["shared"]["frames"]
+    loop, worker = document["profiles"]  # event loop - первым
+    assert loop["name"] == "event-loop"
+    assert [[frames[i]["name"] for i in sample] for sample in loop["samples"]] == [
+        ["main", "handler"]
+    ]
+    assert loop["weights"] == [20.0] and loop["endValue"] == 20.0
+    assert frames[loop["samples"][0][1]] == {
+        "name": "handler",
+        "file": "app/api/media.py",
+        "line": 10,
+    }
+    assert frames[worker["samples"][0][1]] == {"name": "[truncated]"}
+
+
+def test_sampler_sees_busy_threads_and_skips_idle_ones(busy_thread):
+    idle = threading.Event()
+    waiter = threading.Thread(target=idle.wait, name="idle-waiter")
+    waiter.start()
+    try:
+        profile = Profile(interval=0.001)
+        sampler = StackSampler(profile.add)
+        for _ in range(20):
+            profile.add(sampler.sample())
+        with_idle = StackSampler(profile.add, include_idle=True).sample()
+    finally:
+        idle.set()
+        waiter.join()
+
+    threads = {stack[0] for stack in profile.stacks}
+    assert "busy_handler" in _leaf_names(profile, "busy-worker")
+    assert "idle-waiter" not in threads
+    assert "idle-waiter" in {stack[0] for stack in with_idle}
+
+
+def test_max_depth_truncates_root_side():
+    def recurse(n):
+        if n == 0:
+            return StackSampler(lambda stacks: None, max_depth=5)._walk(sys._getframe())
+        return recurse(n - 1)
+
+    labels = recurse(20)
+    assert labels[0] == "[truncated]"
+    assert len(labels) == 6
+    assert labels[-1].startswith("recurse ")
+
+
+def test_on_demand_session_labels_event_loop_and_is_exclusive(run, busy_thread):
+    on_demand = OnDemandProfiler()
+
+    async def scenario():
+        session = asyncio.ensure_future(on_demand.record(0.2, interval=0.005))
+        await asyncio.sleep(0.05)
+        time.sleep(0.05)  # Блокирующий вызов в event loop попадает в профиль
+        with pytest.raises(profiler.ProfilerBusy):
+            await on_demand.record(0.1)
+        return await session
+
+    profile = run(scenario())
+    assert profile.samples > 10
+    assert "scenario" in _leaf_names(profile, "event-loop")
+    assert "busy_handler" in _leaf_names(profile, "busy-worker")
+    assert not on_demand.running
+    assert not any(t.name == profiler.SAMPLER_THREAD for t in threading.enumerate())
+
+
+def test_continuous_profiler_keeps_rolling_window(busy_thread):
+    continuous = ContinuousProfiler(interval=0.002, window_seconds=0.05, windows=2)
+    continuous.start()
+    try:
+        time.sleep(0.3)
+    finally:
+        continuous.stop()
+
+    assert len(continuous.windows) == 2  # Старые окна вытеснены
+    merged = continuous.snapshot()
+    assert merged.samples == sum(p.samples for p in (*continuous.windows, continuous.current))
+    assert "busy_handler" in _leaf_names(merged, "busy-worker")
+    assert continuous.snapshot(seconds=0.01).samples < merged.samples
+
+
+class TestProfileApi:
+    """/debug/profile: доступ и форматы"""
+
+    @pytest.fixture
+    def admin(self, client: TestClient, make_token):
+        return {"Authorization": f"Bearer {make_token(scope='media admin')}"}
+
+    def test_requires_admin_scope(self, client: TestClient):
+        response = client.get("/debug/profile?seconds=0.1")
+
+        assert response.status_code == 403
+        assert 'error="insufficient_scope"' in response.headers["www-authenticate"]
+
+    def test_collapsed_profile(self, client: TestClient, admin):
+        response = client.get("/debug/profile?seconds=0.2&idle=true", headers=admin)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert int(response.headers["x-profile-samples"]) > 0
+        stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+    def test_speedscope_profile(self, client: TestClient, admin):
+        response = client.get(
+            "/debug/profile?seconds=0.1&format=speedscope&interval_ms=5", headers=admin
+        )
+
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        assert response.json()["$schema"] == profiler.SPEEDSCOPE_SCHEMA
+
+    def test_busy_and_continuous_disabled(self, client: TestClient, admin, monkeypatch):
+        busy = OnDemandProfiler()
+        busy.running = True
+        monkeypatch.setattr(profiler, "on_demand_profiler", busy)
+        monkeypatch.setattr(profiler, "continuous_profiler", None)
+
+        assert client.get("/debug/profile?seconds=1", headers=admin).status_code == 409
+        assert client.get("/debug/profile?source=continuous", headers=admin).status_code == 404
+
+    def test_continuous_source_returns_without_waiting(
+        self, client: TestClient, admin, monkeypatch
+    ):
+        continuous = ContinuousProfiler(interval=0.01)
+        continuous.current.add([("event-loop", "handler (app/api/media.py:10)")])
+        monkeypatch.setattr(profiler, "continuous_profiler", continuous)
+
+        started = time.monotonic()
+        response = client.get("/debug/profile?source=continuous&seconds=60", headers=admin)
+
+        assert time.monotonic() - started < 5
+        assert response.text == "event-loop;handler (app/api/media.py:10) 1\n"
@@ -0,0 +1,108 @@
+"""Tests for the query-plan audit report logic (no database needed)"""
+
+from scripts.query_audit import find_regressions, summarize_plan
+
+INDEX_PLAN = {
+    "Node Type": "Index Scan",
+    "Index Name": "ix_media_user_created",
+    "Relation Name": "media",
+    "Total Cost": 12.5,
+}
+
+SEQ_SORT_PLAN = {
+    "Node Type": "Sort",
+    "Total Cost": 950.0,
+    "Plans": [{"Node Type": "Seq Scan", "Relation Name": "media", "Total Cost": 900.0}],
+}
+
+
+def test_summarize_index_plan():
+    summary = summarize_plan(INDEX_PLAN)
+    assert summary == {
+        "cost": 12.5,
+        "seq_scans": [],
+        "sorts": 0,
+        "indexes": ["ix_media_user_created"],
+        "partitions": 0,
+    }
+
+
+def test_seq_scan_and_sort_are_regressions():
+    result = {"patterns": {"get_media_list": [summarize_plan(SEQ_SORT_PLAN)]}}
+    problems = find_regressions(result)
+    assert "get_media_list: Seq Scan on media" in problems
+    assert "get_media_list: in-memory Sort" in problems
+
+
+def test_cost_growth_against_baseline():
+    result = {"patterns": {"get_media_by_id": [summarize_plan(INDEX_PLAN)]}}
+    assert find_regressions(result, {"get_media_by_id": [10.0]}) == []
+    assert find_regressions(result, {"get_media_by_id": [5.0]})
+
+
+def _append(*partitions):
+    return {
+        "Node Type": "Append",
+        "Total Cost": 40.0,
+        "Plans": [
+            {
+                "Node Type": "Index Scan",
+                "Index Name": f"{name}_user_id_created_at_idx",
+                "Relation Name": name,
+                "Total Cost": 20.0,
+            }
+            for name in partitions
+        ],
+    }
+
+
+PARENTS = {
+    "media_p00": "media",
+    "media_p01": "media",
+    "media_p00_user_id_created_at_idx": "ix_media_user_created",
+    "media_p01_user_id_created_at_idx": "ix_media_user_created",
+}
+
+
+def test_partitions_are_reported_under_parent_names():
+    summary = summarize_plan(_append("media_p01"), PARENTS)
+    assert summary["indexes"] == ["ix_media_user_created"]
+    assert summary["partitions"] == 1
+    assert find_regressions({"patterns": {"get_media_list": [summary]}}) == []
+
+
+def test_scanning_several_partitions_is_a_regression():
+    summary = summarize_plan(_append("media_p00", "media_p01"), PARENTS)
+    problems = find_regressions({"patterns": {"get_media_list": [summary]}})
+    assert problems == ["get_media_list: no partition pruning (2 partitions scanned)"]
+
+
+def _sort(rows):
+    return {
+        "Node Type": "Sort",
+        "Plan Rows": rows,
+        "Total Cost": 60.0,
+        "Plans": [dict(INDEX_PLAN, **{"Node Type": "Bitmap Heap Scan"})],
+    }
+
+
+def test_only_large_sorts_are_regressions():
+    small = summarize_plan(_sort(500))
+    large = summarize_plan(_sort(50_000))
+    assert small["sorts"] == 0 and large["sorts"] == 1
+    assert summarize_plan(_sort(500), max_sort_rows=100)["sorts"] == 1
+
+    result = {"patterns": {"get_media_list": [small], "get_tag_counts": [large]}}
+    assert find_regressions(result) == ["get_tag_counts: in-memory Sort"]
+
+
+def test_unused_index_is_a_problem():
+    result = {"patterns": {}, "unused_indexes": ["ix_media_tags"]}
+    assert find_regressions(result) == ["unused index ix_media_tags"]
+
+
+def test_full_scan_patterns_may_read_every_partition():
+    summary = summarize_plan(_append("media_p00", "media_p01"), PARENTS)
+    seq = summarize_plan(SEQ_SORT_PLAN["Plans"][0])
+    result = {"patterns": {"get_stats": [summary, seq]}}
+    assert find_regressions(result) == []
@@ -0,0 +1,142 @@
+"""Tests for the multi-process launcher and per-worker pool sizing"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.core.database import pool_size_for
+from app.middleware.admission import default_lanes
+from app.server import cgroup_cpu_limit, default_workers, parse_args, process_local_state
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork server needs os.fork")
+
+
+def test_pool_size_is_a_share_of_the_connection_budget():
+    assert pool_size_for(budget=0, workers=4, cap=20) == 20  # Без бюджета - как раньше
+    assert pool_size_for(budget=80, workers=4, cap=20) == 18  # 80 / 4 - 2 служебных
+    assert pool_size_for(budget=80, workers=1, cap=20) == 20
+    with pytest.raises(ValueError, match="too small"):
+        pool_size_for(budget=10, workers=8, cap=20)
+
+
+def test_default_workers_fit_the_connection_budget():
+    from app import server
+    from app.core import database
+
+    assert server.DB_RESERVED_CONNECTIONS == database.DB_RESERVED_CONNECTIONS
+    assert default_workers(cpus=4, budget=80) == 4
+    assert default_workers(cpus=64, budget=0) == 64  # Без бюджета - по CPU
+    workers = default_workers(cpus=64, budget=80)
+    assert workers == 26  # 80 // 3, а не ValueError при импорте
+    assert pool_size_for(budget=80, workers=workers, cap=20) == 1
+
+
+def test_cgroup_cpu_quota_limits_available_cpus(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert cgroup_cpu_limit(str(tmp_path)) == 2
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+
+    v1 = tmp_path / "v1"
+    (v1 / "cpu").mkdir(parents=True)
+    (v1 / "cpu" / "cpu.cfs_quota_us").write_text("400000\n")
+    (v1 / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert cgroup_cpu_limit(str(v1)) == 4
+    assert cgroup_cpu_limit(str(tmp_path / "missing")) is None
+
+
+def test_admission_limits_follow_pool_size():
+    lanes = default_lanes(pool_size=10)
+    assert (lanes["read"].limit, lanes["write"].limit) == (7, 3)
+    lanes = default_lanes(pool_size=20)
+    assert (lanes["read"].limit, lanes["write"].limit) == (14, 6)
+
+
+def test_process_local_state_forces_one_worker(monkeypatch):
+    assert process_local_state(items_enabled=False, media_storage="sql") == []
+    assert process_local_state(items_enabled=True, media_storage="memory") == [
+        "/items store (set ITEMS_ENABLED=false)",
+        "MEDIA_STORAGE=memory",
+    ]
+
+    local = ["MEDIA_STORAGE=memory"]
+    assert parse_args([], local_state=local).workers == 1  # Вместо числа CPU
+    assert parse_args(["--workers", "1"], local_state=local).workers == 1
+    with pytest.raises(SystemExit):
+        parse_args(["--workers", "2"], local_state=local)
+
+    assert parse_args(["--workers", "3"], local_state=[]).workers == 3
+    monkeypatch.setattr("app.server.available_cpus", lambda: 2)
+    assert parse_args([], local_state=[]).workers == 2
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, proc: subprocess.Popen) -> None:
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        assert proc.poll() is None, proc.stdout.read()
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    pytest.fail("server did not start")
+
+
+def test_sigterm_drains_in_flight_requests(make_token):
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "ENV": "test",
+        "MEDIA_STORAGE": "memory",
+        "LOG_FORMAT": "text",
+        "SERVER_ALLOW_PROCESS_LOCAL_STATE": "true",  # Только чтения
+    }
+    env.pop("ITEMS_DATA_DIR", None)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port)]
+        + ["--workers", "2", "--warmup-stagger", "0.1", "--drain-timeout", "10"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        _wait_ready(base_url, proc)
+        result = {}
+
+        def slow_request():
+            # Запрос на 1.5 с: SIGTERM приходит посередине
+            result["response"] = httpx.get(
+                f"{base_url}/debug/profile?seconds=1.5",
+                headers={"Authorization": f"Bearer {make_token(scope='admin')}"},
+                timeout=10,
+            )
+
+        thread = threading.Thread(target=slow_request)
+        thread.start()
+        time.sleep(0.5)
+        proc.send_signal(signal.SIGTERM)
+        thread.join(timeout=10)
+
+        assert result["response"].status_code == 200
+        assert proc.wait(timeout=15) == 0
+        output = proc.stdout.read()
+        assert output.count("Application shutdown complete") == 2
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
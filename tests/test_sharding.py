@@ -0,0 +1,276 @@
+"""Tests for user-sharded routing across databases and the user move script"""
+
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core.sharding import HashRing, ShardMoving, ShardSpec, parse_shards
+from app.schemas.media import MediaCreate, MediaKind
+
+needs_db = pytest.mark.skipif(
+    os.getenv("MEDIA_STORAGE", "sql").lower() == "memory", reason="needs PostgreSQL"
+)
+
+
+def test_parse_shards():
+    assert parse_shards("") == []
+    assert parse_shards("s0=media_s0, s1=db2.internal:6432/media_s1,s2=db3/media_s2") == [
+        ShardSpec("s0", "media_s0"),
+        ShardSpec("s1", "media_s1", "db2.internal", "6432"),
+        ShardSpec("s2", "media_s2", "db3"),
+    ]
+    with pytest.raises(ValueError, match="without a database"):
+        parse_shards("s0")
+    with pytest.raises(ValueError, match="unique"):
+        parse_shards("s0=a,s0=b")
+
+
+def test_adding_a_shard_moves_only_its_share_of_users():
+    users = range(1, 6001)
+    before = HashRing(["s0", "s1", "s2"])
+    after = HashRing(["s0", "s1", "s2", "s3"])
+
+    owners = [before.owner(user_id) for user_id in users]
+    assert all(owners.count(name) > len(users) * 0.25 for name in ("s0", "s1", "s2"))
+
+    moved = [user_id for user_id in users if before.owner(user_id) != after.owner(user_id)]
+    assert {after.owner(user_id) for user_id in moved} == {"s3"}  # Только на новый шард
+    assert 0.15 < len(moved) / len(users) < 0.35
+
+
+def test_shard_moving_is_503_with_retry_after(client, monkeypatch):
+    from app.crud.media import media_crud
+
+    async def moving(*args, **kwargs):
+        raise ShardMoving(1)
+
+    monkeypatch.setattr(media_crud, "get_media_list", moving)
+    response = client.get("/media")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert (
+        response.json()["detail"]
+        == "Your data is being moved to another server, please retry shortly"
+    )
+
+
+def _engine(database=None, search_path: bool = True):
+    from app.core.database import connect_args, create_database_url
+
+    spec = ShardSpec("test", database) if database else None
+    return create_async_engine(
+        create_database_url("asyncpg", spec),
+        poolclass=NullPool,
+        connect_args=connect_args("asyncpg") if search_path else {},
+    )
+
+
+def _user_on(ring: HashRing, shard: str, start: int) -> int:
+    return next(user_id for user_id in range(start, start + 1000) if ring.owner(user_id) == shard)
+
+
+async def _count(engine, user_id: int) -> int:
+    async with engine.connect() as conn:
+        return (
+            await conn.execute(
+                text("SELECT count(*) FROM media WHERE user_id = :u"), {"u": user_id}
+            )
+        ).scalar_one()
+
+
+def _sessions():
+    from app.core.sharding import ShardSession
+
+    return sessionmaker(
+        class_=AsyncSession, sync_session_class=ShardSession, expire_on_commit=False
+    )
+
+
+@asynccontextmanager
+async def _shard_databases(*user_ids):
+    """Две временные базы шардов s0, s1: (engines, catalog); directory user_ids чистится"""
+    from app.core.database import DB_SCHEMA
+    from app.models import Base
+
+    suffix = uuid.uuid4().hex[:8]
+    databases = {"s0": f"shard_test_{suffix}_0", "s1": f"shard_test_{suffix}_1"}
+    admin = _engine().execution_options(isolation_level="AUTOCOMMIT")
+    for database in databases.values():
+        async with admin.connect() as conn:
+            await conn.execute(text(f'CREATE DATABASE "{database}"'))
+    engines = {name: _engine(database) for name, database in databases.items()}
+    catalog = _engine()
+    try:
+        for database, engine in zip(databases.values(), engines.values()):
+            if DB_SCHEMA:  # Схема воркера xdist - и в базах шардов
+                async with _engine(database, search_path=False).begin() as conn:
+                    await conn.execute(text(f'CREATE SCHEMA "{DB_SCHEMA}"'))
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        yield engines, catalog
+    finally:
+        async with catalog.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM shard_directory WHERE user_id = ANY(:users)"),
+                {"users": list(user_ids)},
+            )
+        for engine in engines.values():
+            await engine.dispose()
+        await catalog.dispose()
+        for database in databases.values():
+            async with admin.connect() as conn:
+                await conn.execute(text(f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)'))
+        await admin.dispose()
+
+
+@needs_db
+def test_users_are_routed_to_their_shard_and_can_be_moved(run):
+    from app.core.sharding import ShardRouter
+    from app.crud.media import MediaCRUD
+    from scripts.rebalance_shards import _set_directory, move_user
+
+    ring = HashRing(["s0", "s1"])
+    first = _user_on(ring, "s0", 900_000)
+    second = _user_on(ring, "s1", 900_000)
+    sessions = _sessions()
+
+    async def scenario():
+        async with _shard_databases(first, second) as (engines, catalog):
+            router = ShardRouter(engines, catalog, ttl=0)
+            crud = MediaCRUD(coalesce_reads=False, router=router)
+            async with engines["s1"].begin() as conn:  # Диапазоны id шардов не пересекаются
+                await conn.execute(text("SELECT setval('media_id_seq', 1000)"))
+
+            async with sessions() as db:
+                for i in range(3):
+                    media = MediaCreate(title=f"First {i}", kind=MediaKind.MOVIE, year=2000)
+                    await crud.create_media(db, media, first)
+            async with sessions() as db:
+                media = MediaCreate(title="Second", kind=MediaKind.BOOK, year=2001)
+                await crud.create_media(db, media, second)
+            placed = [await _count(engines[name], first) for name in ("s0", "s1")]
+            stats = await crud.get_stats()
+
+            moved = await move_user(
+                router, first, "s1", grace=0, log=lambda line: None, directory_ttl=0
+            )
+            async with sessions() as db:
+                after_move = await crud.get_media_list(db, first)
+                media = MediaCreate(title="After move", kind=MediaKind.MOVIE, year=2002)
+                created = await crud.create_media(db, media, first)
+            left = await _count(engines["s0"], first)
+            directory = await router.lookup(first)
+
+            await _set_directory(router, second, "s1", "frozen")
+            async with sessions() as db:
+                with pytest.raises(ShardMoving):
+                    await crud.get_media_list(db, second)
+            back = await move_user(
+                router, second, "s1", grace=0, log=lambda line: None, directory_ttl=0
+            )
+            async with sessions() as db:
+                unfrozen = await crud.get_media_list(db, second)
+            return placed, stats, moved, after_move, created, left, directory, back, unfrozen
+
+    placed, stats, moved, after_move, created, left, directory, back, unfrozen = run(scenario())
+
+    assert placed == [3, 0]
+    assert stats["total"] == {"users": 2, "media": 4, "tombstones": 0}
+    assert stats["shards"]["s0"]["media"] == 3 and stats["shards"]["s1"]["media"] == 1
+    assert moved
+    assert sorted(m.title for m in after_move) == ["First 0", "First 1", "First 2"]
+    assert created.id > max(m.id for m in after_move)  # media_id_seq шарда подтянута
+    assert left == 0
+    assert directory == ("s1", "active")
+    assert back and [m.title for m in unfrozen] == ["Second"]
+
+
+@needs_db
+def test_write_during_the_freeze_window_is_moved_with_the_user(run):
+    """Воркер приложения ещё видит старую запись directory и пишет на исходный шард"""
+    from app.core.sharding import ShardRouter
+    from app.crud.media import MediaCRUD
+    from scripts.rebalance_shards import move_user
+
+    app_ttl = 0.5
+    user = _user_on(HashRing(["s0", "s1"]), "s0", 910_000)
+    sessions = _sessions()
+
+    async def scenario():
+        async with _shard_databases(user) as (engines, catalog):
+            script = ShardRouter(engines, catalog, routing="directory", ttl=0)
+            worker = MediaCRUD(
+                coalesce_reads=False,
+                router=ShardRouter(engines, catalog, routing="directory", ttl=app_ttl),
+            )
+            async with sessions() as db:  # Кэш воркера: user -> s0, active
+                await worker.create_media(
+                    db, MediaCreate(title="Before", kind=MediaKind.MOVIE, year=2000), user
+                )
+
+            move = asyncio.ensure_future(
+                move_user(script, user, "s1", grace=0, log=lambda line: None, directory_ttl=app_ttl)
+            )
+            while (await script.lookup(user))[1] != "frozen":
+                await asyncio.sleep(0.01)
+            async with sessions() as db:
+                media = MediaCreate(title="During freeze", kind=MediaKind.MOVIE, year=2001)
+                await worker.create_media(db, media, user)
+            await move
+
+            await asyncio.sleep(app_ttl)
+            async with sessions() as db:
+                titles = sorted(m.title for m in await worker.get_media_list(db, user))
+            return titles, await _count(engines["s0"], user), await script.lookup(user)
+
+    titles, left, directory = run(scenario())
+
+    assert titles == ["Before", "During freeze"]  # Запись из окна freeze не потеряна
+    assert left == 0
+    assert directory == ("s1", "active")
+
+
+@needs_db
+def test_move_stops_before_copying_when_ids_are_taken_on_the_target(run):
+    """Последовательности шардов независимы: id пользователя могут быть заняты на target"""
+    from app.core.sharding import ShardRouter
+    from app.crud.media import MediaCRUD
+    from scripts.rebalance_shards import RebalanceError, move_user
+
+    ring = HashRing(["s0", "s1"])
+    moving = _user_on(ring, "s0", 920_000)
+    other = _user_on(ring, "s1", 920_000)
+    sessions = _sessions()
+
+    async def scenario():
+        async with _shard_databases(moving, other) as (engines, catalog):
+            router = ShardRouter(engines, catalog, ttl=0)
+            crud = MediaCRUD(coalesce_reads=False, router=router)
+            async with sessions() as db:
+                for i in range(2):
+                    media = MediaCreate(title=f"Moving {i}", kind=MediaKind.MOVIE, year=2000)
+                    await crud.create_media(db, media, moving)
+            async with sessions() as db:
+                media = MediaCreate(title="Other", kind=MediaKind.BOOK, year=2001)
+                taken = await crud.create_media(db, media, other)
+
+            with pytest.raises(RebalanceError, match=f"media ids {taken.id} are already used"):
+                await move_user(
+                    router, moving, "s1", grace=0, log=lambda line: None, directory_ttl=0
+                )
+            counts = [await _count(engines[name], moving) for name in ("s0", "s1")]
+            return counts, await _count(engines["s1"], other), await router.lookup(moving)
+
+    counts, other_rows, directory = run(scenario())
+
+    assert counts == [2, 0]  # На target ничего не скопировано
+    assert other_rows == 1
+    assert directory == ("s0", "frozen")
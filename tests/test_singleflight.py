@@ -0,0 +1,113 @@
+"""Tests for single-flight read coalescing"""
+
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution(run):
+    flight = SingleFlight()
+    executions = 0
+
+    async def query():
+        nonlocal executions
+        executions += 1
+        await asyncio.sleep(0.01)
+        return ["row"]
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do(1, ("list",), query) for _ in range(50)))
+
+    results = run(scenario())
+
+    assert executions == 1
+    assert all(result == ["row"] for result in results)
+    assert flight.followers == 49
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_and_users_not_shared(run):
+    flight = SingleFlight()
+    executions = []
+
+    async def query(tag):
+        executions.append(tag)
+        await asyncio.sleep(0.01)
+        return tag
+
+    async def scenario():
+        return await asyncio.gather(
+            flight.do(1, ("list", "movie"), lambda: query("a")),
+            flight.do(1, ("list", "book"), lambda: query("b")),
+            flight.do(2, ("list", "movie"), lambda: query("c")),
+        )
+
+    assert run(scenario()) == ["a", "b", "c"]
+    assert sorted(executions) == ["a", "b", "c"]
+
+
+def test_forget_cuts_off_sharing_after_write(run):
+    flight = SingleFlight()
+    executions = 0
+
+    async def query():
+        nonlocal executions
+        executions += 1
+        version = executions
+        await asyncio.sleep(0.02)
+        return version
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do(1, "k", query))
+        await asyncio.sleep(0)
+        flight.forget(1)  # Запись пользователя закоммичена
+        second = await flight.do(1, "k", query)
+        return await first, second
+
+    first, second = run(scenario())
+    assert executions == 2
+    assert first == 1
+    assert second == 2
+
+
+def test_errors_propagate_to_all_waiters(run):
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    async def scenario():
+        return await asyncio.gather(
+            *(flight.do(1, "k", failing) for _ in range(3)), return_exceptions=True
+        )
+
+    results = run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.in_flight() == 0
+
+
+def test_cancelled_leader_lets_followers_retry(run):
+    flight = SingleFlight()
+    calls = 0
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do(1, "k", query))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do(1, "k", query))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert run(scenario()) == "ok"
+    assert calls == 2
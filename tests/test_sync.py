@@ -0,0 +1,118 @@
+"""Tests for delta sync (GET /media/sync)"""
+
+import base64
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.error_handlers import ApiError
+from app.api.media import _decode_sync_token, _encode_sync_token
+from app.crud.storage import SyncCursor
+
+CURSOR = SyncCursor(
+    734, datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc), pending=(729, 733)
+)
+
+
+def test_sync_token_roundtrip():
+    assert _decode_sync_token(_encode_sync_token(CURSOR)) == CURSOR
+    assert _decode_sync_token(_encode_sync_token(CURSOR, "s1"), "s1") == CURSOR
+
+
+def test_sync_token_from_another_shard_means_full_resync():
+    # Позиция курсора имеет смысл только в БД, которая его выдала
+    assert _decode_sync_token(_encode_sync_token(CURSOR, "s1"), "s2") is None
+    assert _decode_sync_token(_encode_sync_token(CURSOR), "s1") is None
+
+
+def test_legacy_timestamp_token_means_full_resync():
+    token = base64.urlsafe_b64encode(b"2025-01-02T03:04:05+00:00").decode().rstrip("=")
+    assert _decode_sync_token(token) is None
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not-a-token",
+        "bm90LWEtZGF0ZQ",
+        "MjAyNS0wMS0wMlQwMzowNDowNQ",
+        # {"p":1,"x":[],"t":"2025-01-02T03:04:05","s":null} - время без таймзоны
+        "eyJwIjoxLCJ4IjpbXSwidCI6IjIwMjUtMDEtMDJUMDM6MDQ6MDUiLCJzIjpudWxsfQ",
+    ],
+)
+def test_sync_token_invalid(token):
+    # Мусор и дата без таймзоны отклоняются
+    with pytest.raises(ApiError):
+        _decode_sync_token(token)
+
+
+# Курсор sync - xmin снимка: строки теста должны быть закоммичены, как у запросов
+@pytest.mark.no_transaction
+class TestMediaSync:
+    """Тесты delta sync"""
+
+    def test_initial_sync_returns_everything(self, client: TestClient):
+        client.post("/media", json={"title": "Sync One", "kind": "movie", "year": 2001})
+        client.post("/media", json={"title": "Sync Two", "kind": "book", "year": 2002})
+
+        response = client.get("/media/sync")
+        assert response.status_code == 200
+
+        body = response.json()
+        assert body["full_resync"] is True
+        assert {m["title"] for m in body["upserts"]} == {"Sync One", "Sync Two"}
+        assert body["deleted"] == []
+        assert body["next_token"]
+
+    def test_no_change_resync_is_empty(self, client: TestClient):
+        client.post("/media", json={"title": "Stable", "kind": "movie", "year": 2001})
+        token = client.get("/media/sync").json()["next_token"]
+
+        body = client.get(f"/media/sync?since={token}").json()
+        assert body["upserts"] == []
+        assert body["deleted"] == []
+        assert body["full_resync"] is False
+
+    def test_resync_returns_only_changes_and_tombstones(self, client: TestClient):
+        keep = client.post("/media", json={"title": "Keep", "kind": "movie", "year": 2001})
+        gone = client.post("/media", json={"title": "Gone", "kind": "movie", "year": 2002})
+        token = client.get("/media/sync").json()["next_token"]
+
+        client.patch(f"/media/{keep.json()['id']}/status", json={"status": "watched"})
+        client.delete(f"/media/{gone.json()['id']}")
+        client.post("/media", json={"title": "New", "kind": "course", "year": 2025})
+
+        body = client.get(f"/media/sync?since={token}").json()
+        assert {m["title"] for m in body["upserts"]} == {"Keep", "New"}
+        assert body["deleted"] == [gone.json()["id"]]
+
+    def test_invalid_token_rejected(self, client: TestClient):
+        response = client.get("/media/sync?since=garbage")
+        assert response.status_code == 422
+        assert "correlation_id" in response.json()
+
+    def test_late_commit_is_not_skipped(self, client: TestClient):
+        """Транзакция, начатая до выдачи курсора и закоммиченная после, попадает в sync"""
+        from sqlalchemy import text
+
+        from app.core.database import sync_engine
+
+        if sync_engine is None:
+            pytest.skip("второе соединение требует PostgreSQL (MEDIA_STORAGE=memory)")
+        token = client.get("/media/sync").json()["next_token"]
+        with sync_engine.connect() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO media (title, title_norm, kind, year, user_id, status) "
+                    "VALUES ('Late', 'late', 'MOVIE', 2001, 1, 'TO_WATCH')"
+                )
+            )
+            # Курсор выдан, пока транзакция открыта; её строка ещё не видна
+            body = client.get(f"/media/sync?since={token}").json()
+            assert body["upserts"] == []
+            token = body["next_token"]
+            conn.commit()
+
+        body = client.get(f"/media/sync?since={token}").json()
+        assert [m["title"] for m in body["upserts"]] == ["Late"]
@@ -0,0 +1,129 @@
+"""Tests for media tags (GET /media?tags=, /media/tags)"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+
+from app.crud.memory_storage import InMemoryMediaStorage
+from app.crud.sql_storage import build_media_list_query
+from app.schemas.media import MediaCreate, MediaKind, MediaTags, TagMatch
+
+
+def test_tags_are_normalized_and_deduplicated():
+    assert MediaTags(tags=[" Sci-Fi", "sci-fi", "Weekend"]).tags == ["sci-fi", "weekend"]
+
+
+@pytest.mark.parametrize("tag", ["", "a,b", "x" * 51, "two  spaces", "<script>"])
+def test_invalid_tags_rejected(tag):
+    with pytest.raises(ValidationError):
+        MediaTags(tags=[tag])
+
+
+@pytest.mark.parametrize("match,operator", [(TagMatch.ALL, "@>"), (TagMatch.ANY, "&&")])
+def test_tag_filter_uses_array_operators(match, operator):
+    # Оба оператора поддерживаются GIN индексом ix_media_tags
+    query = build_media_list_query(1, tags=["work"], tags_match=match)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert f"media.tags {operator}" in sql
+
+
+def test_concurrent_tag_removals_in_memory(run):
+    storage = InMemoryMediaStorage()
+
+    async def scenario():
+        media = await storage.create(
+            None, MediaCreate(title="T", kind=MediaKind.MOVIE, year=2000, tags=["a", "b", "c"]), 1
+        )
+        await asyncio.gather(
+            storage.remove_tag(None, media.id, "a", 1), storage.remove_tag(None, media.id, "b", 1)
+        )
+        return await storage.get_by_id(None, media.id, 1)
+
+    assert run(scenario()).tags == ["c"]
+
+
+@pytest.mark.no_transaction
+def test_tag_removal_does_not_lose_a_concurrent_tag_change(client: TestClient):
+    """DELETE /tags/{tag}, пока другая транзакция меняет теги той же строки"""
+    from sqlalchemy import text
+
+    from app.core.database import sync_engine
+
+    if sync_engine is None:
+        pytest.skip("второе соединение требует PostgreSQL (MEDIA_STORAGE=memory)")
+    media = client.post(
+        "/media", json={"title": "Tagged", "kind": "movie", "year": 2000, "tags": ["a", "b", "c"]}
+    ).json()
+
+    with sync_engine.connect() as conn:
+        conn.execute(
+            text("UPDATE media SET tags = array_remove(tags, 'a') WHERE id = :id"),
+            {"id": media["id"]},
+        )
+        result = {}
+        request = threading.Thread(
+            target=lambda: result.update(response=client.delete(f"/media/{media['id']}/tags/b"))
+        )
+        request.start()
+        time.sleep(0.5)  # DELETE ждёт блокировку строки
+        conn.commit()
+        request.join(timeout=10)
+
+    assert result["response"].status_code == 200
+    assert result["response"].json()["tags"] == ["c"]
+    assert client.get(f"/media/{media['id']}").json()["tags"] == ["c"]
+
+
+class TestMediaTags:
+    """Тесты тегов через API"""
+
+    def _create(self, client: TestClient, title: str, tags):
+        response = client.post(
+            "/media", json={"title": title, "kind": "movie", "year": 2000, "tags": tags}
+        )
+        assert response.status_code == 201
+        return response.json()
+
+    def test_filter_all_and_any(self, client: TestClient):
+        self._create(client, "Both", ["sci-fi", "weekend"])
+        self._create(client, "SciFi", ["sci-fi"])
+        self._create(client, "Work", ["work"])
+
+        all_titles = {m["title"] for m in client.get("/media?tags=sci-fi,weekend").json()}
+        any_titles = {
+            m["title"] for m in client.get("/media?tags=weekend,work&tags_match=any").json()
+        }
+
+        assert all_titles == {"Both"}
+        assert any_titles == {"Both", "Work"}
+
+    def test_replace_and_remove_tags(self, client: TestClient):
+        media = self._create(client, "Tagged", ["a"])
+
+        response = client.put(f"/media/{media['id']}/tags", json={"tags": ["B", "c"]})
+        assert response.status_code == 200
+        assert response.json()["tags"] == ["b", "c"]
+
+        response = client.delete(f"/media/{media['id']}/tags/b")
+        assert response.status_code == 200
+        assert response.json()["tags"] == ["c"]
+
+    def test_tag_counts(self, client: TestClient):
+        self._create(client, "One", ["sci-fi", "weekend"])
+        self._create(client, "Two", ["sci-fi"])
+
+        response = client.get("/media/tags")
+        assert response.status_code == 200
+        assert response.json() == [
+            {"tag": "sci-fi", "count": 2},
+            {"tag": "weekend", "count": 1},
+        ]
+
+    def test_invalid_filter_and_missing_media(self, client: TestClient):
+        assert client.get("/media?tags=<b>").status_code == 422
+        assert client.put("/media/999/tags", json={"tags": ["x"]}).status_code == 404
@@ -0,0 +1,145 @@
+"""Tests for statement timeouts and cancellation on client disconnect"""
+
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import DBAPIError
+
+from app.api.error_handlers import setup_exception_handlers
+from app.middleware.disconnect import CancelOnDisconnectMiddleware
+
+
+class QueryCanceled(Exception):
+    sqlstate = "57014"
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    setup_exception_handlers(app)
+
+    @app.get("/slow-query")
+    async def slow_query():
+        raise DBAPIError("SELECT pg_sleep(60)", None, QueryCanceled("canceling statement"))
+
+    @app.get("/broken-query")
+    async def broken_query():
+        raise DBAPIError("SELECT secret FROM users", None, Exception("relation users"))
+
+    return app
+
+
+def test_statement_timeout_maps_to_safe_503():
+    client = TestClient(make_app())
+    response = client.get("/slow-query")
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    body = response.json()
+    assert body["detail"] == "The request took too long to process, please retry later"
+    assert "pg_sleep" not in response.text
+    assert "correlation_id" in body
+
+
+def test_other_database_errors_do_not_leak_sql():
+    client = TestClient(make_app(), raise_server_exceptions=False)
+    response = client.get("/broken-query")
+
+    assert response.status_code == 500
+    assert "users" not in response.text
+    assert response.json()["detail"] == "An internal error occurred"
+
+
+def test_route_timeout_lookup(monkeypatch):
+    from app.core import database
+
+    class FakeRequest:
+        def __init__(self, endpoint):
+            self.scope = {"endpoint": endpoint}
+
+    def get_media():
+        pass
+
+    def unknown_route():
+        pass
+
+    monkeypatch.setitem(database.ROUTE_STATEMENT_TIMEOUTS_MS, "get_media", 1234)
+    assert database.statement_timeout_for(FakeRequest(get_media)) == 1234
+    assert (
+        database.statement_timeout_for(FakeRequest(unknown_route))
+        == database.DEFAULT_STATEMENT_TIMEOUT_MS
+    )
+    assert database._parse_route_timeouts("a=1, b = 2,bad") == {"a": 1, "b": 2}
+
+
+def test_handler_cancelled_when_client_disconnects(run):
+    state = {"started": False, "cancelled": False}
+
+    async def slow_app(scope, receive, send):
+        state["started"] = True
+        try:
+            await asyncio.sleep(10)  # Долгий SQL-запрос
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def scenario():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise AssertionError("No response expected after disconnect")
+
+        scope = {"type": "http", "method": "GET", "path": "/media", "headers": []}
+        await asyncio.wait_for(
+            CancelOnDisconnectMiddleware(slow_app)(scope, receive, send), timeout=1
+        )
+
+    run(scenario())
+    assert state["started"]
+    assert state["cancelled"]
+
+
+def test_request_body_is_not_buffered_ahead_of_the_handler(run):
+    state = {"received": 0, "max_ahead": 0, "chunks": 0}
+    total = 50
+
+    async def slow_reader(scope, receive, send):
+        while True:
+            message = await receive()
+            state["chunks"] += 1
+            state["max_ahead"] = max(state["max_ahead"], state["received"] - state["chunks"])
+            await asyncio.sleep(0.001)  # Медленный потребитель (запись на диск, в БД)
+            if not message.get("more_body", False):
+                break
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def scenario():
+        async def receive():
+            if state["received"] == total:
+                await asyncio.sleep(10)
+                return {"type": "http.disconnect"}
+            state["received"] += 1
+            return {
+                "type": "http.request",
+                "body": b"x" * 1024,
+                "more_body": state["received"] < total,
+            }
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "method": "POST", "path": "/upload", "headers": []}
+        await asyncio.wait_for(
+            CancelOnDisconnectMiddleware(slow_reader)(scope, receive, send), timeout=5
+        )
+
+    run(scenario())
+    assert state["chunks"] == total
+    assert state["max_ahead"] <= 2  # Очередь на одно сообщение + одно в руках watcher
@@ -0,0 +1,140 @@
+"""Tests for request tracing (spans, traceparent, batching export)"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.core import tracing
+from app.core.tracing import (
+    BatchSpanExporter,
+    FileSpanWriter,
+    Tracer,
+    instrument_engine,
+    parse_traceparent,
+)
+
+INCOMING = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+class ListWriter:
+    def __init__(self):
+        self.payloads = []
+
+    def write(self, payload):
+        self.payloads.append(payload)
+
+    @property
+    def spans(self):
+        return [
+            span
+            for payload in self.payloads
+            for resource in payload["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]
+        ]
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = ListWriter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(BatchSpanExporter(writer), sample_ratio=1))
+    return writer
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(INCOMING) == (
+        "4bf92f3577b34da6a3ce929d0e0e4736",
+        "00f067aa0ba902b7",
+        True,
+    )
+    assert parse_traceparent(INCOMING[:-2] + "00")[2] is False
+    for invalid in (None, "", "garbage", "00-" + "0" * 32 + "-00f067aa0ba902b7-01"):
+        assert parse_traceparent(invalid) is None
+
+
+def test_sample_ratio_bounds():
+    never, always = Tracer(sample_ratio=0), Tracer(sample_ratio=1)
+    assert not never.start_root("GET").sampled
+    assert always.start_root("GET").sampled
+    assert never.start_root("GET", INCOMING).sampled  # Решение клиента важнее
+
+
+def test_request_produces_root_and_crud_spans(run, client: TestClient, writer: ListWriter):
+    response = client.get("/media?kind=movie", headers={"traceparent": INCOMING})
+    assert response.status_code == 200
+    trace_id, root_id, sampled = parse_traceparent(response.headers["traceresponse"])
+    assert (trace_id, sampled) == ("4bf92f3577b34da6a3ce929d0e0e4736", True)
+
+    run(tracing.tracer.exporter.flush())
+    spans = {span["name"]: span for span in writer.spans}
+    root, crud = spans["GET /media"], spans["MediaCRUD.get_media_list"]
+    assert root["spanId"] == root_id
+    assert root["parentSpanId"] == "00f067aa0ba902b7"
+    assert root["kind"] == tracing.SPAN_KIND_SERVER
+    assert crud["parentSpanId"] == root["spanId"]
+    assert {span["traceId"] for span in spans.values()} == {trace_id}
+    attributes = {a["key"]: a["value"] for a in root["attributes"]}
+    assert attributes["http.route"] == {"stringValue": "/media"}
+    assert attributes["http.response.status_code"] == {"intValue": "200"}
+
+
+def test_unsampled_requests_are_not_exported(run, client: TestClient, monkeypatch):
+    writer = ListWriter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(BatchSpanExporter(writer), sample_ratio=0))
+    response = client.get("/health")
+
+    assert response.headers["traceresponse"].endswith("-00")
+    run(tracing.tracer.exporter.flush())
+    assert writer.payloads == []
+
+
+def test_slow_requests_are_exported_outside_the_sample(run):
+    writer = ListWriter()
+    tracer = Tracer(BatchSpanExporter(writer), sample_ratio=0, slow_ms=1e-6)
+    root = tracer.start_root("GET /slow")
+    with tracer.activate(root):
+        with tracer.span("MediaCRUD.get_media_list"):
+            pass
+    tracer.end_root(root)
+
+    run(tracer.exporter.flush())
+    assert [span["name"] for span in writer.spans] == ["MediaCRUD.get_media_list", "GET /slow"]
+
+
+def test_sql_spans_from_engine_events(run, monkeypatch):
+    writer = ListWriter()
+    tracer = Tracer(BatchSpanExporter(writer), sample_ratio=1)
+    monkeypatch.setattr(tracing, "tracer", tracer)
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+
+    root = tracer.start_root("GET /media")
+    with tracer.activate(root), tracer.span("MediaCRUD.get_media_list") as crud:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    tracer.end_root(root)
+
+    run(tracer.exporter.flush())
+    sql = next(span for span in writer.spans if span["name"] == "SQL SELECT")
+    assert sql["parentSpanId"] == crud.span_id
+    assert sql["kind"] == tracing.SPAN_KIND_CLIENT
+    assert {"key": "db.statement", "value": {"stringValue": "SELECT 1"}} in sql["attributes"]
+
+
+def test_file_writer_and_bounded_queue(run, tmp_path):
+    exporter = BatchSpanExporter(FileSpanWriter(str(tmp_path / "traces.jsonl")), max_queue=2)
+    tracer = Tracer(exporter, sample_ratio=1)
+    root = tracer.start_root("GET /media")
+    with tracer.activate(root):
+        for name in ("a", "b"):
+            with tracer.span(name):
+                pass
+    tracer.end_root(root)  # 3 span-а в очередь на 2
+
+    assert len(exporter) == 2
+    run(exporter.flush())
+    payload = json.loads((tmp_path / "traces.jsonl").read_text())
+    spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [span["name"] for span in spans] == ["a", "b"]
@@ -0,0 +1,93 @@
+"""Tests for the event-loop lag watchdog and threadpool saturation"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from anyio import to_thread
+from fastapi.testclient import TestClient
+
+from app.core.metrics import metrics
+from app.core.watchdog import LoopWatchdog
+
+
+def blocking_call():
+    time.sleep(0.3)  # Синхронный I/O в корутине (как hvac в get_db_secrets)
+
+
+def test_blocked_loop_is_detected_with_stack(run, caplog):
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.05, stack_cooldown=0)
+    blocked_before = metrics.value("event_loop_blocked_total")
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        await watchdog.stop()
+
+    with caplog.at_level(logging.WARNING, logger="app.core.watchdog"):
+        run(scenario())
+
+    assert metrics.value("event_loop_blocked_total") == blocked_before + 1
+    assert "blocking_call" in watchdog.last_blocked_stack
+    record = next(r for r in caplog.records if r.message.startswith("Event loop blocked"))
+    assert record.blocked_ms >= 50
+    assert "time.sleep(0.3)" in record.stack
+    assert watchdog.lag >= 0  # Heartbeat после блокировки снова идёт
+
+
+def test_awaiting_loop_is_not_reported(run):
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.1)
+    blocked_before = metrics.value("event_loop_blocked_total")
+    observed_before = metrics.value("event_loop_lag_seconds")
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.2)
+        await watchdog.stop()
+
+    run(scenario())
+    assert metrics.value("event_loop_blocked_total") == blocked_before
+    assert metrics.value("event_loop_lag_seconds") > observed_before
+    assert watchdog.last_blocked_stack is None
+
+
+def test_threadpool_saturation_is_reported(run, caplog):
+    watchdog = LoopWatchdog()
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        to_thread.current_default_thread_limiter().total_tokens = 1
+        calls = [
+            asyncio.ensure_future(to_thread.run_sync(time.sleep, 0.1)),
+            asyncio.ensure_future(to_thread.run_sync(time.sleep, 0.1)),
+            asyncio.ensure_future(asyncio.to_thread(time.sleep, 0.1)),
+            asyncio.ensure_future(asyncio.to_thread(time.sleep, 0.1)),
+        ]
+        await asyncio.sleep(0.05)
+        watchdog.sample_threadpools()
+        saturated = {name: (s.in_use, s.limit, s.waiting) for name, s in watchdog.pools.items()}
+        await asyncio.gather(*calls)
+        watchdog.sample_threadpools()
+        return saturated
+
+    with caplog.at_level(logging.INFO, logger="app.core.watchdog"):
+        saturated = run(scenario())
+
+    assert saturated == {"anyio": (1, 1, 1), "asyncio": (1, 1, 1)}
+    assert metrics.value("threadpool_waiting", {"pool": "anyio"}) == 0
+    messages = [r.getMessage() for r in caplog.records]
+    assert "Threadpool anyio saturated: 1/1 workers busy, 1 calls waiting" in messages
+    assert any(m.startswith("Threadpool asyncio recovered") for m in messages)
+
+
+def test_metrics_expose_lag_histogram(client: TestClient):
+    time.sleep(0.25)  # Несколько heartbeat-ов в цикле TestClient
+    body = client.get("/metrics").text
+
+    assert "# TYPE event_loop_lag_seconds histogram" in body
+    assert 'event_loop_lag_seconds_bucket{le="+Inf"}' in body
+    assert 'threadpool_limit{pool="anyio"} 40' in body
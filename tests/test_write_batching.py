@@ -0,0 +1,140 @@
+"""Tests for group-commit write batching (no database needed)"""
+
+import asyncio
+
+from app.core.audit import AuditLog, MemoryAuditSink
+from app.crud.batching import WriteBatcher
+from app.crud.media import MediaCRUD
+from app.models.media import MediaModel
+from app.schemas.media import MediaCreate, MediaKind, MediaStatusUpdate, WatchStatus
+
+
+class FakeSession:
+    def __init__(self, log):
+        self.log = log
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def commit(self):
+        self.log.append("commit")
+
+    async def rollback(self):
+        self.log.append("rollback")
+
+
+class RecordingBatcher(WriteBatcher):
+    """Batcher that records batches instead of touching the database"""
+
+    def __init__(self, **kwargs):
+        self.log = []
+        super().__init__(session_factory=lambda: FakeSession(self.log), **kwargs)
+
+    async def _apply(self, session, batch):
+        self.log.append(len(batch))
+        if any(item.payload.title == "bad" for item in batch):
+            raise ValueError("constraint violated")
+        return [f"{item.user_id}:{item.payload.title}" for item in batch]
+
+
+def media(title: str) -> MediaCreate:
+    return MediaCreate(title=title, kind=MediaKind.MOVIE, year=2000)
+
+
+def test_concurrent_creates_share_one_commit(run):
+    batcher = RecordingBatcher(max_delay_ms=5, max_batch_size=100)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.create(media(f"m{i}"), 1) for i in range(10)))
+
+    results = run(scenario())
+
+    assert results == [f"1:m{i}" for i in range(10)]
+    assert batcher.log == [10, "commit"]
+    assert batcher.batches == 1
+
+
+def test_batch_size_limit_flushes_early(run):
+    batcher = RecordingBatcher(max_delay_ms=1000, max_batch_size=4)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.create(media(f"m{i}"), 1) for i in range(8))), 1
+        )
+
+    run(scenario())
+    assert batcher.log == [4, "commit", 4, "commit"]
+
+
+def test_failing_item_isolated_others_succeed(run):
+    batcher = RecordingBatcher(max_delay_ms=5, max_batch_size=100)
+
+    async def scenario():
+        return await asyncio.gather(
+            batcher.create(media("ok1"), 1),
+            batcher.create(media("bad"), 2),
+            batcher.create(media("ok2"), 3),
+            return_exceptions=True,
+        )
+
+    ok1, bad, ok2 = run(scenario())
+
+    assert ok1 == "1:ok1"
+    assert ok2 == "3:ok2"
+    assert isinstance(bad, ValueError)
+    # Общий батч откатился, затем каждый элемент в своей транзакции
+    assert batcher.log[:2] == [3, "rollback"]
+    assert batcher.log.count("commit") == 2
+
+
+class StatusBatcher(WriteBatcher):
+    """Status flush over an in-memory row, snapshot taken as in _apply"""
+
+    def __init__(self, row):
+        self.row = row
+        super().__init__(session_factory=lambda: FakeSession([]), max_delay_ms=5)
+
+    async def _apply(self, session, batch):
+        for item in batch:
+            if item.snapshot is not None:
+                item.before = item.snapshot(self.row)
+            self.row.status = item.payload.status
+            self.row.rating = item.payload.rating
+        return [self.row for _ in batch]
+
+
+class NoSessionStorage:
+    """Storage that fails if the request session is used"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"request session used: {name}")
+
+
+def test_batched_status_reads_audit_before_in_flush(run):
+    row = MediaModel(
+        id=1,
+        title="M",
+        kind=MediaKind.MOVIE,
+        year=2000,
+        user_id=7,
+        tags=[],
+        status=WatchStatus.TO_WATCH,
+        rating=None,
+    )
+    sink = MemoryAuditSink()
+    audit = AuditLog(sink)
+    crud = MediaCRUD(NoSessionStorage(), write_batcher=StatusBatcher(row), audit=audit)
+
+    async def scenario():
+        media = await crud.update_media_status(
+            None, 1, MediaStatusUpdate(status=WatchStatus.WATCHED, rating=9), 7
+        )
+        await audit.flush()
+        return media
+
+    assert run(scenario()) is row
+    (event,) = sink.events
+    assert event.changes == {"rating": [None, 9], "status": ["to_watch", "watched"]}